@@ -3,8 +3,96 @@ Defines the standard functions that a blockchain API should be able to handle.
 """
 
 from abc import ABC, abstractmethod
+from functools import wraps
 
+import importlib
+import json
+
+from oauth2.web import Response
+
+from ...exceptions import general_exceptions
 from ...handler import PostgreSQLRouteHandler
+from config import blockchain
+from config import server as server_config
+from server import metrics
+from threads.fan_out import FanOut
+from threads.single_flight import SingleFlight
+
+backends = {
+	"ethereum": "biobank.handlers.blockchain.api.ethereum.ethereum.EthereumAPI",
+	"hyperledger": "biobank.handlers.blockchain.api.hyperledger.hyperledger.HyperledgerAPI",
+}
+"""
+The blockchain backends that can be configured, with their names as keys and the paths of their classes as values.
+"""
+
+fan_out = FanOut(server_config.fan_out_workers)
+"""
+The threads that make independent blockchain reads at the same time, which are shared by all backends and requests.
+"""
+
+single_flight = SingleFlight()
+"""
+The blockchain reads in flight, which identical reads that are made at the same time share.
+"""
+
+request_arguments = ("token", )
+"""
+The keyword arguments that belong to the request rather than to the read, and which are therefore not compared when reads are coalesced.
+"""
+
+def coalesce(function):
+	"""
+	Make a blockchain read share the identical reads that are in flight.
+	Reads are identical if they are made by the same handler, to the same function, with the same arguments.
+	The request's own arguments, such as its access token, differ for every request, so they are left out of the comparison.
+	Reads whose arguments cannot be compared are not shared, and neither are fresh reads, which must not return the result of a read that started earlier.
+
+	:param function: The read function.
+	:type function: function
+
+	:return: The wrapped read function.
+	:rtype: function
+	"""
+
+	@wraps(function)
+	def wrapper(self, *args, **kwargs):
+		if kwargs.get("fresh"):
+			return function(self, *args, **kwargs)
+
+		key = (id(self), function.__name__, args, tuple(sorted((name, value) for name, value in kwargs.items() if name not in request_arguments)))
+		try:
+			hash(key)
+		except TypeError:
+			return function(self, *args, **kwargs)
+
+		result, shared = single_flight.do(key, lambda: function(self, *args, **kwargs))
+		if shared:
+			metrics.blockchain_reads_coalesced.inc(function=function.__name__)
+		return result
+
+	return wrapper
+
+def load_backend(name):
+	"""
+	Load the class of the blockchain backend with the given name.
+	Only the module of that backend is imported, so the libraries of the other backends are never loaded.
+
+	:param name: The name of the backend, or the full path of its class.
+	:type name: str
+
+	:return: The class of the blockchain backend.
+	:rtype: class
+
+	:raises: ValueError
+	"""
+
+	path = backends.get(name, name)
+	if "." not in path:
+		raise ValueError("Unknown blockchain backend %s" % name)
+
+	module, cls = path.rsplit(".", 1)
+	return getattr(importlib.import_module(module), cls)
 
 class BlockchainAPI(PostgreSQLRouteHandler):
 	"""
@@ -17,8 +105,105 @@ class BlockchainAPI(PostgreSQLRouteHandler):
 		#. Participant management;
 		#. Study management; and
 		#. Consent management.
+
+	The backends' consent reads are coalesced: identical reads that are made at the same time share one call to the blockchain.
+
+	:cvar coalesced_reads: The names of the read functions that are coalesced when a backend defines them.
+	:vartype coalesced_reads: tuple of str
 	"""
 
+	coalesced_reads = ("has_consent", "get_study_participants", "get_all_study_participants", "get_consent_trail")
+
+	def __init_subclass__(cls, **kwargs):
+		"""
+		Coalesce the read functions that the backend defines.
+
+		:param cls: The backend's class.
+		:type cls: class
+		"""
+
+		super().__init_subclass__(**kwargs)
+		for name in cls.coalesced_reads:
+			if name in cls.__dict__:
+				setattr(cls, name, coalesce(cls.__dict__[name]))
+
+	@classmethod
+	def from_config(cls, connector):
+		"""
+		Create the blockchain API handler from the blockchain configuration.
+		Backends that need more configuration should override this function.
+
+		:param connector: The connector that is used to access the data store.
+		:type connector: :class:`connection.connection.Connection`
+
+		:return: The blockchain API handler.
+		:rtype: :class:`biobank.handlers.blockchain.api.BlockchainAPI`
+		"""
+
+		return cls(blockchain.admin_host, blockchain.admin_port, blockchain.multiuser_host, blockchain.multiuser_port, connector)
+
+	def warm_up(self):
+		"""
+		Prepare the backend for the first requests, for example by connecting to the blockchain node.
+		By default, there is nothing to prepare.
+
+		:raises: Exception
+		"""
+
+		pass
+
+	def pending_transactions(self):
+		"""
+		Get the number of transactions that have been sent to the blockchain but not confirmed yet.
+		By default, transactions are assumed to be confirmed as soon as they are sent.
+
+		:return: The number of pending transactions.
+		:rtype: int
+		"""
+
+		return 0
+
+	def wait_for_transaction(self, tx_hash):
+		"""
+		Wait for a transaction that an earlier attempt sent to be mined, so that it is not sent again while it is still pending.
+		By default, transactions are confirmed as soon as they are sent, so there is nothing to wait for.
+
+		:param tx_hash: The hash of the transaction.
+		:type tx_hash: str
+
+		:raises: :class:`threads.exceptions.job_exceptions.TransactionPendingException`
+		"""
+
+		pass
+
+	def create_indexer(self, connector):
+		"""
+		Create the indexer that mirrors the consent recorded on the blockchain in the database.
+		By default, the backend has no mirror and consent is always read from the blockchain.
+
+		:param connector: The connection that the indexer uses, which should not be shared with other threads.
+		:type connector: :class:`connection.connection.Connection`
+
+		:return: The indexer, or `None` if the backend has no mirror.
+		:rtype: object or None
+		"""
+
+		return None
+
+	def create_anchorer(self, connector):
+		"""
+		Create the anchorer that anchors batches of consent changes on the blockchain.
+		By default, the backend records each consent change on the blockchain, and has nothing to anchor.
+
+		:param connector: The connection that the anchorer uses, which should not be shared with other threads.
+		:type connector: :class:`connection.connection.Connection`
+
+		:return: The anchorer, or `None` if consent changes are not anchored.
+		:rtype: object or None
+		"""
+
+		return None
+
 	"""
 	Participants.
 	"""
@@ -34,6 +219,20 @@ class BlockchainAPI(PostgreSQLRouteHandler):
 
 		pass
 
+	def get_participant_addresses(self, username):
+		"""
+		Get all the addresses that the participant has on the blockchain.
+		By default, the backend's identities are not known, and `None` is returned.
+
+		:param username: The unique username of the participant.
+		:type username: str
+
+		:return: The participant's addresses, or `None` if they are not known.
+		:rtype: list of str or None
+		"""
+
+		return None
+
 	"""
 	Studies.
 	"""
@@ -53,6 +252,43 @@ class BlockchainAPI(PostgreSQLRouteHandler):
 	Consent.
 	"""
 
+	def consent_confirmed(self, study_id, address, consent):
+		"""
+		Handle a consent change that has been confirmed on the blockchain.
+		Backends that cache the participants of studies should drop the study's participants.
+		By default, nothing is cached.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The unique address of the participant on the blockchain.
+		:type address: str
+		:param consent: The consent status.
+		:type consent: bool
+		"""
+
+		pass
+
+	def get_consent_proof(self, study_id, address, *args, **kwargs):
+		"""
+		Get the proofs that a participant's consent changes to a study were anchored on the blockchain.
+		By default, consent changes are not anchored, so there are no proofs.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The unique address of the participant on the blockchain.
+		:type address: str
+
+		:return: A response with any errors that may arise.
+		:rtype: :class:`oauth2.web.Response`
+		"""
+
+		response = Response()
+		e = general_exceptions.ConsentProofUnavailableException()
+		response.status_code = 500
+		response.add_header("Content-Type", "application/json")
+		response.body = json.dumps({ "error": str(e), "exception": e.__class__.__name__ })
+		return response
+
 	@abstractmethod
 	def set_consent(self, study_id, username, consent, *args, **kwargs):
 		"""
@@ -70,7 +306,7 @@ class BlockchainAPI(PostgreSQLRouteHandler):
 		pass
 
 	@abstractmethod
-	def has_consent(self, study_id, username, *args, **kwargs):
+	def has_consent(self, study_id, username, *args, fresh=False, **kwargs):
 		"""
 		Check whether the participant with the given username has consented to the use of his data in the given study.
 
@@ -78,6 +314,9 @@ class BlockchainAPI(PostgreSQLRouteHandler):
 		:type study_id: int
 		:param username: The unique username of the participant.
 		:type username: str
+		:param fresh: A boolean indicating whether the consent must be read from the blockchain itself, bypassing any mirror, cache or shared read.
+			Writes use fresh reads to decide whether the consent needs to change.
+		:type fresh: bool
 
 		:return: A boolean indicating whether the participant has consented to the use of their sample in the study.
 		:rtype: bool
@@ -115,3 +354,89 @@ class BlockchainAPI(PostgreSQLRouteHandler):
 		"""
 
 		pass
+
+	"""
+	Batched reads.
+	By default, they make one read for each item, and the reads are made concurrently.
+	Backends that can send several reads to the blockchain at once should override them.
+
+	If an `errors` dictionary is given, items whose read fails or times out get a default result, and their exceptions are recorded in the dictionary with the items' indices as keys.
+	Otherwise, the first exception is raised.
+	"""
+
+	def has_consent_many(self, pairs, *args, errors=None, **kwargs):
+		"""
+		Check whether each of the given participants has consented to the use of their data in the given study.
+
+		:param pairs: The studies and participants to check, as tuples with the unique ID of the study and the participant's address.
+		:type pairs: list of tuple
+		:param errors: The dictionary in which to record the exceptions of the pairs that could not be checked, or `None` to raise them.
+		:type errors: dict or None
+
+		:return: A list of booleans indicating whether each participant has consented, in the same order as the pairs.
+			Pairs that could not be checked are considered not to have consented.
+		:rtype: list of bool
+		"""
+
+		return self._fan_out(lambda pair: self.has_consent(pair[0], pair[1], *args, **kwargs), pairs, errors, False)
+
+	def get_study_participants_many(self, study_ids, *args, errors=None, **kwargs):
+		"""
+		Get the addresses of the participants that have consented to participate in each of the given studies.
+
+		:param study_ids: The unique IDs of the studies.
+		:type study_ids: list of str
+		:param errors: The dictionary in which to record the exceptions of the studies that could not be read, or `None` to raise them.
+		:type errors: dict or None
+
+		:return: A list of participant addresses for each study, in the same order as the studies.
+			Studies that could not be read have no participants.
+		:rtype: list of list of str
+		"""
+
+		return self._fan_out(lambda study_id: self.get_study_participants(study_id, *args, **kwargs), study_ids, errors, [])
+
+	def get_consent_trail_many(self, study_ids, username, *args, errors=None, **kwargs):
+		"""
+		Get a user's consent trail for each of the given studies.
+
+		:param study_ids: The unique IDs of the studies.
+		:type study_ids: list of str
+		:param username: The unique username of the participant.
+		:type username: str
+		:param errors: The dictionary in which to record the exceptions of the studies that could not be read, or `None` to raise them.
+		:type errors: dict or None
+
+		:return: A dictionary of consent changes for each study, in the same order as the studies.
+			Studies that could not be read have no consent changes.
+		:rtype: list of dict
+		"""
+
+		return self._fan_out(lambda study_id: self.get_consent_trail(study_id, username, *args, **kwargs), study_ids, errors, {})
+
+	def _fan_out(self, function, items, errors, default):
+		"""
+		Call a read function with each item concurrently.
+
+		:param function: The read function, which receives one item.
+		:type function: function
+		:param items: The items.
+		:type items: list
+		:param errors: The dictionary in which to record the exceptions of the items whose read failed, or `None` to raise them.
+		:type errors: dict or None
+		:param default: The result of items whose read failed.
+		:type default: object
+
+		:return: The results, in the same order as the items.
+		:rtype: list
+
+		:raises: :class:`Exception`
+		"""
+
+		results, failures = fan_out.map(function, items, server_config.fan_out_timeout)
+		if failures and errors is None:
+			raise failures[min(failures)]
+
+		if errors is not None:
+			errors.update(failures)
+		return [ default if index in failures else result for index, result in enumerate(results) ]
@@ -0,0 +1,240 @@
+"""
+The block cache lets contract reads that are made in the same block share their results.
+Reads are pinned to the latest block that the block tracker knows of, so they return the same result until a new block is mined, and can be cached until then.
+"""
+
+import threading
+import time
+import traceback
+
+class BlockTracker(object):
+	"""
+	The block tracker follows the number of the latest block.
+	A single thread polls the node for the latest block, so that reads do not ask the node for it.
+	The thread starts the first time that the latest block is needed.
+
+	If the block number has not been refreshed for a while, for example because the node cannot be reached, it is not known.
+
+	:ivar _w3: A function that returns the connection to the Ethereum node.
+	:vartype _w3: function
+	:ivar _poll_interval: The time, in seconds, between checks for new blocks.
+	:vartype _poll_interval: float
+	:ivar _max_age: The time, in seconds, after which a block number that has not been refreshed is no longer known.
+	:vartype _max_age: float
+	:ivar _block: The number of the latest block, or `None` if it has never been read.
+	:vartype _block: int or None
+	:ivar _refreshed_at: The time, on the monotonic clock, when the block number was last refreshed.
+	:vartype _refreshed_at: float
+	:ivar _thread: The polling thread, or `None` if it has not been started.
+	:vartype _thread: :class:`threading.Thread` or None
+	:ivar _lock: The lock that protects the tracker's state.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	def __init__(self, w3, poll_interval=1, max_age=10):
+		"""
+		Create the block tracker.
+
+		:param w3: A function that returns the connection to the Ethereum node.
+		:type w3: function
+		:param poll_interval: The time, in seconds, between checks for new blocks.
+		:type poll_interval: float
+		:param max_age: The time, in seconds, after which a block number that has not been refreshed is no longer known.
+		:type max_age: float
+		"""
+
+		self._w3 = w3
+		self._poll_interval = poll_interval
+		self._max_age = max_age
+		self._block = None
+		self._refreshed_at = 0
+		self._thread = None
+		self._lock = threading.Lock()
+
+	def latest(self):
+		"""
+		Get the number of the latest block.
+
+		:return: The number of the latest block, or `None` if it is not known.
+		:rtype: int or None
+		"""
+
+		with self._lock:
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name="block-tracker", daemon=True)
+				self._thread.start()
+
+			if self._block is None or time.monotonic() - self._refreshed_at > self._max_age:
+				return None
+			return self._block
+
+	def advance(self, block):
+		"""
+		Move to a newer block that was seen elsewhere, such as the block that includes a transaction that was just confirmed.
+		Reads that are made afterwards then see the transaction.
+
+		:param block: The number of the block.
+		:type block: int
+		"""
+
+		with self._lock:
+			if self._block is not None and block > self._block:
+				self._block = block
+
+	def _run(self):
+		"""
+		Check for new blocks forever.
+		"""
+
+		while True:
+			try:
+				block = self._w3().eth.blockNumber
+				with self._lock:
+					self._block = block if self._block is None else max(block, self._block)
+					self._refreshed_at = time.monotonic()
+			except Exception:
+				traceback.print_exc()
+
+			time.sleep(self._poll_interval)
+
+class BlockCache(object):
+	"""
+	The block cache keeps the results of the reads that are made in the latest block.
+	The results are keyed by the function, its arguments and the block, and they are all dropped when a new block arrives.
+
+	If the latest block is not known, or if there is no tracker, reads are made at the latest block of the node and they are not cached.
+
+	:ivar _tracker: The tracker of the latest block, or `None` if reads are never cached.
+	:vartype _tracker: :class:`biobank.handlers.blockchain.api.ethereum.block_cache.BlockTracker` or None
+	:ivar _max_entries: The maximum number of results that are cached in each block.
+	:vartype _max_entries: int
+	:ivar _block: The block of the cached results, or `None` if nothing has been cached.
+	:vartype _block: int or None
+	:ivar _entries: The cached results, with the functions, their arguments and the block as keys.
+	:vartype _entries: dict
+	:ivar _lock: The lock that protects the cached results.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	def __init__(self, tracker, max_entries=10000):
+		"""
+		Create the empty block cache.
+
+		:param tracker: The tracker of the latest block, or `None` if reads should never be cached.
+		:type tracker: :class:`biobank.handlers.blockchain.api.ethereum.block_cache.BlockTracker` or None
+		:param max_entries: The maximum number of results that are cached in each block.
+		:type max_entries: int
+		"""
+
+		self._tracker = tracker
+		self._max_entries = max_entries
+		self._block = None
+		self._entries = {}
+		self._lock = threading.Lock()
+
+	def block(self):
+		"""
+		Get the block to which reads should be pinned.
+
+		:return: The number of the latest known block, or `None` if it is not known.
+		:rtype: int or None
+		"""
+
+		return self._tracker.latest() if self._tracker is not None else None
+
+	def advance(self, block):
+		"""
+		Move to a newer block that was seen elsewhere, such as the block that includes a transaction that was just confirmed.
+
+		:param block: The number of the block.
+		:type block: int
+		"""
+
+		if self._tracker is not None:
+			self._tracker.advance(block)
+
+	def lookup(self, function, arguments, block):
+		"""
+		Look up the result of a read.
+
+		:param function: The function that was read.
+		:type function: str or tuple
+		:param arguments: The arguments of the function.
+		:type arguments: list
+		:param block: The block to which the read is pinned, or `None` if it is not pinned.
+		:type block: int or None
+
+		:return: A boolean indicating whether the result is cached, and the result.
+		:rtype: tuple
+		"""
+
+		if block is None:
+			return False, None
+
+		key = (function, tuple(arguments), block)
+		with self._lock:
+			self._roll(block)
+			if key in self._entries:
+				return True, self._entries[key]
+		return False, None
+
+	def store(self, function, arguments, block, result):
+		"""
+		Cache the result of a read.
+		Results of reads that are pinned to an older block are not cached.
+
+		:param function: The function that was read.
+		:type function: str or tuple
+		:param arguments: The arguments of the function.
+		:type arguments: list
+		:param block: The block to which the read was pinned, or `None` if it was not pinned.
+		:type block: int or None
+		:param result: The result of the read.
+			It is shared by all the reads that find it, so it should not be changed.
+		:type result: object
+		"""
+
+		if block is None:
+			return
+
+		with self._lock:
+			self._roll(block)
+			if block == self._block and len(self._entries) < self._max_entries:
+				self._entries[(function, tuple(arguments), block)] = result
+
+	def get(self, function, arguments, read):
+		"""
+		Get the result of a read from the cache, or make the read and cache its result.
+
+		:param function: The function to read.
+		:type function: str or tuple
+		:param arguments: The arguments of the function.
+		:type arguments: list
+		:param read: The function that makes the read, which receives the block to which the read is pinned, or `None`.
+		:type read: function
+
+		:return: The result of the read.
+		:rtype: object
+		"""
+
+		block = self.block()
+		cached, result = self.lookup(function, arguments, block)
+		if cached:
+			return result
+
+		result = read(block)
+		self.store(function, arguments, block, result)
+		return result
+
+	def _roll(self, block):
+		"""
+		Drop the cached results if a newer block has arrived.
+		The lock must be held.
+
+		:param block: The block of a read.
+		:type block: int
+		"""
+
+		if self._block is None or block > self._block:
+			self._block = block
+			self._entries = {}
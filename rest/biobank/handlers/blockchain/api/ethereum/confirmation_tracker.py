@@ -0,0 +1,192 @@
+"""
+The confirmation tracker follows new blocks and resolves the transactions that are waiting to be mined.
+A single thread polls the node for new blocks, however many transactions are pending, instead of each transaction polling the node on its own.
+"""
+
+from concurrent.futures import Future
+
+import threading
+import traceback
+
+class ConfirmationTracker(object):
+	"""
+	The confirmation tracker keeps a future for each transaction that is waiting to be mined.
+	Whenever a new block is mined, the tracker looks for the pending transactions among the block's transactions and resolves their futures with their receipts.
+	Callers can wait on the futures, or add callbacks to them.
+
+	The tracking thread only runs while there are pending transactions.
+
+	:ivar _w3: A function that returns the connection to the Ethereum node.
+	:vartype _w3: function
+	:ivar _poll_interval: The time, in seconds, between checks for new blocks.
+	:vartype _poll_interval: float
+	:ivar _pending: The futures of the pending transactions, with the transactions' hashes as keys.
+	:vartype _pending: dict
+	:ivar _last_block: The number of the last block that was checked, or `None` if no block has been checked yet.
+	:vartype _last_block: int or None
+	:ivar _thread: The tracking thread, or `None` if it is not running.
+	:vartype _thread: :class:`threading.Thread` or None
+	:ivar _condition: The condition that protects the tracker's state and wakes up the tracking thread.
+	:vartype _condition: :class:`threading.Condition`
+	"""
+
+	def __init__(self, w3, poll_interval=0.5):
+		"""
+		Create the confirmation tracker.
+
+		:param w3: A function that returns the connection to the Ethereum node.
+		:type w3: function
+		:param poll_interval: The time, in seconds, between checks for new blocks.
+		:type poll_interval: float
+		"""
+
+		self._w3 = w3
+		self._poll_interval = poll_interval
+		self._pending = {}
+		self._last_block = None
+		self._thread = None
+		self._condition = threading.Condition()
+
+	def track(self, tx_hash, callback=None):
+		"""
+		Start tracking a transaction.
+		The transaction should be tracked before it is sent, so that it cannot be mined before the tracker looks for it.
+
+		:param tx_hash: The transaction's hash.
+		:type tx_hash: bytes
+		:param callback: A function that is called with the transaction's future when the transaction is mined.
+		:type callback: function or None
+
+		:return: The future that is resolved with the transaction's receipt when it is mined.
+		:rtype: :class:`concurrent.futures.Future`
+		"""
+
+		tx_hash = self._key(tx_hash)
+		with self._condition:
+			future = self._pending.get(tx_hash)
+			if future is None:
+				future = Future()
+				future.set_running_or_notify_cancel()
+				self._pending[tx_hash] = future
+
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name="confirmation-tracker", daemon=True)
+				self._thread.start()
+			self._condition.notify()
+
+		if callback is not None:
+			future.add_done_callback(callback)
+		return future
+
+	def forget(self, tx_hash):
+		"""
+		Stop tracking a transaction, for example because it was not sent or because the caller stopped waiting for it.
+
+		:param tx_hash: The transaction's hash.
+		:type tx_hash: bytes
+		"""
+
+		with self._condition:
+			self._pending.pop(self._key(tx_hash), None)
+
+	def pending(self):
+		"""
+		Count the transactions that are waiting to be mined.
+
+		:return: The number of pending transactions.
+		:rtype: int
+		"""
+
+		with self._condition:
+			return len(self._pending)
+
+	def _run(self):
+		"""
+		Check for new blocks until there are no pending transactions left.
+		"""
+
+		while True:
+			with self._condition:
+				if not self._pending:
+					"""
+					The next block to check is found again when a transaction is tracked, since blocks are not followed while the thread is stopped.
+					"""
+					self._thread = None
+					self._last_block = None
+					return
+
+			try:
+				self._check_blocks()
+			except Exception:
+				traceback.print_exc()
+
+			with self._condition:
+				self._condition.wait(self._poll_interval)
+
+	def _check_blocks(self):
+		"""
+		Look for the pending transactions in the blocks that were mined since the last check.
+		When the tracker starts, the transactions may already have been mined, so their receipts are looked up directly instead.
+		"""
+
+		w3 = self._w3()
+		latest = w3.eth.blockNumber
+		if self._last_block is None:
+			with self._condition:
+				tracked = list(self._pending)
+
+			for tx_hash in tracked:
+				self._resolve(w3, tx_hash)
+			self._last_block = latest
+			return
+
+		for number in range(self._last_block + 1, latest + 1):
+			block = w3.eth.get_block(number)
+			with self._condition:
+				mined = [ self._key(tx_hash) for tx_hash in block.transactions if self._key(tx_hash) in self._pending ]
+
+			for tx_hash in mined:
+				self._resolve(w3, tx_hash)
+
+			self._last_block = number
+
+	def _resolve(self, w3, tx_hash):
+		"""
+		Resolve a transaction's future with its receipt, if the transaction has been mined.
+
+		:param w3: The connection to the Ethereum node.
+		:type w3: :class:`web3.Web3`
+		:param tx_hash: The transaction's hash.
+		:type tx_hash: str
+		"""
+
+		try:
+			receipt = w3.eth.get_transaction_receipt(tx_hash)
+		except Exception:
+			"""
+			The node raises an exception if the transaction has not been mined yet.
+			"""
+			return
+
+		if receipt is None or receipt.blockNumber is None:
+			return
+
+		with self._condition:
+			future = self._pending.pop(tx_hash, None)
+		if future is not None:
+			future.set_result(receipt)
+
+	def _key(self, tx_hash):
+		"""
+		Get the key of a transaction, so that hashes given as bytes or as hexadecimal strings are the same.
+
+		:param tx_hash: The transaction's hash.
+		:type tx_hash: bytes or str
+
+		:return: The transaction's hash as a lowercase hexadecimal string.
+		:rtype: str
+		"""
+
+		if isinstance(tx_hash, (bytes, bytearray)):
+			return "0x" + bytes(tx_hash).hex()
+		return tx_hash.lower() if tx_hash.startswith("0x") else "0x" + tx_hash.lower()
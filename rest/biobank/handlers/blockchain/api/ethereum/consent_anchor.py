@@ -0,0 +1,573 @@
+"""
+The consent anchor records consent changes in PostgreSQL and anchors them on the blockchain in batches.
+Instead of sending a transaction for each consent change, the anchorer periodically builds a Merkle tree over the changes that were recorded since the last batch, and only sends the tree's root to the blockchain.
+Each consent change can then be proven to be part of an anchored batch with its inclusion proof.
+"""
+
+import traceback
+
+from ...merkle import MerkleTree
+from connection.sql import escape
+
+class ConsentAnchor(object):
+	"""
+	The consent anchor stores consent changes, groups them into batches and answers consent reads.
+	When consent changes are anchored, the database is the record of consent, and the blockchain proves that the record was not changed afterwards.
+
+	:cvar import_lock_id: The ID of the advisory lock that is held while the consent changes that were recorded on the contract are imported.
+	:vartype import_lock_id: int
+
+	:ivar _connector: The connection to the database that stores the consent changes.
+	:vartype _connector: :class:`connection.connection.Connection`
+	:ivar _imported: A boolean indicating whether the consent changes that were recorded on the contract are known to have been imported.
+	:vartype _imported: bool
+	"""
+
+	import_lock_id = 702539
+
+	def __init__(self, connector):
+		"""
+		Create the consent anchor.
+
+		:param connector: The connection to the database that stores the consent changes.
+		:type connector: :class:`connection.connection.Connection`
+		"""
+
+		self._connector = connector
+		self._imported = False
+
+	def is_imported(self):
+		"""
+		Check whether the consent changes that were recorded on the contract, before consent changes were anchored, have been imported.
+
+		:return: A boolean indicating whether the changes have been imported.
+		:rtype: bool
+		"""
+
+		if not self._imported:
+			self._imported = self._connector.exists("""
+				SELECT
+					*
+				FROM
+					consent_anchor_imports
+			""")
+		return self._imported
+
+	def import_changes(self, changes):
+		"""
+		Import the consent changes that were recorded on the contract before consent changes were anchored.
+		Consent is read from the recorded changes once it is anchored, so consent that was only given on the contract would otherwise be lost.
+
+		The changes are imported once, even if several processes import them at the same time, since the import holds an advisory lock and checks that no other process has finished it.
+		Participants who already have recorded changes are skipped, since their recorded changes are newer than those on the contract.
+		The imported changes are anchored with the next batch.
+
+		:param changes: The consent changes, as tuples with the unique ID of the study, the participant's address, the consent status and the UNIX timestamp of the change.
+		:type changes: list of tuple
+		"""
+
+		recorded = { (row["study_id"], row["address"]) for row in self._connector.select("""
+			SELECT DISTINCT
+				study_id, address
+			FROM
+				consent_anchor_changes
+		""") }
+
+		not_imported = "NOT EXISTS (SELECT * FROM consent_anchor_imports)"
+		batch = [ "SELECT pg_advisory_xact_lock(%d)" % self.import_lock_id ]
+		for study_id, address, consent, changed_at in sorted(changes, key=lambda change: change[3]):
+			if (str(study_id), address) in recorded:
+				continue
+
+			batch.append("""
+				INSERT INTO consent_anchor_changes (
+					study_id, address, consent, changed_at)
+				SELECT
+					'%s', '%s', %s, %d
+				WHERE
+					%s
+			""" % (escape(study_id), escape(address), bool(consent), int(changed_at), not_imported))
+
+		batch.append("""
+			INSERT INTO consent_anchor_imports (
+				changes)
+			SELECT
+				%d
+			WHERE
+				%s
+		""" % (len(changes), not_imported))
+		self._connector.execute(batch)
+		self._imported = True
+
+	def record(self, study_id, address, consent):
+		"""
+		Record a consent change, which is anchored with the next batch.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The unique address of the participant on the blockchain.
+		:type address: str
+		:param consent: The consent status.
+		:type consent: bool
+
+		:return: The consent change's ID.
+		:rtype: int
+		"""
+
+		cursor = self._connector.execute("""
+			INSERT INTO consent_anchor_changes (
+				study_id, address, consent, changed_at)
+			VALUES ('%s', '%s', %s, EXTRACT(EPOCH FROM NOW())::BIGINT)
+			RETURNING id
+		""" % (escape(study_id), escape(address), bool(consent)), with_cursor=True)
+		row = cursor.fetchone()
+		cursor.close()
+		return row["id"]
+
+	def create_batch(self, size):
+		"""
+		Group the consent changes that are not part of a batch yet into a new batch, and store the root of its Merkle tree.
+		The changes are given their leaf index in the order in which they were recorded.
+
+		:param size: The maximum number of consent changes in the batch.
+		:type size: int
+
+		:return: The new batch's ID, or `None` if there are no consent changes to anchor.
+		:rtype: int or None
+		"""
+
+		cursor = self._connector.execute("""
+			WITH locked AS (
+				SELECT
+					id
+				FROM
+					consent_anchor_changes
+				WHERE
+					batch_id IS NULL
+				ORDER BY
+					id
+				LIMIT %d
+				FOR UPDATE SKIP LOCKED
+			), numbered AS (
+				SELECT
+					id, ROW_NUMBER() OVER (ORDER BY id) - 1 AS leaf_index
+				FROM
+					locked
+			), batch AS (
+				INSERT INTO consent_anchor_batches (
+					size)
+				SELECT
+					COUNT(*)
+				FROM
+					locked
+				HAVING
+					COUNT(*) > 0
+				RETURNING id
+			)
+			UPDATE
+				consent_anchor_changes
+			SET
+				batch_id = batch.id,
+				leaf_index = numbered.leaf_index
+			FROM
+				batch, numbered
+			WHERE
+				consent_anchor_changes.id = numbered.id
+			RETURNING
+				batch.id AS batch_id
+		""" % size, with_cursor=True)
+		row = cursor.fetchone()
+		cursor.close()
+		if row is None:
+			return None
+
+		self.seal(row["batch_id"])
+		return row["batch_id"]
+
+	def seal(self, batch_id):
+		"""
+		Build the Merkle tree of a batch and store its root.
+
+		:param batch_id: The batch's ID.
+		:type batch_id: int
+
+		:return: The root of the batch's Merkle tree.
+		:rtype: str
+		"""
+
+		root = MerkleTree(self._batch_changes(batch_id)).root
+		self._connector.execute("""
+			UPDATE
+				consent_anchor_batches
+			SET
+				root = '%s'
+			WHERE
+				id = %d
+		""" % (root, int(batch_id)))
+		return root
+
+	def unanchored_batches(self):
+		"""
+		Get the batches whose root has not been sent to the blockchain yet, from the oldest to the newest.
+
+		:return: The batches.
+		:rtype: list of dict
+		"""
+
+		return self._connector.select("""
+			SELECT
+				*
+			FROM
+				consent_anchor_batches
+			WHERE
+				tx_hash IS NULL
+			ORDER BY
+				id
+		""")
+
+	def set_anchored(self, batch_id, tx_hash, block_number):
+		"""
+		Record the transaction that anchored a batch's root on the blockchain.
+
+		:param batch_id: The batch's ID.
+		:type batch_id: int
+		:param tx_hash: The hash of the transaction.
+		:type tx_hash: str
+		:param block_number: The number of the block that includes the transaction.
+		:type block_number: int
+		"""
+
+		self._connector.execute("""
+			UPDATE
+				consent_anchor_batches
+			SET
+				tx_hash = '%s',
+				block_number = %d,
+				anchored_at = NOW()
+			WHERE
+				id = %d
+		""" % (escape(tx_hash), int(block_number), int(batch_id)))
+
+	def proofs(self, study_id, address):
+		"""
+		Get the inclusion proofs of a participant's consent changes to a study.
+		Changes that have not been anchored yet have no proof.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The unique address of the participant on the blockchain.
+		:type address: str
+
+		:return: The consent changes, from the oldest to the newest.
+			Each change includes its leaf, and, if it is anchored, its proof, the batch's root and the anchoring transaction.
+		:rtype: list of dict
+		"""
+
+		rows = self._connector.select("""
+			SELECT
+				consent_anchor_changes.*, consent_anchor_batches.root, consent_anchor_batches.tx_hash,
+				consent_anchor_batches.block_number
+			FROM
+				consent_anchor_changes LEFT JOIN consent_anchor_batches
+					ON consent_anchor_changes.batch_id = consent_anchor_batches.id
+			WHERE
+				consent_anchor_changes.study_id = '%s' AND
+				consent_anchor_changes.address = '%s'
+			ORDER BY
+				consent_anchor_changes.id
+		""" % (escape(study_id), escape(address)))
+
+		"""
+		Each batch's tree is only built once, even if the participant changed their consent several times in it.
+		"""
+		trees = {}
+		proofs = []
+		for row in rows:
+			proof = { "change": _leaf(row), "anchored": row["tx_hash"] is not None }
+			if row["tx_hash"] is not None:
+				if row["batch_id"] not in trees:
+					trees[row["batch_id"]] = MerkleTree(self._batch_changes(row["batch_id"]))
+
+				proof.update({
+					"leaf_index": row["leaf_index"],
+					"proof": trees[row["batch_id"]].proof(row["leaf_index"]),
+					"root": row["root"],
+					"tx_hash": row["tx_hash"],
+					"block_number": row["block_number"],
+				})
+			proofs.append(proof)
+
+		return proofs
+
+	def has_consent_many(self, pairs):
+		"""
+		Check whether each of the given participants consents to the given study, according to their latest consent change.
+
+		:param pairs: The studies and participants to check, as tuples with the unique ID of the study and the participant's address.
+		:type pairs: list of tuple
+
+		:return: A list of booleans indicating whether each participant has consented, in the same order as the pairs.
+		:rtype: list of bool
+		"""
+
+		if not pairs:
+			return []
+
+		rows = self._connector.select("""
+			SELECT DISTINCT ON (study_id, address)
+				study_id, address, consent
+			FROM
+				consent_anchor_changes
+			WHERE
+				(study_id, address) IN (%s)
+			ORDER BY
+				study_id, address, id DESC
+		""" % _pairs(pairs))
+		consents = { (row["study_id"], row["address"]): row["consent"] for row in rows }
+		return [ consents.get((str(study_id), address), False) for study_id, address in pairs ]
+
+	def get_study_participants_many(self, study_ids, all_participants=False):
+		"""
+		Get the addresses of the participants of each of the given studies, in the order in which they first consented.
+
+		:param study_ids: The unique IDs of the studies.
+		:type study_ids: list of str
+		:param all_participants: A boolean indicating whether participants who withdrew their consent are included.
+		:type all_participants: bool
+
+		:return: A list of participant addresses for each study, in the same order as the studies.
+		:rtype: list of list of str
+		"""
+
+		if not study_ids:
+			return []
+
+		rows = self._connector.select("""
+			SELECT
+				study_id, address
+			FROM
+				consent_anchor_changes AS changes
+			WHERE
+				study_id IN (%s)
+			GROUP BY
+				study_id, address
+			HAVING
+				%s
+			ORDER BY
+				MIN(id) FILTER (WHERE consent)
+		""" % (", ".join("'%s'" % escape(study_id) for study_id in study_ids),
+			   "BOOL_OR(consent)" if all_participants else "(ARRAY_AGG(consent ORDER BY id DESC))[1]"))
+
+		participants = { str(study_id): [] for study_id in study_ids }
+		for row in rows:
+			participants[row["study_id"]].append(row["address"])
+		return [ participants[str(study_id)] for study_id in study_ids ]
+
+	def get_consent_trail_many(self, pairs):
+		"""
+		Get the consent trail of each of the given participants in the given study.
+
+		:param pairs: The studies and participants, as tuples with the unique ID of the study and the participant's address.
+		:type pairs: list of tuple
+
+		:return: A dictionary of consent changes for each pair, relating the timestamp of each change with the consent status.
+		:rtype: list of dict
+		"""
+
+		if not pairs:
+			return []
+
+		rows = self._connector.select("""
+			SELECT
+				study_id, address, consent, changed_at
+			FROM
+				consent_anchor_changes
+			WHERE
+				(study_id, address) IN (%s)
+			ORDER BY
+				id
+		""" % _pairs(pairs))
+
+		trails = { (str(study_id), address): {} for study_id, address in pairs }
+		for row in rows:
+			trails[(row["study_id"], row["address"])][row["changed_at"]] = row["consent"]
+		return [ trails[(str(study_id), address)] for study_id, address in pairs ]
+
+	def _batch_changes(self, batch_id):
+		"""
+		Get the leaves of a batch's consent changes, in the order of the tree.
+
+		:param batch_id: The batch's ID.
+		:type batch_id: int
+
+		:return: The leaves of the consent changes.
+		:rtype: list of dict
+		"""
+
+		rows = self._connector.select("""
+			SELECT
+				*
+			FROM
+				consent_anchor_changes
+			WHERE
+				batch_id = %d
+			ORDER BY
+				leaf_index
+		""" % int(batch_id))
+		return [ _leaf(row) for row in rows ]
+
+class ConsentAnchorer(object):
+	"""
+	The consent anchorer periodically groups the recorded consent changes into a batch and sends the batch's root to the blockchain.
+	Batches whose root could not be sent are sent again before new batches are created.
+
+	Only one anchorer runs at a time, even if several processes start one, because the anchorer holds an advisory lock while it runs.
+
+	:cvar lock_id: The ID of the advisory lock that the running anchorer holds.
+	:vartype lock_id: int
+
+	:ivar _anchor: The consent anchor, which should have its own connection, since the advisory lock belongs to the connection's session.
+	:vartype _anchor: :class:`biobank.handlers.blockchain.api.ethereum.consent_anchor.ConsentAnchor`
+	:ivar _send: A function that sends a root to the blockchain and returns the transaction's hash and block number.
+	:vartype _send: function
+	:ivar _interval: The time, in seconds, between batches.
+	:vartype _interval: float
+	:ivar _batch_size: The maximum number of consent changes in a batch.
+	:vartype _batch_size: int
+	:ivar _locked: A boolean indicating whether the anchorer held the advisory lock when it last checked.
+	:vartype _locked: bool
+	"""
+
+	lock_id = 702538
+
+	def __init__(self, anchor, send, interval=60, batch_size=10000):
+		"""
+		Create the consent anchorer.
+
+		:param anchor: The consent anchor, which should have its own connection.
+		:type anchor: :class:`biobank.handlers.blockchain.api.ethereum.consent_anchor.ConsentAnchor`
+		:param send: A function that sends a root to the blockchain and returns the transaction's hash and block number.
+		:type send: function
+		:param interval: The time, in seconds, between batches.
+		:type interval: float
+		:param batch_size: The maximum number of consent changes in a batch.
+		:type batch_size: int
+		"""
+
+		self._anchor = anchor
+		self._send = send
+		self._interval = interval
+		self._batch_size = batch_size
+		self._locked = False
+
+	def run(self, stop):
+		"""
+		Anchor consent changes until the anchorer is asked to stop.
+		If another anchorer is running, wait until it stops.
+
+		:param stop: The event that is set when the anchorer should stop.
+		:type stop: :class:`threading.Event`
+		"""
+
+		while not stop.wait(self._interval):
+			try:
+				if self._lock():
+					self.anchor_once()
+			except Exception:
+				traceback.print_exc()
+
+		self._unlock()
+
+	def anchor_once(self):
+		"""
+		Send the roots of the batches that have not been anchored yet, and then anchor a new batch.
+
+		:return: The number of batches that were anchored.
+		:rtype: int
+		"""
+
+		anchored = 0
+		if self._anchor.create_batch(self._batch_size) is not None:
+			print("Consent anchor: created a new batch")
+
+		for batch in self._anchor.unanchored_batches():
+			"""
+			The root may be missing if the anchorer stopped while it was creating the batch.
+			"""
+			root = batch["root"] or self._anchor.seal(batch["id"])
+			tx_hash, block_number = self._send(root)
+			self._anchor.set_anchored(batch["id"], tx_hash, block_number)
+			print("Consent anchor: anchored %d consent changes in %s" % (batch["size"], tx_hash))
+			anchored += 1
+
+		return anchored
+
+	def _lock(self):
+		"""
+		Try to take the advisory lock that allows only one anchorer to run.
+		The lock is checked before every pass, since it is lost when the connection fails and reconnects.
+		If the session still holds the lock, it is not taken again, so that a single unlock releases it.
+
+		:return: A boolean indicating whether the anchorer holds the lock.
+		:rtype: bool
+		"""
+
+		self._locked = self._anchor._connector.select_one("""
+			SELECT
+				CASE
+					WHEN EXISTS (
+						SELECT
+							*
+						FROM
+							pg_locks
+						WHERE
+							locktype = 'advisory' AND
+							pid = pg_backend_pid() AND
+							objid = %d AND
+							granted
+					) THEN TRUE
+					ELSE pg_try_advisory_lock(%d)
+				END AS locked
+		""" % (self.lock_id, self.lock_id))["locked"]
+		return self._locked
+
+	def _unlock(self):
+		"""
+		Release the advisory lock, if the anchorer holds it.
+		"""
+
+		if self._locked:
+			self._anchor._connector.select_one("SELECT pg_advisory_unlock(%d) AS unlocked" % self.lock_id)
+			self._locked = False
+
+def _leaf(row):
+	"""
+	Get the leaf of a consent change, which is the part of the change that is hashed.
+
+	:param row: The consent change, as stored in the database.
+	:type row: dict
+
+	:return: The leaf, with the change's ID, the study's ID, the participant's address, the consent status and the timestamp.
+	:rtype: dict
+	"""
+
+	return {
+		"id": row["id"],
+		"study_id": row["study_id"],
+		"address": row["address"],
+		"consent": row["consent"],
+		"timestamp": row["changed_at"],
+	}
+
+def _pairs(pairs):
+	"""
+	Format studies and participants as a list of SQL tuples.
+
+	:param pairs: The studies and participants, as tuples with the unique ID of the study and the participant's address.
+	:type pairs: list of tuple
+
+	:return: The SQL tuples, separated by commas.
+	:rtype: str
+	"""
+
+	return ", ".join("('%s', '%s')" % (escape(study_id), escape(address)) for study_id, address in pairs)
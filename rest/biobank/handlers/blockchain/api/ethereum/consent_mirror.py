@@ -0,0 +1,510 @@
+"""
+The consent mirror keeps a copy of the consent state that is recorded on the blockchain in PostgreSQL.
+The indexer follows the chain and copies every consent change into the mirror, and the Ethereum backend can then answer consent reads from the database.
+
+The contract does not emit events, so the indexer decodes the transactions that are sent to the contract instead.
+"""
+
+import time
+import traceback
+
+from connection.sql import escape
+
+class ConsentMirror(object):
+	"""
+	The consent mirror reads consent from the mirrored tables.
+	The mirror should only be used while it is fresh, that is, while the indexer has recently caught up with the node.
+
+	:ivar _connector: The connection to the database that stores the mirror.
+	:vartype _connector: :class:`connection.connection.Connection`
+	:ivar _fresh_until: The time, on the monotonic clock, until which the mirror is known to be fresh.
+	:vartype _fresh_until: float
+	"""
+
+	def __init__(self, connector):
+		"""
+		Create the consent mirror.
+
+		:param connector: The connection to the database that stores the mirror.
+		:type connector: :class:`connection.connection.Connection`
+		"""
+
+		self._connector = connector
+		self._fresh_until = 0.
+
+	def is_fresh(self, max_staleness):
+		"""
+		Check whether the indexer has caught up with the node recently enough for the mirror to be used.
+		A fresh answer is remembered for a second, so that a burst of reads does not check the mirror every time.
+
+		:param max_staleness: The maximum time, in seconds, since the indexer last caught up with the node.
+		:type max_staleness: float
+
+		:return: A boolean indicating whether the mirror is fresh.
+		:rtype: bool
+		"""
+
+		if time.monotonic() < self._fresh_until:
+			return True
+
+		fresh = self._connector.exists("""
+			SELECT
+				*
+			FROM
+				consent_checkpoints
+			WHERE
+				checked_at >= NOW() - INTERVAL '%f seconds'
+			LIMIT 1
+		""" % max_staleness)
+		if fresh:
+			self._fresh_until = time.monotonic() + min(1, max_staleness)
+		return fresh
+
+	def has_consent_many(self, pairs):
+		"""
+		Check whether each of the given participants consents to the given study.
+
+		:param pairs: The studies and participants to check, as tuples with the unique ID of the study and the participant's address.
+		:type pairs: list of tuple
+
+		:return: A list of booleans indicating whether each participant has consented, in the same order as the pairs.
+		:rtype: list of bool
+		"""
+
+		if not pairs:
+			return []
+
+		rows = self._connector.select("""
+			SELECT
+				study_id, address
+			FROM
+				consents
+			WHERE
+				consent = TRUE AND
+				(study_id, address) IN (%s)
+		""" % ", ".join("('%s', '%s')" % (escape(study_id), escape(address)) for study_id, address in pairs))
+		consenting = { (row["study_id"], row["address"]) for row in rows }
+		return [ (str(study_id), address) in consenting for study_id, address in pairs ]
+
+	def get_study_participants_many(self, study_ids, all_participants=False):
+		"""
+		Get the addresses of the participants of each of the given studies, in the order in which they first consented.
+
+		:param study_ids: The unique IDs of the studies.
+		:type study_ids: list of str
+		:param all_participants: A boolean indicating whether participants who withdrew their consent are included.
+		:type all_participants: bool
+
+		:return: A list of participant addresses for each study, in the same order as the studies.
+		:rtype: list of list of str
+		"""
+
+		if not study_ids:
+			return []
+
+		rows = self._connector.select("""
+			SELECT
+				consents.study_id, consents.address,
+				MIN(consent_changes.block_number * 100000 + consent_changes.tx_index) AS position
+			FROM
+				consents LEFT JOIN consent_changes
+					ON consents.study_id = consent_changes.study_id AND consents.address = consent_changes.address
+			WHERE
+				consents.study_id IN (%s) %s
+			GROUP BY
+				consents.study_id, consents.address
+			ORDER BY
+				position
+		""" % (", ".join("'%s'" % escape(study_id) for study_id in study_ids),
+			   "" if all_participants else "AND consents.consent = TRUE"))
+
+		participants = { str(study_id): [] for study_id in study_ids }
+		for row in rows:
+			participants[row["study_id"]].append(row["address"])
+		return [ participants[str(study_id)] for study_id in study_ids ]
+
+	def get_consent_trail_many(self, pairs):
+		"""
+		Get the consent trail of each of the given participants in the given study.
+
+		:param pairs: The studies and participants, as tuples with the unique ID of the study and the participant's address.
+		:type pairs: list of tuple
+
+		:return: A dictionary of consent changes for each pair, relating the timestamp of each change with the consent status.
+		:rtype: list of dict
+		"""
+
+		if not pairs:
+			return []
+
+		rows = self._connector.select("""
+			SELECT
+				study_id, address, consent, block_timestamp
+			FROM
+				consent_changes
+			WHERE
+				(study_id, address) IN (%s)
+			ORDER BY
+				block_number, tx_index
+		""" % ", ".join("('%s', '%s')" % (escape(study_id), escape(address)) for study_id, address in pairs))
+
+		trails = { (str(study_id), address): {} for study_id, address in pairs }
+		for row in rows:
+			trails[(row["study_id"], row["address"])][row["block_timestamp"]] = row["consent"]
+		return [ trails[(str(study_id), address)] for study_id, address in pairs ]
+
+class ConsentIndexer(object):
+	"""
+	The consent indexer copies the consent changes that are recorded on the blockchain into the consent mirror.
+	Blocks are indexed in order, and each block is indexed in its own database transaction, together with a checkpoint that records its hash.
+
+	Before indexing new blocks, the indexer checks that the latest checkpoint is still part of the chain.
+	If it is not, the chain was reorganized, and the changes in the blocks after the last checkpoint that is still part of the chain are undone.
+
+	Only one indexer runs at a time, even if several processes start one, because the indexer holds an advisory lock while it runs.
+	The indexer also reconciles a sample of the mirror with the chain from time to time, and corrects any difference.
+
+	:cvar lock_id: The ID of the advisory lock that the running indexer holds.
+	:vartype lock_id: int
+	:cvar consent_functions: The contract functions that change consent, with the consent that they set as values.
+	:vartype consent_functions: dict
+
+	:ivar _connector: The connection to the database that stores the mirror.
+		The indexer should have its own connection, since the advisory lock belongs to the connection's session.
+	:vartype _connector: :class:`connection.connection.Connection`
+	:ivar _api: The Ethereum backend, which is used to read from the chain.
+	:vartype _api: :class:`biobank.handlers.blockchain.api.ethereum.ethereum.EthereumAPI`
+	:ivar _start_block: The block from which to start indexing if the mirror is empty.
+	:vartype _start_block: int
+	:ivar _reorg_depth: The number of checkpoints to keep, which is the deepest reorganization that can be undone.
+	:vartype _reorg_depth: int
+	:ivar _blocks_per_poll: The maximum number of blocks to index before checking for a stop request.
+	:vartype _blocks_per_poll: int
+	:ivar _poll_interval: The time, in seconds, to wait for new blocks once the indexer has caught up.
+	:vartype _poll_interval: float
+	:ivar _reconcile_interval: The time, in seconds, between reconciliations, or `None` to never reconcile.
+	:vartype _reconcile_interval: float or None
+	:ivar _reconcile_sample: The number of mirrored consents to compare with the chain in each reconciliation.
+	:vartype _reconcile_sample: int
+	:ivar _locked: A boolean indicating whether the indexer held the advisory lock when it last checked.
+	:vartype _locked: bool
+	"""
+
+	lock_id = 702537
+	consent_functions = { "addConsentToStudy": True, "withdrawConsentFromStudy": False }
+
+	def __init__(self, connector, api, start_block=0, reorg_depth=64, blocks_per_poll=100, poll_interval=1,
+				 reconcile_interval=600, reconcile_sample=100):
+		"""
+		Create the consent indexer.
+
+		:param connector: The connection to the database that stores the mirror.
+		:type connector: :class:`connection.connection.Connection`
+		:param api: The Ethereum backend, which is used to read from the chain.
+		:type api: :class:`biobank.handlers.blockchain.api.ethereum.ethereum.EthereumAPI`
+		:param start_block: The block from which to start indexing if the mirror is empty.
+		:type start_block: int
+		:param reorg_depth: The number of checkpoints to keep, which is the deepest reorganization that can be undone.
+		:type reorg_depth: int
+		:param blocks_per_poll: The maximum number of blocks to index before checking for a stop request.
+		:type blocks_per_poll: int
+		:param poll_interval: The time, in seconds, to wait for new blocks once the indexer has caught up.
+		:type poll_interval: float
+		:param reconcile_interval: The time, in seconds, between reconciliations, or `None` to never reconcile.
+		:type reconcile_interval: float or None
+		:param reconcile_sample: The number of mirrored consents to compare with the chain in each reconciliation.
+		:type reconcile_sample: int
+		"""
+
+		self._connector = connector
+		self._api = api
+		self._start_block = start_block
+		self._reorg_depth = reorg_depth
+		self._blocks_per_poll = blocks_per_poll
+		self._poll_interval = poll_interval
+		self._reconcile_interval = reconcile_interval
+		self._reconcile_sample = reconcile_sample
+		self._locked = False
+
+	def run(self, stop):
+		"""
+		Index the chain until the indexer is asked to stop.
+		If another indexer is running, wait until it stops.
+
+		:param stop: The event that is set when the indexer should stop.
+		:type stop: :class:`threading.Event`
+		"""
+
+		last_reconciliation = time.monotonic()
+		while not stop.is_set():
+			caught_up = True
+			try:
+				if self._lock():
+					caught_up = self.index_once()
+
+					if (self._reconcile_interval is not None and
+						time.monotonic() - last_reconciliation >= self._reconcile_interval):
+						self.reconcile()
+						last_reconciliation = time.monotonic()
+			except Exception:
+				traceback.print_exc()
+
+			if caught_up:
+				stop.wait(self._poll_interval)
+
+		self._unlock()
+
+	def index_once(self):
+		"""
+		Undo any reorganization of the chain, and then index the blocks that were mined since the latest checkpoint.
+
+		:return: A boolean indicating whether the indexer has caught up with the node.
+		:rtype: bool
+		"""
+
+		w3 = self._api._w3
+		head = w3.eth.blockNumber
+		checkpoint = self._connector.select_one("""
+			SELECT
+				*
+			FROM
+				consent_checkpoints
+			ORDER BY
+				block_number DESC
+			LIMIT 1
+		""")
+
+		if checkpoint is not None and w3.eth.get_block(checkpoint["block_number"])["hash"].hex() != checkpoint["block_hash"]:
+			self._rewind()
+			return False
+
+		first = self._start_block if checkpoint is None else checkpoint["block_number"] + 1
+		last = min(head, first + self._blocks_per_poll - 1)
+		for number in range(first, last + 1):
+			self._index_block(w3, number)
+
+		"""
+		Record that the mirror has caught up with the node, which is what makes it fresh.
+		"""
+		if last >= head:
+			self._connector.execute("""
+				UPDATE
+					consent_checkpoints
+				SET
+					checked_at = NOW()
+				WHERE
+					block_number = (SELECT MAX(block_number) FROM consent_checkpoints)
+			""")
+			return True
+
+		return False
+
+	def reconcile(self):
+		"""
+		Compare a random sample of the mirrored consents with the chain, and correct any difference.
+
+		:return: The number of consents that were corrected.
+		:rtype: int
+		"""
+
+		rows = self._connector.select("""
+			SELECT
+				study_id, address, consent
+			FROM
+				consents
+			ORDER BY
+				RANDOM()
+			LIMIT %d
+		""" % self._reconcile_sample)
+		if not rows:
+			return 0
+
+		"""
+		The chain is read directly, bypassing the mirror.
+		"""
+		consents = self._api._call_many([ ("hasConsented", [ row["study_id"], row["address"] ]) for row in rows ], Exception)
+		corrections = [ (row, consent[0]) for row, consent in zip(rows, consents) if consent[0] != row["consent"] ]
+		for row, consent in corrections:
+			print("Consent mirror: corrected the consent of %s to %s to %s" % (row["address"], row["study_id"], consent))
+			self._connector.execute("""
+				UPDATE
+					consents
+				SET
+					consent = %s
+				WHERE
+					study_id = '%s' AND
+					address = '%s'
+			""" % (consent, escape(row["study_id"]), escape(row["address"])))
+
+		return len(corrections)
+
+	def _index_block(self, w3, number):
+		"""
+		Copy the successful consent changes in the given block into the mirror, and record the block's checkpoint.
+
+		:param w3: The connection to the Ethereum node.
+		:type w3: :class:`web3.Web3`
+		:param number: The number of the block.
+		:type number: int
+		"""
+
+		block = w3.eth.get_block(number, full_transactions=True)
+		contract = self._api._contract
+		address = contract.address.lower()
+
+		batch = []
+		for tx in block["transactions"]:
+			if tx["to"] is None or tx["to"].lower() != address:
+				continue
+
+			try:
+				function, arguments = contract.decode_function_input(tx["input"])
+			except ValueError:
+				continue
+
+			if function.fn_name not in self.consent_functions:
+				continue
+
+			if w3.eth.get_transaction_receipt(tx["hash"])["status"] != 1:
+				continue
+
+			study_id, participant = escape(arguments["study"]), escape(arguments["participant"])
+			consent = self.consent_functions[function.fn_name]
+			batch.append("""
+				INSERT INTO consent_changes (
+					tx_hash, study_id, address, consent, block_number, tx_index, block_timestamp)
+				VALUES ('%s', '%s', '%s', %s, %d, %d, %d)
+				ON CONFLICT (tx_hash) DO NOTHING
+			""" % (tx["hash"].hex(), study_id, participant, consent, number, tx["transactionIndex"], block["timestamp"]))
+			batch.append("""
+				INSERT INTO consents (
+					study_id, address, consent, block_number)
+				VALUES ('%s', '%s', %s, %d)
+				ON CONFLICT (study_id, address) DO UPDATE
+				SET
+					consent = EXCLUDED.consent,
+					block_number = EXCLUDED.block_number
+			""" % (study_id, participant, consent, number))
+
+		batch.append("""
+			INSERT INTO consent_checkpoints (
+				block_number, block_hash)
+			VALUES (%d, '%s')
+			ON CONFLICT (block_number) DO UPDATE
+			SET
+				block_hash = EXCLUDED.block_hash
+		""" % (number, block["hash"].hex()))
+		batch.append("""
+			DELETE FROM
+				consent_checkpoints
+			WHERE
+				block_number <= %d
+		""" % (number - self._reorg_depth))
+		self._connector.execute(batch)
+
+	def _rewind(self):
+		"""
+		Undo the consent changes in the blocks that are no longer part of the chain.
+		The checkpoints are checked from the latest to find the last block that is still part of the chain.
+		If none of them is, the mirror is rebuilt from the start.
+		"""
+
+		w3 = self._api._w3
+		checkpoints = self._connector.select("""
+			SELECT
+				*
+			FROM
+				consent_checkpoints
+			ORDER BY
+				block_number DESC
+		""")
+
+		fork = self._start_block - 1
+		for checkpoint in checkpoints:
+			if w3.eth.get_block(checkpoint["block_number"])["hash"].hex() == checkpoint["block_hash"]:
+				fork = checkpoint["block_number"]
+				break
+
+		print("Consent mirror: the chain was reorganized, undoing the changes after block %d" % fork)
+
+		"""
+		The consents that changed after the fork are restored from their latest earlier change, if they have one.
+		"""
+		self._connector.execute([
+			"""
+			DELETE FROM
+				consents
+			WHERE
+				block_number > %d
+			""" % fork,
+			"""
+			DELETE FROM
+				consent_changes
+			WHERE
+				block_number > %d
+			""" % fork,
+			"""
+			INSERT INTO consents (
+				study_id, address, consent, block_number)
+			SELECT DISTINCT ON (changes.study_id, changes.address)
+				changes.study_id, changes.address, changes.consent, changes.block_number
+			FROM
+				consent_changes AS changes
+			WHERE
+				NOT EXISTS (
+					SELECT
+						*
+					FROM
+						consents
+					WHERE
+						consents.study_id = changes.study_id AND
+						consents.address = changes.address
+				)
+			ORDER BY
+				changes.study_id, changes.address, changes.block_number DESC, changes.tx_index DESC
+			""",
+			"""
+			DELETE FROM
+				consent_checkpoints
+			WHERE
+				block_number > %d
+			""" % fork,
+		])
+
+	def _lock(self):
+		"""
+		Try to take the advisory lock that allows only one indexer to run.
+		The lock is checked before every pass, since it is lost when the connection fails and reconnects.
+		If the session still holds the lock, it is not taken again, so that a single unlock releases it.
+
+		:return: A boolean indicating whether the indexer holds the lock.
+		:rtype: bool
+		"""
+
+		self._locked = self._connector.select_one("""
+			SELECT
+				CASE
+					WHEN EXISTS (
+						SELECT
+							*
+						FROM
+							pg_locks
+						WHERE
+							locktype = 'advisory' AND
+							pid = pg_backend_pid() AND
+							objid = %d AND
+							granted
+					) THEN TRUE
+					ELSE pg_try_advisory_lock(%d)
+				END AS locked
+		""" % (self.lock_id, self.lock_id))["locked"]
+		return self._locked
+
+	def _unlock(self):
+		"""
+		Release the advisory lock, if the indexer holds it.
+		"""
+
+		if self._locked:
+			self._connector.select_one("SELECT pg_advisory_unlock(%d) AS unlocked" % self.lock_id)
+			self._locked = False
@@ -4,9 +4,10 @@ An abstract, generic representation of a smart contract.
 
 from abc import ABC, abstractmethod
 
-import ast
+from functools import lru_cache
+
 import json
-import re
+import os
 
 class Contract(ABC):
 	"""
@@ -24,24 +25,7 @@ class Contract(ABC):
 		:rtype: list
 		"""
 
-		s = ""
-
-		for line in f:
-			"""
-			Go through each line and add its contents to the string representation.
-			"""
-
-			s = s + line.strip()
-
-		"""
-		Capitalize the boolean flags, otherwise the parser fails.
-		"""
-		false_pattern = re.compile("\": false,")
-		true_pattern = re.compile("\": true,")
-		s = false_pattern.sub("\": False,", s)
-		s = true_pattern.sub("\": True,", s)
-
-		return ast.literal_eval(s)
+		return json.load(f)
 
 	def load_bytecode(f):
 		"""
@@ -55,3 +39,48 @@ class Contract(ABC):
 		"""
 
 		return json.loads(''.join(f.readlines()).strip())["object"]
+
+@lru_cache(maxsize=None)
+def load_artifact(path):
+	"""
+	Load the ABI and bytecode of a compiled contract from its build artifact, such as Truffle's JSON output.
+
+	Build artifacts also include the contract's source and syntax tree, which make them slow to parse.
+	Therefore the ABI and bytecode are saved to a smaller cache file in the `__pycache__` directory next to the artifact.
+	The cache is used as long as it is newer than the artifact.
+	Within a process, each artifact is only loaded once.
+
+	:param path: The path to the build artifact.
+	:type path: str
+
+	:return: A dictionary with the contract's `abi` and `bytecode`.
+	:rtype: dict
+	"""
+
+	cache_dir = os.path.join(os.path.dirname(path), "__pycache__")
+	cache_path = os.path.join(cache_dir, os.path.basename(path) + ".cache")
+
+	try:
+		if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+			with open(cache_path, "r") as f:
+				return json.load(f)
+	except (OSError, ValueError):
+		pass
+
+	with open(path, "r") as f:
+		artifact = json.load(f)
+	artifact = { "abi": artifact["abi"], "bytecode": artifact.get("bytecode") }
+
+	"""
+	The cache is only an optimization, so it is not an error if it cannot be written.
+	"""
+	try:
+		os.makedirs(cache_dir, exist_ok=True)
+		temporary = "%s.%d" % (cache_path, os.getpid())
+		with open(temporary, "w") as f:
+			json.dump(artifact, f)
+		os.replace(temporary, cache_path)
+	except OSError:
+		pass
+
+	return artifact
@@ -2,6 +2,8 @@
 An implementation that interfaces with Hyperledger Composer's own REST API.
 """
 
+from concurrent import futures
+
 import base64
 import hashlib
 import json
@@ -9,25 +11,76 @@ import os
 import re
 import requests
 import sys
-import time
+import threading
 import urllib
 import uuid
-import web3
-from eth_account import Account
 import secrets
-import json
 from . import ethereum_exceptions
+from .block_cache import BlockCache, BlockTracker
+from .confirmation_tracker import ConfirmationTracker
+from .consent_anchor import ConsentAnchor, ConsentAnchorer
+from .consent_mirror import ConsentIndexer, ConsentMirror
+from .contract import load_artifact
+from .nonce_manager import NonceManager
+from ..session import create_session
+from ...participant_cache import ParticipantCache
+from ...participant_index import ParticipantIndex
+from config import blockchain
+from server import timing
+from threads.exceptions.job_exceptions import TransactionPendingException
 
 cwd = os.path.dirname(os.path.realpath(__file__))
-with open(cwd+'contract.json') as f:
-   contract_details = json.load(f)
 
-w3= web3.Web3(web3.HTTPProvider('http://127.0.0.1:8543'))
+_w3 = None
+"""
+The connection to the Ethereum node, which is created the first time that it is needed.
+"""
+
+_w3_lock = threading.Lock()
+"""
+The lock that ensures that only one connection to the Ethereum node is created.
+"""
+
+_session = create_session()
+"""
+The session that keeps persistent connections to the Ethereum node.
+It is shared by web3.py and by the batched reads.
+"""
+
+def get_web3():
+	"""
+	Get the connection to the Ethereum node.
+	The connection, and the :mod:`web3` library itself, are only loaded the first time that they are needed, so that importing the module is fast.
+
+	:return: The connection to the Ethereum node.
+	:rtype: :class:`web3.Web3`
+	"""
+
+	global _w3
+	if _w3 is None:
+		with _w3_lock:
+			if _w3 is None:
+				import web3
+
+				w3 = web3.Web3(web3.HTTPProvider('http://127.0.0.1:8543', session=_session,
+					request_kwargs={ "timeout": blockchain.http_timeout }))
+				w3.middleware_onion.add(timing_middleware)
+				_w3 = w3
+	return _w3
+
+def timing_middleware(make_request, w3):
+	"""
+	Time every JSON-RPC call to the Ethereum node as part of the request's blockchain phase.
+	"""
+
+	def middleware(method, params):
+		with timing.Phase("blockchain"):
+			return make_request(method, params)
+	return middleware
 
 from oauth2.web import Response
 
 from .. import BlockchainAPI
-from config import blockchain
 
 import psycopg2
 
@@ -58,8 +111,34 @@ class EthereumAPI(BlockchainAPI):
 	:vartype _default_multiuser_port: int or None
 	:ivar _connector: The connector that is used to access the data store.
 	:vartype _connector: :class:`connection.connection.Connection`
+	:ivar _tracker: The tracker that waits for sent transactions to be mined.
+	:vartype _tracker: :class:`biobank.handlers.blockchain.api.ethereum.confirmation_tracker.ConfirmationTracker`
+	:ivar _mirror: The mirror of the consent recorded on the blockchain, which consent reads use while it is fresh.
+	:vartype _mirror: :class:`biobank.handlers.blockchain.api.ethereum.consent_mirror.ConsentMirror`
+	:ivar _anchor: The record of consent changes that are anchored in batches, which is used instead of the contract if consent changes are anchored.
+	:vartype _anchor: :class:`biobank.handlers.blockchain.api.ethereum.consent_anchor.ConsentAnchor`
+	:ivar _participants: The cache of the participants of each study, which card lookups use.
+	:vartype _participants: :class:`biobank.handlers.blockchain.participant_cache.ParticipantCache`
+	:ivar _reads: The cache of the contract reads that are made in the latest block.
+	:vartype _reads: :class:`biobank.handlers.blockchain.api.ethereum.block_cache.BlockCache`
+	:ivar _contract_address: The address of the deployed contract.
+	:vartype _contract_address: str
+	:ivar _contract_instance: The deployed contract, which is loaded the first time that it is needed.
+	:vartype _contract_instance: :class:`web3.contract.Contract` or None
+	:ivar _account_instance: The account that signs transactions, which is loaded the first time that it is needed.
+	:vartype _account_instance: :class:`eth_account.signers.local.LocalAccount` or None
+	:ivar _nonce_manager: The manager of the signing account's nonces, which is created the first time that it is needed.
+	:vartype _nonce_manager: :class:`biobank.handlers.blockchain.api.ethereum.nonce_manager.NonceManager` or None
+
+	:cvar nonce_retries: The number of times that a transaction is sent with a new nonce if the node rejects its nonce.
+	:vartype nonce_retries: int
+	:cvar batch_size: The maximum number of contract calls that are sent to the node in one JSON-RPC batch.
+	:vartype batch_size: int
 	"""
 
+	nonce_retries = 3
+	batch_size = 100
+
 	def __init__(self, admin_host, default_admin_port, multiuser_host, default_multiuser_port, connector, contract_address):
 		"""
 		Instantiate the Hyperledger API handler with the URLs it should use.
@@ -74,6 +153,8 @@ class EthereumAPI(BlockchainAPI):
 		:type default_multiuser_port: int
 		:param connector: The connector that is used to access the data store.
 		:type connector: :class:`connection.connection.Connection`
+		:param contract_address: The address of the deployed contract.
+		:type contract_address: str
 		"""
 
 
@@ -82,54 +163,351 @@ class EthereumAPI(BlockchainAPI):
 		self._multiuser_host = multiuser_host
 		self._default_multiuser_port = default_multiuser_port
 		self._connector = connector
+		self._tracker = ConfirmationTracker(get_web3, blockchain.confirmation_poll_interval)
+		self._mirror = ConsentMirror(connector)
+		self._anchor = ConsentAnchor(connector)
+		self._participants = ParticipantCache(ParticipantIndex(connector), self.get_all_study_participants)
+		self._reads = BlockCache(BlockTracker(get_web3, blockchain.read_cache_poll_interval, blockchain.read_cache_max_age)
+								 if blockchain.read_cache else None, blockchain.read_cache_size)
 
 		self._private_key = "priv_key"
-		self._contract = w3.eth.contract(address=contract_address, abi=contract_details["abi"])
-		self._account = w3.eth.account.privateKeyToAccount(self._private_key)
+		self._contract_address = contract_address
+		self._contract_instance = None
+		self._account_instance = None
+		self._nonce_manager = None
+
+	@classmethod
+	def from_config(cls, connector):
+		"""
+		Create the Ethereum API handler from the blockchain configuration.
+
+		:param connector: The connector that is used to access the data store.
+		:type connector: :class:`connection.connection.Connection`
+
+		:return: The Ethereum API handler.
+		:rtype: :class:`biobank.handlers.blockchain.api.ethereum.ethereum.EthereumAPI`
+		"""
+
+		handler = cls(blockchain.admin_host, blockchain.admin_port, blockchain.multiuser_host, blockchain.multiuser_port,
+					  connector, blockchain.contract_address)
+
+		"""
+		If consent changes are anchored, the consent that was recorded on the contract before is imported before any consent is read.
+		"""
+		if blockchain.write_mode == "anchor":
+			handler.import_consents()
+
+		return handler
+
+	@property
+	def _w3(self):
+		"""
+		Get the connection to the Ethereum node.
+
+		:return: The connection to the Ethereum node.
+		:rtype: :class:`web3.Web3`
+		"""
+
+		return get_web3()
+
+	@property
+	def _contract(self):
+		"""
+		Get the deployed contract.
+		Its ABI is loaded from the contract's build artifact the first time that the contract is needed.
+
+		:return: The deployed contract.
+		:rtype: :class:`web3.contract.Contract`
+		"""
+
+		if self._contract_instance is None:
+			abi = load_artifact(os.path.join(cwd, "contract.json"))["abi"]
+			self._contract_instance = self._w3.eth.contract(address=self._contract_address, abi=abi)
+		return self._contract_instance
+
+	@property
+	def _account(self):
+		"""
+		Get the account that signs transactions.
+
+		:return: The account that signs transactions.
+		:rtype: :class:`eth_account.signers.local.LocalAccount`
+		"""
+
+		if self._account_instance is None:
+			self._account_instance = self._w3.eth.account.privateKeyToAccount(self._private_key)
+		return self._account_instance
+
+	@property
+	def _nonces(self):
+		"""
+		Get the manager of the signing account's nonces.
+
+		:return: The nonce manager.
+		:rtype: :class:`biobank.handlers.blockchain.api.ethereum.nonce_manager.NonceManager`
+		"""
+
+		if self._nonce_manager is None:
+			address = self._account.address
+			self._nonce_manager = NonceManager(self._connector, address,
+				lambda: self._w3.eth.getTransactionCount(address, "pending"), stuck_after=blockchain.nonce_stuck_after)
+		return self._nonce_manager
+
+	def warm_up(self):
+		"""
+		Connect to the Ethereum node and load the contract and the account that signs transactions.
+		The account's nonces are synchronized with the node, in case transactions were sent while the server was stopped.
+
+		:raises: :class:`ConnectionError`
+		"""
+
+		self._contract
+		self._account
+		if not self._w3.isConnected():
+			raise ConnectionError("The Ethereum node is not reachable")
+		self._w3.eth.blockNumber
+		self._nonces.resync()
 
 	def _get_tx_params(self):
 		"""
 		Generates the transaction parameters
 
 		The response contains the transaction parameters used to build the transaction.
+		The nonce is only allocated when the transaction is sent, by :func:`~biobank.handlers.blockchain.api.ethereum.ethereum.EthereumAPI._sign_tx`.
 
 		:return: The transaction parameters
-		:rtype: json {"from": str, "chainId": int, "gas": int, "gasPrice": int(wei), "nonce": int}
+		:rtype: json {"from": str, "chainId": int, "gas": int, "gasPrice": int(wei)}
 		"""
-		nonce = w3.eth.getTransactionCount(self._account.address)
-		return {"from": self._account.address, "chainId": 101010, "gas": 200000, "gasPrice": w3.toWei('1', 'gwei'), "nonce": nonce}
+		return {"from": self._account.address, "chainId": 101010, "gas": 200000, "gasPrice": self._w3.toWei('1', 'gwei')}
 
+	@timing.timed("blockchain")
 	def _sign_tx(self, tx):
 		"""
 		Signs a transaction and sends it to the blockchain.
+		The transaction is given a nonce from the nonce manager, so that it does not wait for earlier transactions to be mined.
+		If the node rejects the nonce, the nonces are synchronized with the node and the transaction is sent again with a new nonce.
 
 		:param tx: The transaction to sign
 		:type username: web3.py transaction
+
+		:raises: :class:`threads.exceptions.job_exceptions.TransactionPendingException`
 		"""
-		signed_txn = w3.eth.account.signTransaction(tx, private_key=self._private_key)
-		result = w3.eth.sendRawTransaction(signed_txn.rawTransaction)
+		for attempt in range(self.nonce_retries):
+			tx["nonce"] = self._nonces.allocate()
+			try:
+				signed_txn = self._w3.eth.account.signTransaction(tx, private_key=self._private_key)
+			except Exception:
+				self._nonces.release(tx["nonce"])
+				raise
+
+			"""
+			The transaction is tracked before it is sent, so that it is found even if it is mined straight away.
+			"""
+			confirmation = self._tracker.track(signed_txn.hash)
+			try:
+				result = self._w3.eth.sendRawTransaction(signed_txn.rawTransaction)
+				break
+			except Exception as e:
+				self._tracker.forget(signed_txn.hash)
+				if not self._nonces.is_nonce_error(e):
+					"""
+					The nonce was not used, so it is released to avoid leaving a gap.
+					"""
+					self._nonces.release(tx["nonce"])
+					raise
+
+				self._nonces.resync()
+				if attempt == self.nonce_retries - 1:
+					raise
+
 		print("tx hash", result.hex())
 
-		tx = None
-		tx_blk_num = None       
-		while tx_blk_num == None:
-			tx = w3.eth.get_transaction(result)
-			tx_blk_num = tx.blockNumber
-			time.sleep(0.5)
-				
+		try:
+			receipt = confirmation.result(timeout=blockchain.confirmation_timeout)
+		except futures.TimeoutError:
+			"""
+			The transaction may be held up by a nonce that was never sent, so the nonces are checked for a stuck gap.
+			The transaction may still be mined, so its hash is raised, and a retry waits for it instead of sending the change again.
+			"""
+			self._tracker.forget(signed_txn.hash)
+			self._nonces.resync()
+			raise TransactionPendingException(result.hex())
+
+		"""
+		Reads that are made after the transaction should see it, even if the block tracker has not seen its block yet.
+		"""
+		self._reads.advance(receipt.blockNumber)
+
+		"""
+		Only transactions that failed are replayed, to find the reason why they were reverted.
+		"""
+		if receipt.status == 1:
+			return result.hex()
+
 		replay_tx = {
 			'to': tx['to'],
 			'from': tx['from'],
-			'value': tx['value'],
-			'data': tx['input'],
+			'value': tx.get('value', 0),
+			'data': tx['data'],
 		}
 
 		try:
-			w3.eth.call(replay_tx, tx.blockNumber - 1)
-			return result.hex()
-		except Exception as e: 
+			self._w3.eth.call(replay_tx, receipt.blockNumber - 1)
+			return "execution reverted: The transaction failed"
+		except Exception as e:
 			return str(e)
 
+	def wait_for_transaction(self, tx_hash):
+		"""
+		Wait for a transaction that an earlier attempt sent to be mined.
+		If the node no longer knows the transaction, it was dropped and will never be mined, so there is nothing to wait for.
+
+		:param tx_hash: The hash of the transaction.
+		:type tx_hash: str
+
+		:raises: :class:`threads.exceptions.job_exceptions.TransactionPendingException`
+		"""
+
+		try:
+			known = self._w3.eth.get_transaction(tx_hash) is not None
+		except Exception:
+			"""
+			The node raises an exception if it does not know the transaction.
+			"""
+			known = False
+
+		if not known:
+			print("tx %s was dropped" % tx_hash)
+			return
+
+		confirmation = self._tracker.track(tx_hash)
+		try:
+			receipt = confirmation.result(timeout=blockchain.confirmation_timeout)
+		except futures.TimeoutError:
+			self._tracker.forget(tx_hash)
+			raise TransactionPendingException(tx_hash)
+
+		self._reads.advance(receipt.blockNumber)
+
+	def pending_transactions(self):
+		"""
+		Get the number of transactions that have been sent but not mined yet.
+
+		:return: The number of pending transactions.
+		:rtype: int
+		"""
+
+		return self._tracker.pending()
+
+	def create_indexer(self, connector):
+		"""
+		Create the indexer that copies the consent changes on the blockchain into the consent mirror.
+
+		:param connector: The connection that the indexer uses, which should not be shared with other threads.
+		:type connector: :class:`connection.connection.Connection`
+
+		:return: The indexer, or `None` if the mirror is disabled.
+		:rtype: :class:`biobank.handlers.blockchain.api.ethereum.consent_mirror.ConsentIndexer` or None
+		"""
+
+		if not blockchain.mirror:
+			return None
+
+		return ConsentIndexer(connector, self, start_block=blockchain.mirror_start_block,
+			reorg_depth=blockchain.mirror_reorg_depth, poll_interval=blockchain.mirror_poll_interval,
+			reconcile_interval=blockchain.mirror_reconcile_interval, reconcile_sample=blockchain.mirror_reconcile_sample)
+
+	def create_anchorer(self, connector):
+		"""
+		Create the anchorer that sends the roots of batches of consent changes to the blockchain.
+
+		:param connector: The connection that the anchorer uses, which should not be shared with other threads.
+		:type connector: :class:`connection.connection.Connection`
+
+		:return: The anchorer, or `None` if consent changes are not anchored.
+		:rtype: :class:`biobank.handlers.blockchain.api.ethereum.consent_anchor.ConsentAnchorer` or None
+		"""
+
+		if blockchain.write_mode != "anchor":
+			return None
+
+		return ConsentAnchorer(ConsentAnchor(connector), self._send_root,
+			interval=blockchain.anchor_interval, batch_size=blockchain.anchor_batch_size)
+
+	def import_consents(self):
+		"""
+		Import the consent changes that were recorded on the contract into the record of anchored consent changes.
+		Once consent changes are anchored, consent is only read from the record, so the consent that participants gave on the contract must be part of it.
+		The changes are only imported once.
+
+		:raises: :class:`biobank.handlers.blockchain.api.ethereum.ethereum_exceptions.GetAllStudyParticipantsFailedException`
+		:raises: :class:`biobank.handlers.blockchain.api.ethereum.ethereum_exceptions.GetConsentTrailFailedException`
+		"""
+
+		if self._anchor.is_imported():
+			return
+
+		study_ids = [ row["study_id"] for row in self._connector.select("""
+			SELECT
+				study_id
+			FROM
+				studies
+		""") ]
+		participants = self._call_many([ ("getAllStudyParticipants", [ study_id ]) for study_id in study_ids ],
+									   ethereum_exceptions.GetAllStudyParticipantsFailedException)
+		pairs = [ (study_id, address) for study_id, result in zip(study_ids, participants) for address in result[0] ]
+		trails = self._call_many([ ("getConsentTrail", [ study_id, address ]) for study_id, address in pairs ],
+								 ethereum_exceptions.GetConsentTrailFailedException)
+
+		changes = [ (study_id, address, consent, timestamp)
+					for (study_id, address), trail in zip(pairs, trails) for timestamp, consent in zip(trail[0], trail[1]) ]
+		self._anchor.import_changes(changes)
+		print("Consent anchor: imported %d consent changes of %d participants from the contract" % (len(changes), len(pairs)))
+
+	def _consent_store(self, fresh=False):
+		"""
+		Get the store from which consent should be read instead of the contract.
+		If consent changes are anchored, the contract does not have them, so they are always read from the database, which also has the changes that were imported from the contract.
+		Otherwise, the mirror is only used if it is enabled and if the indexer has caught up with the node recently enough.
+		Fresh reads never use the mirror, since it may lag behind the contract.
+
+		:param fresh: A boolean indicating whether the read must see the latest consent.
+		:type fresh: bool
+
+		:return: The store from which consent should be read, or `None` if it should be read from the contract.
+		:rtype: :class:`biobank.handlers.blockchain.api.ethereum.consent_anchor.ConsentAnchor` or :class:`biobank.handlers.blockchain.api.ethereum.consent_mirror.ConsentMirror` or None
+		"""
+
+		if blockchain.write_mode == "anchor":
+			return self._anchor
+
+		if (not fresh and blockchain.mirror and blockchain.mirror_max_staleness is not None and
+			self._mirror.is_fresh(blockchain.mirror_max_staleness)):
+			return self._mirror
+
+		return None
+
+	def _send_root(self, root):
+		"""
+		Anchor the root of a batch of consent changes on the blockchain.
+		The contract has no function to store roots, so the root is sent as the data of a transaction from the signing account to itself.
+
+		:param root: The root of the batch's Merkle tree, as a hexadecimal string.
+		:type root: str
+
+		:return: The hash of the transaction and the number of the block that includes it.
+		:rtype: tuple
+
+		:raises: :class:`biobank.handlers.blockchain.api.ethereum.ethereum_exceptions.AnchorFailedException`
+		"""
+
+		transaction = self._get_tx_params()
+		transaction.update({ "to": self._account.address, "value": 0, "data": root })
+		response = self._sign_tx(transaction)
+		if not response.startswith("0x"):
+			raise ethereum_exceptions.AnchorFailedException(ethereum_exceptions.get_error_msg(response))
+
+		return response, self._w3.eth.get_transaction_receipt(response).blockNumber
 
 	"""
 	Participants.
@@ -146,6 +524,8 @@ class EthereumAPI(BlockchainAPI):
 		"""
 		priv = secrets.token_hex(32)
 		private_key = "0x" + priv
+		from eth_account import Account
+
 		acct = Account.from_key(private_key)
 		return private_key, acct.address
 
@@ -253,8 +633,8 @@ class EthereumAPI(BlockchainAPI):
 			In other words, a card is only valid if the user has given consent to a study.
 			"""
 			if len(rows):
-				study_participants = self.get_all_study_participants(study_id)
-				valid_rows = [ row for row in rows if row['address'] in study_participants ]
+				participating = self._participants.participating(study_id, [ row['address'] for row in rows ])
+				valid_rows = [ row for row in rows if row['address'] in participating ]
 				if len(valid_rows):
 					card_data = valid_rows[0]["private_key"]
 					return card_data is not None
@@ -294,8 +674,8 @@ class EthereumAPI(BlockchainAPI):
 
 		rows = self._connector.select(query)
 
-		study_participants = self.get_all_study_participants(study_id)
-		participating_rows = [ row for row in rows if row['address'] in study_participants ]
+		participating = self._participants.participating(study_id, [ row['address'] for row in rows ])
+		participating_rows = [ row for row in rows if row['address'] in participating ]
 
 		if len(participating_rows):
 			"""
@@ -411,6 +791,20 @@ class EthereumAPI(BlockchainAPI):
 
 		return response
 
+	def consent_confirmed(self, study_id, address, consent):
+		"""
+		Drop the cached participants of a study in which a consent change has been confirmed.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The unique address of the participant on the blockchain.
+		:type address: str
+		:param consent: The consent status.
+		:type consent: bool
+		"""
+
+		self._participants.invalidate(study_id)
+
 	def set_consent(self, study_id, address, consent, port=None, *args, **kwargs):
 		"""
 		Set a user's consent to the given study.
@@ -435,6 +829,12 @@ class EthereumAPI(BlockchainAPI):
 		:raises: :class:`biobank.handlers.blockchain.api.ethereum.ethereum_exceptions.WithdrawConsentFromStudyFailedException`
 		"""
 
+		"""
+		If consent changes are anchored, the change is only recorded in the database, and it is anchored with the next batch.
+		"""
+		if blockchain.write_mode == "anchor":
+			return self._anchor.record(study_id, address, consent)
+
 		tx_params = self._get_tx_params()
 		#if consent, add consent
 		if consent:
@@ -451,7 +851,7 @@ class EthereumAPI(BlockchainAPI):
 
 		return response
 
-	def has_consent(self, study_id, address, access_token=None, port=None, *args, **kwargs):
+	def has_consent(self, study_id, address, access_token=None, port=None, *args, fresh=False, **kwargs):
 		"""
 		Check whether the participant with the given blockchain address has consented to the use of his data in the given study.
 
@@ -465,6 +865,8 @@ class EthereumAPI(BlockchainAPI):
 		:param port: The port to use when issuing the identity.
 			By default, the request is made to the multi-user REST API endpoint.
 		:type port: int
+		:param fresh: A boolean indicating whether the consent must be read from the contract at the node's latest block, bypassing the mirror and the read cache.
+		:type fresh: bool
 
 		:return: A boolean indicating whether the participant has consented to the use of their sample in the study.
 		:rtype: bool
@@ -473,8 +875,12 @@ class EthereumAPI(BlockchainAPI):
 		"""
 		print("Checking consent for", address)
 
+		store = self._consent_store(fresh)
+		if store is not None:
+			return store.has_consent_many([ (study_id, address) ])[0]
+
 		#check if consented
-		response = self._contract.functions.hasConsented(study_id, address).call()
+		response = self._read("hasConsented", [ study_id, address ], fresh)
 		if type(response) == str and "execution reverted" in str(response):
 			raise ethereum_exceptions.HasConsentedFailedException(ethereum_exceptions.get_error_msg(response))
 
@@ -511,8 +917,12 @@ class EthereumAPI(BlockchainAPI):
 		:raises: :class:`biobank.handlers.blockchain.api.ethereum.ethereum_exceptions.GetAllStudyParticipantsFailedException`
 		"""
 
+		store = self._consent_store()
+		if store is not None:
+			return store.get_study_participants_many([ study_id ], all_participants=True)[0]
+
 		try: 
-			response = self._contract.functions.getAllStudyParticipants(study_id).call()
+			response = self._read("getAllStudyParticipants", [ study_id ])
 			return response
 		except Exception as e: 
 			raise ethereum_exceptions.GetAllStudyParticipantsFailedException(ethereum_exceptions.get_error_msg(str(e)))
@@ -535,8 +945,12 @@ class EthereumAPI(BlockchainAPI):
 		:raises: :class:`biobank.handlers.blockchain.api.ethereum.ethereum_exceptions.GetConsentingParticipantsFailedException`
 		"""
 
+		store = self._consent_store()
+		if store is not None:
+			return store.get_study_participants_many([ study_id ])[0]
+
 		try: 
-			response = self._contract.functions.getConsentingParticipants(study_id).call()
+			response = self._read("getConsentingParticipants", [ study_id ])
 			return response
 		except Exception as e: 
 			raise ethereum_exceptions.GetConsentingParticipantsFailedException(ethereum_exceptions.get_error_msg(str(e)))
@@ -565,8 +979,12 @@ class EthereumAPI(BlockchainAPI):
 		
 		address = self._get_participant_address(username, study_id)
 		print("Address: ",address)
+		store = self._consent_store()
+		if store is not None:
+			return store.get_consent_trail_many([ (study_id, address) ])[0]
+
 		try: 
-			response = self._contract.functions.getConsentTrail(study_id, address).call()
+			response = self._read("getConsentTrail", [ study_id, address ])
 			print("Consent trail response", response)
 		except Exception as e: 
 			print("Get consent trail failed", str(e));
@@ -579,6 +997,289 @@ class EthereumAPI(BlockchainAPI):
 
 		return consent_changes
 
+	def get_consent_proof(self, study_id, address, *args, **kwargs):
+		"""
+		Get the proofs that a participant's consent changes to a study were anchored on the blockchain.
+		Each proof can be verified offline with `verify_consent.py`.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The unique address of the participant on the blockchain.
+		:type address: str
+
+		:return: A response with any errors that may arise.
+			The body contains the participant's consent changes, from the oldest to the newest.
+			Anchored changes include their inclusion proof, the root of their batch and the transaction that anchored it.
+		:rtype: :class:`oauth2.web.Response`
+		"""
+
+		if blockchain.write_mode != "anchor":
+			return super(EthereumAPI, self).get_consent_proof(study_id, address, *args, **kwargs)
+
+		response = Response()
+
+		try:
+			proofs = self._anchor.proofs(study_id, address)
+			response.status_code = 200
+			response.add_header("Content-Type", "application/json")
+			response.body = json.dumps({ "data": proofs })
+		except Exception as e:
+			response.status_code = 500
+			response.add_header("Content-Type", "application/json")
+			response.body = json.dumps({ "error": "Internal Server Error: %s" % str(e), "exception": e.__class__.__name__ })
+
+		return response
+
+	"""
+	Batched reads.
+	"""
+
+	def has_consent_many(self, pairs, *args, errors=None, **kwargs):
+		"""
+		Check whether each of the given participants has consented to the use of their data in the given study.
+		All the checks are sent to the node in one JSON-RPC batch, unless they are answered by the consent mirror.
+
+		:param pairs: The studies and participants to check, as tuples with the unique ID of the study and the participant's address.
+		:type pairs: list of tuple
+		:param errors: The dictionary in which to record the exceptions of the pairs that could not be checked, or `None` to raise them.
+		:type errors: dict or None
+
+		:return: A list of booleans indicating whether each participant has consented, in the same order as the pairs.
+			Pairs that could not be checked are considered not to have consented.
+		:rtype: list of bool
+
+		:raises: :class:`biobank.handlers.blockchain.api.ethereum.ethereum_exceptions.HasConsentedFailedException`
+		"""
+
+		store = self._consent_store()
+		if store is not None:
+			return store.has_consent_many(pairs)
+
+		results = self._call_many([ ("hasConsented", [ study_id, address ]) for study_id, address in pairs ],
+								  ethereum_exceptions.HasConsentedFailedException, errors)
+		return [ False if result is None else result[0] for result in results ]
+
+	def get_study_participants_many(self, study_ids, *args, errors=None, **kwargs):
+		"""
+		Get the addresses of the participants that have consented to participate in each of the given studies.
+		All the studies are sent to the node in one JSON-RPC batch, unless they are answered by the consent mirror.
+
+		:param study_ids: The unique IDs of the studies.
+		:type study_ids: list of str
+		:param errors: The dictionary in which to record the exceptions of the studies that could not be read, or `None` to raise them.
+		:type errors: dict or None
+
+		:return: A list of participant addresses for each study, in the same order as the studies.
+			Studies that could not be read have no participants.
+		:rtype: list of list of str
+
+		:raises: :class:`biobank.handlers.blockchain.api.ethereum.ethereum_exceptions.GetConsentingParticipantsFailedException`
+		"""
+
+		store = self._consent_store()
+		if store is not None:
+			return store.get_study_participants_many(study_ids)
+
+		results = self._call_many([ ("getConsentingParticipants", [ study_id ]) for study_id in study_ids ],
+								  ethereum_exceptions.GetConsentingParticipantsFailedException, errors)
+		return [ [] if result is None else result[0] for result in results ]
+
+	def get_consent_trail_many(self, study_ids, username, *args, errors=None, **kwargs):
+		"""
+		Get a user's consent trail for each of the given studies.
+		All the studies are sent to the node in one JSON-RPC batch, unless they are answered by the consent mirror.
+
+		:param study_ids: The unique IDs of the studies.
+		:type study_ids: list of str
+		:param username: The unique username of the participant.
+		:type username: str
+		:param errors: The dictionary in which to record the exceptions of the studies that could not be read, or `None` to raise them.
+		:type errors: dict or None
+
+		:return: A dictionary of consent changes for each study, in the same order as the studies.
+			The consent changes relate the timestamp of the consent with the consent status.
+			Studies that could not be read have no consent changes.
+		:rtype: list of dict
+
+		:raises: :class:`biobank.handlers.blockchain.api.ethereum.ethereum_exceptions.GetConsentTrailFailedException`
+		"""
+
+		addresses = [ self._get_participant_address(username, study_id) for study_id in study_ids ]
+		store = self._consent_store()
+		if store is not None:
+			return store.get_consent_trail_many(list(zip(study_ids, addresses)))
+
+		results = self._call_many([ ("getConsentTrail", [ study_id, address ]) for study_id, address in zip(study_ids, addresses) ],
+								  ethereum_exceptions.GetConsentTrailFailedException, errors)
+		return [ {} if result is None else dict(zip(result[0], result[1])) for result in results ]
+
+	def _read(self, name, arguments, fresh=False):
+		"""
+		Call a read-only function of the contract.
+		The call is pinned to the latest known block, so that its result can be shared with the same calls that are made in the same block.
+		Fresh calls are made at the node's latest block instead, and they are not cached.
+
+		:param name: The name of the function.
+		:type name: str
+		:param arguments: The function's arguments.
+		:type arguments: list
+		:param fresh: A boolean indicating whether the call must see the node's latest block.
+		:type fresh: bool
+
+		:return: The function's output.
+		:rtype: object
+		"""
+
+		function = getattr(self._contract.functions, name)(*arguments)
+		if fresh:
+			return function.call(block_identifier="latest")
+
+		return self._reads.get(name, arguments, lambda block: function.call(block_identifier="latest" if block is None else block))
+
+	def _call_many(self, calls, exception, errors=None):
+		"""
+		Call several read-only functions of the contract using JSON-RPC batches, so that they take one round trip to the node.
+		web3.py sends one request for each call, so the batch is encoded, sent and decoded here.
+		Like single reads, the calls are pinned to the latest known block, and only the calls that are not cached in that block are sent.
+
+		:param calls: The calls to make, as tuples with the function's name and its arguments.
+		:type calls: list of tuple
+		:param exception: The class of the exception to raise if any of the calls fails.
+		:type exception: class
+		:param errors: The dictionary in which to record the exceptions of the calls that fail, with the calls' indices as keys, or `None` to raise them.
+			If a whole batch fails, the exception is recorded for each of its calls.
+		:type errors: dict or None
+
+		:return: The decoded outputs of each call, in the same order as the calls.
+			The outputs of calls that failed are `None`.
+		:rtype: list of tuple
+
+		:raises: :class:`Exception`
+		"""
+
+		from eth_abi import decode_abi
+
+		"""
+		Batched calls return all their outputs as a tuple, unlike single reads, so they are cached separately.
+		"""
+		block = self._reads.block()
+		results = [ None ] * len(calls)
+		missing = []
+		for i, (name, arguments) in enumerate(calls):
+			cached, result = self._reads.lookup(("batch", name), arguments, block)
+			if cached:
+				results[i] = result
+			else:
+				missing.append(i)
+
+		outputs = {}
+		for i in missing:
+			name = calls[i][0]
+			if name not in outputs:
+				outputs[name] = [ output["type"] for output in self._contract.get_function_by_name(name).abi["outputs"] ]
+
+		for start in range(0, len(missing), self.batch_size):
+			"""
+			Calls that cannot be encoded, for example because an argument is missing, fail on their own.
+			"""
+			batch = []
+			for i in missing[start:start + self.batch_size]:
+				try:
+					data = self._contract.encodeABI(fn_name=calls[i][0], args=calls[i][1])
+				except Exception as e:
+					if errors is None:
+						raise
+
+					errors[i] = exception(str(e))
+					continue
+
+				batch.append({
+					"jsonrpc": "2.0",
+					"id": i,
+					"method": "eth_call",
+					"params": [ { "to": self._contract_address, "data": data }, "latest" if block is None else hex(block) ],
+				})
+
+			if not batch:
+				continue
+
+			indices = [ request["id"] for request in batch ]
+			try:
+				with timing.Phase("blockchain"):
+					response = _session.post(self._w3.provider.endpoint_uri, json=batch)
+				response.raise_for_status()
+				responses = { item.get("id"): item for item in response.json() }
+			except Exception as e:
+				if errors is None:
+					raise
+
+				errors.update({ i: exception(str(e)) for i in indices })
+				continue
+
+			"""
+			The responses are matched to the calls by their IDs, since nodes do not have to keep the order of the batch, and may leave out some of them.
+			"""
+			for i in indices:
+				name, arguments = calls[i]
+				item = responses.get(i, { "error": { "message": "The node did not answer the call" } })
+				if "error" in item:
+					message = str(item["error"].get("message", item["error"]))
+					e = exception(ethereum_exceptions.get_error_msg(message) if "execution reverted: " in message else message)
+					if errors is None:
+						raise e
+
+					errors[i] = e
+					continue
+
+				data = bytes.fromhex(item["result"][2:])
+				results[i] = tuple(self._normalize(kind, value) for kind, value in zip(outputs[name], decode_abi(outputs[name], data)))
+				self._reads.store(("batch", name), arguments, block, results[i])
+
+		return results
+
+	def _normalize(self, kind, value):
+		"""
+		Convert a decoded value to the form that web3.py returns, so that batched reads return the same values as single reads.
+		Addresses are checksummed.
+
+		:param kind: The value's ABI type.
+		:type kind: str
+		:param value: The decoded value.
+		:type value: object
+
+		:return: The normalized value.
+		:rtype: object
+		"""
+
+		if kind == "address":
+			return self._w3.toChecksumAddress(value)
+		if kind == "address[]":
+			return [ self._w3.toChecksumAddress(address) for address in value ]
+		if kind.endswith("[]"):
+			return list(value)
+		return value
+
+	def get_participant_addresses(self, username):
+		"""
+		Get all the addresses that the participant has on the blockchain.
+
+		:param username: The unique username of the participant.
+		:type username: str
+
+		:return: The participant's addresses.
+		:rtype: list of str
+		"""
+
+		rows = self._connector.select("""
+			SELECT
+				address
+			FROM
+				participant_identities_eth
+			WHERE
+				participant_id = '%s'
+		""" % (username))
+		return [ row["address"] for row in rows ]
+
 	def _get_participant_address(self, username, study_id):
 		"""
 		Get the participant's address.
@@ -610,8 +1311,13 @@ class EthereumAPI(BlockchainAPI):
 				WHERE
 					participant_id = '%s'
 			""" % (username))
-			study_participants = self.get_all_study_participants(study_id)
-			row = rows[0]
+
+			"""
+			Prefer the identity that the participant uses in the study, if they have one.
+			"""
+			participating = self._participants.participating(study_id, [ row['address'] for row in rows ])
+			valid_rows = [ row for row in rows if row['address'] in participating ]
+			row = valid_rows[0] if len(valid_rows) else rows[0] if len(rows) else None
 
 		if row is not None:
 			address = row["address"]
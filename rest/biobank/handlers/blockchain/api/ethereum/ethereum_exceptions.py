@@ -72,3 +72,11 @@ class GetConsentTrailFailedException(Exception):
 
 	def __init__(self, message=f"%s"):
 		super(GetConsentTrailFailedException, self).__init__(message)
+
+class AnchorFailedException(Exception):
+	"""
+	An exception that indicates that the transaction to anchor the root of a batch of consent changes failed.
+	"""
+
+	def __init__(self, message=f"%s"):
+		super(AnchorFailedException, self).__init__(message)
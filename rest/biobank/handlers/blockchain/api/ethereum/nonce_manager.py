@@ -0,0 +1,178 @@
+"""
+The nonce manager allocates the nonces of the account that signs transactions.
+Nonces are allocated from the database instead of being read from the node before every transaction.
+In this way, transactions can be signed and sent back to back, by any number of threads and processes, without waiting for the previous ones to be mined.
+"""
+
+import threading
+
+class NonceManager(object):
+	"""
+	The nonce manager keeps the next nonce of an account in the `ethereum_nonces` table.
+	Each allocation is a single statement that locks the account's row, so concurrent allocations never return the same nonce.
+
+	Nonces that are allocated but never sent, for example because signing failed, are released.
+	Released nonces are allocated again before new ones, so that they do not leave gaps that would hold up the account's later transactions.
+	When the node rejects a nonce, or when the account has no row yet, the nonces are synchronized with the node's transaction count.
+
+	A nonce that was allocated but neither sent nor released, for example because the process stopped in between, leaves a gap that holds up every later transaction.
+	The node's count then stays at the gap, below the next nonce.
+	If it is still there, unchanged, when the nonces are synchronized after the grace period, nothing can be in flight to fill it, and the next nonce is moved back to the gap.
+
+	:cvar nonce_errors: The fragments of the node's error messages that indicate that a nonce was rejected.
+	:vartype nonce_errors: list of str
+
+	:ivar _connector: The connection to the database that stores the nonces.
+	:vartype _connector: :class:`connection.connection.Connection`
+	:ivar _address: The address of the account.
+	:vartype _address: str
+	:ivar _transaction_count: A function that returns the number of transactions that the node knows of for the account, including pending ones.
+	:vartype _transaction_count: function
+	:ivar _stuck_after: The time, in seconds, for which the node's count must stay below the next nonce before the gap is considered stuck.
+		If it is `None`, the next nonce is never moved back.
+	:vartype _stuck_after: float or None
+	:ivar _lock: The lock that ensures that the threads of this process synchronize the nonces one at a time.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	nonce_errors = [ "nonce too low", "already known", "known transaction", "replacement transaction underpriced" ]
+
+	def __init__(self, connector, address, transaction_count, stuck_after=None):
+		"""
+		Create the nonce manager.
+
+		:param connector: The connection to the database that stores the nonces.
+		:type connector: :class:`connection.connection.Connection`
+		:param address: The address of the account.
+		:type address: str
+		:param transaction_count: A function that returns the number of transactions that the node knows of for the account, including pending ones.
+		:type transaction_count: function
+		:param stuck_after: The time, in seconds, for which the node's count must stay below the next nonce before the gap is considered stuck.
+			If it is `None`, the next nonce is never moved back.
+		:type stuck_after: float or None
+		"""
+
+		self._connector = connector
+		self._address = address
+		self._transaction_count = transaction_count
+		self._stuck_after = stuck_after
+		self._lock = threading.Lock()
+
+	def allocate(self):
+		"""
+		Allocate a nonce.
+		The lowest released nonce is allocated first, if there is any.
+
+		:return: The nonce.
+		:rtype: int
+		"""
+
+		cursor = self._connector.execute("""
+			WITH account AS (
+				SELECT
+					*
+				FROM
+					ethereum_nonces
+				WHERE
+					address = '%s'
+				FOR UPDATE
+			)
+			UPDATE
+				ethereum_nonces
+			SET
+				next_nonce = CASE WHEN cardinality(account.released) > 0 THEN account.next_nonce ELSE account.next_nonce + 1 END,
+				released = account.released[2:]
+			FROM
+				account
+			WHERE
+				ethereum_nonces.address = account.address
+			RETURNING
+				COALESCE(account.released[1], account.next_nonce) AS nonce
+		""" % self._address, with_cursor=True)
+		row = cursor.fetchone()
+		cursor.close()
+
+		"""
+		The first time that the account is used, its nonces are read from the node.
+		"""
+		if row is None:
+			self.resync()
+			return self.allocate()
+
+		return int(row["nonce"])
+
+	def release(self, nonce):
+		"""
+		Release a nonce that was allocated but not sent, so that it is allocated again.
+		If it is the last nonce that was allocated, the next nonce is simply moved back.
+
+		:param nonce: The nonce to release.
+		:type nonce: int
+		"""
+
+		self._connector.execute("""
+			UPDATE
+				ethereum_nonces
+			SET
+				next_nonce = CASE WHEN next_nonce = %d + 1 THEN next_nonce - 1 ELSE next_nonce END,
+				released = CASE WHEN next_nonce = %d + 1 THEN released ELSE ARRAY(
+					SELECT DISTINCT nonce FROM unnest(released || %d::BIGINT) AS nonce ORDER BY nonce
+				) END
+			WHERE
+				address = '%s' AND
+				next_nonce > %d
+		""" % (nonce, nonce, nonce, self._address, nonce))
+
+	def resync(self):
+		"""
+		Synchronize the nonces with the node.
+		The next nonce is normally not moved back, since other threads or processes may have sent transactions that the node has not seen yet.
+		Released nonces that the node has already seen are discarded.
+
+		When the node's count is below the next nonce, and the count is not one of the released nonces, the count is recorded as a possible gap.
+		If the same gap is seen again once the grace period has passed, it is stuck: the next nonce is moved back to it and the released nonces are discarded.
+		"""
+
+		with self._lock:
+			count = int(self._transaction_count())
+
+			"""
+			The gap is not a released nonce, since those are allocated again anyway.
+			"""
+			gap = "ethereum_nonces.next_nonce > EXCLUDED.next_nonce AND NOT EXCLUDED.next_nonce = ANY(ethereum_nonces.released)"
+			stuck = "FALSE"
+			if self._stuck_after is not None:
+				stuck = """COALESCE(%s AND
+					ethereum_nonces.stuck_nonce = EXCLUDED.next_nonce AND
+					ethereum_nonces.stuck_since <= NOW() - INTERVAL '%f seconds', FALSE)""" % (gap, self._stuck_after)
+
+			self._connector.execute("""
+				INSERT INTO ethereum_nonces (
+					address, next_nonce)
+				VALUES ('%s', %d)
+				ON CONFLICT (address) DO UPDATE
+				SET
+					next_nonce = CASE WHEN %s THEN EXCLUDED.next_nonce ELSE GREATEST(ethereum_nonces.next_nonce, EXCLUDED.next_nonce) END,
+					released = CASE WHEN %s THEN '{}' ELSE ARRAY(
+						SELECT nonce FROM unnest(ethereum_nonces.released) AS nonce WHERE nonce >= EXCLUDED.next_nonce ORDER BY nonce
+					) END,
+					stuck_nonce = CASE WHEN %s AND NOT (%s) THEN EXCLUDED.next_nonce ELSE NULL END,
+					stuck_since = CASE WHEN %s AND NOT (%s) THEN
+						CASE WHEN ethereum_nonces.stuck_nonce = EXCLUDED.next_nonce THEN ethereum_nonces.stuck_since ELSE NOW() END
+					ELSE NULL END,
+					synced_at = NOW()
+			""" % (self._address, count, stuck, stuck, gap, stuck, gap, stuck))
+
+	def is_nonce_error(self, error):
+		"""
+		Check whether an error raised when sending a transaction means that the node rejected the transaction's nonce.
+
+		:param error: The error that was raised.
+		:type error: :class:`Exception`
+
+		:return: A boolean indicating whether the nonce was rejected.
+		:rtype: bool
+		"""
+
+		message = str(error).lower()
+		return any(fragment in message for fragment in self.nonce_errors)
@@ -5,16 +5,13 @@ A study contract, based on a normal smart contract.
 import os
 import sys
 
-from web3.auto import w3
-
-import web3
-
 from .contract import Contract
 
 class Study(Contract):
 	"""
 	The study class is based on a normal contract.
 	However, it implements the ABI and bytecode.
+	These are loaded the first time that they are needed, unless they are loaded explicitly beforehand.
 
 	:cvar abi: The contract's Application Binary Interface (ABI).
 	:vartype abi: list
@@ -22,6 +19,9 @@ class Study(Contract):
 	:vartype bytecode: dict
 	"""
 
+	abi = None
+	bytecode = None
+
 	@staticmethod
 	def deploy():
 		"""
@@ -31,6 +31,9 @@ class Study(Contract):
 		:rtype: str
 		"""
 
+		from web3.auto import w3
+
+		Study._load_default()
 		study = w3.eth.contract(abi=Study.abi, bytecode=Study.bytecode)
 		return study.constructor().transact()
 
@@ -46,6 +49,9 @@ class Study(Contract):
 		:rtype: :class:`web3.utils.datatypes.Contract`
 		"""
 
+		from web3.auto import w3
+
+		Study._load_default()
 		address = w3.toChecksumAddress(address)
 		study = w3.eth.contract(abi=Study.abi, bytecode=Study.bytecode, address=address)
 		return study
@@ -65,8 +71,12 @@ class Study(Contract):
 		Study.abi = Contract.load_abi(abi_file)
 		Study.bytecode = Contract.load_bytecode(bytecode_file)
 
-"""
-Load the ABI and bytecode immediately.
-"""
-with open(os.path.join(os.path.dirname(__file__), "data", "abi.json"), "r") as abi_file, open(os.path.join(os.path.dirname(__file__), "data", "bytecode.json"), "r") as byte_file :
-	Study.load(abi_file, byte_file)
+	@staticmethod
+	def _load_default():
+		"""
+		Load the contract's data from the files that are bundled with the contract, unless it has already been loaded.
+		"""
+
+		if Study.abi is None or Study.bytecode is None:
+			with open(os.path.join(os.path.dirname(__file__), "data", "abi.json"), "r") as abi_file, open(os.path.join(os.path.dirname(__file__), "data", "bytecode.json"), "r") as byte_file :
+				Study.load(abi_file, byte_file)
@@ -7,7 +7,6 @@ import hashlib
 import json
 import os
 import re
-import requests
 import sys
 import time
 import urllib
@@ -24,7 +23,38 @@ import psycopg2
 
 from . import hyperledger_exceptions
 from .. import BlockchainAPI
+from ..session import create_session
+from ...participant_cache import ParticipantCache
+from ...participant_index import ParticipantIndex
 from config import blockchain
+from server import timing
+
+_session = create_session()
+"""
+The session that keeps persistent connections to the Hyperledger Composer REST APIs.
+"""
+
+@timing.timed("blockchain")
+def _get(*args, **kwargs):
+	"""
+	Send a GET request to the Hyperledger Composer REST API, timed as part of the request's blockchain phase.
+
+	:return: The response.
+	:rtype: :class:`requests.models.Response`
+	"""
+
+	return _session.get(*args, **kwargs)
+
+@timing.timed("blockchain")
+def _post(*args, **kwargs):
+	"""
+	Send a POST request to the Hyperledger Composer REST API, timed as part of the request's blockchain phase.
+
+	:return: The response.
+	:rtype: :class:`requests.models.Response`
+	"""
+
+	return _session.post(*args, **kwargs)
 
 class HyperledgerAPI(BlockchainAPI):
 	"""
@@ -53,6 +83,8 @@ class HyperledgerAPI(BlockchainAPI):
 	:vartype _default_multiuser_port: int or None
 	:ivar _connector: The connector that is used to access the data store.
 	:vartype _connector: :class:`connection.connection.Connection`
+	:ivar _participants: The cache of the participants of each study, which card lookups use.
+	:vartype _participants: :class:`biobank.handlers.blockchain.participant_cache.ParticipantCache`
 	"""
 
 	def __init__(self, admin_host, default_admin_port, multiuser_host, default_multiuser_port, connector):
@@ -76,6 +108,23 @@ class HyperledgerAPI(BlockchainAPI):
 		self._multiuser_host = multiuser_host
 		self._default_multiuser_port = default_multiuser_port
 		self._connector = connector
+		self._participants = ParticipantCache(ParticipantIndex(connector), self.get_all_study_participants)
+
+	def warm_up(self):
+		"""
+		Ping the Hyperledger Composer admin REST API, which also opens a connection to the business network.
+
+		:raises: :class:`ConnectionError`
+		"""
+
+		if self._default_admin_port is not None:
+			endpoint = f"{self._admin_host}:{self._default_admin_port}/api/system/ping"
+		else:
+			endpoint = f"{self._admin_host}/api/system/ping"
+
+		response = _get(endpoint, verify=blockchain.verify)
+		if response.status_code != 200:
+			raise ConnectionError("The Hyperledger Composer REST API replied with status %d" % response.status_code)
 
 	"""
 	Participants.
@@ -173,8 +222,8 @@ class HyperledgerAPI(BlockchainAPI):
 
 		rows = self._connector.select(query)
 
-		study_participants = self.get_all_study_participants(study_id)
-		participating_rows = [ row for row in rows if row['address'] in study_participants ]
+		participating = self._participants.participating(study_id, [ row['address'] for row in rows ])
+		participating_rows = [ row for row in rows if row['address'] in participating ]
 
 		if len(participating_rows):
 			"""
@@ -262,7 +311,7 @@ class HyperledgerAPI(BlockchainAPI):
 		:param address: The participant's unique UUID.
 		:type address: str
 		:param card: The card to save.
-		:type card: str
+		:type card: bytes or file
 
 		:return: A response containing the participant's credential-ready card.
 			This is not stored as a JSON string since it is a `bytes` string.
@@ -273,6 +322,7 @@ class HyperledgerAPI(BlockchainAPI):
 		response = Response()
 
 		address = address.decode() # the username is decoded since it is coming from a binary multi-part form.
+		card = card.read() if hasattr(card, "read") else card # large cards are spilled to a temporary file by the multi-part parser.
 
 		self._connector.execute("""
 			UPDATE
@@ -309,7 +359,7 @@ class HyperledgerAPI(BlockchainAPI):
 		else:
 			endpoint = f"{self._admin_host}/api/system/identities/issue"
 
-		response = requests.post(endpoint, data={
+		response = _post(endpoint, data={
 			"participant": f"org.consent.model.ResearchParticipant#{username}",
 			"userID": username,
 			"options": {},
@@ -341,14 +391,14 @@ class HyperledgerAPI(BlockchainAPI):
 		else:
 			endpoint = f"{self._admin_host}:{port}/api/system/identities/"
 
-		response = requests.get(endpoint, verify=blockchain.verify)
+		response = _get(endpoint, verify=blockchain.verify)
 		identities = json.loads(response.content)
 		identities = {
 			identity["name"]: identity["identityId"] for identity in identities
 		}
 
 		endpoint = f"{self._host}:{port}/api/system/identities/{identities[username]}/revoke"
-		response = requests.post(endpoint, verify=blockchain.verify)
+		response = _post(endpoint, verify=blockchain.verify)
 		return response
 
 	def _create_participant(self, username, port=None, *args, **kwargs):
@@ -374,7 +424,7 @@ class HyperledgerAPI(BlockchainAPI):
 		else:
 			endpoint = f"{self._admin_host}/api/org.consent.model.ResearchParticipant"
 
-		response = requests.post(endpoint, data={
+		response = _post(endpoint, data={
 			"$class": "org.consent.model.ResearchParticipant",
 			"participantID": username,
 		}, verify=blockchain.verify)
@@ -424,8 +474,8 @@ class HyperledgerAPI(BlockchainAPI):
 			In other words, a card is only valid if the user has given consent to a study.
 			"""
 			if len(rows):
-				study_participants = self.get_all_study_participants(study_id)
-				valid_rows = [ row for row in rows if row['address'] in study_participants ]
+				participating = self._participants.participating(study_id, [ row['address'] for row in rows ])
+				valid_rows = [ row for row in rows if row['address'] in participating ]
 				if len(valid_rows):
 					card_data = valid_rows[0][card_name]
 					return card_data is not None
@@ -458,7 +508,7 @@ class HyperledgerAPI(BlockchainAPI):
 		else:
 			endpoint = f"{self._admin_host}/api/org.consent.model.Study"
 
-		response = requests.post(endpoint, data={
+		response = _post(endpoint, data={
 			"$class": "org.consent.model.Study",
 			"studyID": study_id,
 		}, verify=blockchain.verify)
@@ -472,6 +522,20 @@ class HyperledgerAPI(BlockchainAPI):
 	Consent.
 	"""
 
+	def consent_confirmed(self, study_id, address, consent):
+		"""
+		Drop the cached participants of a study in which a consent change has been confirmed.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The unique address of the participant on the blockchain.
+		:type address: str
+		:param consent: The consent status.
+		:type consent: bool
+		"""
+
+		self._participants.invalidate(study_id)
+
 	def set_consent(self, study_id, address, consent, access_token, port=None, *args, **kwargs):
 		"""
 		Set a user's consent to the given study.
@@ -502,7 +566,7 @@ class HyperledgerAPI(BlockchainAPI):
 		timestamp = time.time()
 		base_id = str(timestamp) + str(study_id) + str(address)
 		id = hashlib.md5(base_id.encode("utf-8")).hexdigest()
-		response = requests.post(endpoint, data={
+		response = _post(endpoint, data={
 			"$class": "org.consent.model.Consent",
 			"consentID": id,
 			"timestamp": timestamp,
@@ -515,9 +579,10 @@ class HyperledgerAPI(BlockchainAPI):
 
 		return response.content
 
-	def has_consent(self, study_id, address, access_token, port=None, *args, **kwargs):
+	def has_consent(self, study_id, address, access_token, port=None, *args, fresh=False, **kwargs):
 		"""
 		Check whether the participant with the given blockchain address has consented to the use of his data in the given study.
+		Consent is always read from the blockchain, so every read is fresh.
 
 		:param study_id: The unique ID of the study.
 		:type study_id: int
@@ -529,6 +594,8 @@ class HyperledgerAPI(BlockchainAPI):
 		:param port: The port to use when issuing the identity.
 			By default, the request is made to the multi-user REST API endpoint.
 		:type port: int
+		:param fresh: A boolean indicating whether the consent must be read from the blockchain itself.
+		:type fresh: bool
 
 		:return: A boolean indicating whether the participant has consented to the use of their sample in the study.
 		:rtype: bool
@@ -547,7 +614,7 @@ class HyperledgerAPI(BlockchainAPI):
 		else:
 			endpoint = f"{self._admin_host}/api/queries/has_consent?{param_string}"
 
-		response = requests.get(endpoint, headers={
+		response = _get(endpoint, headers={
 			"X-Access-Token": access_token
 		}, verify=blockchain.verify)
 		consent_changes = json.loads(response.content)
@@ -594,7 +661,7 @@ class HyperledgerAPI(BlockchainAPI):
 		else:
 			endpoint = f"{self._admin_host}/api/queries/get_study_consents?{param_string}"
 
-		response = requests.get(endpoint, headers={ }, verify=blockchain.verify)
+		response = _get(endpoint, headers={ }, verify=blockchain.verify)
 
 		"""
 		Sort the consent changes in descending order of timestamp to be certain of their validity.
@@ -649,7 +716,7 @@ class HyperledgerAPI(BlockchainAPI):
 		else:
 			endpoint = f"{self._admin_host}/api/queries/get_study_consents?{param_string}"
 
-		response = requests.get(endpoint, headers={ }, verify=blockchain.verify)
+		response = _get(endpoint, headers={ }, verify=blockchain.verify)
 
 		"""
 		Check whether the user could access the endpoint.
@@ -722,7 +789,7 @@ class HyperledgerAPI(BlockchainAPI):
 		else:
 			endpoint = f"{self._multiuser_host}/api/queries/get_consent_trail?{param_string}"
 
-		response = requests.get(endpoint, headers={
+		response = _get(endpoint, headers={
 			"X-Access-Token": access_token
 		}, verify=blockchain.verify)
 		consent_changes = json.loads(response.content)
@@ -731,6 +798,27 @@ class HyperledgerAPI(BlockchainAPI):
 		}
 		return consent_changes
 
+	def get_participant_addresses(self, username):
+		"""
+		Get all the addresses that the participant has on the blockchain.
+
+		:param username: The unique username of the participant.
+		:type username: str
+
+		:return: The participant's addresses.
+		:rtype: list of str
+		"""
+
+		rows = self._connector.select("""
+			SELECT
+				address
+			FROM
+				participant_identities
+			WHERE
+				participant_id = '%s'
+		""" % (username))
+		return [ row["address"] for row in rows ]
+
 	def _get_participant_address(self, username, study_id):
 		"""
 		Get the participant's address.
@@ -762,8 +850,8 @@ class HyperledgerAPI(BlockchainAPI):
 				WHERE
 					participant_id = '%s'
 			""" % (username))
-			study_participants = self.get_all_study_participants(study_id)
-			valid_rows = [ row for row in rows if row['address'] in study_participants ]
+			participating = self._participants.participating(study_id, [ row['address'] for row in rows ])
+			valid_rows = [ row for row in rows if row['address'] in participating ]
 			row = valid_rows[0] if len(valid_rows) else None
 
 		if row is not None:
@@ -0,0 +1,70 @@
+"""
+The HTTP sessions that the blockchain backends use to talk to their nodes.
+A session keeps a pool of persistent connections, so that requests do not pay for a new TCP, and often TLS, connection every time.
+"""
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import requests
+
+from config import blockchain
+
+class PooledSession(requests.Session):
+	"""
+	A session with a bounded pool of persistent connections, retries and a default timeout.
+	Only connection errors, and the errors of idempotent requests, are retried, so that a transaction is never sent twice.
+
+	:ivar _timeout: The default timeout of requests, in seconds.
+		It may be a tuple with the connection timeout and the read timeout.
+	:vartype _timeout: float or tuple
+	"""
+
+	def __init__(self, pool_size, retries, backoff, timeout):
+		"""
+		Create the session.
+
+		:param pool_size: The maximum number of connections that are kept open to each host.
+		:type pool_size: int
+		:param retries: The maximum number of times that a failed request is retried.
+		:type retries: int
+		:param backoff: The factor of the exponential back-off between retries, in seconds.
+		:type backoff: float
+		:param timeout: The default timeout of requests, in seconds.
+			It may be a tuple with the connection timeout and the read timeout.
+		:type timeout: float or tuple
+		"""
+
+		super(PooledSession, self).__init__()
+		self._timeout = timeout
+
+		retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[ 502, 503, 504 ])
+		adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+		self.mount("http://", adapter)
+		self.mount("https://", adapter)
+
+	def request(self, method, url, **kwargs):
+		"""
+		Send a request, using the default timeout if none is given.
+
+		:param method: The request's method.
+		:type method: str
+		:param url: The request's URL.
+		:type url: str
+
+		:return: The response.
+		:rtype: :class:`requests.models.Response`
+		"""
+
+		kwargs.setdefault("timeout", self._timeout)
+		return super(PooledSession, self).request(method, url, **kwargs)
+
+def create_session():
+	"""
+	Create a session from the blockchain configuration.
+
+	:return: The new session.
+	:rtype: :class:`biobank.handlers.blockchain.api.session.PooledSession`
+	"""
+
+	return PooledSession(blockchain.http_pool_size, blockchain.http_retries, blockchain.http_backoff, blockchain.http_timeout)
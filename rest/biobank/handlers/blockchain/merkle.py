@@ -0,0 +1,170 @@
+"""
+The Merkle trees that anchor batches of consent changes on the blockchain.
+Only the root of each tree is stored on the blockchain, and each consent change can be proven to be part of the tree with an inclusion proof.
+
+The module only uses the standard library, so that proofs can be verified offline without the rest of the server.
+
+Leaves and inner nodes are hashed with SHA-256 and different prefixes, so that a leaf cannot be passed off as an inner node.
+If a level has an odd number of nodes, the last node is carried up to the next level unchanged.
+"""
+
+import hashlib
+import json
+
+LEAF_PREFIX = b"\x00"
+"""
+The prefix of the data that is hashed to get a leaf.
+"""
+
+NODE_PREFIX = b"\x01"
+"""
+The prefix of the data that is hashed to get an inner node.
+"""
+
+def encode_change(change):
+	"""
+	Encode a consent change in the canonical form that is hashed.
+
+	:param change: The consent change, with its ID, the study's ID, the participant's address, the consent status and the timestamp.
+	:type change: dict
+
+	:return: The encoded consent change.
+	:rtype: bytes
+	"""
+
+	change = {
+		"id": int(change["id"]),
+		"study_id": str(change["study_id"]),
+		"address": str(change["address"]),
+		"consent": bool(change["consent"]),
+		"timestamp": int(change["timestamp"]),
+	}
+	return json.dumps(change, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+def leaf_hash(change):
+	"""
+	Hash a consent change to get its leaf.
+
+	:param change: The consent change.
+	:type change: dict
+
+	:return: The leaf's hash.
+	:rtype: bytes
+	"""
+
+	return hashlib.sha256(LEAF_PREFIX + encode_change(change)).digest()
+
+def node_hash(left, right):
+	"""
+	Hash two nodes to get their parent.
+
+	:param left: The left node's hash.
+	:type left: bytes
+	:param right: The right node's hash.
+	:type right: bytes
+
+	:return: The parent's hash.
+	:rtype: bytes
+	"""
+
+	return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+class MerkleTree(object):
+	"""
+	A Merkle tree over a list of consent changes.
+
+	:ivar _levels: The hashes of each level of the tree, from the leaves to the root.
+	:vartype _levels: list of list of bytes
+	"""
+
+	def __init__(self, changes):
+		"""
+		Build the tree.
+
+		:param changes: The consent changes, in the order of their leaves.
+		:type changes: list of dict
+
+		:raises: :class:`ValueError`
+		"""
+
+		if not changes:
+			raise ValueError("A Merkle tree needs at least one leaf")
+
+		self._levels = [ [ leaf_hash(change) for change in changes ] ]
+		while len(self._levels[-1]) > 1:
+			level = self._levels[-1]
+			parents = [ node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2) ]
+			if len(level) % 2:
+				parents.append(level[-1])
+			self._levels.append(parents)
+
+	@property
+	def root(self):
+		"""
+		Get the root of the tree.
+
+		:return: The root's hash as a hexadecimal string.
+		:rtype: str
+		"""
+
+		return "0x" + self._levels[-1][0].hex()
+
+	def proof(self, index):
+		"""
+		Get the inclusion proof of a leaf.
+		The proof lists the siblings of the leaf and of its ancestors, from the bottom up, with the side on which each sibling is.
+		Levels on which a node was carried up without a sibling are skipped.
+
+		:param index: The index of the leaf.
+		:type index: int
+
+		:return: The inclusion proof.
+		:rtype: list of dict
+		"""
+
+		proof = []
+		for level in self._levels[:-1]:
+			sibling = index ^ 1
+			if sibling < len(level):
+				proof.append({
+					"position": "left" if sibling < index else "right",
+					"hash": "0x" + level[sibling].hex(),
+				})
+			index //= 2
+		return proof
+
+def compute_root(change, proof):
+	"""
+	Compute the root of the tree that a consent change belongs to from its inclusion proof.
+
+	:param change: The consent change.
+	:type change: dict
+	:param proof: The inclusion proof, as returned by :func:`~biobank.handlers.blockchain.merkle.MerkleTree.proof`.
+	:type proof: list of dict
+
+	:return: The root's hash as a hexadecimal string.
+	:rtype: str
+	"""
+
+	node = leaf_hash(change)
+	for sibling in proof:
+		sibling_hash = bytes.fromhex(sibling["hash"][2:] if sibling["hash"].startswith("0x") else sibling["hash"])
+		node = node_hash(sibling_hash, node) if sibling["position"] == "left" else node_hash(node, sibling_hash)
+	return "0x" + node.hex()
+
+def verify(change, proof, root):
+	"""
+	Verify that a consent change belongs to the tree with the given root.
+
+	:param change: The consent change.
+	:type change: dict
+	:param proof: The inclusion proof.
+	:type proof: list of dict
+	:param root: The root's hash as a hexadecimal string.
+	:type root: str
+
+	:return: A boolean indicating whether the consent change belongs to the tree.
+	:rtype: bool
+	"""
+
+	return compute_root(change, proof).lower() == (root if root.startswith("0x") else "0x" + root).lower()
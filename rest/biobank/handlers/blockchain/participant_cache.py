@@ -0,0 +1,105 @@
+"""
+The participant cache keeps the participants of each study in memory, so that card lookups do not download the study's participants on every request.
+"""
+
+import threading
+
+class ParticipantCache(object):
+	"""
+	The participant cache keeps the addresses of all the participants who ever had a consent recorded in each study, as sets.
+
+	A study's participants are read from the blockchain the first time that they are needed.
+	They are dropped when this process confirms a consent change in the study.
+	Consent changes that other processes confirm are found in the participant index: if an address is not in the cached set, but the index has it in the study, the study's participants are read again.
+
+	:ivar _index: The participant index, which has the consent changes that every process confirms.
+	:vartype _index: :class:`biobank.handlers.blockchain.participant_index.ParticipantIndex`
+	:ivar _fetch: The function that reads all the participants of a study from the blockchain.
+	:vartype _fetch: function
+	:ivar _participants: The cached participants, with the studies' IDs as keys.
+	:vartype _participants: dict
+	:ivar _generations: The number of times that each study's participants were invalidated, with the studies' IDs as keys.
+		Participants that were read before an invalidation are not cached.
+	:vartype _generations: dict
+	:ivar _lock: The lock that protects the cached participants.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	def __init__(self, index, fetch):
+		"""
+		Create the empty participant cache.
+
+		:param index: The participant index, which has the consent changes that every process confirms.
+		:type index: :class:`biobank.handlers.blockchain.participant_index.ParticipantIndex`
+		:param fetch: The function that reads all the participants of a study from the blockchain.
+			It receives the study's unique ID.
+		:type fetch: function
+		"""
+
+		self._index = index
+		self._fetch = fetch
+		self._participants = {}
+		self._generations = {}
+		self._lock = threading.Lock()
+
+	def participating(self, study_id, addresses):
+		"""
+		Get which of the given addresses ever had a consent recorded in the study.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param addresses: The addresses to look for.
+		:type addresses: list of str
+
+		:return: The addresses that are participants of the study, in the same order as they were given.
+		:rtype: list of str
+		"""
+
+		if not addresses:
+			return []
+
+		with self._lock:
+			participants = self._participants.get(study_id)
+		if participants is None:
+			participants = self._load(study_id)
+
+		"""
+		Addresses that are not cached may have been added by another process since the study was cached.
+		"""
+		missing = [ address for address in addresses if address not in participants ]
+		if missing and any(key[0] == str(study_id) for key in self._index.consents(missing)):
+			participants = self._load(study_id)
+
+		return [ address for address in addresses if address in participants ]
+
+	def invalidate(self, study_id):
+		"""
+		Drop the cached participants of a study, for example when a consent change in it is confirmed.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		"""
+
+		with self._lock:
+			self._participants.pop(study_id, None)
+			self._generations[study_id] = self._generations.get(study_id, 0) + 1
+
+	def _load(self, study_id):
+		"""
+		Read the participants of a study from the blockchain and cache them.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+
+		:return: The participants of the study.
+		:rtype: frozenset of str
+		"""
+
+		with self._lock:
+			generation = self._generations.get(study_id, 0)
+
+		participants = frozenset(self._fetch(study_id))
+		with self._lock:
+			if self._generations.get(study_id, 0) == generation:
+				self._participants[study_id] = participants
+		return participants
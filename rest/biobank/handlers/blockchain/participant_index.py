@@ -0,0 +1,243 @@
+"""
+The participant index maps the addresses of participants to the studies in which they have a consent recorded on the blockchain.
+It lets consent reads only ask the blockchain about the studies of one participant, instead of downloading the participants of every study.
+
+The index is updated whenever a consent change is confirmed on the blockchain.
+Studies that existed before the index are backfilled from the blockchain by the indexer.
+Until a study is backfilled, its participants must still be read from the blockchain.
+"""
+
+import traceback
+
+from connection.sql import escape
+
+class ParticipantIndex(object):
+	"""
+	The participant index reads and updates the indexed consent of participants.
+	A study is synced once the index has every participant who has a consent recorded in it.
+
+	:ivar _connector: The connection to the database that stores the index.
+	:vartype _connector: :class:`connection.connection.Connection`
+	"""
+
+	def __init__(self, connector):
+		"""
+		Create the participant index.
+
+		:param connector: The connection to the database that stores the index.
+		:type connector: :class:`connection.connection.Connection`
+		"""
+
+		self._connector = connector
+
+	def record(self, study_id, address, consent):
+		"""
+		Record a consent change that was confirmed on the blockchain.
+		Confirmed changes overwrite the consent that was backfilled.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The address of the participant on the blockchain.
+		:type address: str
+		:param consent: The consent status.
+		:type consent: bool
+		"""
+
+		self._connector.execute("""
+			INSERT INTO participant_studies (
+				address, study_id, consent)
+			VALUES ('%s', '%s', %s)
+			ON CONFLICT (address, study_id) DO UPDATE SET
+				consent = EXCLUDED.consent,
+				updated_at = NOW();
+		""" % (escape(address), escape(study_id), "TRUE" if consent else "FALSE"))
+
+	def consents(self, addresses):
+		"""
+		Get the indexed consent of the given participants.
+
+		:param addresses: The addresses of the participants on the blockchain.
+		:type addresses: list of str
+
+		:return: The consent status of each study and address in which the participants have a consent recorded, with the study ID and the address as keys.
+		:rtype: dict
+		"""
+
+		if not addresses:
+			return {}
+
+		rows = self._connector.select("""
+			SELECT
+				study_id, address, consent
+			FROM
+				participant_studies
+			WHERE
+				address IN (%s)
+		""" % ", ".join("'%s'" % escape(address) for address in addresses))
+		return { (row["study_id"], row["address"]): row["consent"] for row in rows }
+
+	def synced(self, study_ids):
+		"""
+		Get which of the given studies are synced.
+
+		:param study_ids: The unique IDs of the studies.
+		:type study_ids: list of str
+
+		:return: The unique IDs of the studies that are synced.
+		:rtype: set of str
+		"""
+
+		if not study_ids:
+			return set()
+
+		rows = self._connector.select("""
+			SELECT
+				study_id
+			FROM
+				participant_index_studies
+			WHERE
+				study_id IN (%s)
+		""" % ", ".join("'%s'" % escape(study_id) for study_id in study_ids))
+		return { row["study_id"] for row in rows }
+
+	def unsynced(self):
+		"""
+		Get the studies that have not been synced yet.
+
+		:return: The unique IDs of the studies that are not synced.
+		:rtype: list of str
+		"""
+
+		rows = self._connector.select("""
+			SELECT
+				study_id
+			FROM
+				studies
+			WHERE
+				study_id NOT IN (
+					SELECT
+						study_id
+					FROM
+						participant_index_studies
+				)
+		""")
+		return [ row["study_id"] for row in rows ]
+
+	def sync(self, study_id, participants, consenting):
+		"""
+		Add the participants of a study, as read from the blockchain, and mark the study as synced.
+		Consent changes that were confirmed in the meantime are more recent, so they are not overwritten.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param participants: The addresses of all the participants who ever had a consent recorded in the study.
+		:type participants: list of str
+		:param consenting: The addresses of the participants who currently consent to the study.
+		:type consenting: list of str
+		"""
+
+		consenting = set(consenting)
+		values = ", ".join("('%s', '%s', %s)" % (escape(address), escape(study_id), "TRUE" if address in consenting else "FALSE")
+						   for address in set(participants) | consenting)
+
+		batch = [] if not values else [ """
+			INSERT INTO participant_studies (
+				address, study_id, consent)
+			VALUES %s
+			ON CONFLICT (address, study_id) DO NOTHING;
+		""" % values ]
+		batch.append(self.mark_synced_sql(study_id))
+		self._connector.execute(batch)
+
+	@staticmethod
+	def mark_synced_sql(study_id):
+		"""
+		Get the statement that marks a study as synced.
+		New studies have no participants, so the statement can be executed with the study's creation.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+
+		:return: The SQL statement.
+		:rtype: str
+		"""
+
+		return """
+			INSERT INTO participant_index_studies (
+				study_id)
+			VALUES ('%s')
+			ON CONFLICT (study_id) DO NOTHING;
+		""" % escape(study_id)
+
+class ParticipantIndexer(object):
+	"""
+	The participant indexer backfills the participant index with the studies that are not synced.
+	Studies that cannot be read from the blockchain are tried again later.
+
+	:ivar _index: The participant index.
+	:vartype _index: :class:`biobank.handlers.blockchain.participant_index.ParticipantIndex`
+	:ivar _blockchain_connector: The connector to the blockchain.
+	:vartype _blockchain_connector: :class:`biobank.handlers.blockchain.api.BlockchainAPI`
+	:ivar _interval: The time, in seconds, between backfills.
+	:vartype _interval: float
+	"""
+
+	def __init__(self, index, blockchain_connector, interval=300):
+		"""
+		Create the participant indexer.
+
+		:param index: The participant index.
+		:type index: :class:`biobank.handlers.blockchain.participant_index.ParticipantIndex`
+		:param blockchain_connector: The connector to the blockchain.
+		:type blockchain_connector: :class:`biobank.handlers.blockchain.api.BlockchainAPI`
+		:param interval: The time, in seconds, between backfills.
+		:type interval: float
+		"""
+
+		self._index = index
+		self._blockchain_connector = blockchain_connector
+		self._interval = interval
+
+	def run(self, stop):
+		"""
+		Backfill the index until the indexer is asked to stop.
+
+		:param stop: The event that is set when the indexer should stop.
+		:type stop: :class:`threading.Event`
+		"""
+
+		while not stop.is_set():
+			try:
+				self.sync_once(stop)
+			except Exception:
+				traceback.print_exc()
+
+			stop.wait(self._interval)
+
+	def sync_once(self, stop=None):
+		"""
+		Backfill the studies that are not synced.
+
+		:param stop: The event that is set when the indexer should stop, or `None` to sync all the studies.
+		:type stop: :class:`threading.Event` or None
+
+		:return: The number of studies that were synced.
+		:rtype: int
+		"""
+
+		synced = 0
+		for study_id in self._index.unsynced():
+			if stop is not None and stop.is_set():
+				break
+
+			try:
+				participants = self._blockchain_connector.get_all_study_participants(study_id)
+				consenting = self._blockchain_connector.get_study_participants(study_id)
+			except Exception as e:
+				print("Could not index the participants of study %s: %s" % (study_id, str(e)))
+				continue
+
+			self._index.sync(study_id, participants, consenting)
+			synced += 1
+
+		return synced
@@ -6,7 +6,6 @@ from datetime import datetime
 import json
 import os
 import sys
-import threading
 import traceback
 
 path = sys.path[0]
@@ -18,15 +17,52 @@ from oauth2.web import Response
 
 from .exceptions import general_exceptions, study_exceptions, user_exceptions
 from .blockchain.api.hyperledger import hyperledger_exceptions
+from .blockchain.participant_index import ParticipantIndex
 from .handler import PostgreSQLRouteHandler
 
 from config import blockchain
+from config import server as server_config
+from threads.job_queue import JobQueue, describe
 
 class ConsentHandler(PostgreSQLRouteHandler):
 	"""
 	The dynamic consent handler receives and handles requests that are related to participants giving or withdrawing their consent.
+	Consent changes are recorded on the blockchain by job workers, so that participants do not wait for the transactions.
+	Changes to the same consent that are made in quick succession are merged, so that only the latest one is recorded.
+	Until they are recorded, consent reads return the participants' latest consent changes, and flag them as pending.
+
+	Once recorded, consent changes are added to the participant index, so that consent reads only ask the blockchain about the participant's studies.
+
+	:ivar _jobs: The queue of blockchain writes.
+	:vartype _jobs: :class:`threads.job_queue.JobQueue`
+	:ivar _participant_index: The index of the studies in which each participant has a consent recorded.
+	:vartype _participant_index: :class:`biobank.handlers.blockchain.participant_index.ParticipantIndex`
 	"""
 
+	def __init__(self, connector, blockchain_connector, *args, **kwargs):
+		"""
+		Create the consent handler and the queue of blockchain writes.
+
+		:param connector: The connector that is used to access the data store.
+		:type connector: :class:`connection.connection.Connection`
+		:param blockchain_connector: The connector to the blockchain.
+		:type blockchain_connector: :class:`biobank.blockchain.api.BlockchainAPI`
+		"""
+
+		super(ConsentHandler, self).__init__(connector, blockchain_connector, *args, **kwargs)
+		self._jobs = JobQueue(connector)
+		self._participant_index = ParticipantIndex(connector)
+
+	def job_operations(self):
+		"""
+		Get the operations that job workers can perform on behalf of this handler.
+
+		:return: The functions that perform each operation, with the operations' names as keys.
+		:rtype: dict
+		"""
+
+		return { "set_consent": self._set_consent }
+
 	def get_attributes(self, username, attributes, *args, **kwargs):
 		"""
 		Get the attribute values of the participant with the given username.
@@ -93,12 +129,13 @@ class ConsentHandler(PostgreSQLRouteHandler):
 		:type address: str
 
 		:return: A response with any errors that may arise.
+			The body contains the ID of the job that records the consent on the blockchain.
+			If the request includes an `idempotency_key` that was given before, the job of the earlier request is returned.
 		:rtype: :class:`oauth2.web.Response`
 		"""
 
 		response = Response()
 
-
 		try:
 			if not self._study_exists(study_id):
 				raise study_exceptions.StudyDoesNotExistException()
@@ -106,13 +143,11 @@ class ConsentHandler(PostgreSQLRouteHandler):
 			if not self._participant_address_exists(address):
 				raise user_exceptions.ParticipantAddressDoesNotExistException()
 
-			thread = threading.Thread(target=self._set_consent, args=(study_id, address, True, *args), kwargs=kwargs)
-			thread.start()
-			self._threads.append(thread)
+			job_id = self._enqueue_consent(study_id, address, True, **kwargs)
 
 			response.status_code = 200
 			response.add_header("Content-Type", "application/json")
-			response.body = json.dumps({ })
+			response.body = json.dumps({ "data": { "job_id": job_id } })
 		except (
 				study_exceptions.AttributeNotLinkedException,
 				study_exceptions.MissingAttributesException,
@@ -142,6 +177,8 @@ class ConsentHandler(PostgreSQLRouteHandler):
 		:type address: str
 
 		:return: A response with any errors that may arise.
+			The body contains the ID of the job that records the withdrawal on the blockchain.
+			If the request includes an `idempotency_key` that was given before, the job of the earlier request is returned.
 		:rtype: :class:`oauth2.web.Response`
 		"""
 
@@ -154,13 +191,11 @@ class ConsentHandler(PostgreSQLRouteHandler):
 			if not self._participant_address_exists(address):
 				raise user_exceptions.ParticipantAddressDoesNotExistException()
 
-			thread = threading.Thread(target=self._set_consent, args=(study_id, address, False, *args), kwargs=kwargs)
-			thread.start()
-			self._threads.append(thread)
+			job_id = self._enqueue_consent(study_id, address, False, **kwargs)
 
 			response.status_code = 200
 			response.add_header("Content-Type", "application/json")
-			response.body = json.dumps({ })
+			response.body = json.dumps({ "data": { "job_id": job_id } })
 		except (
 			study_exceptions.StudyDoesNotExistException,
 			study_exceptions.StudyExpiredException,
@@ -177,6 +212,46 @@ class ConsentHandler(PostgreSQLRouteHandler):
 
 		return response
 
+	def get_consent_job(self, job_id, address, *args, **kwargs):
+		"""
+		Get the status of a job that records a consent change on the blockchain.
+
+		:param job_id: The unique ID of the job.
+		:type job_id: int
+		:param address: The unique address of the participant whose consent the job changes.
+		:type address: str
+
+		:return: A response with any errors that may arise.
+			The body contains the job's status, the number of attempts and the last error, if any.
+		:rtype: :class:`oauth2.web.Response`
+		"""
+
+		response = Response()
+
+		try:
+			"""
+			Jobs that change the consent of other participants are treated as if they did not exist.
+			"""
+			job = self._jobs.get(int(job_id))
+			if job is None or job["operation"] != "set_consent" or job["arguments"].get("address") != address:
+				raise general_exceptions.JobDoesNotExistException()
+
+			response.status_code = 200
+			response.add_header("Content-Type", "application/json")
+			response.body = json.dumps({ "data": describe(job) })
+		except (
+			general_exceptions.JobDoesNotExistException
+		) as e:
+			response.status_code = 500
+			response.add_header("Content-Type", "application/json")
+			response.body = json.dumps({ "error": str(e), "exception": e.__class__.__name__ })
+		except Exception as e:
+			response.status_code = 500
+			response.add_header("Content-Type", "application/json")
+			response.body = json.dumps({ "error": "Internal Server Error: %s" % str(e), "exception": e.__class__.__name__ })
+
+		return response
+
 	def get_participants_by_study(self, study_id, *args, **kwargs):
 		"""
 		Get a list of participant which have given their consent to the given study.
@@ -185,7 +260,7 @@ class ConsentHandler(PostgreSQLRouteHandler):
 		:type study_id: str
 
 		:return: A response with any errors that may arise.
-			The body contains the studies.
+			The body contains the participants, which are streamed as they are decrypted.
 		:rtype: :class:`oauth2.web.Response`
 
 		:raises: :class:`handlers.exceptions.study_exceptions.StudyDoesNotExistException`
@@ -202,7 +277,7 @@ class ConsentHandler(PostgreSQLRouteHandler):
 			"""
 			Get the information of all participants that consented to the use of their sample in the study.
 			"""
-			participants = self._connector.select("""
+			participants = self._connector.stream("""
 				SELECT
 					participants.*
 				FROM
@@ -211,10 +286,10 @@ class ConsentHandler(PostgreSQLRouteHandler):
 				WHERE
 					address IN ('%s')
 			""" % ("', '".join(addresses)))
-			decrypted_data = [ self._decrypt_participant(participant) for participant in participants ]
+			decrypted_data = ( self._decrypt_participant(participant) for participant in participants )
 			response.status_code = 200
 			response.add_header("Content-Type", "application/json")
-			response.body = json.dumps({ "data": decrypted_data })
+			response.body = self._stream_json(decrypted_data)
 		except (
 			hyperledger_exceptions.UnauthorizedDataAccessException
 		) as e:
@@ -243,6 +318,8 @@ class ConsentHandler(PostgreSQLRouteHandler):
 
 		:return: A response with any errors that may arise.
 			The body contains the studies.
+			Each study has a `pending` flag, which is true if the participant's consent to it has not been recorded on the blockchain yet.
+			Studies that could not be read from the blockchain are left out, and listed with their errors in `errors`.
 		:rtype: :class:`oauth2.web.Response`
 		"""
 
@@ -279,25 +356,47 @@ class ConsentHandler(PostgreSQLRouteHandler):
 			addresses = [ identity['address'] for identity in identities ]
 
 			"""
-			Check the participant's consent status and only retain the study if they consented.
+			The participant index has the studies in which the participant has a consent recorded.
+			The addresses associated with the studies that the index has not synced yet are read from the blockchain, all at once.
+			Then, check the participant's consent status and only retain the study if they consented.
+			Consent changes that have not been recorded on the blockchain yet take precedence.
+			Studies whose reads fail are left out, so that one study does not fail the whole response.
 			"""
-			studies = []
+			overlay = self._pending_consents(addresses)
+			indexed = self._participant_index.consents(addresses)
+			synced = self._participant_index.synced([ row["study_id"] for row in rows ])
+			unsynced = [ row for row in rows if row["study_id"] not in synced ]
+
+			errors = {}
+			study_addresses = self._blockchain_connector.get_study_participants_many(
+				[ row["study_id"] for row in unsynced ], *args, errors=errors, **kwargs)
+			errors = { unsynced[index]["study_id"]: e for index, e in errors.items() }
+			study_addresses = dict(zip([ row["study_id"] for row in unsynced ], study_addresses))
+			for study_id in synced:
+				study_addresses[study_id] = [ address for address in addresses if indexed.get((study_id, address)) ]
+
+			candidates = []
 			for row in rows:
-				study_id = row["study_id"]
-
-				"""
-				Get a list of addresses associated with the study.
-				"""
-				print("Getting participants of study", str(study_id))
-				study_addresses = self._blockchain_connector.get_study_participants(study_id, *args, **kwargs)
-				address = list(set(study_addresses).intersection(set(addresses)))
-				if not len(address):
-					continue
+				participants = study_addresses.get(row["study_id"], [])
+				address = [ address for address in addresses if (str(row["study_id"]), address) in overlay ]
+				address = address or list(set(participants).intersection(set(addresses)))
+				if len(address):
+					candidates.append((row, address[0]))
+
+			recorded = [ (row, address) for row, address in candidates if (str(row["study_id"]), address) not in overlay ]
+			consent_errors = {}
+			consents = self._blockchain_connector.has_consent_many(
+				[ (row["study_id"], address) for row, address in recorded ], *args, errors=consent_errors, **kwargs)
+			errors.update({ recorded[index][0]["study_id"]: e for index, e in consent_errors.items() })
+			consents = { (str(row["study_id"]), address): { "consent": consent, "pending": False }
+						 for (row, address), consent in zip(recorded, consents) }
+			consents.update(overlay)
 
-				address = address[0]
-				consent = self._blockchain_connector.has_consent(study_id, address, *args, **kwargs)
-				if consent:
-					studies.append(row)
+			studies = []
+			for row, address in candidates:
+				consent = consents[(str(row["study_id"]), address)]
+				if consent["consent"]:
+					studies.append((row, consent["pending"]))
 
 			response.status_code = 200
 			response.add_header("Content-Type", "application/json")
@@ -306,8 +405,10 @@ class ConsentHandler(PostgreSQLRouteHandler):
 					{
 						"study": study,
 						"researchers": self._get_study_researchers(study["study_id"]),
-					} for study in studies
+						"pending": pending,
+					} for study, pending in studies
 				],
+				"errors": self._read_errors(errors),
 			})
 		except (
 			user_exceptions.ParticipantDoesNotExistException
@@ -332,7 +433,7 @@ class ConsentHandler(PostgreSQLRouteHandler):
 		:type address: str
 
 		:return: A response with any errors that may arise.
-			The body contains the consent status.
+			The body contains the consent status, and a `pending` flag that is true if the consent has not been recorded on the blockchain yet.
 		:rtype: :class:`oauth2.web.Response`
 		"""
 
@@ -345,10 +446,16 @@ class ConsentHandler(PostgreSQLRouteHandler):
 			if not self._participant_address_exists(address):
 				raise user_exceptions.ParticipantAddressDoesNotExistException()
 
-			consent = self._blockchain_connector.has_consent(study_id, address, *args, **kwargs)
+			"""
+			The participant's latest consent change is returned if it has not been recorded on the blockchain yet.
+			"""
+			overlay = self._pending_consents([ address ]).get((str(study_id), address))
+			if overlay is None:
+				overlay = { "consent": self._blockchain_connector.has_consent(study_id, address, *args, **kwargs), "pending": False }
+
 			response.status_code = 200
 			response.add_header("Content-Type", "application/json")
-			response.body = json.dumps({ "data": consent })
+			response.body = json.dumps({ "data": overlay["consent"], "pending": overlay["pending"] })
 		except (
 			study_exceptions.StudyDoesNotExistException,
 			user_exceptions.ParticipantAddressDoesNotExistException
@@ -378,6 +485,7 @@ class ConsentHandler(PostgreSQLRouteHandler):
 			The two are separated from each other.
 			The timeline is made up of the timestamp, and a list of consent changes separated by study IDs.
 			The studies are separated by IDs, and therefore the timeline can use it as a look-up table.
+			Studies whose consent trail could not be read from the blockchain are listed with their errors in `errors`.
 		:rtype: :class:`oauth2.web.Response`
 		"""
 
@@ -407,15 +515,31 @@ class ConsentHandler(PostgreSQLRouteHandler):
 			}
 
 			"""
-			For each study get the user's consent changes, if any.
+			Only the studies in which the participant has a consent recorded have a consent trail.
+			These are the studies in the participant index, and the studies that the index has not synced yet.
+			The index is only used if the backend knows the participant's addresses, since they are the index's keys.
 			"""
-			for row in rows:
+			addresses = self._blockchain_connector.get_participant_addresses(username)
+			trail_rows = rows
+			if addresses is not None:
+				indexed = { study_id for study_id, _ in self._participant_index.consents(addresses) }
+				synced = self._participant_index.synced(list(studies))
+				trail_rows = [ row for row in rows if row["study_id"] in indexed or row["study_id"] not in synced ]
+
+			"""
+			Get the user's consent changes for all of these studies at once.
+			Studies whose consent trail cannot be read are left out of the timeline.
+			"""
+			errors = {}
+			consent_trails = self._blockchain_connector.get_consent_trail_many(
+				[ row["study_id"] for row in trail_rows ], username, *args, errors=errors, **kwargs)
+			errors = { trail_rows[index]["study_id"]: e for index, e in errors.items() }
+			for row, consent_trail in zip(trail_rows, consent_trails):
 				study_id = row["study_id"]
 
 				"""
 				Construct the timeline, one timestamp at a time, from the current study.
 				"""
-				consent_trail = self._blockchain_connector.get_consent_trail(study_id, username, *args, **kwargs)
 				for (timestamp, consent) in consent_trail.items():
 					timeline[timestamp] = timeline.get(timestamp, {})
 					timeline[timestamp][study_id] = consent
@@ -426,7 +550,8 @@ class ConsentHandler(PostgreSQLRouteHandler):
 				"data":{
 					"studies": studies,
 					"timeline": timeline
-				}
+				},
+				"errors": self._read_errors(errors),
 			})
 		except (
 			user_exceptions.ParticipantDoesNotExistException
@@ -443,7 +568,87 @@ class ConsentHandler(PostgreSQLRouteHandler):
 
 		return response
 
-	def _set_consent(self, study_id, address, consent, *args, **kwargs):
+	def _read_errors(self, errors):
+		"""
+		Describe the studies that could not be read from the blockchain, so that they can be returned alongside partial results.
+
+		:param errors: The exceptions raised by the reads, with the unique IDs of the studies as keys.
+		:type errors: dict
+
+		:return: The studies that could not be read, each with the error and the exception's name.
+		:rtype: list of dict
+		"""
+
+		for study_id, e in errors.items():
+			print("Error reading study %s from the blockchain: %s" % (study_id, str(e)))
+
+		return [ {
+			"study_id": study_id,
+			"error": str(e),
+			"exception": e.__class__.__name__,
+		} for study_id, e in errors.items() ]
+
+	def _enqueue_consent(self, study_id, address, consent, idempotency_key=None, **kwargs):
+		"""
+		Add a job that records a consent change on the blockchain.
+		The OAuth token is not stored with the job, but the other request parameters are passed on to the blockchain connector.
+
+		The job waits for the coalescing window before it runs.
+		If the participant changes the same consent again in the meantime, the job is updated instead of adding another one.
+		Since the job only sends a transaction if the consent on the blockchain differs, changes that cancel each other out send none.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The unique address of the participant on the blockchain.
+		:type address: str
+		:param consent: The consent status.
+		:type consent: bool
+		:param idempotency_key: A key that the client gives to identify the request.
+			If the client repeats a request with the same key, the job of the first request is returned.
+		:type idempotency_key: str or None
+
+		:return: The job's ID.
+		:rtype: int
+		"""
+
+		arguments = { key: value for key, value in kwargs.items() if key != "token" }
+		arguments.update({ "study_id": study_id, "address": address, "consent": consent })
+
+		"""
+		Idempotency keys are scoped to the participant, so that participants cannot see each other's jobs.
+		"""
+		return self._jobs.enqueue("set_consent", arguments, delay=server_config.consent_coalesce_window,
+			coalesce_key="set_consent:%s:%s" % (study_id, address),
+			idempotency_key=None if idempotency_key is None else "%s:%s" % (address, idempotency_key))
+
+	def _pending_consents(self, addresses):
+		"""
+		Get the consent changes of the given addresses that have not been recorded on the blockchain yet.
+		If the blockchain is read through the consent mirror, changes that were recorded recently are included too, since the mirror may not have seen them yet.
+		These changes are not flagged as pending.
+
+		:param addresses: The addresses of the participants on the blockchain.
+		:type addresses: list of str
+
+		:return: The latest consent change of each study and address, with the study ID and the address as keys.
+			Each change is a dictionary with the consent status and a boolean indicating whether it is still pending.
+		:rtype: dict
+		"""
+
+		settle = blockchain.mirror_max_staleness if blockchain.mirror and blockchain.mirror_max_staleness is not None else 0
+		jobs = self._jobs.outstanding("set_consent", "address", addresses, settle)
+
+		"""
+		The jobs are sorted from the oldest to the newest, so later changes overwrite earlier ones.
+		"""
+		return {
+			(str(job["arguments"]["study_id"]), job["arguments"]["address"]): {
+				"consent": job["arguments"]["consent"],
+				"pending": job["status"] != JobQueue.DONE,
+			} for job in jobs
+		}
+
+	def _set_consent(self, study_id, address, consent, *args, tx_hash=None, **kwargs):
 		"""
 		Set a user's consent to the given study.
 		A consent is created if it does not exist.
@@ -455,9 +660,12 @@ class ConsentHandler(PostgreSQLRouteHandler):
 		:type address: str
 		:param consent: The consent status.
 		:type consent: bool
+		:param tx_hash: The hash of the transaction that an earlier attempt sent, but which was not mined in time, or `None` if no transaction is pending.
+		:type tx_hash: str or None
 
 		:raises: :class:`handlers.exceptions.study_exceptions.StudyDoesNotExistException`
 		:raises: :class:`handlers.exceptions.user_exceptions.ParticipantDoesNotExistException`
+		:raises: :class:`threads.exceptions.job_exceptions.TransactionPendingException`
 		"""
 
 		if not self._study_exists(study_id):
@@ -466,13 +674,27 @@ class ConsentHandler(PostgreSQLRouteHandler):
 		if not self._participant_address_exists(address):
 			raise user_exceptions.ParticipantAddressDoesNotExistException()
 
+		"""
+		The consent is only read once the transaction of an earlier attempt is mined, since the read would not see the change while it is pending, and the change would be sent twice.
+		"""
+		if tx_hash is not None:
+			self._blockchain_connector.wait_for_transaction(tx_hash)
+
 		"""
 		Set the consent accordingly.
 		Do not commit transactions do not change the state of the consent.
+		The consent is read fresh from the blockchain, since a mirrored or cached read may not have seen the latest change yet, and the transaction would be skipped.
 		"""
-		if (consent != self._blockchain_connector.has_consent(study_id, address, *args, **kwargs)):
+		if (consent != self._blockchain_connector.has_consent(study_id, address, *args, fresh=True, **kwargs)):
 			self._blockchain_connector.set_consent(study_id, address, consent, *args, **kwargs)
 
+		"""
+		The consent on the blockchain is now confirmed, so it is added to the participant index, and the study's cached participants are dropped.
+		If the job is retried after the transaction, the consent is still indexed.
+		"""
+		self._participant_index.record(study_id, address, consent)
+		self._blockchain_connector.consent_confirmed(study_id, address, consent)
+
 	def _set_attribute_value(self, attribute_id, username, value):
 		"""
 		Set the participant's value for the given attribute.
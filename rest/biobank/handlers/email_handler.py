@@ -293,10 +293,13 @@ class EmailHandler(PostgreSQLRouteHandler):
 
 			"""
 			Get the response.
+			When all emails are requested, they are streamed as they are fetched.
 			"""
-			emails = self._connector.select(sql)
-			for i, email in enumerate(emails):
-				emails[i]['created_at'] = emails[i]['created_at'].timestamp()
+			if id is not None:
+				emails = self._connector.select(sql)
+			else:
+				emails = self._connector.stream(sql)
+			emails = ( dict(email, created_at=email['created_at'].timestamp()) for email in emails )
 
 			"""
 			Calculate the total number of results.
@@ -317,7 +320,10 @@ class EmailHandler(PostgreSQLRouteHandler):
 
 			response.status_code = 200
 			response.add_header("Content-Type", "application/json")
-			response.body = json.dumps({ "total": summary['total'], "data": emails[0] if id is not None else emails })
+			if id is not None:
+				response.body = json.dumps({ "total": summary['total'], "data": next(emails) })
+			else:
+				response.body = self._stream_json(emails, total=summary['total'])
 		except (email_exceptions.EmailDoesNotExistException) as e:
 			response.status_code = 500
 			response.add_header("Content-Type", "application/json")
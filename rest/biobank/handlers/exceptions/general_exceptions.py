@@ -6,3 +6,19 @@ class InputException(Exception):
 	"""
 	A generic input exception.
 	"""
+
+class JobDoesNotExistException(Exception):
+	"""
+	An exception that indicates that the job that is sought does not exist.
+	"""
+
+	def __init__(self, message="Job does not exist"):
+		super(JobDoesNotExistException, self).__init__(message)
+
+class ConsentProofUnavailableException(Exception):
+	"""
+	An exception that indicates that consent proofs are not available because consent changes are not anchored.
+	"""
+
+	def __init__(self, message="Consent proofs are only available when consent changes are anchored"):
+		super(ConsentProofUnavailableException, self).__init__(message)
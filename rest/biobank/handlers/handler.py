@@ -23,6 +23,7 @@ if path not in sys.path:
 	sys.path.insert(1, path)
 
 from config import db
+from server import timing, warmup
 
 class RouteHandler(ABC):
 	"""
@@ -30,19 +31,19 @@ class RouteHandler(ABC):
 
 	:cvar encrypted_attributes: The attributes that should be stored encrypted.
 	:vartype encrypted_attributes: str
+	:cvar stream_chunk_size: The approximate size, in characters, of the chunks of streamed response bodies.
+	:vartype stream_chunk_size: int
 
 	:ivar _connector: The connector that is used to access the data store.
 	:vartype _connector: :class:`connection.connection.Connection`
 	:ivar _blockchain_connector: The connector to the blockchain.
 	:vartype _blockchain_connector: :class:`biobank.blockchain.api.BlockchainAPI`
-	:ivar _threads: A list of threads, shared with the :class:`async.thread_manager.ThreadManager`.
-					The threads can be used to perform time-consuming operations asynchronously.
-	:type _threads: list
 	"""
 
 	encrypted_attributes = [ 'first_name', 'last_name', 'email' ]
+	stream_chunk_size = 64 * 1024
 
-	def __init__(self, connector, blockchain_connector, threads, *args, **kwargs):
+	def __init__(self, connector, blockchain_connector, *args, **kwargs):
 		"""
 		Create the route handler, incorporating a connection with a store.
 		This store can be both in memory or as a database.
@@ -52,14 +53,10 @@ class RouteHandler(ABC):
 		:type connector: :class:`connection.connection.Connection`
 		:param blockchain_connector: The connector to the blockchain.
 		:type blockchain_connector: :class:`biobank.blockchain.api.BlockchainAPI`
-		:param threads: A list of threads, shared with the :class:`async.thread_manager.ThreadManager`.
-						The threads can be used to perform time-consuming operations asynchronously.
-		:type threads: list
 		"""
 
 		self._connector = connector
 		self._blockchain_connector = blockchain_connector
-		self._threads = threads
 
 	def _404_page_not_found(self, arguments):
 		"""
@@ -78,6 +75,41 @@ class RouteHandler(ABC):
 		response.body = json.dumps({ "error": "Page Not Found" })
 		return response
 
+	def _stream_json(self, data, **kwargs):
+		"""
+		Serialize a JSON object that has the given list as its `data` attribute, a chunk at a time.
+		The list is consumed lazily, so it can be a generator of rows that are fetched while the response is sent.
+		Small elements are grouped into chunks of roughly :attr:`stream_chunk_size` characters.
+
+		:param data: The elements of the `data` attribute.
+		:type data: iterable
+		:param kwargs: Any other attributes of the JSON object.
+		:type kwargs: dict
+
+		:return: A generator of JSON-encoded chunks, to be used as a response body.
+		:rtype: generator
+		"""
+
+		chunk = '{"data": ['
+		try:
+			for i, element in enumerate(data):
+				chunk += (", " if i else "") + json.dumps(element)
+				if len(chunk) >= self.stream_chunk_size:
+					yield chunk
+					chunk = ""
+		finally:
+			"""
+			If the response is abandoned halfway, close the data so that any open cursor is released.
+			"""
+			if hasattr(data, "close"):
+				data.close()
+
+		chunk += "]"
+		for key, value in kwargs.items():
+			chunk += ", %s: %s" % (json.dumps(key), json.dumps(value))
+		yield chunk + "}"
+
+	@timing.timed("crypto")
 	def _encrypt(self, string):
 		"""
 		Encrypt the given string.
@@ -94,6 +126,7 @@ class RouteHandler(ABC):
 		f = Fernet(db.encryption_secret)
 		return f.encrypt(str.encode(string)).decode()
 
+	@timing.timed("crypto")
 	def _decrypt(self, string):
 		"""
 		Decrypt the given string.
@@ -130,15 +163,18 @@ class PostgreSQLRouteHandler(RouteHandler):
 	def ping(self, *args, **kwargs):
 		"""
 		Reply to a ping to the server.
-		This function always returns a success notice.
 		Its purpose is to ensure that there is a link with the server.
+		The response includes which steps of the server's warm-up succeeded.
+		The server only starts listening once it has warmed up, so it is always ready when it replies.
 
 		:return: A success response.
 		:rtype: :class:`oauth2.web.Response`
 		"""
 
 		response = Response()
+		response.add_header("Content-Type", "application/json")
 		response.status_code = 200
+		response.body = json.dumps({ "data": warmup.status() })
 		return response
 
 	"""
@@ -228,6 +228,8 @@ class ParticipantHandler(UserHandler):
 		Filter participants using the given arguments.
 		If no arguments are given, all participants are returned.
 
+		The participants are streamed, so they are fetched and decrypted while the response is being sent.
+
 		:param username: The user's username.
 		:type username: str
 
@@ -238,7 +240,7 @@ class ParticipantHandler(UserHandler):
 		username = self._sanitize(username) if username is not None else username
 
 		if username is None:
-			rows = self._connector.select("""
+			rows = self._connector.stream("""
 				SELECT
 					*
 				FROM
@@ -252,7 +254,7 @@ class ParticipantHandler(UserHandler):
 					participants
 			""")
 		else:
-			rows = self._connector.select("""
+			rows = self._connector.stream("""
 				SELECT
 					*
 				FROM
@@ -270,10 +272,10 @@ class ParticipantHandler(UserHandler):
 					user_id = '%s'
 			""")
 
-		decrypted_data = [ self._decrypt_participant(row) for row in rows ]
+		decrypted_data = ( self._decrypt_participant(row) for row in rows )
 
 		response = Response()
 		response.status_code = 200
 		response.add_header("Content-Type", "application/json")
-		response.body = json.dumps({ "data": decrypted_data, "total": total })
+		response.body = self._stream_json(decrypted_data, total=total)
 		return response
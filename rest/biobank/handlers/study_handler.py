@@ -18,6 +18,7 @@ if path not in sys.path:
 from oauth2.web import Response
 
 from .exceptions import general_exceptions, study_exceptions, user_exceptions
+from .blockchain.participant_index import ParticipantIndex
 from .handler import PostgreSQLRouteHandler
 
 import config
@@ -83,12 +84,14 @@ class StudyHandler(PostgreSQLRouteHandler):
 
 			"""
 			Add the study.
+			A new study has no participants, so the participant index already has all of them.
 			"""
 			self._connector.execute([
 				"""
 				INSERT INTO studies (
 					study_id, name, description, homepage, attachment, recruiting)
 				VALUES ('%s', '%s', '%s', '%s', '%s', '%r');""" % (study_id, name, description, homepage, attachment or '', recruiting),
+				ParticipantIndex.mark_synced_sql(study_id),
 			])
 
 			"""
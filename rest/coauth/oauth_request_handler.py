@@ -1,15 +1,233 @@
 """
-Handles OAuth requests
+Handles OAuth requests.
+The built-in server keeps connections open between requests, so that clients can send several requests over the same connection.
 """
 
-from wsgiref.simple_server import WSGIRequestHandler
+from socketserver import TCPServer, ThreadingMixIn
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer
+
+from http.server import BaseHTTPRequestHandler
+
+import os
+import socket
+import stat
+import sys
+
+path = sys.path[0]
+path = os.path.join(path, "..")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from config import server as server_config
+
+class OAuthServer(ThreadingMixIn, WSGIServer):
+	"""
+	The server that serves the python-oauth2 application.
+	Each connection is served in its own thread, so that idle persistent connections do not block other clients.
+	"""
+
+	daemon_threads = True
+
+class UnixOAuthServer(OAuthServer):
+	"""
+	The server that serves the python-oauth2 application over a Unix domain socket.
+	Clients on the same host, such as the WordPress plugin, can use it to skip the TCP loopback and to avoid exposing a port.
+	Access to the server is controlled by the socket file's permissions, so clients are considered to connect from `localhost`.
+
+	:ivar _mode: The permissions of the socket file.
+	:vartype _mode: int
+	:ivar _bound: A boolean indicating whether the server created the socket file.
+	:vartype _bound: bool
+	"""
+
+	address_family = socket.AF_UNIX
+
+	def __init__(self, path, RequestHandlerClass, mode=0o660):
+		"""
+		Create the server and bind it to the socket file.
+
+		:param path: The path of the socket file.
+		:type path: str
+		:param RequestHandlerClass: The class that handles requests.
+		:type RequestHandlerClass: class
+		:param mode: The permissions of the socket file.
+		:type mode: int
+		"""
+
+		self._mode = mode
+		self._bound = False
+		super(UnixOAuthServer, self).__init__(path, RequestHandlerClass)
+
+	def server_bind(self):
+		"""
+		Bind the server to the socket file, replacing any stale file left behind by a server that did not shut down cleanly.
+
+		:raises: OSError
+		"""
+
+		self._remove_stale_socket()
+		TCPServer.server_bind(self)
+		self._bound = True
+		os.chmod(self.server_address, self._mode)
+		self.server_name = "localhost"
+		self.server_port = 0
+		self.setup_environ()
+
+	def get_request(self):
+		"""
+		Accept a connection.
+		Unix domain sockets have no client address, so the client is given the address of `localhost`.
+
+		:return: The connection's socket and the client's address.
+		:rtype: tuple
+		"""
+
+		request, _ = self.socket.accept()
+		return request, ("localhost", 0)
+
+	def server_close(self):
+		"""
+		Close the server and remove the socket file if the server created it.
+		"""
+
+		super(UnixOAuthServer, self).server_close()
+		if self._bound:
+			self._bound = False
+			try:
+				os.unlink(self.server_address)
+			except OSError:
+				pass
+
+	def _remove_stale_socket(self):
+		"""
+		Remove the socket file if it exists and no server is listening on it.
+
+		:raises: OSError
+		"""
+
+		try:
+			if not stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+				raise OSError("%s exists and is not a socket" % self.server_address)
+		except FileNotFoundError:
+			return
+
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+			try:
+				probe.connect(self.server_address)
+			except ConnectionRefusedError:
+				os.unlink(self.server_address)
+				return
+
+		raise OSError("Another server is listening on %s" % self.server_address)
 
 class OAuthRequestHandler(WSGIRequestHandler):
 	"""
 	Request handler that enables formatting of the log messages on the console.
 	This handler is used by the python-oauth2 application.
+
+	The handler speaks HTTP/1.1, so connections are persistent unless the client asks to close them.
+	A connection is closed when it has been idle for longer than the keep-alive timeout, or when it has served the maximum number of requests.
+
+	:cvar protocol_version: The HTTP version that the server speaks.
+	:vartype protocol_version: str
+	:cvar max_drain: The maximum number of unread body bytes that are skipped to keep a connection open.
+		If a handler leaves more of the request body unread, the connection is closed instead.
+	:vartype max_drain: int
+
+	:ivar _requests: The number of requests that have been served on the connection.
+	:vartype _requests: int
 	"""
 
+	protocol_version = "HTTP/1.1"
+	max_drain = 1024 * 1024
+
+	def setup(self):
+		"""
+		Set up the connection.
+		The keep-alive timeout applies to every read and write, including the wait for the next request.
+		"""
+
+		self.timeout = server_config.keep_alive_timeout
+		self._requests = 0
+		super(OAuthRequestHandler, self).setup()
+
+	def handle(self):
+		"""
+		Handle requests until the connection is closed.
+		This restores the persistent behavior of :class:`http.server.BaseHTTPRequestHandler`, which the WSGI handler overrides to serve one request.
+		"""
+
+		BaseHTTPRequestHandler.handle(self)
+
+	def handle_one_request(self):
+		"""
+		Handle a single request on the connection.
+		"""
+
+		try:
+			self.raw_requestline = self.rfile.readline(65537)
+			if len(self.raw_requestline) > 65536:
+				self.requestline = ''
+				self.request_version = ''
+				self.command = ''
+				self.send_error(414)
+				self.close_connection = True
+				return
+
+			if not self.raw_requestline:
+				self.close_connection = True
+				return
+
+			if not self.parse_request(): # An error code has been sent, just exit
+				return
+
+			"""
+			Close the connection after the last request that it is allowed to serve.
+			"""
+			self._requests += 1
+			if self._requests >= server_config.keep_alive_max_requests:
+				self.close_connection = True
+
+			"""
+			Request bodies that are sent in chunks have no length, so the end of the body cannot be found to keep the connection open.
+			"""
+			if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+				self.close_connection = True
+
+			try:
+				length = max(int(self.headers.get("Content-Length", 0)), 0)
+			except ValueError:
+				length = 0
+				self.close_connection = True
+
+			stdin = BoundedInput(self.rfile, length)
+			handler = KeepAliveServerHandler(
+				stdin, self.wfile, self.get_stderr(), self.get_environ(),
+				multithread=True,
+			)
+			handler.request_handler = self      # backpointer for logging and connection management
+			handler.run(self.server.get_app())
+
+			"""
+			If the response was not completed, the state of the connection is unknown.
+			"""
+			if handler.status is not None:
+				self.close_connection = True
+
+			"""
+			Skip any part of the body that was not read, so that the next request starts at the right place.
+			"""
+			if not self.close_connection and not stdin.drain(self.max_drain):
+				self.close_connection = True
+
+			self.wfile.flush()
+		except socket.timeout:
+			"""
+			A read or a write timed out, or the connection was idle for too long.
+			Socket timeouts only became a kind of :class:`TimeoutError` in Python 3.10.
+			"""
+			self.close_connection = True
+
 	def address_string(self):
 		"""
 		The string of the authority/resource server.
@@ -19,3 +237,217 @@ class OAuthRequestHandler(WSGIRequestHandler):
 		"""
 
 		return "server"
+
+class KeepAliveServerHandler(ServerHandler):
+	"""
+	The handler that writes a response so that the connection can be kept open.
+	Responses need a known length to keep a connection open.
+	If the application does not give a `Content-Length`, the response is sent with chunked transfer encoding to HTTP/1.1 clients.
+	Otherwise, the connection is closed after the response.
+
+	:ivar _chunked: A boolean indicating whether the response is sent in chunks.
+	:vartype _chunked: bool
+	"""
+
+	def __init__(self, *args, **kwargs):
+		"""
+		Create the handler.
+		The arguments are those of :class:`wsgiref.handlers.SimpleHandler`.
+		"""
+
+		super(KeepAliveServerHandler, self).__init__(*args, **kwargs)
+		self._chunked = False
+
+	def start_response(self, status, headers, exc_info=None):
+		"""
+		Start the response and decide how the connection should be managed.
+		The connection headers are added here because applications are not allowed to set them.
+
+		:param status: The response's status.
+		:type status: str
+		:param headers: The response's headers.
+		:type headers: list of tuple
+		:param exc_info: The information of an exception, if the response is an error.
+		:type exc_info: tuple or None
+
+		:return: The function that writes the response body.
+		:rtype: function
+		"""
+
+		write = super(KeepAliveServerHandler, self).start_response(status, headers, exc_info)
+
+		request_handler = self.request_handler
+		self.http_version = "1.1" if request_handler.request_version == "HTTP/1.1" else "1.0"
+		self._chunked = False
+		if "Content-Length" not in self.headers and not request_handler.close_connection:
+			if self.http_version == "1.1":
+				self._chunked = True
+				self.headers["Transfer-Encoding"] = "chunked"
+			else:
+				request_handler.close_connection = True
+
+		if request_handler.close_connection:
+			self.headers["Connection"] = "close"
+		elif self.http_version == "1.0":
+			self.headers["Connection"] = "keep-alive"
+
+		return write
+
+	def set_content_length(self):
+		"""
+		Compute the `Content-Length` of responses that are not sent in chunks.
+		"""
+
+		if not self._chunked:
+			super(KeepAliveServerHandler, self).set_content_length()
+
+	def write(self, data):
+		"""
+		Write part of the response body, framing it as a chunk if the response is sent in chunks.
+
+		:param data: The data to write.
+		:type data: bytes
+		"""
+
+		if self._chunked:
+			if not data:
+				"""
+				An empty chunk would end the body, so it is not sent.
+				"""
+				return
+			data = b"%x\r\n%s\r\n" % (len(data), data)
+
+		super(KeepAliveServerHandler, self).write(data)
+
+	def finish_content(self):
+		"""
+		Ensure that the headers and the whole body have been sent.
+		Chunked responses end with an empty chunk.
+		"""
+
+		if not self._chunked:
+			super(KeepAliveServerHandler, self).finish_content()
+			return
+
+		if not self.headers_sent:
+			self.send_headers()
+		self._write(b"0\r\n\r\n")
+		self._flush()
+
+	def handle_error(self):
+		"""
+		Send an error response and close the connection, since part of the response may already have been sent.
+		"""
+
+		self.request_handler.close_connection = True
+		super(KeepAliveServerHandler, self).handle_error()
+
+class BoundedInput(object):
+	"""
+	The request body, which ends after `Content-Length` bytes even though the connection stays open.
+	It is given to the application as `wsgi.input`.
+
+	:ivar _stream: The connection's input stream.
+	:vartype _stream: file
+	:ivar _remaining: The number of bytes of the body that have not been read yet.
+	:vartype _remaining: int
+	"""
+
+	def __init__(self, stream, length):
+		"""
+		Create the body.
+
+		:param stream: The connection's input stream.
+		:type stream: file
+		:param length: The length of the body, in bytes.
+		:type length: int
+		"""
+
+		self._stream = stream
+		self._remaining = length
+
+	def read(self, size=-1):
+		"""
+		Read from the body.
+
+		:param size: The maximum number of bytes to read.
+			If it is negative, the rest of the body is read.
+		:type size: int
+
+		:return: The bytes that were read, which are empty at the end of the body.
+		:rtype: bytes
+		"""
+
+		if self._remaining <= 0:
+			return b""
+
+		size = self._remaining if size is None or size < 0 else min(size, self._remaining)
+		data = self._stream.read(size)
+		self._remaining -= len(data)
+		if not data:
+			self._remaining = 0
+		return data
+
+	def readline(self, size=-1):
+		"""
+		Read a line from the body.
+
+		:param size: The maximum number of bytes to read.
+			If it is negative, the line is read until its end, or until the end of the body.
+		:type size: int
+
+		:return: The line, including its line break.
+		:rtype: bytes
+		"""
+
+		if self._remaining <= 0:
+			return b""
+
+		size = self._remaining if size is None or size < 0 else min(size, self._remaining)
+		data = self._stream.readline(size)
+		self._remaining -= len(data)
+		if not data:
+			self._remaining = 0
+		return data
+
+	def readlines(self, hint=-1):
+		"""
+		Read the rest of the body as lines.
+
+		:param hint: Ignored.
+		:type hint: int
+
+		:return: The lines.
+		:rtype: list of bytes
+		"""
+
+		return list(iter(self.readline, b""))
+
+	def __iter__(self):
+		"""
+		Iterate over the lines of the body.
+
+		:return: An iterator over the lines.
+		:rtype: iterator
+		"""
+
+		return iter(self.readline, b"")
+
+	def drain(self, limit):
+		"""
+		Skip the rest of the body, if it is not too long.
+
+		:param limit: The maximum number of bytes to skip.
+		:type limit: int
+
+		:return: A boolean indicating whether the whole body has been read.
+		:rtype: bool
+		"""
+
+		if self._remaining > limit:
+			return False
+
+		while self._remaining > 0:
+			if not self.read(64 * 1024):
+				return False
+		return True
@@ -7,7 +7,80 @@ import psycopg2
 from oauth2.error import AccessTokenNotFound
 from oauth2.store.dbapi.mysql import MysqlAccessTokenStore, MysqlAuthCodeStore, MysqlClientStore
 
-class PostgresqlAccessTokenStore(MysqlAccessTokenStore):
+class PostgresqlStore(object):
+	"""
+	The statements of the PostgreSQL stores.
+	The server handles requests in several threads, which share the stores' connection and its transaction.
+	Therefore each statement holds the connection until it is committed, or rolled back if it fails.
+
+	:ivar connection: The database connection to use to store data.
+	:vartype connection: :class:`connection.db_connection.PostgreSQLConnection`
+	"""
+
+	def execute(self, query, *params):
+		"""
+		Execute a query and commit it.
+
+		:param query: The query to execute.
+		:type query: str
+		:param params: The values of the query's placeholders.
+		:type params: tuple
+
+		:return: The identifier of the last row that was changed.
+		:rtype: int
+		"""
+
+		with self.connection.transaction():
+			cursor = self.connection.cursor()
+			try:
+				cursor.execute(query, params)
+				return cursor.lastrowid
+			finally:
+				cursor.close()
+
+	def fetchone(self, query, *params):
+		"""
+		Get the first row of a query.
+
+		:param query: The query to execute.
+		:type query: str
+		:param params: The values of the query's placeholders.
+		:type params: tuple
+
+		:return: The first row, or `None` if the query has no rows.
+		:rtype: tuple or None
+		"""
+
+		with self.connection.transaction():
+			cursor = self.connection.cursor()
+			try:
+				cursor.execute(query, params)
+				return cursor.fetchone()
+			finally:
+				cursor.close()
+
+	def fetchall(self, query, *params):
+		"""
+		Get all the rows of a query.
+
+		:param query: The query to execute.
+		:type query: str
+		:param params: The values of the query's placeholders.
+		:type params: tuple
+
+		:return: The rows.
+		:rtype: list of tuple
+		"""
+
+		with self.connection.transaction():
+			cursor = self.connection.cursor()
+			try:
+				cursor.execute(query, params)
+				return cursor.fetchall()
+			finally:
+				cursor.close()
+
+class PostgresqlAccessTokenStore(PostgresqlStore, MysqlAccessTokenStore):
 	"""
 	The access token store that uses PostgreSQL.
 	The implementation is based on MySQL since the two languages are similar.
@@ -37,6 +110,7 @@ class PostgresqlAccessTokenStore(MysqlAccessTokenStore):
 		Moreover, the auto increment starts from 1.
 		Therefore there is a mismatch between the access token and its information (data and scope).
 		Instead, the access token ID is fetched using a more secure way.
+		The token, its data and its scopes are saved in one transaction, so that other threads never see a token without its scopes.
 
 		:param access_token: An instance of an access token.
 		:type access_token: :class:`oauth2.datatype.AccessToken`
@@ -45,20 +119,21 @@ class PostgresqlAccessTokenStore(MysqlAccessTokenStore):
 		:rtype: bool
 		"""
 
-		access_token_id = self.fetchone(self.create_access_token_query,
-							access_token.client_id,
-							access_token.grant_type,
-							access_token.token,
-							access_token.expires_at,
-							access_token.refresh_token,
-							access_token.refresh_expires_at,
-							access_token.user_id)
+		with self.connection.transaction():
+			access_token_id = self.fetchone(self.create_access_token_query,
+								access_token.client_id,
+								access_token.grant_type,
+								access_token.token,
+								access_token.expires_at,
+								access_token.refresh_token,
+								access_token.refresh_expires_at,
+								access_token.user_id)
 
-		for key, value in list(access_token.data.items()):
-			self.execute(self.create_data_query, key, value, access_token_id)
+			for key, value in list(access_token.data.items()):
+				self.execute(self.create_data_query, key, value, access_token_id)
 
-		for scope in access_token.scopes:
-			self.execute(self.create_scope_query, scope, access_token_id)
+			for scope in access_token.scopes:
+				self.execute(self.create_scope_query, scope, access_token_id)
 
 		return True
 
@@ -74,14 +149,15 @@ class PostgresqlAccessTokenStore(MysqlAccessTokenStore):
 
 		:raises: :class:`oauth2.error.AccessTokenNotFound` if access token cannot be retrieved.
 		"""
-		row = self.fetchone(self.fetch_by_access_token_query, access_token)
+		with self.connection.transaction():
+			row = self.fetchone(self.fetch_by_access_token_query, access_token)
 
-		if row is None:
-			raise AccessTokenNotFound
+			if row is None:
+				raise AccessTokenNotFound
 
-		scopes = self._fetch_scopes(access_token_id=row[0])
+			scopes = self._fetch_scopes(access_token_id=row[0])
 
-		data = self._fetch_data(access_token_id=row[0])
+			data = self._fetch_data(access_token_id=row[0])
 
 		return self._row_to_token(data=data, scopes=scopes, row=row)
 
@@ -128,7 +204,7 @@ class PostgresqlAccessTokenStore(MysqlAccessTokenStore):
 		WHERE
 			access_token_id = %s"""
 
-class PostgresqlAuthCodeStore(MysqlAuthCodeStore):
+class PostgresqlAuthCodeStore(PostgresqlStore, MysqlAuthCodeStore):
 	"""
 	The authorization code store that uses PostgreSQL.
 	The implementation is based on MySQL since the two languages are similar.
@@ -136,10 +212,18 @@ class PostgresqlAuthCodeStore(MysqlAuthCodeStore):
 
 	pass
 
-class PostgresqlClientStore(MysqlClientStore):
+class PostgresqlClientStore(PostgresqlStore, MysqlClientStore):
 	"""
 	The client store that uses PostgreSQL.
 	The implementation is based on MySQL since the two languages are similar.
+
+	Clients are needed by every token request and rarely change, so they are kept in memory once they are fetched.
+	Clients that are changed directly in the database are only seen after the server restarts.
+
+	:ivar connection: The database connection to use to store data.
+	:vartype connection: :class:`connection.connection.Connection`
+	:ivar _clients: The clients that have been fetched, with their identifiers as keys.
+	:vartype _clients: dict
 	"""
 
 	def __init__(self, connection):
@@ -152,6 +236,7 @@ class PostgresqlClientStore(MysqlClientStore):
 		"""
 		self.connection = connection
 		self.connection.reconnect()
+		self._clients = {}
 
 	def add_client(self, client_id, client_secret):
 		"""
@@ -164,6 +249,41 @@ class PostgresqlClientStore(MysqlClientStore):
 		"""
 
 		self.execute(self.add_client_query, client_id, client_secret)
+		self._clients.pop(client_id, None)
+
+	def fetch_by_client_id(self, client_id):
+		"""
+		Fetch the client with the given identifier, from memory if it has been fetched before.
+
+		:param client_id: The unique identifier of the client.
+		:type client_id: str
+
+		:return: The client.
+		:rtype: :class:`oauth2.datatype.Client`
+
+		:raises: :class:`oauth2.error.ClientNotFoundError`
+		"""
+
+		client = self._clients.get(client_id)
+		if client is None:
+			client = super(PostgresqlClientStore, self).fetch_by_client_id(client_id)
+			self._clients[client_id] = client
+		return client
+
+	def preload(self):
+		"""
+		Fetch all the clients into memory.
+		"""
+
+		for row in self.fetchall(self.fetch_client_identifiers_query):
+			self.fetch_by_client_id(row[0])
+
+	fetch_client_identifiers_query = """
+		SELECT
+			identifier
+		FROM
+			clients
+	"""
 
 	add_client_query = """
 		INSERT INTO clients (
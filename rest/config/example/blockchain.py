@@ -41,3 +41,159 @@ verify = True if admin_host.lower().startswith('https') or multiuser_host.lower(
 			 The only case when HTTPS requests do not need to be verified is when they use self-signed certificates.
 :vartype verify: bool
 """
+
+contract_address = "0x5d7be6ee249CaE84fDef611949AD829Ef3E07892"
+"""
+:var contract_address: The address of the deployed Dwarna contract.
+					   It is only used by the Ethereum backend.
+:vartype contract_address: str
+"""
+
+confirmation_poll_interval = 0.5
+"""
+:var confirmation_poll_interval: The time, in seconds, between checks for new blocks while transactions are waiting to be mined.
+								 It is only used by the Ethereum backend.
+:vartype confirmation_poll_interval: float
+"""
+
+confirmation_timeout = 240
+"""
+:var confirmation_timeout: The maximum time, in seconds, to wait for a transaction to be mined.
+						   It should be shorter than the job lease in the server configuration, so that another worker does not claim the job in the meantime.
+						   It is only used by the Ethereum backend.
+:vartype confirmation_timeout: float
+"""
+
+nonce_stuck_after = 60
+"""
+:var nonce_stuck_after: The time, in seconds, for which the node's transaction count must stay below the next nonce before the nonces are moved back to fill the gap.
+						A gap is left when a nonce is allocated but the transaction is never sent, for example because the server stopped in between, and it holds up every later transaction.
+						If it is `None`, the nonces are never moved back.
+						It is only used by the Ethereum backend.
+:vartype nonce_stuck_after: float or None
+"""
+
+http_pool_size = 20
+"""
+:var http_pool_size: The maximum number of persistent connections that are kept open to each blockchain node or REST API.
+					 Requests wait for a free connection when all of them are in use.
+:vartype http_pool_size: int
+"""
+
+http_retries = 3
+"""
+:var http_retries: The maximum number of times that a request to the blockchain is retried after a connection error.
+				   Requests that may change the blockchain are only retried if they could not be sent at all.
+:vartype http_retries: int
+"""
+
+http_backoff = 0.5
+"""
+:var http_backoff: The factor of the exponential back-off between retries, in seconds.
+:vartype http_backoff: float
+"""
+
+http_timeout = (3.05, 60)
+"""
+:var http_timeout: The timeouts of requests to the blockchain, in seconds, as a tuple with the connection timeout and the read timeout.
+:vartype http_timeout: tuple
+"""
+
+mirror = True
+"""
+:var mirror: A boolean indicating whether the consent recorded on the blockchain is mirrored in the database.
+			 The server runs an indexer that copies every consent change into the mirror.
+			 It is only used by the Ethereum backend.
+:vartype mirror: bool
+"""
+
+mirror_max_staleness = 30
+"""
+:var mirror_max_staleness: The maximum time, in seconds, since the indexer last caught up with the node for consent to be read from the mirror.
+						   If the mirror is staler, consent is read from the blockchain.
+						   If it is `None`, consent is always read from the blockchain, although the mirror is still kept up to date.
+:vartype mirror_max_staleness: float or None
+"""
+
+mirror_start_block = 0
+"""
+:var mirror_start_block: The block from which the indexer starts copying consent changes, such as the block in which the contract was deployed.
+:vartype mirror_start_block: int
+"""
+
+mirror_poll_interval = 1
+"""
+:var mirror_poll_interval: The time, in seconds, between checks for new blocks once the indexer has caught up with the node.
+:vartype mirror_poll_interval: float
+"""
+
+mirror_reorg_depth = 64
+"""
+:var mirror_reorg_depth: The number of recent blocks whose hashes the indexer keeps to detect reorganizations of the chain.
+						 Deeper reorganizations rebuild the mirror from the start block.
+:vartype mirror_reorg_depth: int
+"""
+
+mirror_reconcile_interval = 600
+"""
+:var mirror_reconcile_interval: The time, in seconds, between comparisons of a sample of the mirror with the blockchain.
+								If it is `None`, the mirror is never compared with the blockchain.
+:vartype mirror_reconcile_interval: float or None
+"""
+
+mirror_reconcile_sample = 100
+"""
+:var mirror_reconcile_sample: The number of mirrored consents that are compared with the blockchain each time.
+:vartype mirror_reconcile_sample: int
+"""
+
+write_mode = "transaction"
+"""
+:var write_mode: How consent changes are recorded on the blockchain.
+				 If it is `transaction`, each consent change is its own transaction to the contract.
+				 If it is `anchor`, consent changes are recorded in the database and anchored in batches: only the root of each batch's Merkle tree is sent to the blockchain.
+				 Consent is then read from the database, and participants can get a proof that each of their consent changes was anchored.
+				 When the server first starts in this mode, the consent changes that were sent to the contract are imported into the database, and anchored with the next batch.
+				 It is only used by the Ethereum backend.
+:vartype write_mode: str
+"""
+
+anchor_interval = 60
+"""
+:var anchor_interval: The time, in seconds, between batches of anchored consent changes.
+:vartype anchor_interval: float
+"""
+
+anchor_batch_size = 10000
+"""
+:var anchor_batch_size: The maximum number of consent changes in a batch.
+:vartype anchor_batch_size: int
+"""
+
+read_cache = True
+"""
+:var read_cache: A boolean indicating whether contract reads are pinned to the latest block and cached until a new block is mined.
+				 The same reads that are made in the same block then only call the node once.
+				 It is only used by the Ethereum backend.
+:vartype read_cache: bool
+"""
+
+read_cache_poll_interval = 1
+"""
+:var read_cache_poll_interval: The time, in seconds, between checks for new blocks.
+							   Reads may return results that are this old, unless they follow a transaction that this process sent.
+:vartype read_cache_poll_interval: float
+"""
+
+read_cache_max_age = 10
+"""
+:var read_cache_max_age: The time, in seconds, after which the latest block is no longer trusted if it has not been refreshed.
+						 Until it is refreshed again, reads are made at the node's latest block and they are not cached.
+:vartype read_cache_max_age: float
+"""
+
+read_cache_size = 10000
+"""
+:var read_cache_size: The maximum number of read results that are cached in each block.
+:vartype read_cache_size: int
+"""
@@ -0,0 +1,173 @@
+max_body_size = 10 * 1024 * 1024
+"""
+:var max_body_size: The maximum size, in bytes, of a request body.
+					Requests with a larger body are rejected with a 413 error before the body is read.
+:vartype max_body_size: int
+"""
+
+spill_threshold = 1024 * 1024
+"""
+:var spill_threshold: The size, in bytes, above which a part of a multipart request is written to a temporary file instead of memory.
+					  Such parts are passed on to handlers as files instead of `bytes`.
+:vartype spill_threshold: int
+"""
+
+chunk_size = 64 * 1024
+"""
+:var chunk_size: The number of bytes to read from a request body at a time.
+:vartype chunk_size: int
+"""
+
+max_batch_size = 20
+"""
+:var max_batch_size: The maximum number of requests that can be sent together to the `/batch` path.
+:vartype max_batch_size: int
+"""
+
+batch_workers = 4
+"""
+:var batch_workers: The number of GET requests in a batch that are handled concurrently.
+:vartype batch_workers: int
+"""
+
+slow_request_threshold = 1
+"""
+:var slow_request_threshold: The time, in seconds, above which a request is considered to be slow.
+:vartype slow_request_threshold: float
+"""
+
+slow_request_log = "slow_requests.log"
+"""
+:var slow_request_log: The file where slow requests are logged, one JSON object per line.
+					   Each entry includes the time spent in each phase of the request and the executed queries.
+					   If it is empty, slow requests are not logged.
+:vartype slow_request_log: str
+"""
+
+metrics_local_access = False
+"""
+:var metrics_local_access: A boolean indicating whether requests for the metrics from the local host, or over the Unix domain socket, are served without an access token.
+						   Other requests need an access token with the admin scope.
+						   This should be left off if a reverse proxy on the same host forwards requests from other hosts, since they would appear to come from the local host.
+:vartype metrics_local_access: bool
+"""
+
+max_concurrent_requests = 64
+"""
+:var max_concurrent_requests: The maximum number of requests that are served at the same time.
+							  Further requests are rejected with a 503 status code until one finishes.
+							  If it is `None`, there is no limit.
+:vartype max_concurrent_requests: int or None
+"""
+
+keep_alive_timeout = 15
+"""
+:var keep_alive_timeout: The time, in seconds, for which an idle connection is kept open, waiting for the next request.
+:vartype keep_alive_timeout: float
+"""
+
+keep_alive_max_requests = 100
+"""
+:var keep_alive_max_requests: The maximum number of requests that are served over the same connection before it is closed.
+:vartype keep_alive_max_requests: int
+"""
+
+socket_path = None
+"""
+:var socket_path: The path of a Unix domain socket on which to serve the REST API, in addition to the TCP port.
+				  Clients on the same host, such as the WordPress plugin, can use it instead of a loopback TCP connection.
+				  If it is `None`, the REST API is only served over TCP.
+:vartype socket_path: str or None
+"""
+
+socket_mode = 0o660
+"""
+:var socket_mode: The permissions of the Unix domain socket.
+				  Any user who can write to the socket can reach the REST API, including routes that are restricted to `localhost`.
+:vartype socket_mode: int
+"""
+
+warm_up = True
+"""
+:var warm_up: A boolean indicating whether the server should warm up before it starts listening.
+			  The warm-up checks the database connections, loads the study catalog and the OAuth clients, and pings the blockchain node.
+			  Its outcome is reported by the `/ping` route.
+:vartype warm_up: bool
+"""
+
+task_drain_timeout = 30
+"""
+:var task_drain_timeout: The maximum time, in seconds, to wait for each background thread, such as a job worker, to finish when the server stops.
+:vartype task_drain_timeout: float
+"""
+
+background_services = True
+"""
+:var background_services: A boolean indicating whether the server runs the blockchain job workers, the consent indexer, the consent anchorer and the participant indexer itself.
+						  If the server runs in several processes, such as under mod_wsgi, every process would run them, so it should be `False`.
+						  The services should then be run in a single process with `worker.py`.
+:vartype background_services: bool
+"""
+
+job_workers = 2
+"""
+:var job_workers: The number of threads in the server that record consent changes on the blockchain.
+				  Consent changes are queued in the database, so more workers can be started in other processes with `worker.py`.
+				  If it is 0, the server only queues the changes.
+:vartype job_workers: int
+"""
+
+job_max_attempts = 5
+"""
+:var job_max_attempts: The maximum number of times that a blockchain write is attempted before it is marked as failed.
+:vartype job_max_attempts: int
+"""
+
+job_backoff = 5
+"""
+:var job_backoff: The time, in seconds, to wait before retrying a failed blockchain write for the first time.
+				  The wait doubles after every failed attempt.
+:vartype job_backoff: float
+"""
+
+job_lease = 300
+"""
+:var job_lease: The time, in seconds, for which a blockchain write is reserved for the worker that claimed it.
+				If the worker does not finish it in time, for example because its process stopped, another worker may claim it.
+:vartype job_lease: float
+"""
+
+job_poll_interval = 1
+"""
+:var job_poll_interval: The time, in seconds, that idle workers wait before checking the queue again.
+:vartype job_poll_interval: float
+"""
+
+consent_coalesce_window = 2
+"""
+:var consent_coalesce_window: The time, in seconds, for which a consent change waits before it is recorded on the blockchain.
+							  Changes to the same consent that are made in the meantime are merged, so that only the latest one is recorded.
+							  If it is 0, changes are only merged while they wait for a free worker.
+:vartype consent_coalesce_window: float
+"""
+
+fan_out_workers = 16
+"""
+:var fan_out_workers: The number of threads that make independent blockchain reads at the same time, such as the reads for each study.
+					  The threads are shared by all requests.
+:vartype fan_out_workers: int
+"""
+
+fan_out_timeout = 10
+"""
+:var fan_out_timeout: The maximum time, in seconds, that each of these reads may take.
+					  Reads that fail or time out are reported in the response's errors, and the other results are still returned.
+:vartype fan_out_timeout: float
+"""
+
+participant_index_interval = 300
+"""
+:var participant_index_interval: The time, in seconds, between the participant indexer's checks for studies that it has not synced yet.
+								 Studies that existed before the participant index are read from the blockchain once, and are synced from then on.
+:vartype participant_index_interval: float
+"""
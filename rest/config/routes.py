@@ -5,8 +5,7 @@ from biobank.handlers.email_handler import EmailHandler
 from biobank.handlers.participant_handler import ParticipantHandler
 from biobank.handlers.researcher_handler import ResearcherHandler
 from biobank.handlers.study_handler import StudyHandler
-from biobank.handlers.blockchain.api.hyperledger import hyperledger
-from biobank.handlers.blockchain.api.ethereum import ethereum
+from biobank.handlers.blockchain.api import load_backend
 
 from connection.db_connection import PostgreSQLConnection
 
@@ -54,9 +53,10 @@ consent_handler_class = ConsentHandler
 :vartype consent_handler_class: :class:`biobank.handler.RouteHandler`
 """
 
-blockchain_handler_class = ethereum.EthereumAPI
+blockchain_handler_class = load_backend("ethereum")
 """
 :var blockchain_handler_class: The handler that receives route parameters and services requests related to blockchain-specific functions.
+								 The backend is given by name, either `ethereum` or `hyperledger`, and only its module is imported.
 :vartype blockchain_handler_class: :class:`biobank.blockchain.api.BlockchainAPI`
 """
 
@@ -86,6 +86,39 @@ admin_scope = "admin"
 :vartype admin_scope: str
 """
 
+rate_limits = {
+	"read": {
+		"user": { "rate": 20, "burst": 100 },
+		"client": { "rate": 200, "burst": 500 },
+	},
+	"write": {
+		"user": { "rate": 10, "burst": 50 },
+		"client": { "rate": 100, "burst": 200 },
+	},
+	"blockchain_read": {
+		"user": { "rate": 10, "burst": 50 },
+		"client": { "rate": 100, "burst": 200 },
+	},
+	"blockchain_write": {
+		"user": { "rate": 1, "burst": 50 },
+		"client": { "rate": 10, "burst": 100 },
+		"max_threads": 100,
+	},
+}
+"""
+:var rate_limits: The rate limits of each class of routes.
+	Routes are in the class given by their `rate_limit` attribute.
+	If they do not have one, GET routes are in the `read` class, and other routes are in the `write` class.
+
+	Each class may have a `user` and a `client` limit, applied to each user and each OAuth client respectively.
+	A limit allows `rate` requests per second on average, and bursts of up to `burst` requests.
+	Requests beyond the limit are rejected with a 429 status code.
+
+	A class may also have a `max_threads` limit.
+	While that many blockchain writes are queued, requests of the class are rejected with a 503 status code.
+:vartype rate_limits: dict
+"""
+
 """
 Basic routes.
 """
@@ -107,8 +140,9 @@ routes = {
 	- the handler class;
 	- the handler function;
 	- a list of scopes;
-	- the required parameters; and
-	- a boolean indicating whether the function is personal.
+	- the required parameters;
+	- a boolean indicating whether the function is personal; and
+	- optionally, the class of the route, whose rate limits are given in `rate_limits`.
 
 	Scopes need not be unique.
 	For example, different ways of removing participants may share the same scope.
@@ -225,6 +259,7 @@ routes.update({
 			"function": study_handler_class.create_study,
 			"scopes": ["create_study"],
 			"parameters": ["study_id", "name", "description", "homepage"],
+			"rate_limit": "blockchain_write",
 		},
 		"PUT": {
 			"handler": study_handler_class,
@@ -278,7 +313,8 @@ routes.update({
 			"function": consent_handler_class.get_participants_by_study,
 			"scopes": ["view_consent"],
 			"parameters": ["study_id"],
-			"method": ["GET"]
+			"method": ["GET"],
+			"rate_limit": "blockchain_read",
 		}
 	},
 	"/get_studies_by_participant": {
@@ -287,7 +323,8 @@ routes.update({
 			"function": consent_handler_class.get_studies_by_participant,
 			"scopes": ["view_consent"],
 			"parameters": ["username"],
-			"self_only": True
+			"self_only": True,
+			"rate_limit": "blockchain_read",
 		}
 	},
 	"/get_consent_trail": {
@@ -296,7 +333,8 @@ routes.update({
 			"function": consent_handler_class.get_consent_trail,
 			"scopes": ["view_consent"],
 			"parameters": ["username"],
-			"self_only": True
+			"self_only": True,
+			"rate_limit": "blockchain_read",
 		}
 	},
 })
@@ -308,7 +346,8 @@ routes.update({
 			"function": consent_handler_class.give_consent,
 			"scopes": ["update_consent"],
 			"parameters": ["study_id", "address"],
-			"self_only": True
+			"self_only": True,
+			"rate_limit": "blockchain_write",
 		}
 	},
 	"/withdraw_consent": {
@@ -317,7 +356,8 @@ routes.update({
 			"function": consent_handler_class.withdraw_consent,
 			"scopes": ["update_consent"],
 			"parameters": ["study_id", "address"],
-			"self_only": True
+			"self_only": True,
+			"rate_limit": "blockchain_write",
 		}
 	},
 	"/has_consent": {
@@ -326,7 +366,17 @@ routes.update({
 			"function": consent_handler_class.has_consent,
 			"scopes": ["view_consent"],
 			"parameters": ["study_id", "address"],
-			"self_only": True
+			"self_only": True,
+			"rate_limit": "blockchain_read",
+		}
+	},
+	"/consent_job": {
+		"GET": {
+			"handler": consent_handler_class,
+			"function": consent_handler_class.get_consent_job,
+			"scopes": ["view_consent"],
+			"parameters": ["job_id", "address"],
+			"self_only": True,
 		}
 	},
 })
@@ -359,6 +409,15 @@ routes.update({
 			"parameters": ["address", "card"],
 		}
 	},
+	"/consent_proof": {
+		"GET": {
+			"handler": blockchain_handler_class,
+			"function": blockchain_handler_class.get_consent_proof,
+			"scopes": ["view_consent"],
+			"parameters": ["study_id", "address"],
+			"self_only": True,
+		}
+	},
 })
 
 """
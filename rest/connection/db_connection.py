@@ -3,6 +3,9 @@ Database interfaces using the base connection class.
 """
 
 import os
+import threading
+import uuid
+from contextlib import contextmanager
 from os.path import expanduser
 
 import psycopg2
@@ -11,6 +14,8 @@ import psycopg2.extras
 from .connection import Connection
 from .exceptions import connection_exceptions
 
+from server import timing
+
 class PostgreSQLConnection(Connection):
 	"""
 	The connection to the PostgreSQL database.
@@ -29,6 +34,15 @@ class PostgreSQLConnection(Connection):
 		The RealDictCursor factory is the default one.
 		This factory returns associative arrays (`dict` instances) from queries.
 	:type _cursor_factory: :class:`psycopg2.extras.RealDictCursor`
+	:ivar _in_flight: The number of statements that are currently being executed on the connection, or waiting for it.
+	:vartype _in_flight: int
+	:ivar _in_flight_lock: The lock that protects the number of statements being executed.
+	:vartype _in_flight_lock: :class:`threading.Lock`
+	:ivar _lock: The lock that lets one thread at a time use the connection.
+		Threads share the connection's transaction, so a statement and its commit must not be interleaved with another thread's, and the connection must not be replaced while another thread uses it.
+	:vartype _lock: :class:`threading.RLock`
+	:ivar _depth: The number of nested transactions that the thread that holds the connection has opened.
+	:vartype _depth: int
 	"""
 
 	def __init__(self, database, host, username, password, cursor_factory=psycopg2.extras.RealDictCursor):
@@ -54,6 +68,10 @@ class PostgreSQLConnection(Connection):
 		self._username = username
 		self._password = password
 		self._cursor_factory = cursor_factory
+		self._in_flight = 0
+		self._in_flight_lock = threading.Lock()
+		self._lock = threading.RLock()
+		self._depth = 0
 		self.reconnect()
 
 	@staticmethod
@@ -93,7 +111,8 @@ class PostgreSQLConnection(Connection):
 		Reconnect to the database.
 		"""
 
-		self._con = psycopg2.connect(dbname=self._database, host=self._host, user=self._username, password=self._password)
+		with self._lock:
+			self._con = psycopg2.connect(dbname=self._database, host=self._host, user=self._username, password=self._password)
 
 	def cursor(self):
 		"""
@@ -114,6 +133,34 @@ class PostgreSQLConnection(Connection):
 
 		self._con.commit()
 
+	@contextmanager
+	def transaction(self):
+		"""
+		Hold the connection for a group of statements that are made directly on its cursors, such as those of the OAuth stores.
+		Other threads wait until the group ends, so they neither see its changes before they are committed nor interleave their own.
+		The statements are committed together at the end, and rolled back if one of them fails, so that the failure does not abort the transaction of the next thread.
+		Transactions can be nested, in which case only the outermost one commits or rolls back.
+
+		:return: The connection.
+		:rtype: :class:`connection.db_connection.PostgreSQLConnection`
+
+		:raises: :class:`Exception`: Any exception that is caught is rethrown.
+		"""
+
+		self._enter()
+		self._depth += 1
+		try:
+			yield self
+			if self._depth == 1:
+				self._con.commit()
+		except Exception:
+			if self._depth == 1:
+				self._con.rollback()
+			raise
+		finally:
+			self._depth -= 1
+			self._leave()
+
 	def count(self, query):
 		"""
 		Count the number of rows when executing the given query.
@@ -182,6 +229,84 @@ class PostgreSQLConnection(Connection):
 		cursor.close()
 		return rows
 
+	def stream(self, query, size=1000):
+		"""
+		Fetch the rows returned from the database using the given query lazily.
+		The rows are fetched from a server-side cursor, a batch at a time, so the result set is never held in memory as a whole.
+
+		The query is executed immediately, so any errors are raised here rather than while iterating.
+		The cursor is declared `WITH HOLD` so that it survives commits made by other users of the connection.
+
+		:param query: The `select` query to execute.
+		:type query: str
+		:param size: The number of rows to fetch from the database at a time.
+		:type size: int
+
+		:return: A generator of rows.
+		:rtype: generator
+
+		:raises: :class:`Exception`: Any exception that is caught is rethrown.
+		"""
+
+		self._enter()
+		try:
+			cursor = self._con.cursor(name="stream_%s" % uuid.uuid4().hex, cursor_factory=self._cursor_factory, withhold=True)
+			cursor.itersize = size
+			with timing.Query(query):
+				cursor.execute(query)
+				self._con.commit()
+		except Exception as e:
+			"""
+			If the query failed for some reason, reconnect to the database and raise the exception again.
+			In this way, the calling function knows about the failure.
+			"""
+			self.reconnect()
+			raise e
+		finally:
+			self._leave()
+
+		return self._iterate(cursor)
+
+	def _iterate(self, cursor):
+		"""
+		Iterate over the rows of the given server-side cursor, closing it at the end.
+		Rows are fetched a batch at a time, and each fetch waits until the connection is free, like any other statement.
+
+		The fetches are not committed, since the connection's transaction is shared with other threads.
+		The cursor is declared `WITH HOLD`, so it does not need a transaction of its own, and the next statement's commit ends the fetches' transaction.
+
+		:param cursor: The server-side cursor.
+		:type cursor: :class:`DictCursorBase`
+
+		:return: A generator of rows.
+		:rtype: generator
+		"""
+
+		try:
+			while True:
+				self._enter()
+				try:
+					rows = cursor.fetchmany(cursor.itersize)
+				finally:
+					self._leave()
+
+				if not rows:
+					break
+
+				for row in rows:
+					yield row
+		finally:
+			"""
+			The cursor may already be gone if the connection was re-established in the meantime.
+			"""
+			self._enter()
+			try:
+				cursor.close()
+			except psycopg2.Error:
+				pass
+			finally:
+				self._leave()
+
 	def bulk_execute(self, sql, tuples, placeholder):
 		"""
 		Execute the given transaction in batch.
@@ -204,10 +329,12 @@ class PostgreSQLConnection(Connection):
 		:raises: :class:`Exception`: Any exception that is caught is rethrown.
 		"""
 
+		self._enter()
 		try:
 			cursor = self.cursor()
-			psycopg2.extras.execute_values(cursor, sql, tuples, placeholder)
-			self._con.commit()
+			with timing.Query(sql):
+				psycopg2.extras.execute_values(cursor, sql, tuples, placeholder)
+				self._con.commit()
 			cursor.close()
 		except Exception as e:
 			"""
@@ -216,6 +343,8 @@ class PostgreSQLConnection(Connection):
 			"""
 			self.reconnect()
 			raise e
+		finally:
+			self._leave()
 
 	def execute(self, batch, with_cursor=False):
 		"""
@@ -235,6 +364,7 @@ class PostgreSQLConnection(Connection):
 		:raises: :class:`Exception`: Any exception that is caught is rethrown.
 		"""
 
+		self._enter()
 		try:
 			cursor = self.cursor()
 
@@ -243,10 +373,14 @@ class PostgreSQLConnection(Connection):
 			"""
 			if type(batch) == list:
 				for query in batch:
-					cursor.execute(query)
+					with timing.Query(query):
+						cursor.execute(query)
 			else:
-				cursor.execute(batch)
-			self._con.commit()
+				with timing.Query(batch):
+					cursor.execute(batch)
+
+			with timing.Phase("db"):
+				self._con.commit()
 
 			if with_cursor:
 				return cursor
@@ -259,6 +393,46 @@ class PostgreSQLConnection(Connection):
 			"""
 			self.reconnect()
 			raise e
+		finally:
+			self._leave()
+
+	def in_flight(self):
+		"""
+		Get the number of statements that are currently being executed on the connection, or waiting for it.
+
+		:return: The number of statements being executed or waiting.
+		:rtype: int
+		"""
+
+		return self._in_flight
+
+	def is_open(self):
+		"""
+		Check whether the connection to the database is open.
+
+		:return: A boolean indicating whether the connection is open.
+		:rtype: bool
+		"""
+
+		return not self._con.closed
+
+	def _enter(self):
+		"""
+		Count a statement that is starting to be executed, and wait until the connection is free.
+		"""
+
+		with self._in_flight_lock:
+			self._in_flight += 1
+		self._lock.acquire()
+
+	def _leave(self):
+		"""
+		Free the connection, and stop counting a statement that has been executed.
+		"""
+
+		self._lock.release()
+		with self._in_flight_lock:
+			self._in_flight -= 1
 
 	def close(self):
 		"""
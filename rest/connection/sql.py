@@ -0,0 +1,16 @@
+"""
+Helpers to build the SQL statements that are executed by the connections.
+"""
+
+def escape(value):
+	"""
+	Escape a value so that it can be included in a quoted SQL string.
+
+	:param value: The value to escape.
+	:type value: object
+
+	:return: The escaped value.
+	:rtype: str
+	"""
+
+	return str(value).replace("'", "''")
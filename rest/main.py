@@ -5,12 +5,7 @@ The server that handles all requests to the backend.
 """
 
 from multiprocessing import Process
-
-from oauth2.grant import RefreshToken
-from oauth2.store.memory import ClientStore, TokenStore
-from oauth2.tokengenerator import Uuid4
-from oauth2.web.wsgi import Application, Request
-from threading import Thread
+from threading import Event, Thread
 from wsgiref.simple_server import make_server
 
 import argparse
@@ -20,6 +15,20 @@ import sys
 import os
 from os.path import expanduser
 
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__))))
+
+"""
+Start profiling the startup before the other modules are imported, so that their import time is included.
+"""
+from server import startup
+if "--profile-startup" in sys.argv:
+	startup.enable()
+
+from oauth2.grant import RefreshToken
+from oauth2.store.memory import ClientStore, TokenStore
+from oauth2.tokengenerator import Uuid4
+from oauth2.web.wsgi import Application, Request
+
 import psycopg2
 from psycopg2.extensions import cursor
 
@@ -27,22 +36,21 @@ from psycopg2.extensions import cursor
 Biobank-specific classes.
 """
 
-sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__))))
-
-from threads.thread_manager import ThreadManager
-
-from biobank.handlers.blockchain.api.hyperledger import hyperledger
-from biobank.handlers.blockchain.api.ethereum import ethereum
+from threads.job_queue import JobQueue
+from worker import start_job_workers, start_services
 
 from coauth.grants.grants import CustomClientCredentialsGrant
 from coauth.token_store.postgresql_token_store import PostgresqlAccessTokenStore, PostgresqlAuthCodeStore, PostgresqlClientStore
-from coauth.oauth_request_handler import OAuthRequestHandler
+from coauth.oauth_request_handler import OAuthRequestHandler, OAuthServer, UnixOAuthServer
 
+from server import metrics, warmup
+from server.admission import AdmissionController
 from server.application import OAuthApplication
 from server.resource_server import ResourceServer
 from server.authorization_server import AuthorizationServer
 
 from config import blockchain, db, oauth, routes
+from config import server as server_config
 
 pid = None
 """
@@ -56,6 +64,10 @@ def setup_args():
 	Accepted arguments:
 		- -p --port		The port on which to serve the REST API, defaults to 7225.
 		- --single-card	Run the server in single-card mode.
+		- --socket		The path of a Unix domain socket on which to serve the REST API, in addition to the port.
+		- --socket-mode	The permissions of the Unix domain socket, in octal, defaults to the configuration.
+		- --no-tcp		Serve the REST API only on the Unix domain socket.
+		- --profile-startup	Report the time taken to import each module and to initialize the server.
 
 	:return: The command-line arguments.
 	:rtype: list
@@ -64,70 +76,132 @@ def setup_args():
 	parser = argparse.ArgumentParser(description="Serve the REST API which controls the dynamic consent functionality.")
 	parser.add_argument("-p", "--port", nargs="+", type=int, default=7225, help="<Optional> The port on which to serve the REST API, defaults to 7225.", required=False)
 	parser.add_argument("--single-card", help="Run the server in single-card mode.", action="store_true")
+	parser.add_argument("--socket", type=str, default=server_config.socket_path, help="<Optional> The path of a Unix domain socket on which to serve the REST API, in addition to the port.", required=False)
+	parser.add_argument("--socket-mode", type=lambda mode: int(mode, 8), default=server_config.socket_mode, help="<Optional> The permissions of the Unix domain socket, in octal, such as 660.", required=False)
+	parser.add_argument("--no-tcp", help="Serve the REST API only on the Unix domain socket.", action="store_true")
+	parser.add_argument("--profile-startup", help="Report the time taken to import each module and to initialize the server.", action="store_true")
 	args = parser.parse_args()
 	return args
 
-def start_auth_server(port, token_expiry, connection, oauth_connection):
+def get_listen_port(args):
+	"""
+	Get the port on which to serve the REST API from the command-line arguments.
+
+	:param args: The command-line arguments.
+	:type args: :class:`argparse.Namespace`
+
+	:return: The port on which to serve the REST API.
+		If it is `None`, the server only serves the REST API on the Unix domain socket.
+	:rtype: int or None
+	"""
+
+	if args.no_tcp:
+		return None
+
+	return args.port[0] if type(args.port) is not int else args.port
+
+def start_auth_server(port, token_expiry, connection, oauth_connection, socket_path=None, socket_mode=0o660):
 	"""
-	Start the authorization server on the given port.
+	Start the authorization server on the given port and, optionally, on a Unix domain socket.
 
 	:param port: The port on which the server listens.
-	:type port: int
+		If it is `None`, the server does not listen on TCP.
+	:type port: int or None
 	:param token_expiry: The time taken for an access token delivered by the authorization server to expire.
 	:type token_expiry: int
 	:param connection: The database connection to use.
 	:type connection: :class:`connection.connection.Connection`
 	:param oauth_connection: The database connection to use for OAuth.
 	:type oauth_connection: :class:`connection.connection.Connection`
+	:param socket_path: The path of the Unix domain socket on which the server listens.
+		If it is `None`, the server does not listen on a Unix domain socket.
+	:type socket_path: str or None
+	:param socket_mode: The permissions of the Unix domain socket.
+	:type socket_mode: int
 	"""
 
+	servers = []
+	background_stop = Event()
+	background_threads = []
 	try:
-		client_store = PostgresqlClientStore(oauth_connection)
-		client_store.add_client(client_id=oauth.client_id, client_secret=oauth.client_secret)
+		with startup.Step("create the OAuth stores"):
+			client_store = PostgresqlClientStore(oauth_connection)
+			client_store.add_client(client_id=oauth.client_id, client_secret=oauth.client_secret)
 
-		"""
-		Create a token store.
-		"""
-		token_store = PostgresqlAccessTokenStore(oauth_connection)
+			"""
+			Create a token store.
+			"""
+			token_store = PostgresqlAccessTokenStore(oauth_connection)
 
 		"""
 		Create the authentication and resource servers.
 		The resource server is given the access token store to validate requests.
 		The routes and their handler are also passed on as arguments.
+		The blockchain handler is the backend that is configured in the routes.
 		"""
-		blockchain_handler = ethereum.EthereumAPI(
-			blockchain.admin_host,
-			blockchain.admin_port,
-			blockchain.multiuser_host,
-			blockchain.multiuser_port,
-			connection,
-			"0x5d7be6ee249CaE84fDef611949AD829Ef3E07892"
-		)
+		with startup.Step("create the blockchain handler"):
+			blockchain_handler = routes.blockchain_handler_class.from_config(connection)
 
 		"""
-		Create a thread manager since some functionality uses threading.
-		This thread manager routinely checks for dead threads.
+		The route handlers are a set of classes that handle different requests.
 		"""
-		thread_list = []
-		thread_manager = ThreadManager(thread_list)
-		thread = Thread(target=thread_manager.run)
-		thread.start()
+		with startup.Step("create the route handlers"):
+			route_handlers = { handler_class: handler_class(connection, blockchain_handler)
+								for handler_class in routes.handler_classes }
+			route_handlers[routes.blockchain_handler_class] = blockchain_handler
 
 		"""
-		The route handlers are a set of classes that handle different requests.
+		Blockchain writes are queued in the database and performed by job workers.
+		The workers, the indexers and the consent anchorer run in this process only if the configuration allows it.
+		Otherwise, they should be started with `worker.py`, for example when the server runs in several processes.
 		"""
-		route_handlers = { handler_class: handler_class(connection, blockchain_handler, thread_list)
-							for handler_class in routes.handler_classes }
-		route_handlers[ethereum.EthereumAPI] = blockchain_handler
+		job_queue = JobQueue(connection)
+		if server_config.background_services:
+			with startup.Step("start the background services"):
+				background_threads = start_job_workers(connection, blockchain_handler, server_config.job_workers, background_stop)
+				background_threads += start_services(connection, blockchain_handler, background_stop)
+
+		"""
+		The admission controller rejects requests early when clients exceed their rate limits or when the server is overloaded.
+		Queued blockchain writes count as background work.
+		"""
+		admission_controller = AdmissionController(routes.rate_limits,
+			max_concurrent=server_config.max_concurrent_requests,
+			thread_count=lambda: job_queue.count(JobQueue.PENDING))
 
 		resource_provider = ResourceServer(
 			connection=connection,
 			access_token_store=token_store,
 			auth_code_store=PostgresqlAuthCodeStore(oauth_connection),
-			client_store=PostgresqlClientStore(oauth_connection),
+			client_store=client_store,
 			token_generator=Uuid4(),
 			routes=routes.routes,
-			route_handlers=route_handlers)
+			route_handlers=route_handlers,
+			metrics_scope=routes.admin_scope,
+			admission=admission_controller)
+
+		"""
+		Export the state of the server's resources in the metrics.
+		There is one database connection for the handlers and another one for OAuth.
+		Each connection is shared by the threads that serve requests, which take turns to use it.
+		"""
+		metrics.registry.gauge("biobank_db_connections_open", "Whether each database connection is open.",
+			lambda: { ("main", ): int(connection.is_open()), ("oauth", ): int(oauth_connection.is_open()) }, labels=("connection", ))
+		metrics.registry.gauge("biobank_db_statements_in_flight", "The number of statements being executed on, or waiting for, each database connection.",
+			lambda: { ("main", ): connection.in_flight(), ("oauth", ): oauth_connection.in_flight() }, labels=("connection", ))
+		metrics.registry.gauge("biobank_blockchain_jobs", "The number of queued blockchain writes, by status.",
+			lambda: { (status, ): job_queue.count(status) for status in [ JobQueue.PENDING, JobQueue.RUNNING, JobQueue.FAILED ] }, labels=("status", ))
+		metrics.registry.gauge("biobank_blockchain_pending_transactions", "The number of blockchain transactions that have been sent but not confirmed.",
+			blockchain_handler.pending_transactions)
+		metrics.registry.gauge("biobank_emails_unsent", "The number of email recipients who have not been sent their email yet.",
+			lambda: connection.count("""
+				SELECT
+					COUNT(*)
+				FROM
+					email_recipients
+				WHERE
+					sent = FALSE
+			"""))
 
 		"""
 		The authorization server gives out access tokens.
@@ -148,17 +222,72 @@ def start_auth_server(port, token_expiry, connection, oauth_connection):
 
 		app = OAuthApplication(resource_provider=resource_provider, authorization_server=authorization_server)
 
+		"""
+		Warm up the server before it starts listening, so that the first requests do not pay for cold connections and data.
+		"""
+		if server_config.warm_up:
+			def warm_up_database():
+				connection.select_one("SELECT 1")
+				oauth_connection.select_one("SELECT 1")
+
+			def warm_up_studies():
+				response = route_handlers[routes.study_handler_class].get_studies(number=-1)
+				if response.status_code != 200:
+					raise Exception(response.body)
+
+			with startup.Step("warm up"):
+				warmup.warm_up([
+					("database", warm_up_database),
+					("study catalog", warm_up_studies),
+					("OAuth clients", client_store.preload),
+					("blockchain node", blockchain_handler.warm_up),
+				])
+		else:
+			warmup.set_ready()
+
+		startup.report()
+
+		if socket_path is not None:
+			httpd = UnixOAuthServer(socket_path, OAuthRequestHandler, mode=socket_mode)
+			httpd.set_app(app)
+			servers.append(httpd)
+			print("Starting OAuth2 server on unix:%s..." % (socket_path))
+
 		if port is not None:
 			port = int(port)
-			httpd = make_server('', port, app, handler_class=OAuthRequestHandler)
-
+			httpd = make_server('', port, app, server_class=OAuthServer, handler_class=OAuthRequestHandler)
+			servers.append(httpd)
 			print("Starting OAuth2 server on http://localhost:%d/..." % (port))
-			httpd.serve_forever()
+
+		"""
+		The last server is served in this thread, and any other server in the background.
+		"""
+		if servers:
+			"""
+			Stop gracefully on SIGTERM, which is how the development server and most process managers stop the server.
+			"""
+			signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+			for httpd in servers[:-1]:
+				Thread(target=httpd.serve_forever, daemon=True).start()
+			servers[-1].serve_forever()
 		return app
-	except KeyboardInterrupt:
-		httpd.server_close()
+	except (KeyboardInterrupt, SystemExit):
+		signal.signal(signal.SIGTERM, signal.SIG_IGN)
+		signal.signal(signal.SIGINT, signal.SIG_IGN)
+		for httpd in servers:
+			httpd.server_close()
 
-def main(database, oauth_database, listen_port=None, single_card=None, token_expiry=oauth.token_expiry, dev=True):
+		"""
+		Let the job workers finish their current jobs, and stop the indexers and the consent anchorer.
+		Jobs that are interrupted are claimed again by another worker once their lease expires.
+		"""
+		background_stop.set()
+		for thread in background_threads:
+			thread.join(server_config.task_drain_timeout)
+
+def main(database, oauth_database, listen_port=None, single_card=None, token_expiry=oauth.token_expiry, dev=True,
+		 socket_path=server_config.socket_path, socket_mode=server_config.socket_mode):
 	"""
 	Establish a connection with PostgreSQL and start the server.
 
@@ -176,6 +305,10 @@ def main(database, oauth_database, listen_port=None, single_card=None, token_exp
 	:type token_expiry: int
 	:param dev: A boolean indicating whether the server is in development or not.
 	:type dev: bool
+	:param socket_path: The path of a Unix domain socket on which to serve the REST API, in addition to the port.
+	:type socket_path: str or None
+	:param socket_mode: The permissions of the Unix domain socket.
+	:type socket_mode: int
 
 	:return: The WSGI server application or None if it is not in development
 	:rtype: server.application.OAuthApplication or None
@@ -195,8 +328,9 @@ def main(database, oauth_database, listen_port=None, single_card=None, token_exp
 	Get the connection details from the .pgpass file.
 	Then, create connections to the server's database and to the OAuth 2.0 database.
 	"""
-	connection = routes.handler_connector.connect(database)
-	oauth_connection = routes.handler_connector.connect(oauth_database, cursor_factory=cursor)
+	with startup.Step("connect to the databases"):
+		connection = routes.handler_connector.connect(database)
+		oauth_connection = routes.handler_connector.connect(oauth_database, cursor_factory=cursor)
 
 	global pid
 	pid = os.getpid()
@@ -206,7 +340,7 @@ def main(database, oauth_database, listen_port=None, single_card=None, token_exp
 	"""
 
 	if dev:
-		auth_server = Process(target=start_auth_server, args=(listen_port, token_expiry, connection, oauth_connection))
+		auth_server = Process(target=start_auth_server, args=(listen_port, token_expiry, connection, oauth_connection, socket_path, socket_mode))
 		auth_server.start()
 
 		def sigint_handler(signal, frame):
@@ -217,26 +351,30 @@ def main(database, oauth_database, listen_port=None, single_card=None, token_exp
 
 		signal.signal(signal.SIGINT, sigint_handler)
 	else:
-		app = start_auth_server(listen_port, token_expiry, connection, oauth_connection)
+		app = start_auth_server(listen_port, token_expiry, connection, oauth_connection, socket_path, socket_mode)
 		return app
 
 if __name__ == "__main__":
 	args = setup_args()
-	port = args.port[0] if type(args.port) is not int else args.port
-	app = main(db.database, db.oauth_database, port, dev=True)
-
-	print("To test the REST API:")
-	print("curl --ipv4 -v POST \\")
-	print(f"\t-d 'grant_type=client_credentials&client_id={oauth.client_id}&client_secret={oauth.client_secret}' \\")
-	print("\t-d 'scope=create_participant create_researcher' \\")
-	print(f"\thttp://localhost:{port}/token")
-	print()
-	print("curl -I -X GET \\")
-	print("\t-h 'authorization: ACCESS_TOKEN' \\")
-	print(f"\thttp://localhost:{port}/ping")
-	print()
+	port = get_listen_port(args)
+	app = main(db.database, db.oauth_database, port, dev=True, socket_path=args.socket, socket_mode=args.socket_mode)
+
+	"""
+	The example requests use the TCP port, so they are only shown if the server listens on one.
+	"""
+	if port is not None:
+		print("To test the REST API:")
+		print("curl --ipv4 -v POST \\")
+		print(f"\t-d 'grant_type=client_credentials&client_id={oauth.client_id}&client_secret={oauth.client_secret}' \\")
+		print("\t-d 'scope=create_participant create_researcher' \\")
+		print(f"\thttp://localhost:{port}/token")
+		print()
+		print("curl -I -X GET \\")
+		print("\t-h 'authorization: ACCESS_TOKEN' \\")
+		print(f"\thttp://localhost:{port}/ping")
+		print()
 elif __name__.startswith('_mod_wsgi_'):
-	app = main(db.database, db.oauth_database, None, dev=False)
+	app = main(db.database, db.oauth_database, None, dev=False, socket_path=None)
 
 def application(env, start_response):
 	global app
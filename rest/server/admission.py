@@ -0,0 +1,279 @@
+"""
+Admission control decides early whether a request should be served.
+Requests are rejected before any work is done if their client or user has exceeded its rate limit, or if the server is overloaded.
+In this way, overload degrades gracefully instead of piling up threads.
+"""
+
+import math
+import threading
+import time
+
+from .exceptions import request_exceptions
+
+class TokenBucket(object):
+	"""
+	A token bucket allows a steady rate of requests, with bursts up to the bucket's capacity.
+	Each request takes one token, and tokens are refilled at a constant rate.
+
+	:ivar _rate: The number of tokens added every second.
+	:vartype _rate: float
+	:ivar _capacity: The maximum number of tokens that the bucket can hold.
+	:vartype _capacity: float
+	:ivar _tokens: The number of tokens in the bucket at the time of the last update.
+	:vartype _tokens: float
+	:ivar _updated: The time of the last update, from :func:`time.monotonic`.
+	:vartype _updated: float
+	"""
+
+	def __init__(self, rate, capacity, now=None):
+		"""
+		Create a full bucket.
+
+		:param rate: The number of tokens added every second.
+		:type rate: float
+		:param capacity: The maximum number of tokens that the bucket can hold.
+		:type capacity: float
+		:param now: The current time, from :func:`time.monotonic`.
+			Tokens are taken at this time or later, so the bucket must not be created later than it.
+		:type now: float or None
+		"""
+
+		self._rate = float(rate)
+		self._capacity = float(capacity)
+		self._tokens = float(capacity)
+		self._updated = time.monotonic() if now is None else now
+
+	def take(self, now=None):
+		"""
+		Take a token from the bucket if there is one.
+		This function is not thread-safe, so the caller should hold a lock.
+
+		:param now: The current time, from :func:`time.monotonic`.
+		:type now: float or None
+
+		:return: 0 if a token was taken, or the number of seconds until a token becomes available otherwise.
+		:rtype: float
+		"""
+
+		now = time.monotonic() if now is None else now
+		self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+		self._updated = now
+
+		if self._tokens >= 1:
+			self._tokens -= 1
+			return 0
+
+		return (1 - self._tokens) / self._rate if self._rate > 0 else float("inf")
+
+	def give_back(self):
+		"""
+		Return a token that was taken, for example because the request was rejected by another bucket.
+		"""
+
+		self._tokens = min(self._capacity, self._tokens + 1)
+
+	def is_full(self, now=None):
+		"""
+		Check whether the bucket has refilled completely, in which case it behaves like a new bucket.
+
+		:param now: The current time, from :func:`time.monotonic`.
+		:type now: float or None
+
+		:return: A boolean indicating whether the bucket is full.
+		:rtype: bool
+		"""
+
+		now = time.monotonic() if now is None else now
+		return self._tokens + (now - self._updated) * self._rate >= self._capacity
+
+class AdmissionController(object):
+	"""
+	The admission controller applies rate limits per client and per user, separately for each class of routes.
+	It also caps the number of requests that are served concurrently.
+
+	The limits are given per route class as follows:
+
+	.. code-block:: python
+
+	   {
+	   	"blockchain_write": {
+	   		"user": { "rate": 0.2, "burst": 3 },
+	   		"client": { "rate": 2, "burst": 20 },
+	   		"max_threads": 50,
+	   	}
+	   }
+
+	The `rate` is the number of requests per second that are allowed on average, and the `burst` is the number of requests that can be made at once.
+	User limits apply to access tokens that belong to a user, whereas client limits apply to all the requests of an OAuth client.
+	If `max_threads` is given, requests of that class are shed while the number of pending background tasks is at least that number.
+	Any limit that is not given is not applied.
+
+	:cvar prune_size: The number of buckets above which full buckets are discarded.
+	:vartype prune_size: int
+	:cvar count_interval: The time, in seconds, for which the number of pending background tasks is remembered.
+		Counting the tasks may query the database, so it is not done for every request.
+	:vartype count_interval: float
+
+	:ivar _limits: The limits of each route class.
+	:vartype _limits: dict
+	:ivar _max_concurrent: The maximum number of requests that can be served concurrently, or `None` if there is no limit.
+	:vartype _max_concurrent: int or None
+	:ivar _thread_count: A function that returns the number of pending background tasks.
+	:vartype _thread_count: function or None
+	:ivar _counted: The number of pending background tasks when they were last counted.
+	:vartype _counted: int
+	:ivar _counted_at: The time when the pending background tasks were last counted, from :func:`time.monotonic`.
+	:vartype _counted_at: float
+	:ivar _buckets: The token buckets, with the route class, the kind of limit and the client or user ID as keys.
+	:vartype _buckets: dict
+	:ivar _active: The number of requests that are being served.
+	:vartype _active: int
+	:ivar _lock: The lock that protects the buckets and the number of active requests.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	prune_size = 10000
+	count_interval = 1
+
+	def __init__(self, limits, max_concurrent=None, thread_count=None):
+		"""
+		Create the admission controller.
+
+		:param limits: The limits of each route class.
+		:type limits: dict
+		:param max_concurrent: The maximum number of requests that can be served concurrently.
+			If it is `None`, there is no limit.
+		:type max_concurrent: int or None
+		:param thread_count: A function that returns the number of pending background tasks.
+			It is needed to shed load based on the `max_threads` limits.
+		:type thread_count: function or None
+		"""
+
+		self._limits = limits or {}
+		self._max_concurrent = max_concurrent
+		self._thread_count = thread_count
+		self._counted = 0
+		self._counted_at = float("-inf")
+		self._buckets = {}
+		self._active = 0
+		self._lock = threading.Lock()
+
+	def enter(self):
+		"""
+		Start serving a request, unless too many requests are already being served.
+		Every successful call must be followed by a call to :func:`~server.admission.AdmissionController.leave`.
+
+		:raises: :class:`server.exceptions.request_exceptions.ServiceUnavailableException`
+		"""
+
+		with self._lock:
+			if self._max_concurrent is not None and self._active >= self._max_concurrent:
+				raise request_exceptions.ServiceUnavailableException(1, "Too many concurrent requests")
+			self._active += 1
+
+	def leave(self):
+		"""
+		Stop serving a request.
+		"""
+
+		with self._lock:
+			self._active -= 1
+
+	def admit(self, route_class, client_id=None, user_id=None):
+		"""
+		Check whether a request of the given route class can be served.
+		A request takes a token from both its client's and its user's bucket.
+		If either is empty, the request is rejected and no token is taken.
+
+		:param route_class: The class of the route.
+		:type route_class: str
+		:param client_id: The ID of the OAuth client that made the request.
+		:type client_id: str or None
+		:param user_id: The ID of the user to whom the access token belongs.
+		:type user_id: str or None
+
+		:raises: :class:`server.exceptions.request_exceptions.ServiceUnavailableException`
+		:raises: :class:`server.exceptions.request_exceptions.TooManyRequestsException`
+		"""
+
+		limits = self._limits.get(route_class, {})
+		now = time.monotonic()
+
+		"""
+		Shed the request if the background work that it would add is already backed up.
+		"""
+		max_threads = limits.get("max_threads")
+		if max_threads is not None and self._thread_count is not None and self._pending_threads(now) >= max_threads:
+			raise request_exceptions.ServiceUnavailableException(5, "The server is busy, try again later")
+
+		with self._lock:
+			buckets = []
+			for kind, identifier in [ ("client", client_id), ("user", user_id) ]:
+				if kind in limits and identifier is not None:
+					buckets.append(self._get_bucket((route_class, kind, identifier), limits[kind], now))
+
+			"""
+			Take tokens only if all buckets have one, so that rejected requests do not use up the other limits.
+			"""
+			waits = [ bucket.take(now) for bucket in buckets ]
+			if any(waits):
+				for bucket, wait in zip(buckets, waits):
+					if not wait:
+						bucket.give_back()
+				raise request_exceptions.TooManyRequestsException(max(waits))
+
+	def _pending_threads(self, now):
+		"""
+		Get the number of pending background tasks, counting them again only if they were last counted more than :attr:`count_interval` seconds ago.
+		The lock is not held while counting, so concurrent requests may count the tasks at the same time.
+
+		:param now: The current time, from :func:`time.monotonic`.
+		:type now: float
+
+		:return: The number of pending background tasks.
+		:rtype: int
+		"""
+
+		if now - self._counted_at >= self.count_interval:
+			self._counted = self._thread_count()
+			self._counted_at = now
+		return self._counted
+
+	def _get_bucket(self, key, limit, now):
+		"""
+		Get the bucket with the given key, creating it if need be.
+		When there are many buckets, those that are full are discarded, since they behave like new buckets.
+		This function should be called while holding the lock.
+
+		:param key: The bucket's key.
+		:type key: tuple
+		:param limit: The bucket's `rate` and `burst`.
+		:type limit: dict
+		:param now: The current time, from :func:`time.monotonic`.
+		:type now: float
+
+		:return: The bucket.
+		:rtype: :class:`server.admission.TokenBucket`
+		"""
+
+		if key not in self._buckets:
+			if len(self._buckets) >= self.prune_size:
+				self._buckets = { bucket_key: bucket for bucket_key, bucket in self._buckets.items() if not bucket.is_full(now) }
+			self._buckets[key] = TokenBucket(limit["rate"], limit.get("burst", max(1, limit["rate"])), now)
+
+		return self._buckets[key]
+
+def retry_after(seconds):
+	"""
+	Format a delay for the `Retry-After` header, which accepts only whole seconds.
+
+	:param seconds: The delay in seconds.
+	:type seconds: float
+
+	:return: The delay, rounded up to a whole number of seconds, at least 1.
+	:rtype: str
+	"""
+
+	if math.isinf(seconds):
+		return "3600"
+	return str(max(1, int(math.ceil(seconds))))
@@ -3,8 +3,14 @@ A custom application to handle requests.
 The application adds status codes that are not included by default.
 """
 
+import traceback
+
 from oauth2.web.wsgi import Application, Request
 
+from . import metrics, timing
+
+from config import server as server_config
+
 class OAuthApplication(Application):
 	"""
 	The application that handles incoming requests.
@@ -38,7 +44,10 @@ class OAuthApplication(Application):
 		self.HTTP_CODES.update({
 			403: "403 Forbidden",
 			405: "405 Method Not Allowed",
+			413: "413 Request Entity Too Large",
+			429: "429 Too Many Requests",
 			500: "500 Internal Server Error",
+			503: "503 Service Unavailable",
 		})
 
 	def __call__(self, env, start_response):
@@ -50,7 +59,8 @@ class OAuthApplication(Application):
 		:param start_response: The handler that starts building the response.
 		:type start_response: function
 		:return: A list containing the response body, encoded using UTF-8.
-		:rtype: list
+			If the handler gave a generator as the body, the chunks are encoded and streamed one at a time instead.
+		:rtype: list or generator
 		"""
 
 		environ = {}
@@ -64,16 +74,106 @@ class OAuthApplication(Application):
 		If the request needs a token or some form of authorization, send the request to the authorization server.
 		Otherwise, the resource provider handles the request.
 		"""
+		timer = timing.start()
 		request = self.request_class(env)
 		if env.get("PATH_INFO") in [self.authorize_uri, self.token_uri]:
 			response = self.authorization_server.dispatch(request, environ)
 		else:
 			response = self.provider.handle_request(request, env)
 
+		with timing.Phase("encode"):
+			if type(response.body) is bytes:
+				body = [response.body]
+			elif type(response.body) is str:
+				body = [response.body.encode('utf-8')]
+			else:
+				body = None
+
+		"""
+		The timings of streamed bodies can only include the time taken before streaming starts.
+		"""
+		response.add_header("Server-Timing", timer.header())
+
+		"""
+		Bodies that are sent at once are given a length, so that the connection can be kept open without sending the body in chunks.
+		"""
+		if body is not None and "Content-Length" not in response.headers:
+			response.add_header("Content-Length", str(len(body[0])))
 		start_response(self.HTTP_CODES[response.status_code],
 					   list(response.headers.items()))
 
-		if type(response.body) is not bytes:
-			return [response.body.encode('utf-8')]
+		if body is not None:
+			self._finish(timer, env, response.status_code)
+			return body
 		else:
-			return [response.body]
+			return self._stream(response.body, timer, env, response.status_code)
+
+	def _stream(self, body, timer, env, status_code):
+		"""
+		Encode the chunks of a streamed body one at a time.
+
+		:param body: The body, given as an iterable of chunks.
+		:type body: iterable of str or bytes
+		:param timer: The request's timer, which is stopped once the body has been streamed.
+		:type timer: :class:`server.timing.RequestTimer`
+		:param env: The request environment.
+		:type env: dict
+		:param status_code: The response's status code.
+		:type status_code: int
+
+		:return: A generator of chunks, encoded using UTF-8.
+		:rtype: generator
+		"""
+
+		try:
+			chunks = iter(body)
+			while True:
+				"""
+				The chunks are generated lazily, so generating them is part of encoding the body.
+				"""
+				with timing.Phase("encode"):
+					chunk = next(chunks, None)
+					if chunk is not None and type(chunk) is not bytes:
+						chunk = chunk.encode('utf-8')
+
+				if chunk is None:
+					break
+				yield chunk
+		finally:
+			"""
+			If the client disconnects, close the body so that any open cursor is released.
+			"""
+			if hasattr(body, "close"):
+				body.close()
+			self._finish(timer, env, status_code)
+
+	def _finish(self, timer, env, status_code):
+		"""
+		Stop timing the request, record it in the metrics and log it if it was slow.
+
+		:param timer: The request's timer.
+		:type timer: :class:`server.timing.RequestTimer`
+		:param env: The request environment.
+		:type env: dict
+		:param status_code: The response's status code.
+		:type status_code: int
+		"""
+
+		timer.finish()
+		if timing.current() is timer:
+			timing.bind(None)
+
+		"""
+		Update the request metrics.
+		"""
+		path, method = env.get("PATH_INFO"), env.get("REQUEST_METHOD")
+		route = path if path in [self.authorize_uri, self.token_uri] else self.provider.get_route_label(path)
+		label = metrics.method_label(method)
+		metrics.requests_total.inc(route=route, method=label, status=status_code)
+		metrics.request_duration.observe(timer.total(), route=route, method=label)
+
+		try:
+			timing.log_slow_request(timer, method, path, status_code,
+									server_config.slow_request_threshold, server_config.slow_request_log)
+		except OSError:
+			traceback.print_exc()
@@ -42,3 +42,43 @@ class MethodNotAllowedException(Exception):
 
 	def __init__(self, message="Method not allowed"):
 		super(MethodNotAllowedException, self).__init__(message)
+
+class MalformedBodyException(Exception):
+	"""
+	An exception that indicates that the request body could not be parsed.
+	"""
+
+	def __init__(self, message="Malformed request body"):
+		super(MalformedBodyException, self).__init__(message)
+
+class RequestEntityTooLargeException(Exception):
+	"""
+	An exception that indicates that the request body is larger than the server accepts.
+	"""
+
+	def __init__(self, message="Request entity too large"):
+		super(RequestEntityTooLargeException, self).__init__(message)
+
+class TooManyRequestsException(Exception):
+	"""
+	An exception that indicates that the client or user has exceeded its rate limit.
+
+	:ivar retry_after: The number of seconds after which the request may be retried.
+	:vartype retry_after: float
+	"""
+
+	def __init__(self, retry_after, message="Too many requests"):
+		super(TooManyRequestsException, self).__init__(message)
+		self.retry_after = retry_after
+
+class ServiceUnavailableException(Exception):
+	"""
+	An exception that indicates that the server is too busy to serve the request.
+
+	:ivar retry_after: The number of seconds after which the request may be retried.
+	:vartype retry_after: float
+	"""
+
+	def __init__(self, retry_after, message="Service unavailable"):
+		super(ServiceUnavailableException, self).__init__(message)
+		self.retry_after = retry_after
@@ -0,0 +1,412 @@
+"""
+Metrics about the REST API, exported in the `Prometheus text format <https://prometheus.io/docs/instrumenting/exposition_formats/>`_.
+Counters and histograms are updated as requests are served.
+Gauges are read from callbacks whenever the metrics are exported.
+"""
+
+import threading
+import traceback
+
+class Metric(object):
+	"""
+	The base class of all metrics.
+	Every metric has a name, a description and, optionally, a list of label names.
+
+	:cvar type: The Prometheus type of the metric.
+	:vartype type: str
+
+	:ivar name: The metric's name.
+	:vartype name: str
+	:ivar description: The metric's description.
+	:vartype description: str
+	:ivar labels: The names of the metric's labels.
+	:vartype labels: tuple of str
+	:ivar _lock: The lock that protects the metric's values.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	type = "untyped"
+
+	def __init__(self, name, description, labels=()):
+		"""
+		Create the metric.
+
+		:param name: The metric's name.
+		:type name: str
+		:param description: The metric's description.
+		:type description: str
+		:param labels: The names of the metric's labels.
+		:type labels: tuple of str
+		"""
+
+		self.name = name
+		self.description = description
+		self.labels = tuple(labels)
+		self._lock = threading.Lock()
+
+	def render(self):
+		"""
+		Export the metric.
+
+		:return: The lines that describe the metric and its samples.
+		:rtype: list of str
+		"""
+
+		lines = [
+			"# HELP %s %s" % (self.name, self.description.replace("\\", "\\\\").replace("\n", "\\n")),
+			"# TYPE %s %s" % (self.name, self.type),
+		]
+		lines.extend(self._samples())
+		return lines
+
+	def _samples(self):
+		"""
+		Export the metric's samples.
+
+		:return: The lines with the metric's samples.
+		:rtype: list of str
+		"""
+
+		return []
+
+	def _key(self, labels):
+		"""
+		Get the values of the metric's labels, in order.
+
+		:param labels: The labels, with the label names as keys.
+		:type labels: dict
+
+		:return: The label values.
+		:rtype: tuple of str
+		"""
+
+		return tuple(str(labels.get(label, "")) for label in self.labels)
+
+	def _format(self, name, key, value, extra=None):
+		"""
+		Format a sample.
+
+		:param name: The sample's name, which may have a suffix after the metric's name.
+		:type name: str
+		:param key: The values of the metric's labels.
+		:type key: tuple of str
+		:param value: The sample's value.
+		:type value: int or float
+		:param extra: Any additional label, such as a histogram's bucket.
+		:type extra: tuple or None
+
+		:return: The formatted sample.
+		:rtype: str
+		"""
+
+		pairs = list(zip(self.labels, key))
+		if extra is not None:
+			pairs.append(extra)
+
+		if pairs:
+			labels = ",".join("%s=\"%s\"" % (label, label_value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+							  for label, label_value in pairs)
+			return "%s{%s} %s" % (name, labels, _number(value))
+		return "%s %s" % (name, _number(value))
+
+class Counter(Metric):
+	"""
+	A counter is a value that only increases, such as the number of served requests.
+
+	:ivar _values: The counter's value for each combination of label values.
+	:vartype _values: dict
+	"""
+
+	type = "counter"
+
+	def __init__(self, *args, **kwargs):
+		"""
+		Create the counter.
+		The arguments are those of :class:`server.metrics.Metric`.
+		"""
+
+		super(Counter, self).__init__(*args, **kwargs)
+		self._values = {}
+
+	def inc(self, value=1, **labels):
+		"""
+		Increment the counter.
+
+		:param value: The amount by which to increment the counter.
+		:type value: int or float
+		:param labels: The values of the metric's labels.
+		:type labels: dict
+		"""
+
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + value
+
+	def _samples(self):
+		"""
+		Export the counter's values.
+
+		:return: The lines with the counter's values.
+		:rtype: list of str
+		"""
+
+		with self._lock:
+			values = sorted(self._values.items())
+		return [ self._format(self.name, key, value) for key, value in values ]
+
+class Histogram(Metric):
+	"""
+	A histogram counts observations, such as request durations, in cumulative buckets.
+
+	:cvar default_buckets: The default upper bounds of the buckets.
+	:vartype default_buckets: tuple of float
+
+	:ivar _buckets: The upper bounds of the buckets, in ascending order.
+	:vartype _buckets: tuple of float
+	:ivar _values: The bucket counts, the sum and the count of observations for each combination of label values.
+	:vartype _values: dict
+	"""
+
+	type = "histogram"
+	default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+	def __init__(self, name, description, labels=(), buckets=None):
+		"""
+		Create the histogram.
+
+		:param name: The histogram's name.
+		:type name: str
+		:param description: The histogram's description.
+		:type description: str
+		:param labels: The names of the histogram's labels.
+		:type labels: tuple of str
+		:param buckets: The upper bounds of the buckets.
+			If they are not given, the default buckets are used.
+		:type buckets: tuple of float or None
+		"""
+
+		super(Histogram, self).__init__(name, description, labels)
+		self._buckets = tuple(sorted(buckets or self.default_buckets))
+		self._values = {}
+
+	def observe(self, value, **labels):
+		"""
+		Record an observation.
+
+		:param value: The observed value.
+		:type value: int or float
+		:param labels: The values of the metric's labels.
+		:type labels: dict
+		"""
+
+		key = self._key(labels)
+		with self._lock:
+			counts, total, count = self._values.get(key, ([ 0 ] * len(self._buckets), 0, 0))
+			counts = [ bucket_count + (1 if value <= bound else 0) for bucket_count, bound in zip(counts, self._buckets) ]
+			self._values[key] = (counts, total + value, count + 1)
+
+	def _samples(self):
+		"""
+		Export the histogram's buckets, sum and count.
+
+		:return: The lines with the histogram's samples.
+		:rtype: list of str
+		"""
+
+		with self._lock:
+			values = sorted(self._values.items())
+
+		lines = []
+		for key, (counts, total, count) in values:
+			for bound, bucket_count in zip(self._buckets, counts):
+				lines.append(self._format(self.name + "_bucket", key, bucket_count, ("le", _number(bound))))
+			lines.append(self._format(self.name + "_bucket", key, count, ("le", "+Inf")))
+			lines.append(self._format(self.name + "_sum", key, total))
+			lines.append(self._format(self.name + "_count", key, count))
+		return lines
+
+class Gauge(Metric):
+	"""
+	A gauge is a value that can go up or down, such as the number of running threads.
+	Its value is read from a callback whenever the metrics are exported.
+
+	:ivar _callback: The function that returns the gauge's value.
+		If the gauge has labels, the function returns a dictionary.
+		Its keys are tuples of label values and its values are the gauge's values.
+	:vartype _callback: function
+	"""
+
+	type = "gauge"
+
+	def __init__(self, name, description, callback, labels=()):
+		"""
+		Create the gauge.
+
+		:param name: The gauge's name.
+		:type name: str
+		:param description: The gauge's description.
+		:type description: str
+		:param callback: The function that returns the gauge's value.
+		:type callback: function
+		:param labels: The names of the gauge's labels.
+		:type labels: tuple of str
+		"""
+
+		super(Gauge, self).__init__(name, description, labels)
+		self._callback = callback
+
+	def _samples(self):
+		"""
+		Read the gauge's value.
+		If the callback fails, the gauge has no samples.
+
+		:return: The lines with the gauge's values.
+		:rtype: list of str
+		"""
+
+		try:
+			value = self._callback()
+		except Exception:
+			traceback.print_exc()
+			return []
+
+		if self.labels:
+			return [ self._format(self.name, tuple(str(label) for label in key), value) for key, value in sorted(value.items()) ]
+		return [ self._format(self.name, (), value) ]
+
+class Registry(object):
+	"""
+	The registry keeps all the metrics and exports them together.
+
+	:ivar _metrics: The metrics, with their names as keys.
+	:vartype _metrics: dict
+	:ivar _lock: The lock that protects the list of metrics.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	def __init__(self):
+		"""
+		Create an empty registry.
+		"""
+
+		self._metrics = {}
+		self._lock = threading.Lock()
+
+	def register(self, metric):
+		"""
+		Add a metric to the registry.
+		If a metric with the same name is already registered, it is replaced.
+
+		:param metric: The metric to add.
+		:type metric: :class:`server.metrics.Metric`
+
+		:return: The added metric.
+		:rtype: :class:`server.metrics.Metric`
+		"""
+
+		with self._lock:
+			self._metrics[metric.name] = metric
+		return metric
+
+	def counter(self, name, description, labels=()):
+		"""
+		Create and register a counter.
+
+		:return: The new counter.
+		:rtype: :class:`server.metrics.Counter`
+		"""
+
+		return self.register(Counter(name, description, labels))
+
+	def histogram(self, name, description, labels=(), buckets=None):
+		"""
+		Create and register a histogram.
+
+		:return: The new histogram.
+		:rtype: :class:`server.metrics.Histogram`
+		"""
+
+		return self.register(Histogram(name, description, labels, buckets))
+
+	def gauge(self, name, description, callback, labels=()):
+		"""
+		Create and register a gauge.
+
+		:return: The new gauge.
+		:rtype: :class:`server.metrics.Gauge`
+		"""
+
+		return self.register(Gauge(name, description, callback, labels))
+
+	def render(self):
+		"""
+		Export all the metrics.
+
+		:return: The metrics in the Prometheus text format.
+		:rtype: str
+		"""
+
+		with self._lock:
+			metrics = list(self._metrics.values())
+
+		lines = []
+		for metric in metrics:
+			lines.extend(metric.render())
+		return "\n".join(lines) + "\n"
+
+def _number(value):
+	"""
+	Format a number for export.
+
+	:param value: The number, which may also be a string that is already formatted.
+	:type value: int or float or str
+
+	:return: The formatted number.
+	:rtype: str
+	"""
+
+	if type(value) is str:
+		return value
+	return repr(value) if type(value) is float else str(int(value))
+
+def method_label(method):
+	"""
+	Get the label of a request's method, used to group requests in the metrics.
+	Clients can send any method, so unknown methods share the same label, so that they do not create a new group each.
+
+	:param method: The request's method.
+	:type method: str or None
+
+	:return: The method if it is a standard HTTP method, or `other` otherwise.
+	:rtype: str
+	"""
+
+	return method if method in methods else "other"
+
+methods = [ "GET", "HEAD", "POST", "PUT", "DELETE", "CONNECT", "OPTIONS", "TRACE", "PATCH" ]
+"""
+The HTTP methods that are used as labels in the request metrics.
+"""
+
+registry = Registry()
+"""
+The registry that is exported by the `/metrics` route.
+"""
+
+requests_total = registry.counter("biobank_requests_total", "The number of requests served, by route, method and status code.",
+								  labels=("route", "method", "status"))
+"""
+The number of requests that have been served.
+"""
+
+request_duration = registry.histogram("biobank_request_duration_seconds", "The time taken to serve requests, by route and method.",
+									  labels=("route", "method"))
+"""
+The time taken to serve requests.
+"""
+
+blockchain_reads_coalesced = registry.counter("biobank_blockchain_reads_coalesced_total", "The number of blockchain reads that shared an identical read in flight, by function.",
+											  labels=("function", ))
+"""
+The number of blockchain reads that did not reach the node because an identical read was in flight.
+"""
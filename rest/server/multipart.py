@@ -0,0 +1,287 @@
+"""
+A streaming parser for `multipart/form-data` request bodies.
+The body is read in chunks, so it is never held in memory as a whole.
+Parts that grow beyond a threshold are spilled to temporary files.
+"""
+
+import io
+import re
+import tempfile
+
+from .exceptions import request_exceptions
+
+class MultipartParser(object):
+	"""
+	The multipart parser reads a `multipart/form-data` body from a stream and splits it into its parts.
+	Small parts are returned as `bytes`, like before.
+	Large parts are returned as temporary files, positioned at the start of their content.
+
+	:cvar max_header_size: The maximum size, in bytes, of the headers of a single part.
+	:vartype max_header_size: int
+
+	:ivar _stream: The stream from which to read the body, normally `wsgi.input`.
+	:vartype _stream: file
+	:ivar _remaining: The number of bytes of the body that have not been read yet.
+	:vartype _remaining: int
+	:ivar _boundary: The boundary that separates the parts, without the leading dashes.
+	:vartype _boundary: bytes
+	:ivar _spill_threshold: The size, in bytes, above which a part is written to a temporary file.
+	:vartype _spill_threshold: int
+	:ivar _chunk_size: The number of bytes to read from the stream at a time.
+	:vartype _chunk_size: int
+	"""
+
+	max_header_size = 16 * 1024
+
+	def __init__(self, stream, content_type, content_length, spill_threshold=1024 * 1024, chunk_size=64 * 1024):
+		"""
+		Create the parser.
+
+		:param stream: The stream from which to read the body, normally `wsgi.input`.
+		:type stream: file
+		:param content_type: The request's content type, which includes the boundary.
+		:type content_type: str
+		:param content_length: The size of the body, in bytes.
+		:type content_length: int
+		:param spill_threshold: The size, in bytes, above which a part is written to a temporary file.
+		:type spill_threshold: int
+		:param chunk_size: The number of bytes to read from the stream at a time.
+		:type chunk_size: int
+
+		:raises: :class:`server.exceptions.request_exceptions.MalformedBodyException`
+		"""
+
+		boundary = re.search("boundary=(\"?)([^\";]+)\\1", content_type)
+		if boundary is None:
+			raise request_exceptions.MalformedBodyException("Missing multipart boundary")
+
+		self._stream = stream
+		self._remaining = content_length
+		self._boundary = boundary.group(2).encode()
+		self._spill_threshold = spill_threshold
+		self._chunk_size = chunk_size
+
+	def parse(self):
+		"""
+		Read the body and split it into its parts.
+
+		:return: The parts of the body, with the part names as keys.
+			The values are `bytes` for small parts and temporary files for large parts.
+		:rtype: dict
+
+		:raises: :class:`server.exceptions.request_exceptions.MalformedBodyException`
+		"""
+
+		parts = {}
+		name_pattern = re.compile(b"name=\"(.+?)\"")
+
+		"""
+		The first delimiter is not preceded by a line break.
+		Any preamble before it is discarded.
+		"""
+		buffer = self._read_until(b"", b"--" + self._boundary)
+		delimiter = b"\r\n--" + self._boundary
+
+		while True:
+			"""
+			A delimiter followed by two dashes closes the body.
+			Otherwise, the delimiter is followed by a line break and the part's headers.
+			"""
+			buffer = self._fill(buffer, 2)
+			if buffer.startswith(b"--"):
+				break
+			if not buffer.startswith(b"\r\n"):
+				raise request_exceptions.MalformedBodyException("Malformed multipart delimiter")
+			buffer = buffer[2:]
+
+			headers, buffer = self._read_headers(buffer)
+			disposition = headers.get(b"content-disposition", b"")
+			names = name_pattern.findall(disposition)
+			if not names:
+				raise request_exceptions.MalformedBodyException("Multipart part without a name")
+
+			part = _Part(self._spill_threshold)
+			buffer = self._read_until(buffer, delimiter, sink=part)
+			parts[names[0].decode()] = part.value()
+
+		"""
+		Consume the epilogue so that the stream is left at the end of the body.
+		"""
+		while self._read():
+			pass
+
+		return parts
+
+	def _read(self):
+		"""
+		Read the next chunk of the body.
+
+		:return: The next chunk, which is empty when the body has been read completely.
+		:rtype: bytes
+		"""
+
+		if self._remaining <= 0:
+			return b""
+
+		chunk = self._stream.read(min(self._chunk_size, self._remaining))
+		self._remaining -= len(chunk)
+		if not chunk:
+			self._remaining = 0
+		return chunk
+
+	def _fill(self, buffer, size):
+		"""
+		Read from the stream until the buffer has at least the given number of bytes.
+
+		:param buffer: The bytes that have been read but not consumed yet.
+		:type buffer: bytes
+		:param size: The minimum number of bytes that the buffer should have.
+		:type size: int
+
+		:return: The filled buffer.
+		:rtype: bytes
+
+		:raises: :class:`server.exceptions.request_exceptions.MalformedBodyException`
+		"""
+
+		while len(buffer) < size:
+			chunk = self._read()
+			if not chunk:
+				raise request_exceptions.MalformedBodyException("Unexpected end of multipart body")
+			buffer += chunk
+		return buffer
+
+	def _read_headers(self, buffer):
+		"""
+		Read the headers of a part.
+
+		:param buffer: The bytes that have been read but not consumed yet.
+		:type buffer: bytes
+
+		:return: A tuple with the headers, keyed by their lower-case names, and the rest of the buffer.
+		:rtype: tuple
+
+		:raises: :class:`server.exceptions.request_exceptions.MalformedBodyException`
+		"""
+
+		header_end = buffer.find(b"\r\n\r\n")
+		while header_end < 0:
+			if len(buffer) > self.max_header_size:
+				raise request_exceptions.MalformedBodyException("Multipart headers are too large")
+			buffer = self._fill(buffer, len(buffer) + 1)
+			header_end = buffer.find(b"\r\n\r\n")
+
+		"""
+		The headers may also have arrived in one chunk, which is larger than the limit.
+		"""
+		if header_end > self.max_header_size:
+			raise request_exceptions.MalformedBodyException("Multipart headers are too large")
+
+		headers = {}
+		for line in buffer[:header_end].split(b"\r\n"):
+			if b":" in line:
+				key, value = line.split(b":", 1)
+				headers[key.strip().lower()] = value.strip()
+
+		return headers, buffer[header_end + 4:]
+
+	def _read_until(self, buffer, delimiter, sink=None):
+		"""
+		Read from the stream until the given delimiter is found.
+		The bytes before the delimiter are written to the sink, if one is given, or discarded otherwise.
+		Only the tail of the buffer that could hold a partial delimiter is kept in memory.
+
+		:param buffer: The bytes that have been read but not consumed yet.
+		:type buffer: bytes
+		:param delimiter: The delimiter to look for.
+		:type delimiter: bytes
+		:param sink: The part to which the bytes before the delimiter are written.
+		:type sink: :class:`server.multipart._Part` or None
+
+		:return: The buffer that follows the delimiter.
+		:rtype: bytes
+
+		:raises: :class:`server.exceptions.request_exceptions.MalformedBodyException`
+		"""
+
+		while True:
+			index = buffer.find(delimiter)
+			if index >= 0:
+				if sink is not None:
+					sink.write(buffer[:index])
+				return buffer[index + len(delimiter):]
+
+			"""
+			The delimiter may be split across two chunks.
+			Therefore the last few bytes are kept until the next chunk arrives.
+			"""
+			safe = max(len(buffer) - len(delimiter) + 1, 0)
+			if sink is not None:
+				sink.write(buffer[:safe])
+			buffer = buffer[safe:]
+
+			chunk = self._read()
+			if not chunk:
+				raise request_exceptions.MalformedBodyException("Unexpected end of multipart body")
+			buffer += chunk
+
+class _Part(object):
+	"""
+	The content of a single part.
+	The content is kept in memory until it exceeds the spill threshold.
+	Then, it is moved to a temporary file.
+
+	:ivar _threshold: The size, in bytes, above which the content is written to a temporary file.
+	:vartype _threshold: int
+	:ivar _memory: The content, while it is kept in memory.
+	:vartype _memory: :class:`io.BytesIO`
+	:ivar _file: The temporary file, once the content has been spilled.
+	:vartype _file: file or None
+	"""
+
+	def __init__(self, threshold):
+		"""
+		Create an empty part.
+
+		:param threshold: The size, in bytes, above which the content is written to a temporary file.
+		:type threshold: int
+		"""
+
+		self._threshold = threshold
+		self._memory = io.BytesIO()
+		self._file = None
+
+	def write(self, data):
+		"""
+		Append the given data to the part.
+
+		:param data: The data to append.
+		:type data: bytes
+		"""
+
+		if not data:
+			return
+
+		if self._file is None and self._memory.tell() + len(data) > self._threshold:
+			self._file = tempfile.TemporaryFile()
+			self._file.write(self._memory.getvalue())
+			self._memory = None
+
+		if self._file is None:
+			self._memory.write(data)
+		else:
+			self._file.write(data)
+
+	def value(self):
+		"""
+		Get the part's content.
+
+		:return: The content as `bytes` if it is small, or the temporary file, rewound, if it was spilled.
+		:rtype: bytes or file
+		"""
+
+		if self._file is None:
+			return self._memory.getvalue()
+
+		self._file.seek(0)
+		return self._file
@@ -5,11 +5,10 @@ More information, including status codes: https://www.oauth.com/oauth2-servers/t
 
 import json
 import os
-import re
 import sys
 import traceback
 
-from requests_toolbelt.multipart import decoder
+from concurrent.futures import ThreadPoolExecutor
 
 path = sys.path[0]
 path = os.path.join(path, "../")
@@ -23,8 +22,12 @@ from oauth2.web import Response
 from urllib import parse
 
 from .exceptions import request_exceptions
+from .multipart import MultipartParser
+from . import admission, metrics, timing
 from biobank.handlers.handler import PostgreSQLRouteHandler
 
+from config import server as server_config
+
 class ResourceServer(Provider):
 	"""
 	The resource server receives requests from an application and services them.
@@ -36,10 +39,18 @@ class ResourceServer(Provider):
 	:vartype _routes: dict of dicts
 	:ivar _route_handlers: The objects that are used to handle requests for different routes.
 	:vartype _route_handlers: dict
+	:ivar _batch_uri: The path that accepts batches of requests.
+	:vartype _batch_uri: str
+	:ivar _metrics_uri: The path that exports the server's metrics.
+	:vartype _metrics_uri: str
+	:ivar _metrics_scope: The scope that access tokens need to read the metrics.
+	:vartype _metrics_scope: str
+	:ivar _admission: The admission controller that rejects requests early when clients exceed their limits or the server is overloaded.
+	:vartype _admission: :class:`server.admission.AdmissionController` or None
 	"""
 
 	def __init__(self, connection, access_token_store, auth_code_store, client_store, token_generator,
-		routes, route_handlers):
+		routes, route_handlers, batch_uri="/batch", metrics_uri="/metrics", metrics_scope="admin", admission=None):
 		"""
 		Create the resource server based on :class:`oauth2.Provider`.
 		The first arguments should be the :class:`oauth2.Provider`'s.
@@ -67,12 +78,19 @@ class ResourceServer(Provider):
 		Each route also has a list of scopes that restrict access to protected resources.
 		Moreover, to protect against erroneous requests, the method is linked with the API endpoint as well.
 
+		The optional `rate_limit` attribute is the class of the route, whose limits are applied by the admission controller.
+		By default, GET routes are in the `read` class, and other routes are in the `write` class.
+
 		The `self_only` attribute is optional.
 		When set to `True`, it restricts users to access only their own data.
 		To ensure that the user is accessing their own data, the access token owner is checked with the username in question.
 
 		The provided route handler contains the functions that handle each route.
 
+		Several requests can also be sent together to the batch path.
+		Then, they share the same access token and round trip.
+		The server's metrics are exported on the metrics path.
+
 		:param _connection: The connector that is used to access the data store.
 		:type _connection: :class:`connection.connection.Connection`
 		:param access_token_store: Store for all access tokens.
@@ -87,6 +105,16 @@ class ResourceServer(Provider):
 		:type routes: dict of dicts
 		:param route_handlers: The objects that are used to handle requests for different routes.
 		:type route_handlers: dict
+		:param batch_uri: The path that accepts batches of requests.
+		:type batch_uri: str
+		:param metrics_uri: The path that exports the server's metrics.
+		:type metrics_uri: str
+		:param metrics_scope: The scope that access tokens need to read the metrics.
+			Requests from the local host do not need an access token if the configuration allows it.
+		:type metrics_scope: str
+		:param admission: The admission controller that rejects requests early when clients exceed their limits or the server is overloaded.
+			If it is not given, all requests are admitted.
+		:type admission: :class:`server.admission.AdmissionController` or None
 		"""
 
 		super(ResourceServer, self).__init__(access_token_store, auth_code_store, client_store, token_generator)
@@ -94,6 +122,10 @@ class ResourceServer(Provider):
 		self._connector = connection
 		self._routes = routes
 		self._route_handlers = route_handlers
+		self._batch_uri = batch_uri
+		self._metrics_uri = metrics_uri
+		self._metrics_scope = metrics_scope
+		self._admission = admission
 
 	def handle_request(self, request, env):
 		"""
@@ -112,85 +144,430 @@ class ResourceServer(Provider):
 		"""
 
 		path, method = env.get("PATH_INFO"), env.get("REQUEST_METHOD").upper()
-		resource = self._routes.get(path, {}) # Get the route
-		route = resource.get(method, {}) # Get the actual route handler according to the method
+		if path == self._batch_uri and method == "POST":
+			return self._handle_batch(request, env)
+		elif path == self._metrics_uri and method == "GET":
+			return self._handle_metrics(request, env)
 
-		api_handler = route.get("handler", list(self._route_handlers.keys())[0])
-		api_function = route.get("function", api_handler._404_page_not_found) # If the route function is not found, return a 404 error
-		api_scopes = list(route.get("scopes", [])) # Get the scopes, or permissions, that are requirerd by the API endpoint
-		api_method = list(route.get("method", [])) # Get the type of method that is expected by the API endpoint
-		api_self_only = route.get("self_only", False) # Check whether the call allows users access only to their own data
-		required_parameters = route.get("parameters", [])
+		route = self._routes.get(path, {}).get(method, {}) # Get the actual route handler according to the method
 
 		response = Response()
+		parameters = {}
+		admitted = False
 		try:
-			access_token = request.header("Authorization")
-			token = self.access_token_store.fetch_by_token(access_token) # Fetch the token
+			admitted = self._enter()
+
+			with timing.Phase("auth"):
+				access_token = request.header("Authorization")
+				token = self.access_token_store.fetch_by_token(access_token) # Fetch the token
+
+				api_scopes = list(route.get("scopes", [])) # Get the scopes, or permissions, that are requirerd by the API endpoint
+				if not self._is_authorized(token, api_scopes):
+					raise request_exceptions.InsufficientScopeException(" ".join([ scope for scope in token.scopes if scope not in api_scopes ]))
 
-			if not self._is_authorized(token, api_scopes):
-				raise request_exceptions.InsufficientScopeException(" ".join([ scope for scope in token.scopes if scope not in api_scopes ]))
+				self._admit(route, method, token)
 
 			"""
 			If the request is authorized, check that the method is supported.
 			"""
-			if method == "GET":
-				parameters = self._get_get_parameters(env, request)
-			elif method in ["POST", "DELETE", "PUT"]:
-				parameters = self._get_post_parameters(env, request)
-			else:
-				response.status_code = 405
-				response.add_header("Allow", "POST, GET")
+			with timing.Phase("parameters"):
+				if method == "GET":
+					parameters = self._get_get_parameters(env, request)
+				elif method in ["POST", "DELETE", "PUT"]:
+					parameters = self._get_post_parameters(env, request)
+				else:
+					response.status_code = 405
+					response.add_header("Allow", "POST, GET")
+					return response
+
+			with timing.Phase("handler"):
+				return self._dispatch(route, token, access_token, parameters)
+		except Exception as e:
+			return self._error_response(e, route)
+		finally:
+			"""
+			Large multipart parts are spilled to temporary files, which are removed once closed.
+			"""
+			for value in parameters.values():
+				if hasattr(value, "close"):
+					value.close()
+
+			if admitted:
+				self._admission.leave()
+
+	def get_route_label(self, path):
+		"""
+		Get the label of the route that serves the given path, used to group requests in the metrics.
+		Unknown paths share the same label, so that they do not create a new group each.
+
+		:param path: The request's path.
+		:type path: str
+
+		:return: The path if it is served by the resource server, or `other` otherwise.
+		:rtype: str
+		"""
+
+		if path in self._routes or path in [ self._batch_uri, self._metrics_uri ]:
+			return path
+		return "other"
+
+	def _handle_metrics(self, request, env):
+		"""
+		Export the server's metrics in the Prometheus text format.
+		Requests need an access token with the metrics scope.
+		If the configuration allows it, requests from the local host are served without one.
+		This should be left off if a reverse proxy on the same host forwards requests from other hosts.
+
+		:param request: The original request. This includes the headers.
+		:type request: :class:`oauth2.web.wsgi.Request`
+		:param env: The request environment.
+		:type env: dict
+
+		:return: A response with the metrics.
+		:rtype: :class:`oauth2.web.Response`
+		"""
+
+		try:
+			local = env.get("REMOTE_ADDR") in [ "127.0.0.1", "::1", "localhost" ]
+			if not (server_config.metrics_local_access and local):
+				with timing.Phase("auth"):
+					token = self.access_token_store.fetch_by_token(request.header("Authorization")) # Fetch the token
+					if not self._is_authorized(token, [ self._metrics_scope ]):
+						raise request_exceptions.InsufficientScopeException(self._metrics_scope)
+
+			with timing.Phase("handler"):
+				response = Response()
+				response.status_code = 200
+				response.add_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+				response.body = metrics.registry.render()
 				return response
+		except Exception as e:
+			return self._error_response(e, { "method": [ "GET" ] })
 
-			if api_self_only and not self._is_personal(access_token, parameters):
-				"""
-				Ensure that the user is trying to access their own data if the route has this safety measure.
-				"""
-				raise request_exceptions.UnauthorizedDataAccessException()
+	def _enter(self):
+		"""
+		Start serving a request if the server is not serving too many requests already.
 
-			if len(route) == 0:
-				"""
-				Ensure that the request was made using the correct method.
-				"""
-				raise request_exceptions.MethodNotAllowedException()
+		:return: A boolean indicating whether the request was counted by the admission controller.
+			If it was, the admission controller should be told when the request has been served.
+		:rtype: bool
 
-			missing_parameters = self._has_required_parameters(parameters, required_parameters)
-			if len(missing_parameters):
-				"""
-				Ensure that the request has all the required parameters.
-				"""
-				raise request_exceptions.MissingArgumentException("Missing arguments: %s" % ', '.join(missing_parameters))
+		:raises: :class:`server.exceptions.request_exceptions.ServiceUnavailableException`
+		"""
+
+		if self._admission is None:
+			return False
+
+		self._admission.enter()
+		return True
+
+	def _admit(self, route, method, token):
+		"""
+		Check that the request's client and user have not exceeded the limits of the route's class.
+
+		:param route: The route that handles the request, as described in the constructor.
+		:type route: dict
+		:param method: The request's method.
+		:type method: str
+		:param token: The access token that was fetched for the request.
+		:type token: :class:`oauth2.datatype.AccessToken`
+
+		:raises: :class:`server.exceptions.request_exceptions.ServiceUnavailableException`
+		:raises: :class:`server.exceptions.request_exceptions.TooManyRequestsException`
+		"""
+
+		if self._admission is not None:
+			route_class = route.get("rate_limit", "read" if method == "GET" else "write")
+			self._admission.admit(route_class, client_id=token.client_id, user_id=token.user_id)
+
+	def _dispatch(self, route, token, access_token, parameters):
+		"""
+		Pass on an authorized request to the function that handles its route.
+		Before doing so, the request is validated against the route.
+
+		:param route: The route that handles the request, as described in the constructor.
+		:type route: dict
+		:param token: The access token that was fetched for the request.
+		:type token: :class:`oauth2.datatype.AccessToken`
+		:param access_token: The supplied access token.
+		:type access_token: str
+		:param parameters: The parameters of the request.
+		:type parameters: dict
+
+		:return: The handler's response.
+		:rtype: :class:`oauth2.web.Response`
+
+		:raises: :class:`server.exceptions.request_exceptions.UnauthorizedDataAccessException`
+		:raises: :class:`server.exceptions.request_exceptions.MethodNotAllowedException`
+		:raises: :class:`server.exceptions.request_exceptions.MissingArgumentException`
+		"""
+
+		api_handler = route.get("handler", list(self._route_handlers.keys())[0])
+		api_function = route.get("function", api_handler._404_page_not_found) # If the route function is not found, return a 404 error
+		api_self_only = route.get("self_only", False) # Check whether the call allows users access only to their own data
+		required_parameters = route.get("parameters", [])
+
+		if api_self_only and not self._is_personal(access_token, parameters):
+			"""
+			Ensure that the user is trying to access their own data if the route has this safety measure.
+			"""
+			raise request_exceptions.UnauthorizedDataAccessException()
 
+		if len(route) == 0:
 			"""
-			Pass on all parameters - even those that are not required - to the handler function.
+			Ensure that the request was made using the correct method.
 			"""
-			return api_function(self._route_handlers[api_handler], token=token, **parameters)
-		except request_exceptions.MissingArgumentException as e:
+			raise request_exceptions.MethodNotAllowedException()
+
+		missing_parameters = self._has_required_parameters(parameters, required_parameters)
+		if len(missing_parameters):
+			"""
+			Ensure that the request has all the required parameters.
+			"""
+			raise request_exceptions.MissingArgumentException("Missing arguments: %s" % ', '.join(missing_parameters))
+
+		"""
+		Pass on all parameters - even those that are not required - to the handler function.
+		"""
+		return api_function(self._route_handlers[api_handler], token=token, **parameters)
+
+	def _error_response(self, e, route):
+		"""
+		Create the response for an exception that was raised while handling a request.
+		This function should be called while handling the exception.
+
+		:param e: The exception that was raised.
+		:type e: :class:`Exception`
+		:param route: The route that was being handled, as described in the constructor.
+		:type route: dict
+
+		:return: A response with the error.
+		:rtype: :class:`oauth2.web.Response`
+		"""
+
+		response = Response()
+		if isinstance(e, (request_exceptions.MalformedBodyException,
+						  request_exceptions.MissingArgumentException)):
 			response.status_code = 400
 			response.add_header("Content-Type", "application/json")
 			response.body = json.dumps({ "error": str(e), "exception": e.__class__.__name__ })
-			return response
-		except (request_exceptions.InvalidTokenException,
-				request_exceptions.UnauthorizedDataAccessException,
-				error.AccessTokenNotFound) as e:
+		elif isinstance(e, (request_exceptions.InvalidTokenException,
+							request_exceptions.UnauthorizedDataAccessException,
+							error.AccessTokenNotFound)):
 			response.status_code = 401
 			response.add_header("WWW-Authenticate", "Bearer realm=\"biobank\"")
 			response.body = json.dumps({ "error": str(e), "exception": e.__class__.__name__ })
-			return response
-		except request_exceptions.InsufficientScopeException as e:
+		elif isinstance(e, request_exceptions.InsufficientScopeException):
 			response.status_code = 403
 			response.add_header("WWW-Authenticate", ", ".join(["Bearer realm=\"biobank\"", "scope=\"%s\"" % str(e), "error=insufficient_scope"]))
-			return response
-		except request_exceptions.MethodNotAllowedException as e:
+		elif isinstance(e, request_exceptions.MethodNotAllowedException):
 			response.status_code = 405
-			response.add_header("Allow", ', '.join(api_method))
-			return response
-		except Exception as e:
+			response.add_header("Allow", ', '.join(list(route.get("method", [])))) # Get the type of method that is expected by the API endpoint
+		elif isinstance(e, request_exceptions.RequestEntityTooLargeException):
+			response.status_code = 413
+			response.add_header("Content-Type", "application/json")
+			response.body = json.dumps({ "error": str(e), "exception": e.__class__.__name__ })
+		elif isinstance(e, (request_exceptions.TooManyRequestsException,
+							request_exceptions.ServiceUnavailableException)):
+			response.status_code = 429 if isinstance(e, request_exceptions.TooManyRequestsException) else 503
+			response.add_header("Retry-After", admission.retry_after(e.retry_after))
+			response.add_header("Content-Type", "application/json")
+			response.body = json.dumps({ "error": str(e), "exception": e.__class__.__name__ })
+		else:
 			response.status_code = 500
 			response.add_header("Content-Type", "application/json")
 			response.body = json.dumps({ "error": "Internal Server Error: %s" % str(e), "exception": e.__class__.__name__ })
 			traceback.print_exc()
+		return response
+
+	def _handle_batch(self, request, env):
+		"""
+		Handle a batch of requests that has been received in one POST request.
+		The access token is fetched only once and used to authorize each request in the batch.
+
+		The body is a JSON array of requests, each of the form:
+
+		.. code-block:: python
+
+		   {
+		   	"method": "GET",
+		   	"path": "/has_consent",
+		   	"parameters": { "study_id": "8", "address": "0x..." }
+		   }
+
+		Consecutive GET requests do not depend on each other, so they are handled concurrently.
+		Any other request is handled on its own, in order, so it sees the effects of the requests before it.
+
+		:param request: The original request. This includes the headers.
+		:type request: :class:`oauth2.web.wsgi.Request`
+		:param env: The request environment.
+		:type env: dict
+
+		:return: A response whose data is a list of responses, in the same order as the requests.
+			Each response has a `status`, its `headers` and its `body`, decoded if it is JSON.
+		:rtype: :class:`oauth2.web.Response`
+		"""
+
+		admitted = False
+		try:
+			admitted = self._enter()
+
+			with timing.Phase("auth"):
+				access_token = request.header("Authorization")
+				token = self.access_token_store.fetch_by_token(access_token) # Fetch the token
+
+			with timing.Phase("parameters"):
+				batch = self._get_batch_requests(env)
+
+			"""
+			Group consecutive GET requests so that each group can be handled concurrently.
+			"""
+			groups = []
+			for sub_request in batch:
+				if sub_request["method"] == "GET" and groups and groups[-1][0]["method"] == "GET":
+					groups[-1].append(sub_request)
+				else:
+					groups.append([ sub_request ])
+
+			responses = []
+			timer = timing.current()
+			with ThreadPoolExecutor(max_workers=server_config.batch_workers) as executor:
+				for group in groups:
+					responses.extend(executor.map(lambda sub_request: self._handle_sub_request(sub_request, token, access_token, timer), group))
+
+			response = Response()
+			response.status_code = 200
+			response.add_header("Content-Type", "application/json")
+			response.body = json.dumps({ "data": responses })
 			return response
+		except Exception as e:
+			return self._error_response(e, { "method": [ "POST" ] })
+		finally:
+			if admitted:
+				self._admission.leave()
+
+	def _handle_sub_request(self, sub_request, token, access_token, timer=None):
+		"""
+		Handle a single request from a batch.
+		The request is authorized and validated like any other request.
+		Since it is handled in a different thread, the batch's timer is given explicitly.
+		The timings of concurrent requests overlap, so their sum may exceed the time taken by the batch.
+
+		:param sub_request: The request, with its `method`, `path` and `parameters`.
+		:type sub_request: dict
+		:param token: The access token that was fetched for the batch.
+		:type token: :class:`oauth2.datatype.AccessToken`
+		:param access_token: The supplied access token.
+		:type access_token: str
+		:param timer: The batch's timer.
+		:type timer: :class:`server.timing.RequestTimer` or None
+
+		:return: The response, with its `status`, `headers` and `body`.
+		:rtype: dict
+		"""
+
+		timing.bind(timer)
+		route = self._routes.get(sub_request["path"], {}).get(sub_request["method"], {})
+		try:
+			try:
+				api_scopes = list(route.get("scopes", []))
+				if not self._is_authorized(token, api_scopes):
+					raise request_exceptions.InsufficientScopeException(" ".join([ scope for scope in token.scopes if scope not in api_scopes ]))
+
+				self._admit(route, sub_request["method"], token)
+
+				with timing.Phase("handler"):
+					response = self._dispatch(route, token, access_token, dict(sub_request["parameters"]))
+
+				"""
+				Streamed bodies are collected since they are returned as part of the batch's body.
+				A body that fails while it is collected, or that is not valid JSON, fails only this request, since the requests before it may have changed data already.
+				"""
+				with timing.Phase("encode"):
+					body = self._collect_body(response)
+			except Exception as e:
+				response = self._error_response(e, route)
+				body = self._collect_body(response)
+
+			return { "status": response.status_code, "headers": dict(response.headers), "body": body }
+		finally:
+			timing.bind(None)
+
+	def _collect_body(self, response):
+		"""
+		Collect the body of a response from a batch, decoding it if it is JSON.
+
+		:param response: The response.
+		:type response: :class:`oauth2.web.Response`
+
+		:return: The response's body.
+		:rtype: object
+
+		:raises: :class:`ValueError`
+		"""
+
+		body = response.body
+		if type(body) not in [ str, bytes ]:
+			body = ''.join(chunk.decode() if type(chunk) is bytes else chunk for chunk in body)
+		body = body.decode() if type(body) is bytes else body
+
+		if response.headers.get("Content-Type") == "application/json" and body:
+			body = json.loads(body)
+		return body
+
+	def _get_batch_requests(self, env):
+		"""
+		Extract the requests from the body of a batch request.
+
+		:param env: The request environment.
+		:type env: dict
+
+		:return: The list of requests, each with an upper-case `method`, a `path` and a dictionary of `parameters`.
+		:rtype: list of dict
+
+		:raises: :class:`server.exceptions.request_exceptions.RequestEntityTooLargeException`
+		:raises: :class:`server.exceptions.request_exceptions.MalformedBodyException`
+		"""
+
+		try:
+			request_body_size = int(env.get('CONTENT_LENGTH', 0))
+		except (ValueError):
+			request_body_size = 0
+
+		if request_body_size > server_config.max_body_size:
+			raise request_exceptions.RequestEntityTooLargeException("The request body cannot exceed %d bytes" % server_config.max_body_size)
+
+		try:
+			batch = json.loads(env['wsgi.input'].read(request_body_size).decode())
+		except ValueError:
+			raise request_exceptions.MalformedBodyException("A batch must be a JSON array of requests")
+
+		if type(batch) is not list:
+			raise request_exceptions.MalformedBodyException("A batch must be a JSON array of requests")
+
+		if len(batch) > server_config.max_batch_size:
+			raise request_exceptions.MalformedBodyException("A batch cannot have more than %d requests" % server_config.max_batch_size)
+
+		requests = []
+		for sub_request in batch:
+			if type(sub_request) is not dict or "path" not in sub_request:
+				raise request_exceptions.MalformedBodyException("Each request in a batch must have a path")
+
+			parameters = sub_request.get("parameters", {})
+			if type(parameters) is not dict:
+				raise request_exceptions.MalformedBodyException("The parameters of a request in a batch must be an object")
+
+			path, method = sub_request["path"], sub_request.get("method", "GET")
+			if type(path) is not str or type(method) is not str:
+				raise request_exceptions.MalformedBodyException("The path and method of a request in a batch must be strings")
+
+			requests.append({
+				"method": method.upper(),
+				"path": path if path.startswith("/") else "/" + path,
+				"parameters": parameters,
+			})
+
+		return requests
 
 	def _get_get_parameters(self, env, request):
 		"""
@@ -218,28 +595,35 @@ class ResourceServer(Provider):
 		:type env: dict
 
 		:return: The parsed body - containing the parameters - of the POST request.
+			Multipart parts that exceed the spill threshold are given as temporary files instead of `bytes`.
 		:rtype: dict
+
+		:raises: :class:`server.exceptions.request_exceptions.RequestEntityTooLargeException`
 		"""
 		try:
 			request_body_size = int(env.get('CONTENT_LENGTH', 0))
 		except (ValueError):
 			request_body_size = 0
 
+		"""
+		Reject large bodies before reading them.
+		"""
+		if request_body_size > server_config.max_body_size:
+			raise request_exceptions.RequestEntityTooLargeException("The request body cannot exceed %d bytes" % server_config.max_body_size)
+
+		"""
+		Multipart bodies are parsed as a stream since they may carry files.
+		"""
+		if env.get("CONTENT_TYPE", "").startswith("multipart/form-data"):
+			parser = MultipartParser(env['wsgi.input'], env.get("CONTENT_TYPE", ""), request_body_size,
+									 spill_threshold=server_config.spill_threshold, chunk_size=server_config.chunk_size)
+			return parser.parse()
+
 		request_body = env['wsgi.input'].read(request_body_size)
 		request_body = request_body.decode() if type(request_body) is not bytes else request_body
 		if env.get('CONTENT_TYPE', "") == "application/json":
 			request_body = json.loads(request_body)
 			return dict(request_body)
-		elif env.get("CONTENT_TYPE", "").startswith("multipart/form-data"):
-			multipart_data = decoder.MultipartDecoder(request_body, env.get("CONTENT_TYPE", ""))
-
-			request_body = {}
-			name_pattern = re.compile(b"name=\"(.+?)\"")
-			for part in multipart_data.parts:
-				name = name_pattern.findall(part.headers.get(b"Content-Disposition"))[0].decode()
-				content = part.content
-				request_body[name] = content
-			return request_body
 		else:
 			request_body = parse.parse_qsl(request_body)
 			return dict(request_body)
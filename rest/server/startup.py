@@ -0,0 +1,227 @@
+"""
+Startup profiling reports how long the server takes to import each module and to complete each initialization step.
+It is enabled by the `--profile-startup` flag of `main.py`, and does nothing otherwise.
+"""
+
+import importlib.abc
+import sys
+import threading
+import time
+
+_enabled = False
+"""
+A boolean indicating whether startup is being profiled.
+"""
+
+_lock = threading.Lock()
+"""
+The lock that protects the recorded imports and steps.
+"""
+
+_local = threading.local()
+"""
+The thread-local stack of modules that are being imported, used to separate the time of a module from the time of the modules that it imports.
+"""
+
+_imports = []
+"""
+The imported modules, as tuples with the module's name, its own import time and its total import time, in seconds.
+"""
+
+_steps = []
+"""
+The initialization steps, as tuples with the step's name and its duration, in seconds.
+"""
+
+class _TimedLoader(importlib.abc.Loader):
+	"""
+	A loader that times the execution of a module.
+	All other calls are passed on to the module's original loader.
+
+	:ivar _loader: The module's original loader.
+	:vartype _loader: :class:`importlib.abc.Loader`
+	"""
+
+	def __init__(self, loader):
+		"""
+		Wrap the given loader.
+
+		:param loader: The module's original loader.
+		:type loader: :class:`importlib.abc.Loader`
+		"""
+
+		self._loader = loader
+
+	def create_module(self, spec):
+		"""
+		Create the module using the original loader.
+
+		:param spec: The module's specification.
+		:type spec: :class:`importlib.machinery.ModuleSpec`
+
+		:return: The new module, or `None` to use the default module creation.
+		:rtype: module or None
+		"""
+
+		return self._loader.create_module(spec)
+
+	def exec_module(self, module):
+		"""
+		Execute the module using the original loader, and record how long it takes.
+
+		:param module: The module to execute.
+		:type module: module
+		"""
+
+		stack = _local.__dict__.setdefault("stack", [])
+		frame = [ time.perf_counter(), 0. ]
+		stack.append(frame)
+		try:
+			self._loader.exec_module(module)
+		finally:
+			stack.pop()
+			elapsed = time.perf_counter() - frame[0]
+			if stack:
+				stack[-1][1] += elapsed
+			with _lock:
+				_imports.append((module.__name__, elapsed - frame[1], elapsed))
+
+	def __getattr__(self, name):
+		"""
+		Pass on any other attribute to the original loader, for example to read resources.
+
+		:param name: The attribute's name.
+		:type name: str
+
+		:return: The original loader's attribute.
+		:rtype: object
+		"""
+
+		return getattr(self._loader, name)
+
+class _ImportProfiler(importlib.abc.MetaPathFinder):
+	"""
+	A finder that finds modules using the other finders, and wraps their loaders in a :class:`server.startup._TimedLoader`.
+	"""
+
+	def find_spec(self, fullname, path, target=None):
+		"""
+		Find the module's specification using the other finders.
+
+		:param fullname: The module's full name.
+		:type fullname: str
+		:param path: The path of the module's parent package.
+		:type path: list of str or None
+		:param target: The module that is being reloaded, if any.
+		:type target: module or None
+
+		:return: The module's specification with a timed loader, or `None` if no finder can find the module.
+		:rtype: :class:`importlib.machinery.ModuleSpec` or None
+		"""
+
+		for finder in sys.meta_path:
+			if finder is self or not hasattr(finder, "find_spec"):
+				continue
+
+			spec = finder.find_spec(fullname, path, target)
+			if spec is not None:
+				if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+					spec.loader = _TimedLoader(spec.loader)
+				return spec
+
+		return None
+
+class Step(object):
+	"""
+	A block that records the duration of an initialization step when startup is being profiled.
+
+	.. code-block:: python
+
+	   with startup.Step("create the route handlers"):
+	   	route_handlers = create_route_handlers()
+
+	:ivar _name: The name of the step.
+	:vartype _name: str
+	:ivar _start: The time when the step started.
+	:vartype _start: float
+	"""
+
+	def __init__(self, name):
+		"""
+		Create the block.
+
+		:param name: The name of the step.
+		:type name: str
+		"""
+
+		self._name = name
+		self._start = 0.
+
+	def __enter__(self):
+		"""
+		Start the step.
+
+		:return: The block itself.
+		:rtype: :class:`server.startup.Step`
+		"""
+
+		self._start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		"""
+		Record the step's duration if startup is being profiled.
+		Exceptions are not suppressed.
+		"""
+
+		if _enabled:
+			with _lock:
+				_steps.append((self._name, time.perf_counter() - self._start))
+
+def enable():
+	"""
+	Start profiling startup.
+	Only the modules that are imported after this function is called are profiled.
+	"""
+
+	global _enabled
+	if not _enabled:
+		_enabled = True
+		sys.meta_path.insert(0, _ImportProfiler())
+
+def is_enabled():
+	"""
+	Check whether startup is being profiled.
+
+	:return: A boolean indicating whether startup is being profiled.
+	:rtype: bool
+	"""
+
+	return _enabled
+
+def report(limit=30):
+	"""
+	Print the startup profile.
+	The slowest modules are listed by the time that they took to import, including the modules that they imported.
+	The initialization steps are listed in the order in which they ran.
+
+	:param limit: The maximum number of modules to list.
+	:type limit: int
+	"""
+
+	if not _enabled:
+		return
+
+	with _lock:
+		imports = sorted(_imports, key=lambda module: module[2], reverse=True)
+		steps = list(_steps)
+
+	print("Startup profile")
+	print("Imports (%d modules, %.1f ms in total):" % (len(imports), sum(module[1] for module in imports) * 1000))
+	print("%10s %10s  %s" % ("self (ms)", "total (ms)", "module"))
+	for name, own, total in imports[:limit]:
+		print("%10.1f %10.1f  %s" % (own * 1000, total * 1000, name))
+
+	print("Initialization (%.1f ms in total):" % (sum(duration for _, duration in steps) * 1000))
+	for name, duration in steps:
+		print("%10.1f  %s" % (duration * 1000, name))
@@ -0,0 +1,325 @@
+"""
+Per-request timers that break down where the time of a request goes.
+The timer of the request that is being handled is kept per thread.
+In this way, the code that does the work, such as the database connection, does not need to be given the timer.
+"""
+
+from datetime import datetime
+
+import json
+import threading
+import time
+
+_local = threading.local()
+"""
+The thread-local storage of the current request's timer and of the stack of open phases.
+"""
+
+_log_lock = threading.Lock()
+"""
+The lock that serializes writes to the slow-request log.
+"""
+
+class RequestTimer(object):
+	"""
+	The request timer accumulates the time spent in each phase of a request.
+	Phases are timed using :class:`server.timing.Phase` blocks.
+
+	:cvar phases: The phases in which the time of a request is split, in the order in which they are reported.
+	:vartype phases: list of str
+
+	:ivar _start: The time when the request started, from :func:`time.perf_counter`.
+	:vartype _start: float
+	:ivar _end: The time when the request finished, or `None` if it is still being handled.
+	:vartype _end: float or None
+	:ivar _durations: The time, in seconds, spent in each phase.
+	:vartype _durations: dict
+	:ivar _counts: The number of times that each phase was entered.
+	:vartype _counts: dict
+	:ivar _queries: The queries that were executed, with their duration in milliseconds.
+	:vartype _queries: list of dict
+	:ivar _lock: The lock that protects the timer when it is shared by the threads handling a batch.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	phases = [ "auth", "parameters", "handler", "db", "blockchain", "crypto", "encode" ]
+
+	def __init__(self):
+		"""
+		Create the timer and start the clock.
+		"""
+
+		self._start = time.perf_counter()
+		self._end = None
+		self._durations = dict.fromkeys(self.phases, 0.)
+		self._counts = dict.fromkeys(self.phases, 0)
+		self._queries = []
+		self._lock = threading.Lock()
+
+	def add(self, phase, duration):
+		"""
+		Add time to the given phase.
+
+		:param phase: The name of the phase.
+		:type phase: str
+		:param duration: The time, in seconds, to add.
+		:type duration: float
+		"""
+
+		with self._lock:
+			self._durations[phase] = self._durations.get(phase, 0.) + duration
+			self._counts[phase] = self._counts.get(phase, 0) + 1
+
+	def add_query(self, query, duration):
+		"""
+		Record a query that was executed.
+
+		:param query: The query, with its whitespace collapsed when recorded.
+		:type query: str
+		:param duration: The time, in seconds, that the query took.
+		:type duration: float
+		"""
+
+		with self._lock:
+			self._queries.append({ "query": " ".join(str(query).split()), "duration": round(duration * 1000, 3) })
+
+	def finish(self):
+		"""
+		Stop the clock.
+		Calling this function again has no effect.
+		"""
+
+		if self._end is None:
+			self._end = time.perf_counter()
+
+	def total(self):
+		"""
+		Get the time taken by the request so far, or in total if it has finished.
+
+		:return: The time, in seconds, taken by the request.
+		:rtype: float
+		"""
+
+		return (self._end if self._end is not None else time.perf_counter()) - self._start
+
+	def header(self):
+		"""
+		Build the value of the `Server-Timing` header.
+		Only the phases that were entered are included, followed by the total time.
+
+		:return: The value of the `Server-Timing` header, with durations in milliseconds.
+		:rtype: str
+		"""
+
+		metrics = []
+		for phase, duration in self._durations.items():
+			if self._counts[phase]:
+				metric = "%s;dur=%.3f" % (phase, duration * 1000)
+				if phase == "db":
+					metric += ";desc=\"%d queries\"" % len(self._queries)
+				metrics.append(metric)
+		metrics.append("total;dur=%.3f" % (self.total() * 1000))
+		return ", ".join(metrics)
+
+	def summary(self):
+		"""
+		Summarize the timings.
+
+		:return: The total time and the time of each phase, in milliseconds, and the executed queries.
+		:rtype: dict
+		"""
+
+		return {
+			"total": round(self.total() * 1000, 3),
+			"phases": { phase: round(duration * 1000, 3) for phase, duration in self._durations.items() if self._counts[phase] },
+			"queries": list(self._queries),
+		}
+
+class Phase(object):
+	"""
+	A block that adds the time spent in it to a phase of the current request's timer.
+	Time spent in nested phases is only counted in the innermost one, so the phases add up to the request's time.
+	If no request is being timed in the current thread, the block is not timed.
+
+	.. code-block:: python
+
+	   with timing.Phase("blockchain"):
+	   	response = requests.get(endpoint)
+
+	:ivar _name: The name of the phase.
+	:vartype _name: str
+	:ivar _timer: The timer to which the time is added, or `None` if no request is being timed.
+	:vartype _timer: :class:`server.timing.RequestTimer` or None
+	:ivar _start: The time when the block was entered.
+	:vartype _start: float
+	:ivar _nested: The time spent in nested phases, which is not counted in this phase.
+	:vartype _nested: float
+	"""
+
+	def __init__(self, name):
+		"""
+		Create the block.
+
+		:param name: The name of the phase.
+		:type name: str
+		"""
+
+		self._name = name
+		self._timer = None
+		self._start = 0.
+		self._nested = 0.
+
+	def __enter__(self):
+		"""
+		Start timing the block.
+
+		:return: The block itself.
+		:rtype: :class:`server.timing.Phase`
+		"""
+
+		self._timer = current()
+		if self._timer is not None:
+			self._nested = 0.
+			self._start = time.perf_counter()
+			_local.stack.append(self)
+		return self
+
+	def __exit__(self, *args):
+		"""
+		Stop timing the block and add its time, excluding that of nested phases, to the timer.
+		Exceptions are not suppressed.
+		"""
+
+		if self._timer is not None:
+			elapsed = time.perf_counter() - self._start
+			_local.stack.pop()
+			self._timer.add(self._name, elapsed - self._nested)
+			self._elapsed(elapsed)
+			if _local.stack:
+				_local.stack[-1]._nested += elapsed
+
+	def _elapsed(self, elapsed):
+		"""
+		A hook that receives the total time spent in the block.
+		By default, it does nothing.
+
+		:param elapsed: The time, in seconds, spent in the block, including nested phases.
+		:type elapsed: float
+		"""
+
+		pass
+
+class Query(Phase):
+	"""
+	A block that times a database query.
+	The query is recorded along with its duration.
+
+	:ivar _query: The query that is being executed.
+	:vartype _query: str
+	"""
+
+	def __init__(self, query):
+		"""
+		Create the block.
+
+		:param query: The query that is being executed.
+		:type query: str
+		"""
+
+		super(Query, self).__init__("db")
+		self._query = query
+
+	def _elapsed(self, elapsed):
+		"""
+		Record the query with its duration.
+
+		:param elapsed: The time, in seconds, that the query took.
+		:type elapsed: float
+		"""
+
+		self._timer.add_query(self._query, elapsed)
+
+def timed(name):
+	"""
+	Create a decorator that times every call of a function as the given phase.
+
+	:param name: The name of the phase.
+	:type name: str
+
+	:return: The decorator.
+	:rtype: function
+	"""
+
+	def decorator(function):
+		def wrapper(*args, **kwargs):
+			with Phase(name):
+				return function(*args, **kwargs)
+		return wrapper
+	return decorator
+
+def start():
+	"""
+	Start timing a new request in the current thread.
+
+	:return: The new timer.
+	:rtype: :class:`server.timing.RequestTimer`
+	"""
+
+	timer = RequestTimer()
+	bind(timer)
+	return timer
+
+def bind(timer):
+	"""
+	Time the work in the current thread using the given timer.
+	This is used when a request is handled by more than one thread.
+
+	:param timer: The timer to use, or `None` to stop timing in this thread.
+	:type timer: :class:`server.timing.RequestTimer` or None
+	"""
+
+	_local.timer = timer
+	_local.stack = []
+
+def current():
+	"""
+	Get the timer of the request being handled in the current thread.
+
+	:return: The current timer, or `None` if no request is being timed.
+	:rtype: :class:`server.timing.RequestTimer` or None
+	"""
+
+	return getattr(_local, "timer", None)
+
+def log_slow_request(timer, method, path, status_code, threshold, log_file):
+	"""
+	Append the request to the slow-request log if it took longer than the threshold.
+	Each line in the log is a JSON object with the request, its timings and its queries.
+
+	:param timer: The request's timer, which should have finished.
+	:type timer: :class:`server.timing.RequestTimer`
+	:param method: The request's method.
+	:type method: str
+	:param path: The request's path.
+	:type path: str
+	:param status_code: The response's status code.
+	:type status_code: int
+	:param threshold: The time, in seconds, above which a request is slow.
+	:type threshold: float
+	:param log_file: The path to the slow-request log.
+		If it is empty, slow requests are not logged.
+	:type log_file: str or None
+
+	:return: A boolean indicating whether the request was logged.
+	:rtype: bool
+	"""
+
+	if not log_file or timer.total() < threshold:
+		return False
+
+	record = { "time": datetime.now().isoformat(), "method": method, "path": path, "status": status_code }
+	record.update(timer.summary())
+	with _log_lock:
+		with open(log_file, "a") as file:
+			file.write(json.dumps(record) + "\n")
+	return True
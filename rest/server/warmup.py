@@ -0,0 +1,77 @@
+"""
+The warm-up prepares the server for its first requests before it starts listening.
+Connections are opened and exercised, and the data that almost every request needs is loaded.
+In this way, the first requests after a restart are not slower than the rest.
+
+The outcome of the warm-up is reported by the `/ping` route.
+The route is public, so it only reports which steps succeeded; the reasons why steps failed are only logged.
+"""
+
+import threading
+import time
+import traceback
+
+_ready = threading.Event()
+"""
+The event that is set once the server is ready to serve requests.
+"""
+
+_results = {}
+"""
+The outcome of each warm-up step, with the steps' names as keys.
+"""
+
+def warm_up(steps):
+	"""
+	Run the warm-up steps in order, and then mark the server as ready.
+	A step that fails is reported, but it does not stop the warm-up, since the server can still serve the requests that do not depend on it.
+
+	:param steps: The warm-up steps, as tuples with the step's name and the function that performs it.
+	:type steps: list of tuple
+	"""
+
+	for name, function in steps:
+		start = time.perf_counter()
+		try:
+			function()
+			error = None
+		except Exception as e:
+			traceback.print_exc()
+			error = str(e)
+
+		duration = time.perf_counter() - start
+		_results[name] = { "duration": round(duration * 1000, 3), "success": error is None }
+		if error is None:
+			print("Warm-up: %s (%.1f ms)" % (name, duration * 1000))
+		else:
+			print("Warm-up: %s failed after %.1f ms: %s" % (name, duration * 1000, error))
+
+	set_ready()
+
+def set_ready():
+	"""
+	Mark the server as ready to serve requests.
+	"""
+
+	_ready.set()
+
+def is_ready():
+	"""
+	Check whether the server is ready to serve requests.
+
+	:return: A boolean indicating whether the server is ready.
+	:rtype: bool
+	"""
+
+	return _ready.is_set()
+
+def status():
+	"""
+	Get the server's readiness and the outcome of the warm-up.
+	The outcome of each step is its duration and whether it succeeded, without the error of steps that failed.
+
+	:return: A dictionary with the server's readiness and the outcome of each warm-up step.
+	:rtype: dict
+	"""
+
+	return { "ready": is_ready(), "warm_up": { name: dict(result) for name, result in _results.items() } }
@@ -7,7 +7,7 @@ cd "$parent_path" # go to the script path
 source ../variables.sh
 
 usage() {
-	echo -e "${HIGHLIGHT}Usage: sh $0 [-t <card|consent|email|general|study|user>]${DEFAULT}";
+	echo -e "${HIGHLIGHT}Usage: sh $0 [-t <card|consent|email|general|study|unit|user>]${DEFAULT}";
 }
 
 card_tests() {
@@ -35,6 +35,32 @@ study_tests() {
 	python3 -m unittest tests.test_study_management
 }
 
+unit_tests() {
+	echo -e "${HIGHLIGHT}Unit Tests${DEFAULT}"
+	python3 -m unittest \
+		tests.test_admission \
+		tests.test_batch \
+		tests.test_batched_reads \
+		tests.test_block_cache \
+		tests.test_confirmation_tracker \
+		tests.test_consent_anchoring \
+		tests.test_consent_mirror \
+		tests.test_fan_out \
+		tests.test_job_queue \
+		tests.test_keep_alive \
+		tests.test_metrics \
+		tests.test_multipart \
+		tests.test_nonce_manager \
+		tests.test_participant_cache \
+		tests.test_participant_index \
+		tests.test_session \
+		tests.test_single_flight \
+		tests.test_startup \
+		tests.test_streaming \
+		tests.test_token_store \
+		tests.test_unix_socket
+}
+
 user_tests() {
 	echo -e "${HIGHLIGHT}User Tests${DEFAULT}"
 	python3 -m unittest tests.test_user_management
@@ -58,6 +84,9 @@ then
 		study)
 			study_tests
 			;;
+		unit)
+			unit_tests
+			;;
 		user)
 			user_tests
 			;;
@@ -72,5 +101,6 @@ else
 	email_tests
 	general_tests
 	study_tests
+	unit_tests
 	user_tests
 fi
@@ -0,0 +1,451 @@
+"""
+Stand-ins for the blockchain, its node and the participant index, which the tests share.
+They keep their state in memory, so that the tests do not need a blockchain node.
+"""
+
+import hashlib
+
+from types import SimpleNamespace
+
+class AttributeDict(dict):
+	"""
+	A dictionary whose keys can also be read as attributes, like the blocks and receipts that web3.py returns.
+	"""
+
+	def __getattr__(self, name):
+		"""
+		Get the value of a key.
+
+		:param name: The key.
+		:type name: str
+
+		:return: The key's value.
+		:rtype: object
+
+		:raises: AttributeError
+		"""
+
+		try:
+			return self[name]
+		except KeyError:
+			raise AttributeError(name)
+
+class LocalNode(object):
+	"""
+	A stand-in for the Ethereum backend, its connection to the node and its contract, which keeps the chain's blocks in memory.
+	The node is its own connection, Ethereum API and contract, so that it can be given wherever any of them is expected.
+	Transactions encode the contract function that they call and its arguments in their input.
+
+	:ivar _w3: The connection to the node, which is the node itself.
+	:vartype _w3: :class:`tests.fixtures.LocalNode`
+	:ivar _contract: The contract, which is the node itself.
+	:vartype _contract: :class:`tests.fixtures.LocalNode`
+	:ivar eth: The node's Ethereum API, which is the node itself.
+	:vartype eth: :class:`tests.fixtures.LocalNode`
+	:ivar address: The address of the contract.
+	:vartype address: str
+	:ivar blocks: The blocks of the chain, starting with the genesis block.
+	:vartype blocks: list of :class:`tests.fixtures.AttributeDict`
+	:ivar receipts: The receipts of the transactions, with the hashes of the transactions as hexadecimal strings as keys.
+	:vartype receipts: dict
+	:ivar pool: The hashes of the transactions that were sent but not mined yet, as hexadecimal strings.
+	:vartype pool: set of str
+	:ivar failures: The number of times that the node should fail to return a block.
+	:vartype failures: int
+	"""
+
+	def __init__(self):
+		"""
+		Create the chain with only its genesis block.
+		"""
+
+		self._w3 = self
+		self._contract = self
+		self.eth = self
+		self.address = "0x%040d" % 1
+		self.blocks = []
+		self.receipts = {}
+		self.pool = set()
+		self.failures = 0
+		self.mine([])
+
+	@property
+	def blockNumber(self):
+		"""
+		Get the number of the latest block.
+
+		:return: The number of the latest block.
+		:rtype: int
+		"""
+
+		return len(self.blocks) - 1
+
+	def mine(self, calls, to=None, status=1, hashes=None):
+		"""
+		Mine a block with a transaction for each of the given contract calls.
+
+		:param calls: The calls, as tuples with the name of the function, the unique ID of the study and the participant's address.
+		:type calls: list of tuple
+		:param to: The address to which the transactions are sent, which is the contract by default.
+		:type to: str or None
+		:param status: The status of the transactions, which is 1 if they succeeded.
+		:type status: int
+		:param hashes: The hashes of the transactions, which are derived from the calls by default.
+		:type hashes: list of bytes or None
+
+		:return: The hashes of the transactions.
+		:rtype: list of bytes
+		"""
+
+		number = len(self.blocks)
+		transactions = []
+		for i, call in enumerate(calls):
+			tx_hash = hashes[i] if hashes is not None else hashlib.sha256(("%d:%d:%d:%s" % (len(self.receipts), number, i, ":".join(call))).encode("utf-8")).digest()
+			transactions.append(AttributeDict(hash=tx_hash, to=to or self.address, input=":".join(call), transactionIndex=i))
+			self.receipts[self._key(tx_hash)] = AttributeDict(status=status, blockNumber=number)
+			self.pool.discard(self._key(tx_hash))
+
+		block_hash = hashlib.sha256(("%d:%d" % (len(self.receipts), number)).encode("utf-8")).digest()
+		self.blocks.append(AttributeDict(hash=block_hash, timestamp=1600000000 + number, transactions=transactions))
+		return [ tx["hash"] for tx in transactions ]
+
+	def fork(self, number):
+		"""
+		Drop the blocks after the given block, so that new blocks replace them.
+
+		:param number: The number of the last block that remains part of the chain.
+		:type number: int
+		"""
+
+		self.blocks = self.blocks[:number + 1]
+
+	def get_block(self, number, full_transactions=False):
+		"""
+		Get a block of the chain.
+
+		:param number: The number of the block.
+		:type number: int
+		:param full_transactions: A boolean indicating whether the block's transactions are included, or only their hashes.
+		:type full_transactions: bool
+
+		:return: The block.
+		:rtype: :class:`tests.fixtures.AttributeDict`
+
+		:raises: ConnectionError
+		"""
+
+		if self.failures:
+			self.failures -= 1
+			raise ConnectionError("The Ethereum node is not reachable")
+
+		block = self.blocks[number]
+		if full_transactions:
+			return block
+		return AttributeDict(block, transactions=[ tx["hash"] for tx in block["transactions"] ])
+
+	def get_transaction(self, tx_hash):
+		"""
+		Get a transaction that was sent or mined.
+
+		:param tx_hash: The hash of the transaction.
+		:type tx_hash: bytes or str
+
+		:return: The transaction.
+		:rtype: :class:`tests.fixtures.AttributeDict`
+
+		:raises: ValueError
+		"""
+
+		key = self._key(tx_hash)
+		if key not in self.pool and key not in self.receipts:
+			raise ValueError("Transaction %s not found" % key)
+		return AttributeDict(hash=key)
+
+	def get_transaction_receipt(self, tx_hash):
+		"""
+		Get the receipt of a transaction.
+
+		:param tx_hash: The hash of the transaction.
+		:type tx_hash: bytes or str
+
+		:return: The receipt of the transaction.
+		:rtype: :class:`tests.fixtures.AttributeDict`
+
+		:raises: ValueError
+		"""
+
+		key = self._key(tx_hash)
+		if key not in self.receipts:
+			raise ValueError("Transaction %s not found" % key)
+		return self.receipts[key]
+
+	def decode_function_input(self, input):
+		"""
+		Decode the contract function that a transaction calls, and its arguments.
+
+		:param input: The input of the transaction.
+		:type input: str
+
+		:return: The function and its arguments.
+		:rtype: tuple
+
+		:raises: ValueError
+		"""
+
+		from biobank.handlers.blockchain.api.ethereum.consent_mirror import ConsentIndexer
+
+		name, study, participant = input.split(":")
+		if name not in ConsentIndexer.consent_functions:
+			raise ValueError("Unknown function %s" % name)
+		return SimpleNamespace(fn_name=name), { "study": study, "participant": participant }
+
+	def has_consented(self, study_id, address):
+		"""
+		Check whether the participant consents to the study, according to the successful transactions on the chain.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param address: The participant's address.
+		:type address: str
+
+		:return: A boolean indicating whether the participant consents to the study.
+		:rtype: bool
+		"""
+
+		from biobank.handlers.blockchain.api.ethereum.consent_mirror import ConsentIndexer
+
+		consent = False
+		for block in self.blocks:
+			for tx in block["transactions"]:
+				name, study, participant = tx["input"].split(":")
+				if (tx["to"] == self.address and self.get_transaction_receipt(tx["hash"])["status"] == 1 and
+					name in ConsentIndexer.consent_functions and (study, participant) == (study_id, address)):
+					consent = ConsentIndexer.consent_functions[name]
+		return consent
+
+	def _call_many(self, calls, exception):
+		"""
+		Call read-only functions of the contract.
+		Only `hasConsented` is supported.
+
+		:param calls: The calls, as tuples with the name of the function and its arguments.
+		:type calls: list of tuple
+		:param exception: The class of the exception to raise if a call fails.
+		:type exception: class
+
+		:return: The output of each call, in the same order as the calls.
+		:rtype: list of list
+		"""
+
+		return [ [ self.has_consented(*arguments) ] for _, arguments in calls ]
+
+	def _key(self, tx_hash):
+		"""
+		Get the key of a transaction's receipt, so that hashes given as bytes or as hexadecimal strings are the same.
+
+		:param tx_hash: The hash of the transaction.
+		:type tx_hash: bytes or str
+
+		:return: The hash as a lowercase hexadecimal string.
+		:rtype: str
+		"""
+
+		return "0x" + tx_hash.hex() if isinstance(tx_hash, bytes) else tx_hash.lower()
+
+class LocalContract(object):
+	"""
+	A stand-in for the deployed contract, which encodes a call as the function's name and its arguments.
+
+	:cvar outputs: The types of the outputs of each function, with the functions' names as keys.
+	:vartype outputs: dict
+	"""
+
+	outputs = {
+		"hasConsented": [ "bool" ],
+		"getAllStudyParticipants": [ "address[]" ],
+		"getConsentTrail": [ "uint256[]", "bool[]" ],
+	}
+
+	def get_function_by_name(self, name):
+		"""
+		Get a function of the contract.
+
+		:param name: The name of the function.
+		:type name: str
+
+		:return: The function, with its ABI.
+		:rtype: :class:`types.SimpleNamespace`
+		"""
+
+		return SimpleNamespace(abi={ "outputs": [ { "type": kind } for kind in self.outputs[name] ] })
+
+	def encodeABI(self, fn_name, args):
+		"""
+		Encode a call.
+
+		:param fn_name: The name of the function.
+		:type fn_name: str
+		:param args: The arguments of the function.
+		:type args: list
+
+		:return: The encoded call.
+		:rtype: str
+
+		:raises: TypeError
+		"""
+
+		if None in args:
+			raise TypeError("Cannot encode a missing argument of %s" % fn_name)
+		return "%s(%s)" % (fn_name, ",".join(str(argument) for argument in args))
+
+class LocalSession(object):
+	"""
+	A stand-in for the HTTP session, which answers JSON-RPC batches of calls to a :class:`tests.fixtures.LocalContract` with canned results.
+	The items of each response are returned in reverse order, since nodes do not have to keep the order of the batch.
+
+	:ivar results: The outputs of each call, with the encoded calls as keys.
+		The outputs are the values to encode, or a string with the error that the node returns.
+	:vartype results: dict
+	:ivar batches: The batches that were sent.
+	:vartype batches: list of list
+	:ivar down: A boolean indicating whether the node is unreachable.
+	:vartype down: bool
+	:ivar unanswered: The encoded calls that the node leaves out of its responses.
+	:vartype unanswered: set of str
+	"""
+
+	def __init__(self):
+		"""
+		Create the session without any results.
+		"""
+
+		self.results = {}
+		self.batches = []
+		self.down = False
+		self.unanswered = set()
+
+	def post(self, url, json):
+		"""
+		Send a batch.
+
+		:param url: The node's URL.
+		:type url: str
+		:param json: The batch.
+		:type json: list of dict
+
+		:return: The response.
+		:rtype: :class:`types.SimpleNamespace`
+
+		:raises: ConnectionError
+		"""
+
+		from eth_abi import encode_abi
+
+		self.batches.append(json)
+		if self.down:
+			raise ConnectionError("The Ethereum node is not reachable")
+
+		items = []
+		for request in json:
+			data = request["params"][0]["data"]
+			if data in self.unanswered:
+				continue
+
+			result = self.results[data]
+			if isinstance(result, str):
+				items.append({ "jsonrpc": "2.0", "id": request["id"], "error": { "code": 3, "message": result } })
+			else:
+				kinds = LocalContract.outputs[data.split("(")[0]]
+				items.append({ "jsonrpc": "2.0", "id": request["id"], "result": "0x" + encode_abi(kinds, result).hex() })
+
+		return SimpleNamespace(raise_for_status=lambda: None, json=lambda: items[::-1])
+
+class LocalChain(object):
+	"""
+	A stand-in for the blockchain backend, which keeps the participants of each study and the anchored roots in memory.
+
+	:ivar participants: The addresses of all the participants of each study, with the studies' IDs as keys.
+	:vartype participants: dict
+	:ivar consenting: The addresses of the consenting participants of each study, with the studies' IDs as keys.
+	:vartype consenting: dict
+	:ivar roots: The anchored roots, with the hashes of their transactions as keys.
+	:vartype roots: dict
+	"""
+
+	def __init__(self):
+		"""
+		Create the empty chain.
+		"""
+
+		self.participants = {}
+		self.consenting = {}
+		self.roots = {}
+
+	def get_all_study_participants(self, study_id):
+		"""
+		Get the addresses of all the participants of a study.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+
+		:return: The addresses of the participants.
+		:rtype: list of str
+		"""
+
+		return self.participants.get(study_id, [])
+
+	def get_study_participants(self, study_id):
+		"""
+		Get the addresses of the consenting participants of a study.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+
+		:return: The addresses of the consenting participants.
+		:rtype: list of str
+		"""
+
+		return self.consenting.get(study_id, [])
+
+	def send(self, root):
+		"""
+		Anchor a root in a new block.
+
+		:param root: The root to anchor.
+		:type root: str
+
+		:return: The hash of the transaction and the number of the block that includes it.
+		:rtype: tuple
+		"""
+
+		tx_hash = "0x" + hashlib.sha256(("%d:%s" % (len(self.roots), root)).encode("utf-8")).hexdigest()
+		self.roots[tx_hash] = root
+		return tx_hash, len(self.roots)
+
+class LocalIndex(object):
+	"""
+	A stand-in for the participant index, which keeps the confirmed consent changes in memory.
+
+	:ivar changes: The consent status of each study and address, with the study ID and the address as keys.
+	:vartype changes: dict
+	"""
+
+	def __init__(self):
+		"""
+		Create the empty index.
+		"""
+
+		self.changes = {}
+
+	def consents(self, addresses):
+		"""
+		Get the consent changes of the given addresses.
+
+		:param addresses: The addresses of the participants.
+		:type addresses: list of str
+
+		:return: The consent status of each study and address, with the study ID and the address as keys.
+		:rtype: dict
+		"""
+
+		return { key: consent for key, consent in self.changes.items() if key[1] in addresses }
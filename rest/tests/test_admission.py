@@ -0,0 +1,169 @@
+"""
+Test the admission control that rejects requests early when clients exceed their rate limits or when the server is overloaded.
+"""
+
+import os
+import sys
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from server.admission import AdmissionController, TokenBucket, retry_after
+from server.exceptions import request_exceptions
+
+class TokenBucketTest(unittest.TestCase):
+	"""
+	Test that buckets allow bursts up to their capacity, and that they refill at their rate.
+	"""
+
+	def setUp(self):
+		"""
+		Create a bucket that allows two requests per second, with bursts of three.
+		"""
+
+		self._bucket = TokenBucket(2, 3)
+		self._start = self._bucket._updated
+
+	def test_burst(self):
+		"""
+		Test that a full bucket allows a burst, and then reports how long to wait for the next token.
+		"""
+
+		self.assertEqual([ self._bucket.take(self._start) for _ in range(3) ], [ 0, 0, 0 ])
+		self.assertAlmostEqual(self._bucket.take(self._start), 0.5)
+
+	def test_refill(self):
+		"""
+		Test that tokens are added at the bucket's rate, up to its capacity.
+		"""
+
+		for _ in range(3):
+			self._bucket.take(self._start)
+
+		self.assertEqual(self._bucket.take(self._start + 0.5), 0)
+		self.assertGreater(self._bucket.take(self._start + 0.5), 0)
+		self.assertFalse(self._bucket.is_full(self._start + 1))
+		self.assertTrue(self._bucket.is_full(self._start + 10))
+		self.assertEqual([ self._bucket.take(self._start + 10) for _ in range(4) ][-1], 0.5)
+
+	def test_give_back(self):
+		"""
+		Test that a token that is given back can be taken again, but that the bucket does not overflow.
+		"""
+
+		self._bucket.take(self._start)
+		self._bucket.give_back()
+		self._bucket.give_back()
+		self.assertTrue(self._bucket.is_full(self._start))
+		self.assertEqual([ self._bucket.take(self._start) for _ in range(4) ][-1], 0.5)
+
+	def test_no_rate(self):
+		"""
+		Test that a bucket without a rate never refills.
+		"""
+
+		bucket = TokenBucket(0, 1)
+		bucket.take()
+		self.assertEqual(bucket.take(), float("inf"))
+		self.assertEqual(retry_after(bucket.take()), "3600")
+
+class AdmissionControllerTest(unittest.TestCase):
+	"""
+	Test that requests are rejected when their client or user exceeds its limit, or when the server is overloaded.
+
+	:ivar _pending: The number of pending background tasks.
+	:vartype _pending: int
+	:ivar _counts: The number of times that the pending background tasks were counted.
+	:vartype _counts: int
+	"""
+
+	def setUp(self):
+		"""
+		Create the admission controller, with limits on blockchain writes.
+		"""
+
+		self._pending = 0
+		self._counts = 0
+		self._controller = AdmissionController({
+			"blockchain_write": {
+				"user": { "rate": 0, "burst": 1 },
+				"client": { "rate": 0, "burst": 2 },
+				"max_threads": 10,
+			},
+		}, max_concurrent=2, thread_count=self._count)
+
+	def _count(self):
+		"""
+		Count the pending background tasks.
+
+		:return: The number of pending background tasks.
+		:rtype: int
+		"""
+
+		self._counts += 1
+		return self._pending
+
+	def test_concurrent(self):
+		"""
+		Test that requests are rejected while the maximum number of requests are being served.
+		"""
+
+		self._controller.enter()
+		self._controller.enter()
+		self.assertRaises(request_exceptions.ServiceUnavailableException, self._controller.enter)
+		self._controller.leave()
+		self._controller.enter()
+
+	def test_user_limit(self):
+		"""
+		Test that a user's limit applies to all of its requests, and that rejected requests do not use up the client's limit.
+		"""
+
+		self._controller.admit("blockchain_write", "c1", "u1")
+		with self.assertRaises(request_exceptions.TooManyRequestsException):
+			self._controller.admit("blockchain_write", "c1", "u1")
+
+		self._controller.admit("blockchain_write", "c1", "u2")
+		self.assertRaises(request_exceptions.TooManyRequestsException, self._controller.admit, "blockchain_write", "c1", "u3")
+
+	def test_unlimited(self):
+		"""
+		Test that route classes without limits are always admitted.
+		"""
+
+		for _ in range(10):
+			self._controller.admit("read", "c1", "u1")
+		self.assertEqual(self._counts, 0)
+
+	def test_shed(self):
+		"""
+		Test that requests are shed while the background work is backed up, and that the work is only counted once a second.
+		"""
+
+		self._pending = 10
+		with self.assertRaises(request_exceptions.ServiceUnavailableException):
+			self._controller.admit("blockchain_write", "c1", "u1")
+
+		self._pending = 0
+		self.assertRaises(request_exceptions.ServiceUnavailableException, self._controller.admit, "blockchain_write", "c1", "u1")
+		self.assertEqual(self._counts, 1)
+
+		self._controller._counted_at -= AdmissionController.count_interval
+		self._controller.admit("blockchain_write", "c1", "u1")
+		self.assertEqual(self._counts, 2)
+
+	def test_prune(self):
+		"""
+		Test that full buckets are discarded when there are too many buckets.
+		"""
+
+		self._controller.prune_size = 2
+		self._controller._limits["read"] = { "user": { "rate": 1, "burst": 1 } }
+		self._controller.admit("blockchain_write", None, "u1")
+		self._controller.admit("read", None, "u2")
+		self._controller._buckets[("read", "user", "u2")]._updated -= 1
+		self._controller.admit("read", None, "u3")
+		self.assertEqual(set(self._controller._buckets), { ("blockchain_write", "user", "u1"), ("read", "user", "u3") })
@@ -0,0 +1,127 @@
+"""
+Test that the requests of a batch fail on their own.
+"""
+
+import json
+import os
+import sys
+import unittest
+
+from oauth2.web import Response
+from types import SimpleNamespace
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.handler import RouteHandler
+from server import timing
+from server.resource_server import ResourceServer
+
+class BatchHandler(RouteHandler):
+	"""
+	A route handler whose responses fail after they are returned.
+	"""
+
+	def stream(self, *args, **kwargs):
+		"""
+		Return a streamed body that fails partway.
+
+		:return: The response.
+		:rtype: :class:`oauth2.web.Response`
+		"""
+
+		def body():
+			yield '{ "data": ['
+			raise ConnectionError("The database connection was lost")
+
+		response = Response()
+		response.add_header("Content-Type", "application/json")
+		response.body = body()
+		return response
+
+	def invalid(self, *args, **kwargs):
+		"""
+		Return a body that is not valid JSON.
+
+		:return: The response.
+		:rtype: :class:`oauth2.web.Response`
+		"""
+
+		response = Response()
+		response.add_header("Content-Type", "application/json")
+		response.body = "{ \"data\": "
+		return response
+
+	def valid(self, *args, **kwargs):
+		"""
+		Return a valid body.
+
+		:return: The response.
+		:rtype: :class:`oauth2.web.Response`
+		"""
+
+		response = Response()
+		response.add_header("Content-Type", "application/json")
+		response.body = json.dumps({ "data": [] })
+		return response
+
+class SubRequestTest(unittest.TestCase):
+	"""
+	Test that a request whose body cannot be encoded gets its own error, without failing the batch.
+	"""
+
+	def setUp(self):
+		"""
+		Create the resource server, without its stores.
+		"""
+
+		handler = BatchHandler(None, None)
+		self._server = ResourceServer.__new__(ResourceServer)
+		self._server._route_handlers = { BatchHandler: handler }
+		self._server._admission = None
+		self._server._routes = {
+			"/%s" % name: { "GET": { "handler": BatchHandler, "function": getattr(BatchHandler, name) } }
+			for name in [ "stream", "invalid", "valid" ]
+		}
+		self._token = SimpleNamespace(scopes=[])
+
+	def _handle(self, path):
+		"""
+		Handle a GET request of a batch, timed by the batch's timer.
+
+		:param path: The request's path.
+		:type path: str
+
+		:return: The request's response.
+		:rtype: dict
+		"""
+
+		return self._server._handle_sub_request({ "method": "GET", "path": path, "parameters": {} }, self._token, "token", timing.RequestTimer())
+
+	def test_stream_error(self):
+		"""
+		Test that a streamed body that fails partway becomes the request's error, and that the thread stops timing the batch.
+		"""
+
+		response = self._handle("/stream")
+		self.assertEqual(response["status"], 500)
+		self.assertEqual(response["body"]["exception"], ConnectionError.__name__)
+		self.assertIsNone(timing.current())
+
+	def test_invalid_json(self):
+		"""
+		Test that a body that is not valid JSON becomes the request's error.
+		"""
+
+		response = self._handle("/invalid")
+		self.assertEqual(response["status"], 500)
+		self.assertEqual(response["body"]["exception"], json.JSONDecodeError.__name__)
+
+	def test_valid(self):
+		"""
+		Test that a valid body is decoded.
+		"""
+
+		self.assertEqual(self._handle("/valid"), { "status": 200, "headers": { "Content-Type": "application/json" }, "body": { "data": [] } })
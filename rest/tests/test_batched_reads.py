@@ -0,0 +1,207 @@
+"""
+Test the contract reads that are sent to the Ethereum node in JSON-RPC batches.
+"""
+
+import os
+import sys
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+from eth_utils import to_checksum_address
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.api.ethereum import ethereum
+from biobank.handlers.blockchain.api.ethereum.block_cache import BlockCache
+from biobank.handlers.blockchain.api.ethereum.ethereum import EthereumAPI
+from biobank.handlers.blockchain.api.ethereum.ethereum_exceptions import HasConsentedFailedException
+
+from .fixtures import LocalContract, LocalSession
+
+ALICE = "0x" + "ab" * 20
+BOB = "0x" + "cd" * 20
+
+class PinnedCache(BlockCache):
+	"""
+	A block cache whose latest block is set by the tests.
+
+	:ivar pinned: The latest block.
+	:vartype pinned: int or None
+	"""
+
+	def __init__(self, block):
+		"""
+		Create the cache at the given block.
+
+		:param block: The latest block.
+		:type block: int or None
+		"""
+
+		super(PinnedCache, self).__init__(None)
+		self.pinned = block
+
+	def block(self):
+		"""
+		Get the block to which reads should be pinned.
+
+		:return: The latest block.
+		:rtype: int or None
+		"""
+
+		return self.pinned
+
+class BatchedReadTest(unittest.TestCase):
+	"""
+	Test that batched reads are decoded like single reads, that they are cached in the latest block and that their errors are reported for each call.
+	"""
+
+	def setUp(self):
+		"""
+		Create the backend, without connecting to a node or to the database.
+		"""
+
+		self._session = LocalSession()
+		self._session.results = {
+			"hasConsented(s1,%s)" % ALICE: [ True ],
+			"hasConsented(s1,%s)" % BOB: [ False ],
+			"getAllStudyParticipants(s1)": [ [ ALICE, BOB ] ],
+			"getConsentTrail(s1,%s)" % ALICE: [ [ 1600000000, 1600000100 ], [ True, False ] ],
+			"hasConsented(s2,%s)" % ALICE: "execution reverted: Study does not exist",
+		}
+
+		w3 = SimpleNamespace(provider=SimpleNamespace(endpoint_uri="http://localhost:8545"), toChecksumAddress=to_checksum_address)
+		for patch in [ mock.patch.object(ethereum, "_session", self._session), mock.patch.object(ethereum, "get_web3", lambda: w3) ]:
+			patch.start()
+			self.addCleanup(patch.stop)
+
+		self._api = EthereumAPI.__new__(EthereumAPI)
+		self._api._contract_address = "0x%040d" % 1
+		self._api._contract_instance = LocalContract()
+		self._api._reads = PinnedCache(7)
+
+	def test_decode(self):
+		"""
+		Test that the outputs are decoded in the order of the calls, with checksummed addresses and lists, in one round trip pinned to the latest block.
+		"""
+
+		results = self._api._call_many([
+			("hasConsented", [ "s1", ALICE ]),
+			("getAllStudyParticipants", [ "s1" ]),
+			("getConsentTrail", [ "s1", ALICE ]),
+			("hasConsented", [ "s1", BOB ]),
+		], HasConsentedFailedException)
+
+		self.assertEqual(results, [
+			(True, ),
+			([ to_checksum_address(ALICE), to_checksum_address(BOB) ], ),
+			([ 1600000000, 1600000100 ], [ True, False ]),
+			(False, ),
+		])
+		self.assertEqual(len(self._session.batches), 1)
+		self.assertEqual({ request["params"][1] for request in self._session.batches[0] }, { "0x7" })
+
+	def test_batch_size(self):
+		"""
+		Test that calls are split into batches of at most the batch size.
+		"""
+
+		self._api.batch_size = 2
+		calls = [ ("hasConsented", [ "s1", ALICE ]), ("hasConsented", [ "s1", BOB ]), ("getAllStudyParticipants", [ "s1" ]) ]
+		results = self._api._call_many(calls, HasConsentedFailedException)
+		self.assertEqual([ len(batch) for batch in self._session.batches ], [ 2, 1 ])
+		self.assertEqual(results[:2], [ (True, ), (False, ) ])
+
+	def test_cached(self):
+		"""
+		Test that calls that were made in the latest block are not sent again, and that they are sent again in a new block.
+		"""
+
+		self._api._call_many([ ("hasConsented", [ "s1", ALICE ]) ], HasConsentedFailedException)
+		results = self._api._call_many([ ("hasConsented", [ "s1", ALICE ]), ("hasConsented", [ "s1", BOB ]) ], HasConsentedFailedException)
+		self.assertEqual(results, [ (True, ), (False, ) ])
+		self.assertEqual([ len(batch) for batch in self._session.batches ], [ 1, 1 ])
+
+		self._api._reads.pinned = 8
+		self._api._call_many([ ("hasConsented", [ "s1", ALICE ]) ], HasConsentedFailedException)
+		self.assertEqual(self._session.batches[-1][0]["params"][1], "0x8")
+
+	def test_unpinned(self):
+		"""
+		Test that calls are made at the node's latest block, and not cached, if the latest block is not known.
+		"""
+
+		self._api._reads.pinned = None
+		for _ in range(2):
+			self._api._call_many([ ("hasConsented", [ "s1", ALICE ]) ], HasConsentedFailedException)
+		self.assertEqual([ batch[0]["params"][1] for batch in self._session.batches ], [ "latest", "latest" ])
+
+	def test_call_error(self):
+		"""
+		Test that a reverted call is raised with the contract's reason, or recorded without failing the other calls.
+		"""
+
+		calls = [ ("hasConsented", [ "s1", ALICE ]), ("hasConsented", [ "s2", ALICE ]) ]
+		with self.assertRaises(HasConsentedFailedException) as context:
+			self._api._call_many(calls, HasConsentedFailedException)
+		self.assertEqual(str(context.exception), "Study does not exist")
+
+		errors = {}
+		self.assertEqual(self._api._call_many(calls, HasConsentedFailedException, errors), [ (True, ), None ])
+		self.assertEqual(list(errors), [ 1 ])
+		self.assertIsInstance(errors[1], HasConsentedFailedException)
+
+	def test_encode_error(self):
+		"""
+		Test that a call that cannot be encoded is raised, or recorded without failing the other calls.
+		"""
+
+		calls = [ ("hasConsented", [ "s1", None ]), ("hasConsented", [ "s1", BOB ]) ]
+		self.assertRaises(TypeError, self._api._call_many, calls, HasConsentedFailedException)
+
+		errors = {}
+		self.assertEqual(self._api._call_many(calls, HasConsentedFailedException, errors), [ None, (False, ) ])
+		self.assertEqual(list(errors), [ 0 ])
+		self.assertIsInstance(errors[0], HasConsentedFailedException)
+		self.assertEqual(len(self._session.batches[-1]), 1)
+
+	def test_unanswered(self):
+		"""
+		Test that the responses are matched to the calls by their IDs, so that a call that the node leaves out does not shift the other results.
+		"""
+
+		self._session.unanswered.add("hasConsented(s1,%s)" % ALICE)
+		calls = [ ("hasConsented", [ "s1", ALICE ]), ("hasConsented", [ "s1", BOB ]), ("getAllStudyParticipants", [ "s1" ]) ]
+		errors = {}
+		results = self._api._call_many(calls, HasConsentedFailedException, errors)
+		self.assertEqual(results, [ None, (False, ), ([ to_checksum_address(ALICE), to_checksum_address(BOB) ], ) ])
+		self.assertEqual(list(errors), [ 0 ])
+
+	def test_batch_error(self):
+		"""
+		Test that a batch that fails as a whole is raised, or recorded for each of its calls.
+		"""
+
+		self._session.down = True
+		calls = [ ("hasConsented", [ "s1", ALICE ]), ("hasConsented", [ "s1", BOB ]) ]
+		with self.assertRaises(ConnectionError):
+			self._api._call_many(calls, HasConsentedFailedException)
+
+		errors = {}
+		self.assertEqual(self._api._call_many(calls, HasConsentedFailedException, errors), [ None, None ])
+		self.assertEqual(sorted(errors), [ 0, 1 ])
+		self.assertTrue(all(isinstance(error, HasConsentedFailedException) for error in errors.values()))
+
+	def test_normalize(self):
+		"""
+		Test that decoded values take the form that web3.py returns.
+		"""
+
+		self.assertEqual(self._api._normalize("address", ALICE), to_checksum_address(ALICE))
+		self.assertEqual(self._api._normalize("address[]", (ALICE, )), [ to_checksum_address(ALICE) ])
+		self.assertEqual(self._api._normalize("bool[]", (True, False)), [ True, False ])
+		self.assertEqual(self._api._normalize("uint256", 5), 5)
@@ -0,0 +1,98 @@
+"""
+Test the cache of the contract reads that are made in the latest block.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.api.ethereum.block_cache import BlockCache, BlockTracker
+
+from .fixtures import LocalNode
+
+class BlockCacheTest(unittest.TestCase):
+	"""
+	Test that reads are pinned to the latest block, and that they are only made once in each block.
+	"""
+
+	def setUp(self):
+		"""
+		Create a chain with one block after the genesis block and the cache, and wait until the tracker knows the latest block.
+		"""
+
+		self._node = LocalNode()
+		self._node.mine([])
+		self._cache = BlockCache(BlockTracker(lambda: self._node, poll_interval=0.01))
+		self._reads = []
+		while self._cache.block() is None:
+			time.sleep(0.01)
+
+	def _read(self, block):
+		"""
+		Make a read that returns the block to which it is pinned.
+
+		:param block: The block to which the read is pinned.
+		:type block: int or None
+
+		:return: The block.
+		:rtype: int or None
+		"""
+
+		self._reads.append(block)
+		return block
+
+	def _wait_for(self, block):
+		"""
+		Wait until the tracker sees the given block.
+
+		:param block: The number of the block.
+		:type block: int
+		"""
+
+		while self._cache.block() != block:
+			time.sleep(0.01)
+
+	def test_same_block(self):
+		"""
+		Test that the same reads in the same block only call the node once, and that different arguments are read separately.
+		"""
+
+		self.assertEqual(self._cache.get("hasConsented", [ "s1", "0x1" ], self._read), 1)
+		self.assertEqual(self._cache.get("hasConsented", [ "s1", "0x1" ], self._read), 1)
+		self.assertEqual(self._cache.get("hasConsented", [ "s1", "0x2" ], self._read), 1)
+		self.assertEqual(self._reads, [ 1, 1 ])
+
+	def test_new_block(self):
+		"""
+		Test that reads are made again once a new block arrives.
+		"""
+
+		self._cache.get("hasConsented", [ "s1", "0x1" ], self._read)
+		self._node.mine([])
+		self._wait_for(2)
+		self.assertEqual(self._cache.get("hasConsented", [ "s1", "0x1" ], self._read), 2)
+		self.assertEqual(self._reads, [ 1, 2 ])
+
+	def test_advance(self):
+		"""
+		Test that reads see the block of a confirmed transaction before the tracker does.
+		"""
+
+		self._cache.advance(3)
+		self.assertEqual(self._cache.get("hasConsented", [ "s1", "0x1" ], self._read), 3)
+
+	def test_disabled(self):
+		"""
+		Test that reads are never cached without a tracker.
+		"""
+
+		cache = BlockCache(None)
+		cache.get("hasConsented", [ "s1", "0x1" ], self._read)
+		cache.get("hasConsented", [ "s1", "0x1" ], self._read)
+		self.assertEqual(self._reads, [ None, None ])
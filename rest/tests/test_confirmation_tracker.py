@@ -0,0 +1,197 @@
+"""
+Test the tracker that resolves transactions when they are mined.
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+from unittest import mock
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.api.ethereum import ethereum
+from biobank.handlers.blockchain.api.ethereum.block_cache import BlockCache
+from biobank.handlers.blockchain.api.ethereum.confirmation_tracker import ConfirmationTracker
+from biobank.handlers.blockchain.api.ethereum.ethereum import EthereumAPI
+from threads.exceptions.job_exceptions import TransactionPendingException
+
+from .fixtures import LocalNode
+
+class ConfirmationTrackerTest(unittest.TestCase):
+	"""
+	Test that tracked transactions are resolved with their receipts when they are mined, and that the tracking thread only runs while transactions are pending.
+	"""
+
+	def setUp(self):
+		"""
+		Create the node and the tracker.
+		"""
+
+		self._node = LocalNode()
+		self._tracker = ConfirmationTracker(lambda: self._node, poll_interval=0.01)
+
+	def _mine(self, tx_hash):
+		"""
+		Mine a block with a transaction that has the given hash.
+
+		:param tx_hash: The hash of the transaction.
+		:type tx_hash: bytes
+		"""
+
+		self._node.mine([ ("createStudy", "s1", "0x1") ], hashes=[ tx_hash ])
+
+	def _wait_until_stopped(self):
+		"""
+		Wait until the tracking thread stops.
+		"""
+
+		for _ in range(500):
+			if self._tracker._thread is None:
+				return
+			time.sleep(0.01)
+		self.fail("The tracking thread did not stop")
+
+	def _wait_until_started(self):
+		"""
+		Wait until the tracking thread has checked the latest block.
+		"""
+
+		for _ in range(500):
+			if self._tracker._last_block is not None:
+				return
+			time.sleep(0.01)
+		self.fail("The tracking thread did not start")
+
+	def test_mined(self):
+		"""
+		Test that a transaction is resolved with its receipt when it is mined in a new block, and that the thread then stops.
+		"""
+
+		future = self._tracker.track(b"\x01" * 32)
+		self._wait_until_started()
+		self.assertFalse(future.done())
+
+		self._mine(b"\x02" * 32)
+		self._mine(b"\x01" * 32)
+		self.assertEqual(future.result(timeout=5).blockNumber, 2)
+		self.assertEqual(self._tracker.pending(), 0)
+		self._wait_until_stopped()
+
+	def test_mined_before(self):
+		"""
+		Test that a transaction that was mined before the tracker started is found from its receipt.
+		"""
+
+		self._mine(b"\x01" * 32)
+		future = self._tracker.track(b"\x01" * 32)
+		self.assertEqual(future.result(timeout=5).blockNumber, 1)
+
+	def test_same_transaction(self):
+		"""
+		Test that a transaction's hash as bytes or as a hexadecimal string is tracked once, and that callbacks are called.
+		"""
+
+		called = []
+		first = self._tracker.track(b"\xab" * 32)
+		second = self._tracker.track("0x" + "AB" * 32, callback=called.append)
+		self.assertIs(first, second)
+		self.assertEqual(self._tracker.pending(), 1)
+
+		self._mine(b"\xab" * 32)
+		first.result(timeout=5)
+		self.assertEqual(called, [ first ])
+
+	def test_forget(self):
+		"""
+		Test that a forgotten transaction is not resolved, and that the thread stops when nothing is pending.
+		"""
+
+		future = self._tracker.track(b"\x01" * 32)
+		self._tracker.forget("0x" + "01" * 32)
+		self.assertEqual(self._tracker.pending(), 0)
+		self._wait_until_stopped()
+
+		self._mine(b"\x01" * 32)
+		time.sleep(0.05)
+		self.assertFalse(future.done())
+
+	def test_node_error(self):
+		"""
+		Test that the tracker keeps following blocks after the node fails.
+		"""
+
+		future = self._tracker.track(b"\x01" * 32)
+		self._wait_until_started()
+
+		self._node.failures = 2
+		self._mine(b"\x01" * 32)
+		self.assertEqual(future.result(timeout=5).blockNumber, 1)
+
+class WaitForTransactionTest(unittest.TestCase):
+	"""
+	Test that a retried write waits for the transaction that an earlier attempt sent, instead of sending it again.
+	"""
+
+	def setUp(self):
+		"""
+		Create the node and the backend, without connecting to a node or to the database.
+		"""
+
+		self._node = LocalNode()
+		for patch in [ mock.patch.object(ethereum, "get_web3", lambda: self._node), mock.patch.object(ethereum.blockchain, "confirmation_timeout", 0.2) ]:
+			patch.start()
+			self.addCleanup(patch.stop)
+
+		self._api = EthereumAPI.__new__(EthereumAPI)
+		self._api._tracker = ConfirmationTracker(lambda: self._node, poll_interval=0.01)
+		self._api._reads = BlockCache(None)
+
+	def test_timeout_and_retry(self):
+		"""
+		Test that a transaction that is still pending is raised again with its hash, and that the retry returns once it is mined.
+		"""
+
+		tx_hash = "0x" + "01" * 32
+		self._node.pool.add(tx_hash)
+		with self.assertRaises(TransactionPendingException) as context:
+			self._api.wait_for_transaction(tx_hash)
+		self.assertEqual(context.exception.tx_hash, tx_hash)
+		self.assertEqual(self._api._tracker.pending(), 0)
+
+		timer = threading.Timer(0.05, self._mine, [ tx_hash ])
+		timer.start()
+		self._api.wait_for_transaction(tx_hash)
+		timer.join()
+		self.assertNotIn(tx_hash, self._node.pool)
+
+	def test_mined(self):
+		"""
+		Test that a transaction that was mined before the retry is found straight away.
+		"""
+
+		self._node.mine([ ("createStudy", "s1", "0x1") ], hashes=[ b"\x01" * 32 ])
+		self._api.wait_for_transaction("0x" + "01" * 32)
+
+	def test_dropped(self):
+		"""
+		Test that a transaction that the node no longer knows is not waited for, so that the change can be sent again.
+		"""
+
+		self._api.wait_for_transaction("0x" + "01" * 32)
+		self.assertEqual(self._api._tracker.pending(), 0)
+
+	def _mine(self, tx_hash):
+		"""
+		Mine a block with a transaction that has the given hash.
+
+		:param tx_hash: The hash of the transaction, as a hexadecimal string.
+		:type tx_hash: str
+		"""
+
+		self._node.mine([ ("createStudy", "s1", "0x1") ], hashes=[ bytes.fromhex(tx_hash[2:]) ])
@@ -0,0 +1,193 @@
+"""
+Test the anchoring of consent changes in Merkle-tree batches.
+"""
+
+import os
+import sys
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain import merkle
+from biobank.handlers.blockchain.api.ethereum.consent_anchor import ConsentAnchor, ConsentAnchorer
+
+import verify_consent
+
+from .environment import *
+from .fixtures import LocalChain
+
+class MerkleTreeTest(unittest.TestCase):
+	"""
+	Test the Merkle trees that anchor consent changes.
+	"""
+
+	def _changes(self, n):
+		"""
+		Create consent changes.
+
+		:param n: The number of changes to create.
+		:type n: int
+
+		:return: The consent changes.
+		:rtype: list of dict
+		"""
+
+		return [ { "id": i, "study_id": "s%d" % (i % 3), "address": "0x%040d" % i, "consent": i % 2 == 0, "timestamp": 1600000000 + i }
+				 for i in range(n) ]
+
+	def test_proofs(self):
+		"""
+		Test that every leaf's proof leads to the root, whether the number of leaves is a power of two or not.
+		"""
+
+		for n in range(1, 18):
+			changes = self._changes(n)
+			tree = merkle.MerkleTree(changes)
+			for i, change in enumerate(changes):
+				self.assertTrue(merkle.verify(change, tree.proof(i), tree.root))
+
+	def test_tampered_change(self):
+		"""
+		Test that a proof does not verify a change that was altered.
+		"""
+
+		changes = self._changes(5)
+		tree = merkle.MerkleTree(changes)
+		change = dict(changes[2], consent=not changes[2]["consent"])
+		self.assertFalse(merkle.verify(change, tree.proof(2), tree.root))
+
+	def test_wrong_leaf(self):
+		"""
+		Test that a proof does not verify another leaf.
+		"""
+
+		changes = self._changes(8)
+		tree = merkle.MerkleTree(changes)
+		self.assertFalse(merkle.verify(changes[3], tree.proof(2), tree.root))
+
+	def test_empty_tree(self):
+		"""
+		Test that a tree cannot be built without leaves.
+		"""
+
+		self.assertRaises(ValueError, merkle.MerkleTree, [])
+
+class ConsentAnchorTest(unittest.TestCase):
+	"""
+	Test that consent changes are batched, anchored on a local stand-in for the blockchain and proven.
+	"""
+
+	@classmethod
+	def setUpClass(self):
+		"""
+		Create the schema and connect with the database.
+		"""
+
+		create_testing_environment()
+		self._connection = PostgreSQLConnection.connect(TEST_DATABASE)
+
+	@classmethod
+	def tearDownClass(self):
+		"""
+		Close the connection with the database.
+		"""
+
+		self._connection.close()
+
+	def setUp(self):
+		"""
+		Remove any consent changes that earlier tests recorded.
+		"""
+
+		self._connection.execute([
+			"DELETE FROM consent_anchor_changes",
+			"DELETE FROM consent_anchor_batches",
+			"DELETE FROM consent_anchor_imports",
+		])
+		self._anchor = ConsentAnchor(self._connection)
+		self._chain = LocalChain()
+		self._anchorer = ConsentAnchorer(self._anchor, self._chain.send)
+
+	def test_anchor(self):
+		"""
+		Test that the recorded consent changes are anchored in one batch, and that each change's proof leads to the anchored root.
+		"""
+
+		for i in range(10):
+			self._anchor.record("s1", "0x%040d" % i, True)
+		self._anchor.record("s1", "0x%040d" % 0, False)
+
+		self.assertEqual(self._anchorer.anchor_once(), 1)
+		self.assertEqual(len(self._chain.roots), 1)
+		self.assertEqual(self._anchorer.anchor_once(), 0)
+
+		proofs = self._anchor.proofs("s1", "0x%040d" % 0)
+		self.assertEqual(len(proofs), 2)
+		for proof in proofs:
+			self.assertTrue(proof["anchored"])
+			self.assertEqual(self._chain.roots[proof["tx_hash"]], proof["root"])
+			self.assertEqual(verify_consent.verify(proof), ("included in the root %s" % proof["root"], True))
+
+	def test_unanchored(self):
+		"""
+		Test that consent changes have no proof until they are anchored.
+		"""
+
+		self._anchor.record("s1", "0x%040d" % 1, True)
+		proofs = self._anchor.proofs("s1", "0x%040d" % 1)
+		self.assertEqual(len(proofs), 1)
+		self.assertFalse(proofs[0]["anchored"])
+		self.assertNotIn("proof", proofs[0])
+
+	def test_reads(self):
+		"""
+		Test that consent is read from the latest recorded change, whether it is anchored or not.
+		"""
+
+		self._anchor.record("s1", "0x%040d" % 1, True)
+		self._anchor.record("s1", "0x%040d" % 2, True)
+		self._anchorer.anchor_once()
+		self._anchor.record("s1", "0x%040d" % 2, False)
+
+		self.assertEqual(self._anchor.has_consent_many([ ("s1", "0x%040d" % 1), ("s1", "0x%040d" % 2), ("s2", "0x%040d" % 1) ]),
+			[ True, False, False ])
+		self.assertEqual(self._anchor.get_study_participants_many([ "s1" ]), [ [ "0x%040d" % 1 ] ])
+		self.assertEqual(self._anchor.get_study_participants_many([ "s1" ], all_participants=True),
+			[ [ "0x%040d" % 1, "0x%040d" % 2 ] ])
+
+	def test_import(self):
+		"""
+		Test that the consent changes that were recorded on the contract are imported once, in order, without overriding newer recorded changes.
+		"""
+
+		self._anchor.record("s1", "0x%040d" % 1, False)
+		self.assertFalse(self._anchor.is_imported())
+
+		changes = [
+			("s1", "0x%040d" % 2, False, 1600000300),
+			("s1", "0x%040d" % 1, True, 1600000100),
+			("s1", "0x%040d" % 2, True, 1600000200),
+			("s2", "0x%040d" % 3, True, 1600000400),
+		]
+		self._anchor.import_changes(changes)
+		self.assertTrue(self._anchor.is_imported())
+		self.assertTrue(ConsentAnchor(self._connection).is_imported())
+
+		pairs = [ ("s1", "0x%040d" % 1), ("s1", "0x%040d" % 2), ("s2", "0x%040d" % 3) ]
+		self.assertEqual(self._anchor.has_consent_many(pairs), [ False, False, True ])
+		self.assertEqual(self._anchor.get_consent_trail_many(pairs[1:2]), [ { 1600000200: True, 1600000300: False } ])
+
+		"""
+		A second import, such as one by another process, changes nothing.
+		"""
+		ConsentAnchor(self._connection).import_changes([ ("s2", "0x%040d" % 4, True, 1600000500) ])
+		self.assertEqual(self._anchor.has_consent_many([ ("s2", "0x%040d" % 4) ]), [ False ])
+
+		"""
+		The imported changes are anchored with the next batch.
+		"""
+		self._anchorer.anchor_once()
+		self.assertTrue(all(proof["anchored"] for proof in self._anchor.proofs("s1", "0x%040d" % 2)))
@@ -4,13 +4,14 @@ Test the dynamic consent management functionality in the backend.
 
 import os
 import sys
+import time
 
 path = sys.path[0]
 path = os.path.join(path, "../")
 if path not in sys.path:
 	sys.path.insert(1, path)
 
-from biobank.handlers.exceptions import study_exceptions, user_exceptions
+from biobank.handlers.exceptions import general_exceptions, study_exceptions, user_exceptions
 from config.blockchain import admin_port
 from server.exceptions import request_exceptions
 
@@ -188,6 +189,142 @@ class ConsentManagementTest(BiobankTestCase):
 			self.assertEqual(response.status_code, 200)
 			self.assertTrue(body["data"])
 
+	def test_consent_job(self):
+		"""
+		Test that giving consent returns a job whose status can be followed until the consent is recorded.
+		"""
+
+		with rest_context(2323, 2323, ConsentManagementTest._study_ids[1]) as address:
+			token = self._get_access_token(["update_consent", "view_consent"], "p2323")["access_token"]
+			response = self.send_request("POST", "give_consent", {
+				"study_id": ConsentManagementTest._study_ids[1],
+				"address": address,
+				"access_token": None,
+				"port": 2323,
+			}, token)
+			body = response.json()
+			self.assertEqual(response.status_code, 200)
+			job_id = body["data"]["job_id"]
+
+			for i in range(0, 60):
+				response = self.send_request("GET", "consent_job", {
+					"job_id": job_id,
+					"address": address,
+				}, token)
+				body = response.json()
+				self.assertEqual(response.status_code, 200)
+				self.assertEqual(body["data"]["job_id"], job_id)
+				if body["data"]["status"] in [ "DONE", "FAILED" ]:
+					break
+				time.sleep(1)
+
+			self.assertEqual(body["data"]["status"], "DONE")
+
+			response = self.send_request("GET", "has_consent", {
+				"study_id": ConsentManagementTest._study_ids[1],
+				"address": address,
+				"access_token": "None",
+				"port": 2323,
+			}, token)
+			body = response.json()
+			self.assertEqual(response.status_code, 200)
+			self.assertTrue(body["data"])
+
+	def test_pending_consent(self):
+		"""
+		Test that consent changes are returned straight away, and flagged as pending until they are recorded on the blockchain.
+		"""
+
+		with rest_context(2323, 2323, ConsentManagementTest._study_ids[1]) as address:
+			token = self._get_access_token(["update_consent", "view_consent"], "p2323")["access_token"]
+			for consent in [ "withdraw_consent", "give_consent" ]:
+				response = self.send_request("POST", consent, {
+					"study_id": ConsentManagementTest._study_ids[1],
+					"address": address,
+					"access_token": None,
+					"port": 2323,
+				}, token)
+				self.assertEqual(response.status_code, 200)
+
+				response = self.send_request("GET", "has_consent", {
+					"study_id": ConsentManagementTest._study_ids[1],
+					"address": address,
+					"access_token": "None",
+					"port": 2323,
+				}, token)
+				body = response.json()
+				self.assertEqual(response.status_code, 200)
+				self.assertEqual(body["data"], consent == "give_consent")
+				self.assertIn("pending", body)
+
+	def test_idempotent_consent(self):
+		"""
+		Test that repeating a consent change with the same idempotency key returns the same job.
+		"""
+
+		with rest_context(2323, 2323, ConsentManagementTest._study_ids[1]) as address:
+			token = self._get_access_token(["update_consent", "view_consent"], "p2323")["access_token"]
+			job_ids = []
+			for i in range(0, 2):
+				response = self.send_request("POST", "give_consent", {
+					"study_id": ConsentManagementTest._study_ids[1],
+					"address": address,
+					"access_token": None,
+					"port": 2323,
+					"idempotency_key": "test_idempotent_consent",
+				}, token)
+				body = response.json()
+				self.assertEqual(response.status_code, 200)
+				job_ids.append(body["data"]["job_id"])
+
+			self.assertEqual(job_ids[0], job_ids[1])
+
+	def test_coalesce_consent(self):
+		"""
+		Test that consent changes made in quick succession are merged into one job, which records the latest change.
+		"""
+
+		with rest_context(2323, 2323, ConsentManagementTest._study_ids[1]) as address:
+			token = self._get_access_token(["update_consent", "view_consent"], "p2323")["access_token"]
+			job_ids = []
+			for consent in [ "give_consent", "withdraw_consent", "give_consent" ]:
+				response = self.send_request("POST", consent, {
+					"study_id": ConsentManagementTest._study_ids[1],
+					"address": address,
+					"access_token": None,
+					"port": 2323,
+				}, token)
+				body = response.json()
+				self.assertEqual(response.status_code, 200)
+				job_ids.append(body["data"]["job_id"])
+
+			self.assertEqual(len(set(job_ids)), 1)
+
+			response = self.send_volatile_request("GET", "has_consent", {
+				"study_id": ConsentManagementTest._study_ids[1],
+				"address": address,
+				"access_token": "None",
+				"port": 2323,
+			}, token, value=True)
+			body = response.json()
+			self.assertEqual(response.status_code, 200)
+			self.assertTrue(body["data"])
+
+	def test_get_inexistent_consent_job(self):
+		"""
+		Test that getting a job that does not exist fails.
+		"""
+
+		with rest_context(2323, 2323, ConsentManagementTest._study_ids[1]) as address:
+			token = self._get_access_token(["update_consent", "view_consent"], "p2323")["access_token"]
+			response = self.send_request("GET", "consent_job", {
+				"job_id": 2 ** 31 - 1,
+				"address": address,
+			}, token)
+			body = response.json()
+			self.assertEqual(response.status_code, 500)
+			self.assertEqual(body["exception"], general_exceptions.JobDoesNotExistException.__name__)
+
 	def test_withdraw_consent_if_participant_does_not_exist(self):
 		"""
 		Test withdrawing basic consent when the participant does not exist.
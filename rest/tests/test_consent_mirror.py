@@ -0,0 +1,175 @@
+"""
+Test the consent mirror, and the indexer that copies consent changes from the blockchain into it.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.api.ethereum.consent_mirror import ConsentIndexer, ConsentMirror
+
+from .environment import *
+from .fixtures import LocalNode
+
+class ConsentMirrorTest(unittest.TestCase):
+	"""
+	Test that consent changes are copied into the mirror, that reorganizations are undone and that the mirror is reconciled with the chain.
+	"""
+
+	@classmethod
+	def setUpClass(self):
+		"""
+		Create the schema and connect with the database.
+		"""
+
+		create_testing_environment()
+		self._connection = PostgreSQLConnection.connect(TEST_DATABASE)
+
+	@classmethod
+	def tearDownClass(self):
+		"""
+		Close the connection with the database.
+		"""
+
+		self._connection.close()
+
+	def setUp(self):
+		"""
+		Remove anything that earlier tests mirrored, and create a new chain.
+		"""
+
+		self._connection.execute([
+			"DELETE FROM consents",
+			"DELETE FROM consent_changes",
+			"DELETE FROM consent_checkpoints",
+		])
+		self._node = LocalNode()
+		self._mirror = ConsentMirror(self._connection)
+		self._indexer = ConsentIndexer(self._connection, self._node)
+
+	def _participant(self, i):
+		"""
+		Get the address of a participant.
+
+		:param i: The participant's number.
+		:type i: int
+
+		:return: The participant's address.
+		:rtype: str
+		"""
+
+		return "0x%040d" % (i + 100)
+
+	def test_index(self):
+		"""
+		Test that only successful consent changes sent to the contract are mirrored, in order.
+		"""
+
+		self._node.mine([ ("addConsentToStudy", "s1", self._participant(1)), ("addConsentToStudy", "s1", self._participant(2)) ])
+		self._node.mine([ ("withdrawConsentFromStudy", "s1", self._participant(1)) ])
+		self._node.mine([ ("addConsentToStudy", "s1", self._participant(3)) ], status=0)
+		self._node.mine([ ("addConsentToStudy", "s1", self._participant(4)) ], to="0x%040d" % 2)
+		self._node.mine([ ("createStudy", "s2", self._participant(5)) ])
+
+		self.assertTrue(self._indexer.index_once())
+		self.assertTrue(self._mirror.is_fresh(60))
+		pairs = [ ("s1", self._participant(i)) for i in range(1, 5) ]
+		self.assertEqual(self._mirror.has_consent_many(pairs), [ False, True, False, False ])
+		self.assertEqual(self._mirror.get_study_participants_many([ "s1" ], all_participants=True),
+			[ [ self._participant(1), self._participant(2) ] ])
+		self.assertEqual(self._mirror.get_consent_trail_many(pairs[:1]), [ { 1600000001: True, 1600000002: False } ])
+
+	def test_blocks_per_poll(self):
+		"""
+		Test that the indexer only reports that it has caught up once it has indexed the latest block.
+		"""
+
+		self._indexer = ConsentIndexer(self._connection, self._node, blocks_per_poll=2)
+		for i in range(3):
+			self._node.mine([ ("addConsentToStudy", "s1", self._participant(i)) ])
+
+		self.assertFalse(self._indexer.index_once())
+		self.assertFalse(self._mirror.is_fresh(60))
+		self.assertTrue(self._indexer.index_once())
+		self.assertEqual(self._mirror.has_consent_many([ ("s1", self._participant(i)) for i in range(3) ]), [ True ] * 3)
+
+	def test_rewind(self):
+		"""
+		Test that the changes in blocks that are no longer part of the chain are undone, and that earlier changes are restored.
+		"""
+
+		self._node.mine([ ("addConsentToStudy", "s1", self._participant(1)) ])
+		self._node.mine([ ("withdrawConsentFromStudy", "s1", self._participant(1)), ("addConsentToStudy", "s1", self._participant(2)) ])
+		self._indexer.index_once()
+
+		self._node.fork(1)
+		self._node.mine([ ("addConsentToStudy", "s1", self._participant(3)) ])
+
+		self.assertFalse(self._indexer.index_once())
+		self.assertTrue(self._indexer.index_once())
+		pairs = [ ("s1", self._participant(i)) for i in range(1, 4) ]
+		self.assertEqual(self._mirror.has_consent_many(pairs), [ True, False, True ])
+		self.assertEqual(self._mirror.get_consent_trail_many(pairs[:2]), [ { 1600000001: True }, { } ])
+
+	def test_reconcile(self):
+		"""
+		Test that reconciliation corrects the mirrored consents that differ from the chain.
+		"""
+
+		self._node.mine([ ("addConsentToStudy", "s1", self._participant(i)) for i in range(3) ])
+		self._indexer.index_once()
+		self._connection.execute("UPDATE consents SET consent = FALSE WHERE address = '%s'" % self._participant(1))
+
+		self.assertEqual(self._indexer.reconcile(), 1)
+		self.assertEqual(self._indexer.reconcile(), 0)
+		self.assertEqual(self._mirror.has_consent_many([ ("s1", self._participant(i)) for i in range(3) ]), [ True ] * 3)
+
+	def test_lock(self):
+		"""
+		Test that only one indexer holds the lock, and that an indexer takes the lock again after its connection reconnects.
+		"""
+
+		connection = PostgreSQLConnection.connect(TEST_DATABASE)
+		other = ConsentIndexer(PostgreSQLConnection.connect(TEST_DATABASE), self._node)
+		indexer = ConsentIndexer(connection, self._node)
+		try:
+			self.assertTrue(indexer._lock())
+			self.assertTrue(indexer._lock())
+			self.assertFalse(other._lock())
+
+			"""
+			The lock is held once, even though it was checked twice, so a single unlock releases it.
+			"""
+			indexer._unlock()
+			self.assertTrue(other._lock())
+			other._unlock()
+
+			"""
+			A failed query reconnects, which ends the session that held the lock.
+			"""
+			self.assertTrue(indexer._lock())
+			session = connection._con
+			self.assertRaises(Exception, connection.execute, "SELECT * FROM missing_table")
+			session.close()
+
+			"""
+			The server releases the session's locks once its backend exits, which happens shortly after the client closes the session.
+			"""
+			deadline = time.monotonic() + 5
+			while not other._lock() and time.monotonic() < deadline:
+				time.sleep(0.05)
+			self.assertTrue(other._lock())
+			self.assertFalse(indexer._lock())
+			other._unlock()
+			self.assertTrue(indexer._lock())
+		finally:
+			indexer._unlock()
+			other._unlock()
+			connection.close()
+			other._connector.close()
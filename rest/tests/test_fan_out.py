@@ -0,0 +1,82 @@
+"""
+Test the fan-out that makes independent blockchain reads concurrently.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+from concurrent.futures import TimeoutError
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from threads.fan_out import FanOut
+
+class FanOutTest(unittest.TestCase):
+	"""
+	Test that calls run concurrently, and that calls that fail or time out do not fail the others.
+	"""
+
+	def setUp(self):
+		"""
+		Create the fan-out.
+		"""
+
+		self._fan_out = FanOut(4)
+
+	def tearDown(self):
+		"""
+		Stop the fan-out's threads.
+		"""
+
+		self._fan_out.shutdown()
+
+	def test_order(self):
+		"""
+		Test that the results are returned in the same order as the items, even if the calls finish in a different order.
+		"""
+
+		def square(i):
+			time.sleep((5 - i) / 100)
+			return i * i
+
+		results, errors = self._fan_out.map(square, list(range(5)))
+		self.assertEqual(results, [ 0, 1, 4, 9, 16 ])
+		self.assertEqual(errors, {})
+
+	def test_concurrent(self):
+		"""
+		Test that the calls run concurrently.
+		"""
+
+		start = time.monotonic()
+		self._fan_out.map(time.sleep, [ 0.2 ] * 4)
+		self.assertLess(time.monotonic() - start, 0.6)
+
+	def test_partial_failure(self):
+		"""
+		Test that a call that fails does not fail the others.
+		"""
+
+		def invert(i):
+			return 1 / i
+
+		results, errors = self._fan_out.map(invert, [ 1, 0, 2 ])
+		self.assertEqual(results, [ 1, None, 0.5 ])
+		self.assertEqual(list(errors), [ 1 ])
+		self.assertIsInstance(errors[1], ZeroDivisionError)
+
+	def test_timeout(self):
+		"""
+		Test that a call that times out is reported without waiting for it.
+		"""
+
+		start = time.monotonic()
+		results, errors = self._fan_out.map(time.sleep, [ 0, 1 ], timeout=0.2)
+		self.assertLess(time.monotonic() - start, 0.8)
+		self.assertEqual(list(errors), [ 1 ])
+		self.assertIsInstance(errors[1], TimeoutError)
@@ -2,6 +2,7 @@
 Test the general functionality of the backend.
 """
 
+import http.client
 import json
 import os
 import sys
@@ -16,6 +17,8 @@ if path not in sys.path:
 
 import main
 
+from config import server as server_config
+
 from biobank.handlers.exceptions import general_exceptions, user_exceptions
 from server.exceptions import request_exceptions
 
@@ -131,6 +134,91 @@ class GeneralFunctionalityTest(BiobankTestCase):
 		study = body["study"]
 		self.assertEqual(study["description"], "¯\_(ツ)_/¯")
 
+	@BiobankTestCase.isolated_test
+	def test_body_size(self):
+		"""
+		Test that request bodies that are too large are rejected.
+		"""
+
+		token = self._get_access_token(["create_participant"])["access_token"]
+
+		"""
+		Only the length of the body is sent.
+		The server rejects the request without reading the body, so a body that is still being sent when the server closes the connection could reset it before the response is read.
+		"""
+		connection = http.client.HTTPConnection("localhost", PORT)
+		connection.putrequest("POST", "/participant")
+		connection.putheader("Authorization", token)
+		connection.putheader("Content-Type", "application/json")
+		connection.putheader("Content-Length", str(server_config.max_body_size + 1))
+		connection.endheaders()
+		response = connection.getresponse()
+		body = json.loads(response.read().decode())
+		connection.close()
+		self.assertEqual(response.status, 413)
+		self.assertEqual(body["exception"], request_exceptions.RequestEntityTooLargeException.__name__)
+
+	@BiobankTestCase.isolated_test
+	def test_batch(self):
+		"""
+		Test that several requests can be sent together in a batch.
+		"""
+
+		token = self._get_access_token(["create_participant", "view_participant"])["access_token"]
+
+		response = self.send_request("POST", "batch", [
+			{ "method": "POST", "path": "participant", "parameters": { "username": "nick" } },
+			{ "method": "GET", "path": "participant", "parameters": { "username": "nick" } },
+			{ "method": "GET", "path": "participant", "parameters": { } },
+			{ "method": "DELETE", "path": "participant", "parameters": { "username": "nick" } },
+		], token)
+		body = response.json()
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([ sub_response["status"] for sub_response in body["data"] ], [ 200, 200, 200, 403 ])
+		self.assertEqual(body["data"][1]["body"]["data"][0]["user_id"], "nick")
+		self.assertEqual(body["data"][2]["body"]["total"], 1)
+
+		for batch in [ { "method": "GET", "path": "participant" }, [ { "method": "GET", "path": 5 } ], [ { "method": 5, "path": "participant" } ] ]:
+			response = self.send_request("POST", "batch", batch, token)
+			body = response.json()
+			self.assertEqual(response.status_code, 400)
+			self.assertEqual(body["exception"], request_exceptions.MalformedBodyException.__name__)
+
+	@BiobankTestCase.isolated_test
+	def test_server_timing(self):
+		"""
+		Test that responses break down the time spent on them.
+		"""
+
+		token = self._get_access_token(["create_participant"])["access_token"]
+
+		response = self.send_request("POST", "participant", { "username": "nick" }, token)
+		self.assertEqual(response.status_code, 200)
+		phases = [ metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ") ]
+		self.assertTrue(all(phase in phases for phase in [ "auth", "parameters", "handler", "db", "total" ]))
+
+	@BiobankTestCase.isolated_test
+	def test_metrics(self):
+		"""
+		Test that the metrics are only exported to access tokens with the admin scope, even to the local host.
+		"""
+
+		token = self._get_access_token(["create_participant"])["access_token"]
+		response = self.send_request("POST", "participant", { "username": "nick" }, token)
+		self.assertEqual(response.status_code, 200)
+
+		response = self.send_request("GET", "metrics", { }, "")
+		self.assertEqual(response.status_code, 401)
+		response = self.send_request("GET", "metrics", { }, token)
+		self.assertEqual(response.status_code, 403)
+
+		token = self._get_access_token(["admin"])["access_token"]
+		response = self.send_request("GET", "metrics", { }, token)
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue("biobank_requests_total{route=\"/participant\",method=\"POST\",status=\"200\"}" in response.text)
+		self.assertTrue("biobank_request_duration_seconds_count{route=\"/participant\",method=\"POST\"}" in response.text)
+		self.assertTrue("biobank_blockchain_jobs" in response.text)
+
 class GeneralTimedFunctionalityTest(BiobankTestCase):
 	"""
 	Test the general functionality of the biobank backend.
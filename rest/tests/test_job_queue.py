@@ -0,0 +1,152 @@
+"""
+Test the durable queue of blockchain writes.
+"""
+
+import os
+import sys
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from threads.exceptions.job_exceptions import TransactionPendingException
+from threads.job_queue import JobQueue, JobWorker
+
+from .environment import *
+
+class JobQueueTest(unittest.TestCase):
+	"""
+	Test that jobs are claimed in order, and that jobs with the same coalescing key never run at the same time.
+	"""
+
+	@classmethod
+	def setUpClass(self):
+		"""
+		Create the schema and connect with the database.
+		"""
+
+		create_testing_environment()
+		self._connection = PostgreSQLConnection.connect(TEST_DATABASE)
+
+	@classmethod
+	def tearDownClass(self):
+		"""
+		Close the connection with the database.
+		"""
+
+		self._connection.close()
+
+	def setUp(self):
+		"""
+		Remove any jobs that earlier tests added.
+		"""
+
+		self._connection.execute("DELETE FROM blockchain_jobs")
+		self._queue = JobQueue(self._connection)
+
+	def _expire(self, job_id):
+		"""
+		Expire the lease of a running job, as if its worker had stopped.
+
+		:param job_id: The job's ID.
+		:type job_id: int
+		"""
+
+		self._connection.execute("UPDATE blockchain_jobs SET locked_until = NOW() - INTERVAL '1 second' WHERE id = %d" % job_id)
+
+	def test_claim(self):
+		"""
+		Test that jobs are claimed from the oldest, and only once.
+		"""
+
+		first = self._queue.enqueue("set_consent", { "consent": True })
+		second = self._queue.enqueue("set_consent", { "consent": False })
+
+		self.assertEqual(self._queue.claim("w1", 60)["id"], first)
+		self.assertEqual(self._queue.claim("w2", 60)["id"], second)
+		self.assertIsNone(self._queue.claim("w3", 60))
+
+	def test_coalesce_running(self):
+		"""
+		Test that a job is not claimed while a job with the same coalescing key runs, and that it is claimed once that job finishes.
+		"""
+
+		first = self._queue.enqueue("set_consent", { "consent": True }, coalesce_key="s1:0x1")
+		self.assertEqual(self._queue.claim("w1", 60)["id"], first)
+
+		second = self._queue.enqueue("set_consent", { "consent": False }, coalesce_key="s1:0x1")
+		other = self._queue.enqueue("set_consent", { "consent": True }, coalesce_key="s1:0x2")
+		self.assertNotEqual(first, second)
+		self.assertEqual(self._queue.claim("w2", 60)["id"], other)
+		self.assertIsNone(self._queue.claim("w2", 60))
+
+		self._queue.complete(first, "w1")
+		self.assertEqual(self._queue.claim("w2", 60)["id"], second)
+
+	def test_coalesce_expired(self):
+		"""
+		Test that a job is claimed once the lease of the running job with the same coalescing key expires.
+		"""
+
+		first = self._queue.enqueue("set_consent", { "consent": True }, coalesce_key="s1:0x1")
+		self._queue.claim("w1", 60)
+		second = self._queue.enqueue("set_consent", { "consent": False }, coalesce_key="s1:0x1")
+
+		self._expire(first)
+		self.assertEqual(self._queue.claim("w2", 60)["id"], first)
+		self.assertIsNone(self._queue.claim("w2", 60))
+
+	def test_lost_lease(self):
+		"""
+		Test that a worker whose lease expired cannot finish a job that another worker claimed since.
+		"""
+
+		job_id = self._queue.enqueue("set_consent", { "consent": True })
+		self._queue.claim("w1", 60)
+		self._expire(job_id)
+		self._queue.claim("w2", 60)
+
+		self.assertFalse(self._queue.complete(job_id, "w1"))
+		self.assertFalse(self._queue.fail(job_id, "w1", "Timed out", 0))
+		job = self._queue.get(job_id)
+		self.assertEqual((job["status"], job["locked_by"]), (JobQueue.RUNNING, "w2"))
+
+		self.assertTrue(self._queue.complete(job_id, "w2"))
+		self.assertEqual(self._queue.get(job_id)["status"], JobQueue.DONE)
+
+	def test_fail(self):
+		"""
+		Test that a failed job is retried unless it has failed for the last time.
+		"""
+
+		job_id = self._queue.enqueue("set_consent", { "consent": True })
+		self._queue.claim("w1", 60)
+		self.assertTrue(self._queue.fail(job_id, "w1", "Node unreachable", 0))
+		self.assertEqual(self._queue.get(job_id)["status"], JobQueue.PENDING)
+
+		self._queue.claim("w1", 60)
+		self.assertTrue(self._queue.fail(job_id, "w1", "Node unreachable"))
+		job = self._queue.get(job_id)
+		self.assertEqual((job["status"], job["last_error"]), (JobQueue.FAILED, "Node unreachable"))
+
+	def test_pending_transaction(self):
+		"""
+		Test that the hash of a transaction that was not mined in time is kept with the job, and given to the retry.
+		"""
+
+		calls = []
+		def set_consent(tx_hash=None, **kwargs):
+			calls.append(tx_hash)
+			if len(calls) == 1:
+				raise TransactionPendingException("0xab")
+
+		job_id = self._queue.enqueue("set_consent", { "study_id": "s1" })
+		worker = JobWorker(self._queue, { "set_consent": set_consent }, worker_id="w1", backoff=0)
+		self.assertTrue(worker.run_once())
+		self.assertEqual(self._queue.get(job_id)["tx_hash"], "0xab")
+
+		self.assertTrue(worker.run_once())
+		self.assertEqual(calls, [ None, "0xab" ])
+		self.assertEqual(self._queue.get(job_id)["status"], JobQueue.DONE)
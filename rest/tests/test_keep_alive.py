@@ -0,0 +1,247 @@
+"""
+Test that the built-in server keeps connections open between requests.
+"""
+
+import http.client
+import io
+import os
+import socket
+import sys
+import threading
+import unittest
+
+from wsgiref.simple_server import make_server
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from coauth.oauth_request_handler import BoundedInput, OAuthRequestHandler, OAuthServer
+
+from config import server as server_config
+
+def application(env, start_response):
+	"""
+	A small WSGI application that serves the tests' requests.
+	The `/echo` path returns the request body with its length, `/stream` returns a body without a length and `/ignore` does not read the body.
+
+	:param env: The request environment.
+	:type env: dict
+	:param start_response: The function that starts the response.
+	:type start_response: function
+
+	:return: The response body.
+	:rtype: list of bytes or generator
+	"""
+
+	if env["PATH_INFO"] == "/echo":
+		body = env["wsgi.input"].read()
+		start_response("200 OK", [ ("Content-Length", str(len(body))) ])
+		return [ body ]
+
+	if env["PATH_INFO"] == "/stream":
+		start_response("200 OK", [ ("Content-Type", "text/plain") ])
+		return (part for part in [ b"one ", b"", b"two" ])
+
+	start_response("204 No Content", [ ("Content-Length", "0") ])
+	return [ b"" ]
+
+class KeepAliveTest(unittest.TestCase):
+	"""
+	Test that connections are kept open, that responses without a length are sent in chunks and that connections are closed when they must be.
+	"""
+
+	@classmethod
+	def setUpClass(self):
+		"""
+		Start the server on a free port.
+		"""
+
+		self._httpd = make_server("localhost", 0, application, server_class=OAuthServer, handler_class=OAuthRequestHandler)
+		self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+		self._thread.start()
+
+	@classmethod
+	def tearDownClass(self):
+		"""
+		Stop the server.
+		"""
+
+		self._httpd.shutdown()
+		self._httpd.server_close()
+
+	def setUp(self):
+		"""
+		Open a connection to the server.
+		"""
+
+		self._max_requests = server_config.keep_alive_max_requests
+		self._timeout = server_config.keep_alive_timeout
+		self._connection = http.client.HTTPConnection("localhost", self._httpd.server_port, timeout=5)
+
+	def tearDown(self):
+		"""
+		Close the connection and restore the configuration.
+		"""
+
+		self._connection.close()
+		server_config.keep_alive_max_requests = self._max_requests
+		server_config.keep_alive_timeout = self._timeout
+
+	def _request(self, method, path, body=None):
+		"""
+		Send a request over the connection and read the response.
+
+		:param method: The request's method.
+		:type method: str
+		:param path: The request's path.
+		:type path: str
+		:param body: The request's body.
+		:type body: bytes or None
+
+		:return: The response and its body.
+		:rtype: tuple
+		"""
+
+		self._connection.request(method, path, body)
+		response = self._connection.getresponse()
+		return response, response.read()
+
+	def _raw(self, request):
+		"""
+		Send a raw request over a new connection, and read until the server closes the connection.
+
+		:param request: The raw request.
+		:type request: bytes
+
+		:return: Everything that the server sent.
+		:rtype: bytes
+		"""
+
+		with socket.create_connection(("localhost", self._httpd.server_port), timeout=5) as client:
+			client.sendall(request)
+			received = b""
+			data = client.recv(65536)
+			while data:
+				received += data
+				data = client.recv(65536)
+			return received
+
+	def test_keep_alive(self):
+		"""
+		Test that several requests are served over the same connection.
+		"""
+
+		response, body = self._request("POST", "/echo", b"hello")
+		self.assertEqual(body, b"hello")
+		sock = self._connection.sock
+		self.assertIsNotNone(sock)
+
+		response, body = self._request("POST", "/echo", b"world")
+		self.assertEqual(body, b"world")
+		self.assertIs(self._connection.sock, sock)
+
+	def test_drain(self):
+		"""
+		Test that a body that the application does not read is skipped, so that the next request is read correctly.
+		"""
+
+		response, _ = self._request("POST", "/ignore", b"x" * 1000)
+		self.assertEqual(response.status, 204)
+		sock = self._connection.sock
+
+		response, body = self._request("POST", "/echo", b"next")
+		self.assertEqual(body, b"next")
+		self.assertIs(self._connection.sock, sock)
+
+	def test_chunked(self):
+		"""
+		Test that a response without a length is sent in chunks, without ending the body early, and that the connection stays open.
+		"""
+
+		response, body = self._request("GET", "/stream")
+		self.assertEqual(response.getheader("Transfer-Encoding"), "chunked")
+		self.assertEqual(body, b"one two")
+		self.assertIsNotNone(self._connection.sock)
+
+		response, body = self._request("POST", "/echo", b"after")
+		self.assertEqual(body, b"after")
+
+	def test_http_10(self):
+		"""
+		Test that a response without a length is not sent in chunks to HTTP/1.0 clients, and that the connection is closed after it instead.
+		"""
+
+		received = self._raw(b"GET /stream HTTP/1.0\r\n\r\n")
+		self.assertIn(b"Connection: close", received)
+		self.assertNotIn(b"chunked", received)
+		self.assertTrue(received.endswith(b"one two"))
+
+	def test_max_requests(self):
+		"""
+		Test that the connection is closed once it has served the maximum number of requests.
+		"""
+
+		server_config.keep_alive_max_requests = 2
+		self.assertEqual(self._request("POST", "/echo", b"1")[0].getheader("Connection"), None)
+		self.assertEqual(self._request("POST", "/echo", b"2")[0].getheader("Connection"), "close")
+		self.assertIsNone(self._connection.sock)
+
+	def test_idle_timeout(self):
+		"""
+		Test that an idle connection is closed once the keep-alive timeout expires.
+		"""
+
+		server_config.keep_alive_timeout = 0.2
+		self.assertEqual(self._raw(b""), b"")
+
+class BoundedInputTest(unittest.TestCase):
+	"""
+	Test that the request body ends after its length, even though the connection's stream goes on.
+	"""
+
+	def setUp(self):
+		"""
+		Create a body followed by the next request on the stream.
+		"""
+
+		self._stream = io.BytesIO(b"first\nsecond\nGET / HTTP/1.1\r\n")
+		self._body = BoundedInput(self._stream, 13)
+
+	def test_read(self):
+		"""
+		Test that reads stop at the end of the body.
+		"""
+
+		self.assertEqual(self._body.read(3), b"fir")
+		self.assertEqual(self._body.read(), b"st\nsecond\n")
+		self.assertEqual(self._body.read(), b"")
+		self.assertEqual(self._stream.read(), b"GET / HTTP/1.1\r\n")
+
+	def test_readline(self):
+		"""
+		Test that lines stop at the end of the body.
+		"""
+
+		self.assertEqual(list(self._body), [ b"first\n", b"second\n" ])
+		self.assertEqual(self._body.readline(), b"")
+
+	def test_drain(self):
+		"""
+		Test that the rest of the body is skipped if it is short enough.
+		"""
+
+		self.assertFalse(self._body.drain(5))
+		self._body.read(6)
+		self.assertTrue(self._body.drain(7))
+		self.assertEqual(self._stream.read(), b"GET / HTTP/1.1\r\n")
+
+	def test_truncated(self):
+		"""
+		Test that a body that ends before its length is not drained.
+		"""
+
+		body = BoundedInput(io.BytesIO(b"short"), 10)
+		self.assertFalse(body.drain(10))
+		self.assertEqual(body.read(), b"")
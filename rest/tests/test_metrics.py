@@ -0,0 +1,113 @@
+"""
+Test who can read the server's metrics.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+from oauth2 import error
+from oauth2.datatype import AccessToken
+from types import SimpleNamespace
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from server.resource_server import ResourceServer
+
+from config import server as server_config
+
+class TokenStore(object):
+	"""
+	An access token store that knows two tokens: one with the metrics scope and one without it.
+	"""
+
+	tokens = {
+		"admin": AccessToken("client", "client_credentials", "admin", scopes=[ "admin" ], expires_at=int(time.time()) + 3600),
+		"user": AccessToken("client", "client_credentials", "user", scopes=[ "create_participant" ], expires_at=int(time.time()) + 3600),
+	}
+
+	def fetch_by_token(self, token):
+		"""
+		Get the access token.
+
+		:param token: The access token.
+		:type token: str
+
+		:return: The access token.
+		:rtype: :class:`oauth2.datatype.AccessToken`
+
+		:raises: :class:`oauth2.error.AccessTokenNotFound`
+		"""
+
+		if token not in self.tokens:
+			raise error.AccessTokenNotFound()
+		return self.tokens[token]
+
+class MetricsAccessTest(unittest.TestCase):
+	"""
+	Test that the metrics need an access token with the metrics scope, unless the configuration allows requests from the local host.
+	"""
+
+	def setUp(self):
+		"""
+		Create the resource server, without its routes.
+		"""
+
+		self._server = ResourceServer.__new__(ResourceServer)
+		self._server.access_token_store = TokenStore()
+		self._server._metrics_scope = "admin"
+		self._metrics_local_access = server_config.metrics_local_access
+
+	def tearDown(self):
+		"""
+		Restore the configuration.
+		"""
+
+		server_config.metrics_local_access = self._metrics_local_access
+
+	def _get(self, remote_addr, token=""):
+		"""
+		Request the metrics.
+
+		:param remote_addr: The address of the client.
+		:type remote_addr: str
+		:param token: The access token.
+		:type token: str
+
+		:return: The response's status code.
+		:rtype: int
+		"""
+
+		request = SimpleNamespace(header=lambda name: token if name == "Authorization" else None)
+		return self._server._handle_metrics(request, { "REMOTE_ADDR": remote_addr }).status_code
+
+	def test_default(self):
+		"""
+		Test that the local host needs an access token by default, since a reverse proxy on the same host would make every request local.
+		"""
+
+		server_config.metrics_local_access = False
+		for remote_addr in [ "127.0.0.1", "::1", "localhost", "192.0.2.1" ]:
+			self.assertEqual(401, self._get(remote_addr))
+			self.assertEqual(403, self._get(remote_addr, "user"))
+			self.assertEqual(200, self._get(remote_addr, "admin"))
+
+	def test_local_access(self):
+		"""
+		Test that the local host, including clients of the Unix domain socket, can read the metrics without an access token if the configuration allows it.
+		"""
+
+		server_config.metrics_local_access = True
+		for remote_addr in [ "127.0.0.1", "::1", "localhost" ]:
+			self.assertEqual(200, self._get(remote_addr))
+
+		self.assertEqual(401, self._get("192.0.2.1"))
+		self.assertEqual(403, self._get("192.0.2.1", "user"))
+		self.assertEqual(200, self._get("192.0.2.1", "admin"))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,127 @@
+"""
+Test the streaming parser of multipart request bodies.
+"""
+
+import io
+import os
+import sys
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from server.exceptions import request_exceptions
+from server.multipart import MultipartParser
+
+BOUNDARY = "----boundary1234"
+
+def encode(parts, boundary=BOUNDARY):
+	"""
+	Encode parts as a multipart body.
+
+	:param parts: The parts, as tuples with their names and contents.
+	:type parts: list of tuple
+	:param boundary: The boundary that separates the parts.
+	:type boundary: str
+
+	:return: The body.
+	:rtype: bytes
+	"""
+
+	body = b"preamble\r\n"
+	for name, content in parts:
+		body += b"--%s\r\nContent-Disposition: form-data; name=\"%s\"\r\n\r\n%s\r\n" % (boundary.encode(), name.encode(), content)
+	return body + b"--%s--\r\nepilogue" % boundary.encode()
+
+class MultipartParserTest(unittest.TestCase):
+	"""
+	Test that bodies are split into their parts however they are read, and that malformed bodies are rejected.
+	"""
+
+	def _parse(self, body, content_type="multipart/form-data; boundary=%s" % BOUNDARY, length=None, **kwargs):
+		"""
+		Parse a body.
+
+		:param body: The body.
+		:type body: bytes
+		:param content_type: The request's content type.
+		:type content_type: str
+		:param length: The length of the body, which is the body's actual length by default.
+		:type length: int or None
+
+		:return: The parts, with their names as keys.
+		:rtype: dict
+		"""
+
+		stream = io.BytesIO(body)
+		parts = MultipartParser(stream, content_type, len(body) if length is None else length, **kwargs).parse()
+		self.assertEqual(stream.read(), b"")
+		return parts
+
+	def test_parse(self):
+		"""
+		Test that the parts are returned with their names, and that the preamble and the epilogue are skipped.
+		"""
+
+		body = encode([ ("username", b"nick"), ("card", b"\x00\x01\r\n\xff") ])
+		self.assertEqual(self._parse(body), { "username": b"nick", "card": b"\x00\x01\r\n\xff" })
+
+	def test_split_delimiter(self):
+		"""
+		Test that delimiters that are split across chunks are found.
+		"""
+
+		parts = [ ("username", b"nick"), ("card", b"--" + BOUNDARY.encode()[:-1] + b"\r\n-") ]
+		body = encode(parts)
+		for chunk_size in range(1, len(body) + 1):
+			self.assertEqual(self._parse(body, chunk_size=chunk_size), dict(parts), chunk_size)
+
+	def test_spill(self):
+		"""
+		Test that parts are only spilled to a temporary file if they are larger than the threshold.
+		"""
+
+		parts = self._parse(encode([ ("small", b"a" * 100), ("large", b"b" * 101) ]), spill_threshold=100, chunk_size=7)
+		self.assertEqual(parts["small"], b"a" * 100)
+		self.assertEqual(parts["large"].read(), b"b" * 101)
+		parts["large"].close()
+
+	def test_truncated(self):
+		"""
+		Test that a body that ends before it is closed is rejected, whether the stream or the length is cut short.
+		"""
+
+		body = encode([ ("username", b"nick") ])
+		for truncated in [ body[:len(body) // 2], body[:body.index(b"nick")], body[:body.rindex(b"--")] ]:
+			self.assertRaises(request_exceptions.MalformedBodyException, self._parse, truncated)
+
+		self.assertRaises(request_exceptions.MalformedBodyException, self._parse, body, length=len(body) // 2)
+
+	def test_missing_boundary(self):
+		"""
+		Test that a content type without a boundary, or a body without the boundary, is rejected.
+		"""
+
+		body = encode([ ("username", b"nick") ])
+		self.assertRaises(request_exceptions.MalformedBodyException, self._parse, body, content_type="multipart/form-data")
+		self.assertRaises(request_exceptions.MalformedBodyException, self._parse, body, content_type="multipart/form-data; boundary=other")
+
+	def test_header_size(self):
+		"""
+		Test that parts whose headers are too large are rejected.
+		"""
+
+		body = b"--%s\r\nContent-Disposition: form-data; name=\"a\"\r\nX-Padding: %s\r\n\r\nnick\r\n--%s--" % (
+			BOUNDARY.encode(), b"x" * MultipartParser.max_header_size, BOUNDARY.encode())
+		self.assertRaises(request_exceptions.MalformedBodyException, self._parse, body)
+
+	def test_quoted_boundary(self):
+		"""
+		Test that a quoted boundary is used without its quotes.
+		"""
+
+		boundary = "quoted boundary:1"
+		body = encode([ ("username", b"nick") ], boundary)
+		self.assertEqual(self._parse(body, content_type="multipart/form-data; boundary=\"%s\"; charset=utf-8" % boundary), { "username": b"nick" })
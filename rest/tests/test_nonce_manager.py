@@ -0,0 +1,162 @@
+"""
+Test that nonces are allocated without gaps or duplicates, and that they are synchronized with the node.
+"""
+
+import os
+import sys
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.api.ethereum.nonce_manager import NonceManager
+
+from .environment import *
+
+ADDRESS = "0x0000000000000000000000000000000000000001"
+
+class NonceManagerTest(unittest.TestCase):
+	"""
+	Test the allocation, release and synchronization of nonces.
+
+	:ivar _count: The number of transactions that the fake node knows of.
+	:vartype _count: int
+	"""
+
+	@classmethod
+	def setUpClass(self):
+		"""
+		Create the schema and connect with the database.
+		"""
+
+		create_testing_environment()
+		self._connection = PostgreSQLConnection.connect(TEST_DATABASE)
+
+	@classmethod
+	def tearDownClass(self):
+		"""
+		Close the connection with the database.
+		"""
+
+		self._connection.close()
+
+	def setUp(self):
+		"""
+		Remove the nonces that earlier tests allocated, and start the node at five transactions.
+		"""
+
+		self._connection.execute("DELETE FROM ethereum_nonces")
+		self._count = 5
+		self._nonces = NonceManager(self._connection, ADDRESS, lambda: self._count)
+
+	def _state(self):
+		"""
+		Get the account's next nonce and released nonces.
+
+		:return: The next nonce and the released nonces.
+		:rtype: tuple
+		"""
+
+		row = self._connection.select_one("SELECT next_nonce, released FROM ethereum_nonces WHERE address = '%s'" % ADDRESS)
+		return int(row["next_nonce"]), [ int(nonce) for nonce in row["released"] ]
+
+	def test_allocate(self):
+		"""
+		Test that the first nonce is read from the node, and that the next ones follow it.
+		"""
+
+		self.assertEqual([ self._nonces.allocate() for _ in range(3) ], [ 5, 6, 7 ])
+		self.assertEqual(self._state(), (8, []))
+
+	def test_release(self):
+		"""
+		Test that the last nonce is given back, and that other released nonces are allocated again first.
+		"""
+
+		nonces = [ self._nonces.allocate() for _ in range(4) ]
+		self._nonces.release(nonces[-1])
+		self.assertEqual(self._state(), (8, []))
+
+		self._nonces.release(nonces[1])
+		self._nonces.release(nonces[0])
+		self.assertEqual(self._state(), (8, [ 5, 6 ]))
+		self.assertEqual([ self._nonces.allocate() for _ in range(3) ], [ 5, 6, 8 ])
+
+	def test_resync(self):
+		"""
+		Test that the next nonce follows the node forward, and that released nonces that the node has seen are discarded.
+		"""
+
+		nonces = [ self._nonces.allocate() for _ in range(3) ]
+		self._nonces.release(nonces[0])
+		self._count = 6
+		self._nonces.resync()
+		self.assertEqual(self._state(), (8, []))
+
+		self._count = 10
+		self._nonces.resync()
+		self.assertEqual(self._nonces.allocate(), 10)
+
+	def test_no_rewind(self):
+		"""
+		Test that the next nonce is not moved back if no grace period is given.
+		"""
+
+		[ self._nonces.allocate() for _ in range(3) ]
+		self._nonces.resync()
+		self._nonces.resync()
+		self.assertEqual(self._state(), (8, []))
+
+	def test_rewind(self):
+		"""
+		Test that a gap that is seen twice, after the grace period, is filled.
+		"""
+
+		nonces = NonceManager(self._connection, ADDRESS, lambda: self._count, stuck_after=0)
+		[ nonces.allocate() for _ in range(3) ]
+		nonces.release(6)
+
+		nonces.resync()
+		self.assertEqual(self._state(), (8, [ 6 ]))
+		nonces.resync()
+		self.assertEqual(self._state(), (5, []))
+		self.assertEqual(nonces.allocate(), 5)
+
+	def test_in_flight(self):
+		"""
+		Test that a gap is not filled if the node's count moves in the meantime, or if the grace period has not passed.
+		"""
+
+		nonces = NonceManager(self._connection, ADDRESS, lambda: self._count, stuck_after=0)
+		[ nonces.allocate() for _ in range(3) ]
+		nonces.resync()
+		self._count = 6
+		nonces.resync()
+		self.assertEqual(self._state(), (8, []))
+
+		nonces = NonceManager(self._connection, ADDRESS, lambda: self._count, stuck_after=60)
+		nonces.resync()
+		nonces.resync()
+		self.assertEqual(self._state(), (8, []))
+
+	def test_released_gap(self):
+		"""
+		Test that a gap that is a released nonce is not moved back to, since it is allocated again anyway.
+		"""
+
+		nonces = NonceManager(self._connection, ADDRESS, lambda: self._count, stuck_after=0)
+		[ nonces.allocate() for _ in range(3) ]
+		nonces.release(5)
+		nonces.resync()
+		nonces.resync()
+		self.assertEqual(self._state(), (8, [ 5 ]))
+
+	def test_is_nonce_error(self):
+		"""
+		Test that the node's nonce errors are recognized.
+		"""
+
+		self.assertTrue(self._nonces.is_nonce_error(ValueError({ "message": "Nonce too low" })))
+		self.assertFalse(self._nonces.is_nonce_error(ValueError("insufficient funds")))
@@ -0,0 +1,68 @@
+"""
+Test the cache of the participants of each study, which card lookups use.
+"""
+
+import os
+import sys
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.participant_cache import ParticipantCache
+
+from .fixtures import LocalIndex
+
+class ParticipantCacheTest(unittest.TestCase):
+	"""
+	Test that the participants of each study are read once, and read again when they change.
+	"""
+
+	def setUp(self):
+		"""
+		Create the cache on top of a chain whose reads are counted.
+		"""
+
+		self._participants = { "s1": [ "0x1", "0x2" ] }
+		self._reads = []
+		self._index = LocalIndex()
+
+		def fetch(study_id):
+			self._reads.append(study_id)
+			return list(self._participants.get(study_id, []))
+
+		self._cache = ParticipantCache(self._index, fetch)
+
+	def test_cached(self):
+		"""
+		Test that a study's participants are only read once.
+		"""
+
+		self.assertEqual(self._cache.participating("s1", [ "0x3", "0x2", "0x1" ]), [ "0x2", "0x1" ])
+		self.assertEqual(self._cache.participating("s1", [ "0x1" ]), [ "0x1" ])
+		self.assertEqual(self._cache.participating("s1", [ "0x3" ]), [ ])
+		self.assertEqual(self._reads, [ "s1" ])
+
+	def test_invalidate(self):
+		"""
+		Test that a study's participants are read again once a consent change in it is confirmed.
+		"""
+
+		self._cache.participating("s1", [ "0x1" ])
+		self._participants["s1"].append("0x3")
+		self._cache.invalidate("s1")
+		self.assertEqual(self._cache.participating("s1", [ "0x3" ]), [ "0x3" ])
+		self.assertEqual(self._reads, [ "s1", "s1" ])
+
+	def test_other_process(self):
+		"""
+		Test that a study's participants are read again if the participant index has a participant that is not cached.
+		"""
+
+		self._cache.participating("s1", [ "0x1" ])
+		self._participants["s1"].append("0x3")
+		self._index.changes[("s1", "0x3")] = True
+		self.assertEqual(self._cache.participating("s1", [ "0x3" ]), [ "0x3" ])
+		self.assertEqual(self._reads, [ "s1", "s1" ])
@@ -0,0 +1,89 @@
+"""
+Test the index of the studies in which each participant has a consent recorded.
+"""
+
+import os
+import sys
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.participant_index import ParticipantIndex, ParticipantIndexer
+
+from .environment import *
+from .fixtures import LocalChain
+
+class ParticipantIndexTest(unittest.TestCase):
+	"""
+	Test that the participant index is backfilled from the blockchain and updated with confirmed consent changes.
+	"""
+
+	@classmethod
+	def setUpClass(self):
+		"""
+		Create the schema and connect with the database.
+		"""
+
+		create_testing_environment()
+		self._connection = PostgreSQLConnection.connect(TEST_DATABASE)
+
+	@classmethod
+	def tearDownClass(self):
+		"""
+		Close the connection with the database.
+		"""
+
+		self._connection.close()
+
+	def setUp(self):
+		"""
+		Create two studies that are not synced.
+		"""
+
+		self._connection.execute([
+			"DELETE FROM participant_studies",
+			"DELETE FROM participant_index_studies",
+			"DELETE FROM studies WHERE study_id IN ('pi1', 'pi2')",
+			"INSERT INTO studies (study_id, name, description, homepage) VALUES ('pi1', 'Study 1', '', '')",
+			"INSERT INTO studies (study_id, name, description, homepage) VALUES ('pi2', 'Study 2', '', '')",
+		])
+		self._index = ParticipantIndex(self._connection)
+		self._chain = LocalChain()
+		self._indexer = ParticipantIndexer(self._index, self._chain)
+
+	def tearDown(self):
+		"""
+		Remove the studies.
+		"""
+
+		self._connection.execute("DELETE FROM studies WHERE study_id IN ('pi1', 'pi2')")
+
+	def test_backfill(self):
+		"""
+		Test that the indexer adds the participants of the studies that are not synced, including those who withdrew.
+		"""
+
+		self._chain.participants = { "pi1": [ "0x1", "0x2" ] }
+		self._chain.consenting = { "pi1": [ "0x1" ] }
+
+		self.assertEqual(self._index.synced([ "pi1", "pi2" ]), set())
+		self._indexer.sync_once()
+		self.assertEqual(self._index.synced([ "pi1", "pi2" ]), { "pi1", "pi2" })
+		self.assertEqual(self._index.consents([ "0x1", "0x2" ]), { ("pi1", "0x1"): True, ("pi1", "0x2"): False })
+		self.assertEqual(self._indexer.sync_once(), 0)
+
+	def test_record(self):
+		"""
+		Test that confirmed consent changes overwrite the backfilled consent, and that the backfill does not overwrite them.
+		"""
+
+		self._chain.consenting = { "pi1": [ "0x1" ] }
+		self._index.record("pi1", "0x1", False)
+		self._index.record("pi2", "0x1", True)
+		self._indexer.sync_once()
+
+		self.assertEqual(self._index.consents([ "0x1" ]), { ("pi1", "0x1"): False, ("pi2", "0x1"): True })
+		self.assertEqual(self._index.consents([ "0x2" ]), { })
@@ -0,0 +1,173 @@
+"""
+Test the HTTP sessions that the blockchain backends use to talk to their nodes.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.api.session import PooledSession
+
+class NodeRequestHandler(BaseHTTPRequestHandler):
+	"""
+	A stand-in for a blockchain node, which records the requests that it receives and the connections that they arrive on.
+	The `/flaky` path fails with a 503 the first two times that it is requested, and the `/slow` path takes a quarter of a second to respond.
+	"""
+
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		"""
+		Serve a `GET` request.
+		"""
+
+		self._respond()
+
+	def do_POST(self):
+		"""
+		Serve a `POST` request, after reading its body.
+		"""
+
+		self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		self._respond()
+
+	def _respond(self):
+		"""
+		Record the request and send the response.
+		"""
+
+		server = self.server
+		with server.lock:
+			server.requests.append((self.command, self.path))
+			server.clients.add(self.client_address)
+			failed = self.path == "/flaky" and server.requests.count((self.command, self.path)) <= 2
+
+		if self.path == "/slow":
+			time.sleep(0.25)
+
+		body = b"unavailable" if failed else b"ok"
+		try:
+			self.send_response(503 if failed else 200)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+		except ConnectionError:
+			"""
+			The client stopped waiting for the response.
+			"""
+			self.close_connection = True
+
+	def log_message(self, format, *args):
+		"""
+		Do not log the requests.
+		"""
+
+		pass
+
+class PooledSessionTest(unittest.TestCase):
+	"""
+	Test that connections are kept open and bounded, that only safe requests are retried and that requests time out by default.
+	"""
+
+	@classmethod
+	def setUpClass(self):
+		"""
+		Start the node on a free port.
+		"""
+
+		self._httpd = ThreadingHTTPServer(("localhost", 0), NodeRequestHandler)
+		self._httpd.daemon_threads = True
+		self._httpd.lock = threading.Lock()
+		self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+		self._thread.start()
+		self._url = "http://localhost:%d" % self._httpd.server_port
+
+	@classmethod
+	def tearDownClass(self):
+		"""
+		Stop the node.
+		"""
+
+		self._httpd.shutdown()
+		self._httpd.server_close()
+
+	def setUp(self):
+		"""
+		Forget the requests of earlier tests and create the session.
+		"""
+
+		self._httpd.requests = []
+		self._httpd.clients = set()
+		self._session = PooledSession(2, 2, 0, 5)
+
+	def tearDown(self):
+		"""
+		Close the session.
+		"""
+
+		self._session.close()
+
+	def test_keep_alive(self):
+		"""
+		Test that requests reuse the same connection.
+		"""
+
+		for _ in range(3):
+			self.assertEqual(self._session.get(self._url + "/").text, "ok")
+		self.assertEqual(len(self._httpd.clients), 1)
+
+	def test_pool_size(self):
+		"""
+		Test that concurrent requests wait for a connection instead of opening more connections than the pool allows.
+		"""
+
+		session = PooledSession(1, 0, 0, 5)
+		threads = [ threading.Thread(target=session.get, args=(self._url + "/slow", )) for _ in range(3) ]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		session.close()
+
+		self.assertEqual(len(self._httpd.requests), 3)
+		self.assertEqual(len(self._httpd.clients), 1)
+
+	def test_retry(self):
+		"""
+		Test that idempotent requests are retried when the node is unavailable.
+		"""
+
+		response = self._session.get(self._url + "/flaky")
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(self._httpd.requests, [ ("GET", "/flaky") ] * 3)
+
+	def test_no_retry(self):
+		"""
+		Test that `POST` requests, which may send transactions, are not retried.
+		"""
+
+		response = self._session.post(self._url + "/flaky", json={ "method": "eth_sendRawTransaction" })
+		self.assertEqual(response.status_code, 503)
+		self.assertEqual(self._httpd.requests, [ ("POST", "/flaky") ])
+
+	def test_timeout(self):
+		"""
+		Test that requests time out after the default timeout, unless they give their own.
+		"""
+
+		session = PooledSession(1, 0, 0, 0.05)
+		with self.assertRaises(requests.exceptions.RequestException):
+			session.post(self._url + "/slow")
+		self.assertEqual(session.post(self._url + "/slow", timeout=5).text, "ok")
+		session.close()
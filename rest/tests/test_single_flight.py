@@ -0,0 +1,262 @@
+"""
+Test the single flight that lets identical concurrent blockchain reads share one call.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.api import BlockchainAPI
+from threads.single_flight import SingleFlight
+
+class BlockingAPI(BlockchainAPI):
+	"""
+	A blockchain backend whose consent reads block until they are released.
+
+	:ivar release: The event that releases the reads.
+	:vartype release: :class:`threading.Event`
+	:ivar calls: The arguments of the reads that were made.
+	:vartype calls: list of tuple
+	"""
+
+	def __init__(self):
+		"""
+		Create the backend without any reads.
+		"""
+
+		self.release = threading.Event()
+		self.calls = []
+
+	def create_participant(self, username, *args, **kwargs):
+		"""
+		The tests do not use this function.
+		"""
+
+		pass
+
+	def create_study(self, study_id, *args, **kwargs):
+		"""
+		The tests do not use this function.
+		"""
+
+		pass
+
+	def set_consent(self, study_id, username, consent, *args, **kwargs):
+		"""
+		The tests do not use this function.
+		"""
+
+		pass
+
+	def get_studies_by_participant(self, username, *args, **kwargs):
+		"""
+		The tests do not use this function.
+		"""
+
+		pass
+
+	def get_consent_trail(self, study_id, username, *args, **kwargs):
+		"""
+		The tests do not use this function.
+		"""
+
+		pass
+
+	def has_consent(self, study_id, username, *args, fresh=False, **kwargs):
+		"""
+		Check whether the participant consents to the study, once the read is released.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param username: The participant's address.
+		:type username: str
+		:param fresh: A boolean indicating whether the consent must be read from the blockchain itself.
+		:type fresh: bool
+
+		:return: A boolean indicating whether the participant consents to the study.
+		:rtype: bool
+		"""
+
+		self.calls.append((study_id, username, kwargs.get("port")))
+		self.release.wait(5)
+		return True
+
+class SingleFlightTest(unittest.TestCase):
+	"""
+	Test that identical calls in flight are shared, and that other calls are not.
+	"""
+
+	def setUp(self):
+		"""
+		Create the single flight, and a call that blocks until it is released.
+		"""
+
+		self._single_flight = SingleFlight()
+		self._release = threading.Event()
+		self._calls = []
+
+	def _read(self, study_id):
+		"""
+		Make a read that blocks until it is released.
+
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+
+		:return: The participants of the study.
+		:rtype: list of str
+
+		:raises: ValueError
+		"""
+
+		self._calls.append(study_id)
+		self._release.wait(5)
+		if study_id is None:
+			raise ValueError("No study")
+		return [ "0x1" ]
+
+	def _start(self, key, study_id, outcomes):
+		"""
+		Make a read in another thread, and wait until it is in flight.
+
+		:param key: The key of the read.
+		:type key: object
+		:param study_id: The unique ID of the study.
+		:type study_id: str
+		:param outcomes: The list to which the read's result or exception is added.
+		:type outcomes: list
+
+		:return: The thread that makes the read.
+		:rtype: :class:`threading.Thread`
+		"""
+
+		def run():
+			try:
+				outcomes.append(self._single_flight.do(key, self._read, study_id))
+			except Exception as e:
+				outcomes.append(e)
+
+		in_flight = self._single_flight.in_flight()
+		thread = threading.Thread(target=run)
+		thread.start()
+		while self._single_flight.in_flight() == in_flight and thread.is_alive():
+			pass
+		return thread
+
+	def test_shared(self):
+		"""
+		Test that identical calls in flight share one call and its result.
+		"""
+
+		outcomes = []
+		threads = [ self._start("s1", "s1", outcomes) ]
+		threads += [ threading.Thread(target=lambda: outcomes.append(self._single_flight.do("s1", self._read, "s1"))) for _ in range(4) ]
+		for thread in threads[1:]:
+			thread.start()
+
+		"""
+		Give the other calls time to join the call in flight.
+		"""
+		time.sleep(0.1)
+		self._release.set()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(self._calls, [ "s1" ])
+		self.assertEqual(sorted(shared for _, shared in outcomes), [ False, True, True, True, True ])
+		self.assertTrue(all(result == [ "0x1" ] for result, _ in outcomes))
+		self.assertEqual(self._single_flight.in_flight(), 0)
+
+	def test_different_keys(self):
+		"""
+		Test that calls with different keys are not shared.
+		"""
+
+		outcomes = []
+		threads = [ self._start("s1", "s1", outcomes), self._start("s2", "s2", outcomes) ]
+		self._release.set()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(sorted(self._calls), [ "s1", "s2" ])
+
+	def test_exception(self):
+		"""
+		Test that the exception of a shared call is raised to all its callers, and that the next call is made again.
+		"""
+
+		outcomes = []
+		threads = [ self._start("none", None, outcomes) ]
+		threads.append(threading.Thread(target=lambda: self.assertRaises(ValueError, self._single_flight.do, "none", self._read, None)))
+		threads[1].start()
+		time.sleep(0.1)
+		self._release.set()
+		for thread in threads:
+			thread.join()
+
+		self.assertIsInstance(outcomes[0], ValueError)
+		self.assertEqual(self._single_flight.do("s1", self._read, "s1"), ([ "0x1" ], False))
+
+class CoalescedReadTest(unittest.TestCase):
+	"""
+	Test that the backends' identical consent reads are shared between requests.
+	"""
+
+	def setUp(self):
+		"""
+		Create the backend.
+		"""
+
+		self._api = BlockingAPI()
+
+	def _read(self, calls):
+		"""
+		Make concurrent reads, each with its own access token, and release them once they have had time to join.
+
+		:param calls: The other keyword arguments of each read.
+		:type calls: list of dict
+
+		:return: The reads' results.
+		:rtype: list of bool
+		"""
+
+		results = []
+		threads = [ threading.Thread(target=lambda kwargs=kwargs: results.append(self._api.has_consent("s1", "0x1", token=object(), **kwargs))) for kwargs in calls ]
+		for thread in threads:
+			thread.start()
+
+		time.sleep(0.1)
+		self._api.release.set()
+		for thread in threads:
+			thread.join()
+		return results
+
+	def test_token(self):
+		"""
+		Test that reads from different requests are shared, even though each request has its own token.
+		"""
+
+		self.assertEqual(self._read([ {} ] * 5), [ True ] * 5)
+		self.assertEqual(self._api.calls, [ ("s1", "0x1", None) ])
+
+	def test_port(self):
+		"""
+		Test that the arguments of the read itself are still compared.
+		"""
+
+		self._read([ { "port": 3001 }, { "port": 3002 } ])
+		self.assertEqual(sorted(port for _, _, port in self._api.calls), [ 3001, 3002 ])
+
+	def test_fresh(self):
+		"""
+		Test that fresh reads are never shared.
+		"""
+
+		self._read([ { "fresh": True } ] * 5)
+		self.assertEqual(len(self._api.calls), 5)
@@ -0,0 +1,270 @@
+"""
+Test the parts of the server that make startup faster: loading only the configured blockchain backend, caching contract artifacts and profiling startup.
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.blockchain.api import BlockchainAPI, load_backend
+from biobank.handlers.blockchain.api.ethereum import contract
+from server import startup
+
+class CustomAPI(BlockchainAPI):
+	"""
+	A blockchain backend that is not one of the known backends.
+	"""
+
+	pass
+
+class LoadBackendTest(unittest.TestCase):
+	"""
+	Test loading the blockchain backend by its name or by the path of its class.
+	"""
+
+	def test_name(self):
+		"""
+		Test that known backends are loaded by their name.
+		"""
+
+		backend = load_backend("ethereum")
+		self.assertEqual("EthereumAPI", backend.__name__)
+		self.assertTrue(issubclass(backend, BlockchainAPI))
+
+	def test_path(self):
+		"""
+		Test that other backends are loaded by the full path of their class.
+		"""
+
+		self.assertIs(CustomAPI, load_backend("%s.CustomAPI" % __name__))
+		self.assertIs(load_backend("ethereum"), load_backend("biobank.handlers.blockchain.api.ethereum.ethereum.EthereumAPI"))
+
+	def test_unknown(self):
+		"""
+		Test that unknown names are rejected.
+		"""
+
+		self.assertRaises(ValueError, load_backend, "bitcoin")
+		self.assertRaises(ValueError, load_backend, "")
+
+class ArtifactCacheTest(unittest.TestCase):
+	"""
+	Test that contract artifacts are cached in a compact form, and that the cache is only used while it is newer than the artifact.
+	"""
+
+	def setUp(self):
+		"""
+		Write a build artifact.
+		"""
+
+		self._directory = tempfile.TemporaryDirectory()
+		self._path = os.path.join(self._directory.name, "Contract.json")
+		self._cache_path = os.path.join(self._directory.name, "__pycache__", "Contract.json.cache")
+		self._write({ "abi": [ { "name": "f" } ], "bytecode": "0x01", "source": "contract C {}", "ast": { } })
+		contract.load_artifact.cache_clear()
+
+	def tearDown(self):
+		"""
+		Remove the artifact and forget the artifacts that were loaded.
+		"""
+
+		contract.load_artifact.cache_clear()
+		self._directory.cleanup()
+
+	def _write(self, artifact, path=None, mtime=None):
+		"""
+		Write an artifact.
+
+		:param artifact: The artifact.
+		:type artifact: dict
+		:param path: The path of the file, which defaults to the build artifact.
+		:type path: str or None
+		:param mtime: The modification time of the file.
+			If it is `None`, the modification time is the current time.
+		:type mtime: float or None
+		"""
+
+		path = path or self._path
+		with open(path, "w") as f:
+			json.dump(artifact, f)
+		if mtime is not None:
+			os.utime(path, (mtime, mtime))
+
+	def test_cache(self):
+		"""
+		Test that only the ABI and bytecode are cached.
+		"""
+
+		artifact = contract.load_artifact.__wrapped__(self._path)
+		self.assertEqual({ "abi": [ { "name": "f" } ], "bytecode": "0x01" }, artifact)
+		with open(self._cache_path) as f:
+			self.assertEqual(artifact, json.load(f))
+
+	def test_fresh_cache(self):
+		"""
+		Test that the cache is used while it is newer than the artifact.
+		"""
+
+		contract.load_artifact.__wrapped__(self._path)
+		self._write({ "abi": [], "bytecode": "0x02" }, self._cache_path, time.time() + 10)
+		self.assertEqual({ "abi": [], "bytecode": "0x02" }, contract.load_artifact.__wrapped__(self._path))
+
+	def test_stale_cache(self):
+		"""
+		Test that the artifact is read again once it changes, and that the cache is replaced.
+		"""
+
+		contract.load_artifact.__wrapped__(self._path)
+		self._write({ "abi": [], "bytecode": "0x03" }, mtime=time.time() + 10)
+		self.assertEqual({ "abi": [], "bytecode": "0x03" }, contract.load_artifact.__wrapped__(self._path))
+		with open(self._cache_path) as f:
+			self.assertEqual({ "abi": [], "bytecode": "0x03" }, json.load(f))
+
+	def test_invalid_cache(self):
+		"""
+		Test that a cache that cannot be parsed is ignored.
+		"""
+
+		os.makedirs(os.path.dirname(self._cache_path))
+		with open(self._cache_path, "w") as f:
+			f.write("{ \"abi\": ")
+		os.utime(self._cache_path, (time.time() + 10, time.time() + 10))
+		self.assertEqual({ "abi": [ { "name": "f" } ], "bytecode": "0x01" }, contract.load_artifact.__wrapped__(self._path))
+
+	def test_unwritable_cache(self):
+		"""
+		Test that the artifact is still loaded if the cache cannot be written.
+		"""
+
+		with open(os.path.join(self._directory.name, "__pycache__"), "w") as f:
+			f.write("")
+		self.assertEqual({ "abi": [ { "name": "f" } ], "bytecode": "0x01" }, contract.load_artifact.__wrapped__(self._path))
+
+	def test_process_cache(self):
+		"""
+		Test that each artifact is only loaded once in a process.
+		"""
+
+		artifact = contract.load_artifact(self._path)
+		os.remove(self._path)
+		self.assertIs(artifact, contract.load_artifact(self._path))
+
+class StartupProfileTest(unittest.TestCase):
+	"""
+	Test that the startup profile records imports and initialization steps, and that it is only reported when startup is profiled.
+	"""
+
+	def setUp(self):
+		"""
+		Profile startup with empty records.
+		The import profiler is only installed by the tests that need it.
+		"""
+
+		self._patches = [
+			mock.patch.object(startup, "_enabled", True),
+			mock.patch.object(startup, "_imports", []),
+			mock.patch.object(startup, "_steps", []),
+		]
+		for patch in self._patches:
+			patch.start()
+
+	def tearDown(self):
+		"""
+		Restore the records.
+		"""
+
+		for patch in self._patches:
+			patch.stop()
+
+	def _report(self):
+		"""
+		Report the startup profile.
+
+		:return: The report.
+		:rtype: str
+		"""
+
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			startup.report()
+		return output.getvalue()
+
+	def test_steps(self):
+		"""
+		Test that the steps are recorded in the order in which they ran, even if they fail.
+		"""
+
+		with startup.Step("first"):
+			pass
+
+		with self.assertRaises(RuntimeError):
+			with startup.Step("second"):
+				raise RuntimeError()
+
+		self.assertEqual([ "first", "second" ], [ name for name, _ in startup._steps ])
+
+		report = self._report()
+		self.assertTrue(report.startswith("Startup profile"))
+		self.assertLess(report.index("  first"), report.index("  second"))
+
+	def test_disabled(self):
+		"""
+		Test that nothing is recorded or reported when startup is not profiled.
+		"""
+
+		with mock.patch.object(startup, "_enabled", False):
+			with startup.Step("step"):
+				pass
+
+			self.assertEqual([], startup._steps)
+			self.assertFalse(startup.is_enabled())
+			self.assertEqual("", self._report())
+
+	def test_imports(self):
+		"""
+		Test that each module's own import time excludes the time of the modules that it imports.
+		"""
+
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		with open(os.path.join(directory.name, "startup_outer.py"), "w") as f:
+			f.write("import startup_inner\n")
+		with open(os.path.join(directory.name, "startup_inner.py"), "w") as f:
+			f.write("value = 1\n")
+
+		profiler = startup._ImportProfiler()
+		sys.path.insert(0, directory.name)
+		sys.meta_path.insert(0, profiler)
+		try:
+			import startup_outer
+		finally:
+			sys.meta_path.remove(profiler)
+			sys.path.remove(directory.name)
+			sys.modules.pop("startup_outer", None)
+			sys.modules.pop("startup_inner", None)
+
+		self.assertEqual(1, startup_outer.startup_inner.value)
+
+		imports = { name: (own, total) for name, own, total in startup._imports }
+		self.assertEqual({ "startup_outer", "startup_inner" }, set(imports))
+		self.assertAlmostEqual(imports["startup_outer"][1] - imports["startup_outer"][0], imports["startup_inner"][1])
+		self.assertAlmostEqual(imports["startup_inner"][0], imports["startup_inner"][1])
+
+		report = self._report()
+		self.assertTrue("Imports (2 modules" in report)
+		self.assertLess(report.index("startup_outer"), report.index("startup_inner"))
+
+if __name__ == "__main__":
+	unittest.main()
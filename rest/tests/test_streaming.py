@@ -0,0 +1,202 @@
+"""
+Test that rows are streamed from the database, and that they are serialized as JSON a chunk at a time.
+"""
+
+import json
+import os
+import sys
+import unittest
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from biobank.handlers.handler import RouteHandler
+
+from .environment import *
+
+class StreamingHandler(RouteHandler):
+	"""
+	A route handler that only streams responses, with small chunks so that the tests produce several of them.
+	"""
+
+	stream_chunk_size = 16
+
+class Rows(object):
+	"""
+	An iterable of rows that records whether it was closed.
+
+	:ivar rows: The rows.
+	:vartype rows: list
+	:ivar closed: A boolean indicating whether the rows were closed.
+	:vartype closed: bool
+	"""
+
+	def __init__(self, rows):
+		"""
+		Create the rows.
+
+		:param rows: The rows.
+		:type rows: list
+		"""
+
+		self.rows = rows
+		self.closed = False
+
+	def __iter__(self):
+		"""
+		Iterate over the rows.
+
+		:return: An iterator over the rows.
+		:rtype: iterator
+		"""
+
+		return iter(self.rows)
+
+	def close(self):
+		"""
+		Record that the rows were closed.
+		"""
+
+		self.closed = True
+
+class StreamTest(unittest.TestCase):
+	"""
+	Test that the rows of a query are fetched lazily, and that streaming does not end the transactions of other users of the connection.
+	"""
+
+	@classmethod
+	def setUpClass(self):
+		"""
+		Create the schema, connect with the database and create a table of numbers.
+		"""
+
+		create_testing_environment()
+		self._connection = PostgreSQLConnection.connect(TEST_DATABASE)
+		self._connection.execute([
+			"DROP TABLE IF EXISTS stream_numbers",
+			"CREATE TABLE stream_numbers (n INTEGER PRIMARY KEY)",
+			"INSERT INTO stream_numbers SELECT generate_series(1, 10)",
+		])
+
+	@classmethod
+	def tearDownClass(self):
+		"""
+		Remove the table and close the connection with the database.
+		"""
+
+		self._connection.execute("DROP TABLE stream_numbers")
+		self._connection.close()
+
+	def _open_cursors(self):
+		"""
+		Count the cursors that are open in the connection's session.
+
+		:return: The number of open cursors.
+		:rtype: int
+		"""
+
+		return self._connection.count("SELECT COUNT(*) FROM pg_cursors WHERE name LIKE 'stream_%'")
+
+	def test_stream(self):
+		"""
+		Test that all rows are streamed in order, whatever the size of the batches, and that the cursor is closed at the end.
+		"""
+
+		for size in [ 1, 3, 10, 100 ]:
+			rows = self._connection.stream("SELECT n FROM stream_numbers ORDER BY n", size=size)
+			self.assertEqual([ row["n"] for row in rows ], list(range(1, 11)))
+			self.assertEqual(self._open_cursors(), 0)
+
+	def test_interleaved(self):
+		"""
+		Test that other statements can use the connection while rows are being streamed.
+		"""
+
+		rows = self._connection.stream("SELECT n FROM stream_numbers ORDER BY n", size=2)
+		streamed = [ next(rows)["n"] ]
+		self._connection.execute("UPDATE stream_numbers SET n = n WHERE n = 1")
+		self.assertEqual(self._connection.count("SELECT COUNT(*) FROM stream_numbers"), 10)
+		streamed += [ row["n"] for row in rows ]
+		self.assertEqual(streamed, list(range(1, 11)))
+
+	def test_no_commit(self):
+		"""
+		Test that closing a stream does not commit a transaction that another user of the connection has started.
+		"""
+
+		rows = self._connection.stream("SELECT n FROM stream_numbers ORDER BY n", size=2)
+		next(rows)
+
+		cursor = self._connection.cursor()
+		cursor.execute("INSERT INTO stream_numbers VALUES (11)")
+		rows.close()
+		self._connection._con.rollback()
+		cursor.close()
+
+		self.assertEqual(self._connection.count("SELECT COUNT(*) FROM stream_numbers"), 10)
+
+	def test_abandoned(self):
+		"""
+		Test that the cursor is closed when a stream is abandoned halfway.
+		"""
+
+		rows = self._connection.stream("SELECT n FROM stream_numbers ORDER BY n", size=2)
+		next(rows)
+		self.assertEqual(self._open_cursors(), 1)
+		rows.close()
+		self.assertEqual(self._open_cursors(), 0)
+
+	def test_stream_json(self):
+		"""
+		Test that streamed rows are serialized as a JSON object, in several chunks.
+		"""
+
+		handler = StreamingHandler(self._connection, None)
+		rows = self._connection.stream("SELECT n FROM stream_numbers ORDER BY n", size=3)
+		chunks = list(handler._stream_json(rows, total=10))
+		self.assertGreater(len(chunks), 1)
+		self.assertEqual(json.loads("".join(chunks)), { "data": [ { "n": n } for n in range(1, 11) ], "total": 10 })
+
+class StreamJSONTest(unittest.TestCase):
+	"""
+	Test that JSON responses are serialized a chunk at a time, and that their data is closed.
+	"""
+
+	def setUp(self):
+		"""
+		Create the handler.
+		"""
+
+		self._handler = StreamingHandler(None, None)
+
+	def test_empty(self):
+		"""
+		Test that an empty list is serialized with the other attributes.
+		"""
+
+		self.assertEqual(json.loads("".join(self._handler._stream_json([], total=0))), { "data": [], "total": 0 })
+
+	def test_closed(self):
+		"""
+		Test that the data is closed once it has been serialized.
+		"""
+
+		rows = Rows([ "a" * 10, "b" * 10, "c" ])
+		chunks = list(self._handler._stream_json(rows))
+		self.assertEqual(len(chunks), 3)
+		self.assertEqual(json.loads("".join(chunks)), { "data": [ "a" * 10, "b" * 10, "c" ] })
+		self.assertTrue(rows.closed)
+
+	def test_abandoned(self):
+		"""
+		Test that the data is closed if the response is abandoned halfway.
+		"""
+
+		rows = Rows([ "a" * 20, "b" * 20 ])
+		body = self._handler._stream_json(rows)
+		next(body)
+		self.assertFalse(rows.closed)
+		body.close()
+		self.assertTrue(rows.closed)
@@ -0,0 +1,114 @@
+"""
+Test that the OAuth stores can share their connection between threads.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+import uuid
+
+import psycopg2
+
+from oauth2.datatype import AccessToken
+from oauth2.error import AccessTokenNotFound
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from coauth.token_store.postgresql_token_store import PostgresqlAccessTokenStore
+
+from .environment import *
+
+class TokenStoreTest(unittest.TestCase):
+	"""
+	Test that tokens are saved and fetched as a whole, and that a failed statement does not affect the next one.
+	"""
+
+	@classmethod
+	def setUpClass(self):
+		"""
+		Create the schema and connect with the OAuth database.
+		"""
+
+		create_testing_environment()
+		self._connection = PostgreSQLConnection.connect(TEST_OAUTH_DATABASE, cursor_factory=psycopg2.extensions.cursor)
+		self._store = PostgresqlAccessTokenStore(self._connection)
+
+	@classmethod
+	def tearDownClass(self):
+		"""
+		Close the connection with the database.
+		"""
+
+		self._connection.close()
+
+	def _token(self):
+		"""
+		Create an access token with several scopes.
+		Like the tokens that the server issues, it has no data.
+
+		:return: The access token.
+		:rtype: :class:`oauth2.datatype.AccessToken`
+		"""
+
+		return AccessToken(client_id="client", grant_type="client_credentials", token=str(uuid.uuid4()),
+			expires_at=int(time.time()) + 60, scopes=[ "read", "write", "admin" ])
+
+	def test_save(self):
+		"""
+		Test that a token is fetched with its scopes.
+		"""
+
+		token = self._token()
+		self._store.save_token(token)
+		fetched = self._store.fetch_by_token(token.token)
+		self.assertEqual(sorted(fetched.scopes), sorted(token.scopes))
+		self.assertRaises(AccessTokenNotFound, self._store.fetch_by_token, str(uuid.uuid4()))
+
+	def test_concurrent(self):
+		"""
+		Test that tokens that are saved and fetched at the same time by several threads are never seen without their scopes.
+		"""
+
+		tokens = [ self._token() for _ in range(20) ]
+		scopes = []
+		def run(token):
+			self._store.save_token(token)
+			scopes.append(sorted(self._store.fetch_by_token(token.token).scopes))
+
+		threads = [ threading.Thread(target=run, args=(token, )) for token in tokens ]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(scopes, [ [ "admin", "read", "write" ] ] * len(tokens))
+
+	def test_wait(self):
+		"""
+		Test that other threads wait until a transaction ends.
+		"""
+
+		token = self._token()
+		with self._connection.transaction():
+			thread = threading.Thread(target=self._store.save_token, args=(token, ))
+			thread.start()
+			thread.join(0.2)
+			self.assertTrue(thread.is_alive())
+
+		thread.join()
+		self.assertEqual(self._store.fetch_by_token(token.token).token, token.token)
+
+	def test_failure(self):
+		"""
+		Test that a failed statement is rolled back, so that it does not abort the next statement's transaction.
+		"""
+
+		self.assertRaises(psycopg2.Error, self._store.execute, "SELECT * FROM missing_table")
+		token = self._token()
+		self._store.save_token(token)
+		self.assertEqual(self._store.fetch_by_token(token.token).token, token.token)
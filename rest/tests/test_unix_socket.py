@@ -0,0 +1,257 @@
+"""
+Test that the built-in server can serve the REST API on a Unix domain socket.
+"""
+
+import http.client
+import os
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+path = sys.path[0]
+path = os.path.join(path, "../")
+if path not in sys.path:
+	sys.path.insert(1, path)
+
+from coauth.oauth_request_handler import OAuthRequestHandler, UnixOAuthServer
+
+import main
+
+def application(env, start_response):
+	"""
+	A small WSGI application that returns the client's address.
+
+	:param env: The request environment.
+	:type env: dict
+	:param start_response: The function that starts the response.
+	:type start_response: function
+
+	:return: The response body.
+	:rtype: list of bytes
+	"""
+
+	body = env["REMOTE_ADDR"].encode()
+	start_response("200 OK", [ ("Content-Length", str(len(body))) ])
+	return [ body ]
+
+class UnixConnection(http.client.HTTPConnection):
+	"""
+	A HTTP connection over a Unix domain socket.
+
+	:ivar _path: The path of the socket file.
+	:vartype _path: str
+	"""
+
+	def __init__(self, path, *args, **kwargs):
+		"""
+		Create the connection.
+
+		:param path: The path of the socket file.
+		:type path: str
+		"""
+
+		super(UnixConnection, self).__init__("localhost", *args, **kwargs)
+		self._path = path
+
+	def connect(self):
+		"""
+		Connect to the socket file.
+		"""
+
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(self.timeout)
+		self.sock.connect(self._path)
+
+class UnixSocketTest(unittest.TestCase):
+	"""
+	Test binding to the socket file, replacing stale socket files and removing the socket file on close.
+	"""
+
+	def setUp(self):
+		"""
+		Create a directory for the socket file.
+		The servers that serve requests in the background are kept so that they can be stopped.
+		"""
+
+		self._directory = tempfile.TemporaryDirectory()
+		self._path = os.path.join(self._directory.name, "rest.sock")
+		self._servers = []
+
+	def tearDown(self):
+		"""
+		Close the servers and remove the directory.
+		"""
+
+		for server in self._servers:
+			server.shutdown()
+			server.server_close()
+		self._directory.cleanup()
+
+	def _serve(self, mode=0o660):
+		"""
+		Create a server on the socket file and serve requests in the background.
+
+		:param mode: The permissions of the socket file.
+		:type mode: int
+
+		:return: The server.
+		:rtype: :class:`coauth.oauth_request_handler.UnixOAuthServer`
+		"""
+
+		server = UnixOAuthServer(self._path, OAuthRequestHandler, mode)
+		server.set_app(application)
+		self._servers.append(server)
+		thread = threading.Thread(target=server.serve_forever, daemon=True)
+		thread.start()
+		return server
+
+	def test_bind(self):
+		"""
+		Test that the server creates the socket file with the configured permissions.
+		"""
+
+		for mode in [ 0o600, 0o660 ]:
+			server = UnixOAuthServer(self._path, OAuthRequestHandler, mode)
+			try:
+				self.assertTrue(stat.S_ISSOCK(os.stat(self._path).st_mode))
+				self.assertEqual(mode, stat.S_IMODE(os.stat(self._path).st_mode))
+			finally:
+				server.server_close()
+
+	def test_request(self):
+		"""
+		Test that requests are served over the socket and that their client is `localhost`.
+		"""
+
+		self._serve()
+		connection = UnixConnection(self._path, timeout=5)
+		try:
+			connection.request("GET", "/")
+			response = connection.getresponse()
+			self.assertEqual(200, response.status)
+			self.assertEqual(b"localhost", response.read())
+		finally:
+			connection.close()
+
+	def test_live_socket(self):
+		"""
+		Test that the server does not replace a socket file on which another server is listening.
+		"""
+
+		self._serve()
+		self.assertRaises(OSError, UnixOAuthServer, self._path, OAuthRequestHandler)
+		self.assertTrue(stat.S_ISSOCK(os.stat(self._path).st_mode))
+
+		"""
+		The first server still serves requests.
+		"""
+		connection = UnixConnection(self._path, timeout=5)
+		try:
+			connection.request("GET", "/")
+			self.assertEqual(200, connection.getresponse().status)
+		finally:
+			connection.close()
+
+	def test_stale_socket(self):
+		"""
+		Test that the server replaces a socket file that was left behind by a server that did not shut down cleanly.
+		"""
+
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+			stale.bind(self._path)
+		self.assertTrue(os.path.exists(self._path))
+
+		self._serve()
+		connection = UnixConnection(self._path, timeout=5)
+		try:
+			connection.request("GET", "/")
+			self.assertEqual(200, connection.getresponse().status)
+		finally:
+			connection.close()
+
+	def test_not_socket(self):
+		"""
+		Test that the server does not replace a file that is not a socket.
+		"""
+
+		with open(self._path, "w") as f:
+			f.write("data")
+
+		self.assertRaises(OSError, UnixOAuthServer, self._path, OAuthRequestHandler)
+		with open(self._path) as f:
+			self.assertEqual("data", f.read())
+
+	def test_close(self):
+		"""
+		Test that the server removes the socket file when it is closed, but only if it created it.
+		"""
+
+		server = UnixOAuthServer(self._path, OAuthRequestHandler)
+		self.assertTrue(os.path.exists(self._path))
+		server.server_close()
+		self.assertFalse(os.path.exists(self._path))
+
+		"""
+		A server that failed to bind leaves the other server's socket file alone.
+		"""
+		self._serve()
+		try:
+			UnixOAuthServer(self._path, OAuthRequestHandler)
+		except OSError:
+			pass
+		self.assertTrue(os.path.exists(self._path))
+
+class NoTCPTest(unittest.TestCase):
+	"""
+	Test the command-line arguments that choose where the REST API is served.
+	"""
+
+	def _parse(self, *args):
+		"""
+		Parse the given command-line arguments.
+
+		:return: The command-line arguments.
+		:rtype: :class:`argparse.Namespace`
+		"""
+
+		with mock.patch.object(sys, "argv", [ "main.py" ] + list(args)):
+			return main.setup_args()
+
+	def test_default(self):
+		"""
+		Test that the server listens on the default port.
+		"""
+
+		args = self._parse()
+		self.assertFalse(args.no_tcp)
+		self.assertEqual(7225, main.get_listen_port(args))
+
+	def test_port(self):
+		"""
+		Test that the server listens on the given port.
+		"""
+
+		args = self._parse("--port", "8000")
+		self.assertEqual(8000, main.get_listen_port(args))
+
+	def test_no_tcp(self):
+		"""
+		Test that the server does not listen on TCP with `--no-tcp`, even if a port is given.
+		"""
+
+		args = self._parse("--socket", "/tmp/rest.sock", "--socket-mode", "600", "--no-tcp")
+		self.assertTrue(args.no_tcp)
+		self.assertEqual("/tmp/rest.sock", args.socket)
+		self.assertEqual(0o600, args.socket_mode)
+		self.assertIsNone(main.get_listen_port(args))
+
+		args = self._parse("--port", "8000", "--no-tcp")
+		self.assertIsNone(main.get_listen_port(args))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,16 @@
+"""
+Exceptions that may be raised when performing queued jobs.
+"""
+
+class TransactionPendingException(Exception):
+	"""
+	An exception that indicates that a job sent a transaction that has not been mined yet.
+	The job is retried, and the retry waits for the same transaction instead of sending another one.
+
+	:ivar tx_hash: The hash of the transaction that was sent.
+	:vartype tx_hash: str
+	"""
+
+	def __init__(self, tx_hash, message="The transaction has not been mined yet"):
+		super(TransactionPendingException, self).__init__(message)
+		self.tx_hash = tx_hash
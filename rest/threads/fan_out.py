@@ -0,0 +1,126 @@
+"""
+A fan-out runs the same function on many items concurrently, using a bounded pool of threads.
+It is used to make independent blockchain reads at the same time, so that a request takes as long as its slowest read instead of the sum of all of them.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+import threading
+import time
+
+class FanOut(object):
+	"""
+	The fan-out runs calls on a fixed number of threads, which are shared by all requests.
+	Each call has its own timeout, which starts when the call starts running, so that calls that wait for a free thread are not penalized.
+
+	Calls that fail or time out do not fail the others.
+	Their errors are returned alongside the results, so that callers can return partial results.
+	A call that times out keeps its thread until it returns, but its result is ignored.
+
+	:ivar _executor: The pool of threads.
+	:vartype _executor: :class:`concurrent.futures.ThreadPoolExecutor`
+	:ivar _futures: The futures of the calls that are queued or running.
+	:vartype _futures: set of :class:`concurrent.futures.Future`
+	:ivar _lock: The lock that protects the futures.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	def __init__(self, workers):
+		"""
+		Create the fan-out.
+
+		:param workers: The number of threads.
+		:type workers: int
+		"""
+
+		self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fan-out")
+		self._futures = set()
+		self._lock = threading.Lock()
+
+	def map(self, function, items, timeout=None):
+		"""
+		Call the function with each item concurrently.
+
+		:param function: The function to call, which receives one item.
+		:type function: function
+		:param items: The items.
+		:type items: list
+		:param timeout: The maximum number of seconds that each call may run, or `None` to wait for all calls.
+		:type timeout: float or None
+
+		:return: The results, in the same order as the items, and the exceptions that calls raised, with the items' indices as keys.
+			The results of calls that failed are `None`.
+			Calls that time out have a :class:`concurrent.futures.TimeoutError`.
+		:rtype: tuple
+		"""
+
+		results, errors = [ None ] * len(items), {}
+		started = {}
+		lock = threading.Lock()
+
+		def call(index, item):
+			with lock:
+				started[index] = time.monotonic()
+			return function(item)
+
+		futures = { self._executor.submit(call, index, item): index for index, item in enumerate(items) }
+		with self._lock:
+			self._futures.update(futures)
+		for future in futures:
+			future.add_done_callback(self._done)
+
+		pending = set(futures)
+		while pending:
+			"""
+			Wait until a call finishes or until the next call times out, whichever comes first.
+			"""
+			wait_for = None
+			if timeout is not None:
+				with lock:
+					deadlines = [ started[futures[future]] + timeout for future in pending if futures[future] in started ]
+				wait_for = max(min(deadlines) - time.monotonic(), 0) if deadlines else timeout
+
+			done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+			for future in done:
+				index = futures[future]
+				try:
+					results[index] = future.result()
+				except Exception as e:
+					errors[index] = e
+
+			if timeout is not None:
+				now = time.monotonic()
+				with lock:
+					expired = { future for future in pending if futures[future] in started and now - started[futures[future]] >= timeout }
+				for future in expired:
+					future.cancel()
+					errors[futures[future]] = TimeoutError("The call timed out after %g seconds" % timeout)
+				pending -= expired
+
+		return results, errors
+
+	def shutdown(self):
+		"""
+		Stop the threads once the calls that are running finish.
+		"""
+
+		with self._lock:
+			futures = set(self._futures)
+
+		"""
+		The calls that are still queued are cancelled one by one, since the executor can only cancel them itself from Python 3.9.
+		"""
+		for future in futures:
+			future.cancel()
+		self._executor.shutdown(wait=False)
+
+	def _done(self, future):
+		"""
+		Forget a call that has finished or has been cancelled.
+
+		:param future: The call's future.
+		:type future: :class:`concurrent.futures.Future`
+		"""
+
+		with self._lock:
+			self._futures.discard(future)
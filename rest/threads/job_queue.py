@@ -0,0 +1,489 @@
+"""
+A durable queue of blockchain writes, stored in PostgreSQL.
+Handlers add jobs to the queue and return immediately.
+Workers, which may run in the server or in separate processes, claim the jobs and perform them.
+Since the queue is stored in the database, jobs are not lost when the server restarts, and failed jobs are retried.
+"""
+
+from datetime import datetime
+
+import json
+import os
+import socket
+import threading
+import traceback
+
+from connection.sql import escape
+from threads.exceptions.job_exceptions import TransactionPendingException
+
+_new_jobs = threading.Event()
+"""
+The event that wakes up the workers in this process when a job is added, so that they do not wait for their next poll.
+"""
+
+class JobQueue(object):
+	"""
+	The job queue adds jobs to, and claims jobs from, the `blockchain_jobs` table.
+	Jobs are claimed using `SELECT ... FOR UPDATE SKIP LOCKED`, so that any number of workers can share the queue without claiming the same job.
+
+	:cvar PENDING: The status of jobs that are waiting to run.
+	:vartype PENDING: str
+	:cvar RUNNING: The status of jobs that have been claimed by a worker.
+	:vartype RUNNING: str
+	:cvar DONE: The status of jobs that have finished successfully.
+	:vartype DONE: str
+	:cvar FAILED: The status of jobs that have failed too many times to be retried.
+	:vartype FAILED: str
+
+	:ivar _connector: The connection to the database that stores the queue.
+	:vartype _connector: :class:`connection.connection.Connection`
+	"""
+
+	PENDING = "PENDING"
+	RUNNING = "RUNNING"
+	DONE = "DONE"
+	FAILED = "FAILED"
+
+	def __init__(self, connector):
+		"""
+		Create the job queue.
+
+		:param connector: The connection to the database that stores the queue.
+		:type connector: :class:`connection.connection.Connection`
+		"""
+
+		self._connector = connector
+
+	def enqueue(self, operation, arguments, delay=0, coalesce_key=None, idempotency_key=None):
+		"""
+		Add a job to the queue.
+
+		Jobs that have the same coalescing key are merged while they are waiting to run.
+		The pending job's arguments are replaced with the new ones, so that only the latest request is performed.
+		Jobs that are already running are not changed, and a new job is added instead.
+
+		If an idempotency key is given, and a job was already added with the same key, no job is added and the existing job's ID is returned instead.
+
+		:param operation: The name of the operation that the job performs.
+		:type operation: str
+		:param arguments: The operation's arguments, which must be JSON-serializable.
+		:type arguments: dict
+		:param delay: The number of seconds to wait before the job may run.
+			Jobs that are merged keep the time when the first of them may run.
+		:type delay: float
+		:param coalesce_key: The key that identifies pending jobs that can be merged, or `None` if the job should not be merged.
+		:type coalesce_key: str or None
+		:param idempotency_key: The key that identifies repeated requests, or `None` if the request should not be checked.
+		:type idempotency_key: str or None
+
+		:return: The job's ID.
+		:rtype: int
+		"""
+
+		quote = lambda value: "NULL" if value is None else "'%s'" % escape(value)
+
+		"""
+		The job is added, merged or skipped in a single statement, so that concurrent requests do not add duplicate jobs.
+		The partial unique index on the coalescing key only covers pending jobs.
+		"""
+		cursor = self._connector.execute("""
+			WITH existing AS (
+				SELECT
+					job_id AS id
+				FROM
+					blockchain_job_keys
+				WHERE
+					idempotency_key = %s
+			), job AS (
+				INSERT INTO blockchain_jobs (
+					operation, arguments, coalesce_key, run_after)
+				SELECT
+					'%s', '%s'::jsonb, %s, NOW() + INTERVAL '%f seconds'
+				WHERE
+					NOT EXISTS (SELECT * FROM existing)
+				ON CONFLICT (coalesce_key) WHERE status = '%s' DO UPDATE
+				SET
+					arguments = EXCLUDED.arguments,
+					updated_at = NOW()
+				RETURNING id
+			), keys AS (
+				INSERT INTO blockchain_job_keys (
+					idempotency_key, job_id)
+				SELECT
+					%s, id
+				FROM
+					job
+				WHERE
+					%s IS NOT NULL
+				ON CONFLICT (idempotency_key) DO NOTHING
+			)
+			SELECT id FROM existing
+			UNION ALL
+			SELECT id FROM job
+		""" % (quote(idempotency_key), operation, escape(json.dumps(arguments)), quote(coalesce_key),
+			   delay, self.PENDING, quote(idempotency_key), quote(idempotency_key)), with_cursor=True)
+		row = cursor.fetchone()
+		cursor.close()
+
+		_new_jobs.set()
+		return row["id"]
+
+	def get(self, job_id):
+		"""
+		Get the job with the given ID.
+
+		:param job_id: The job's ID.
+		:type job_id: int
+
+		:return: The job, or `None` if it does not exist.
+		:rtype: dict or None
+		"""
+
+		return self._connector.select_one("""
+			SELECT
+				*
+			FROM
+				blockchain_jobs
+			WHERE
+				id = %d
+		""" % int(job_id))
+
+	def claim(self, worker_id, lease):
+		"""
+		Claim the oldest job that is ready to run.
+		A job is ready if it is pending and its back-off has expired, or if it is running but its worker's lease has expired.
+		Jobs are not ready while another job with the same coalescing key is running under a lease that has not expired, so that changes to the same consent are never performed out of order.
+		The claim is committed immediately, so that the job is reserved even if the worker stops while performing it.
+
+		:param worker_id: The unique ID of the worker that claims the job.
+		:type worker_id: str
+		:param lease: The number of seconds for which the job is reserved for the worker.
+		:type lease: float
+
+		:return: The claimed job, or `None` if there is no job to run.
+		:rtype: dict or None
+		"""
+
+		cursor = self._connector.execute("""
+			UPDATE
+				blockchain_jobs
+			SET
+				status = '%s',
+				attempts = attempts + 1,
+				locked_by = '%s',
+				locked_until = NOW() + INTERVAL '%f seconds',
+				updated_at = NOW()
+			WHERE
+				id = (
+					SELECT
+						id
+					FROM
+						blockchain_jobs
+					WHERE
+						(
+							(status = '%s' AND run_after <= NOW()) OR
+							(status = '%s' AND locked_until < NOW())
+						) AND
+						NOT EXISTS (
+							SELECT
+								*
+							FROM
+								blockchain_jobs AS running
+							WHERE
+								running.coalesce_key = blockchain_jobs.coalesce_key AND
+								running.id <> blockchain_jobs.id AND
+								running.status = '%s' AND
+								running.locked_until >= NOW()
+						)
+					ORDER BY
+						id
+					LIMIT 1
+					FOR UPDATE SKIP LOCKED
+				)
+			RETURNING *
+		""" % (self.RUNNING, escape(worker_id), lease, self.PENDING, self.RUNNING, self.RUNNING), with_cursor=True)
+		job = cursor.fetchone()
+		cursor.close()
+		return job
+
+	def complete(self, job_id, worker_id):
+		"""
+		Mark the job as done.
+		The job is only changed if the worker still holds it, since another worker may have claimed it after the worker's lease expired.
+
+		:param job_id: The job's ID.
+		:type job_id: int
+		:param worker_id: The unique ID of the worker that claimed the job.
+		:type worker_id: str
+
+		:return: A boolean indicating whether the worker still held the job.
+		:rtype: bool
+		"""
+
+		cursor = self._connector.execute("""
+			UPDATE
+				blockchain_jobs
+			SET
+				status = '%s',
+				locked_by = NULL,
+				locked_until = NULL,
+				last_error = NULL,
+				updated_at = NOW()
+			WHERE
+				id = %d AND
+				locked_by = '%s'
+		""" % (self.DONE, int(job_id), escape(worker_id)), with_cursor=True)
+		held = cursor.rowcount > 0
+		cursor.close()
+		return held
+
+	def fail(self, job_id, worker_id, error, retry_in=None, tx_hash=None):
+		"""
+		Record that an attempt to perform the job failed.
+		The job is only changed if the worker still holds it, since another worker may have claimed it after the worker's lease expired.
+		If the attempt sent a transaction that has not been mined yet, its hash is kept with the job, so that the next attempt waits for it instead of sending another one.
+
+		:param job_id: The job's ID.
+		:type job_id: int
+		:param worker_id: The unique ID of the worker that claimed the job.
+		:type worker_id: str
+		:param error: The error that the attempt raised.
+		:type error: str
+		:param retry_in: The number of seconds after which the job may be retried.
+			If it is `None`, the job is not retried.
+			The job is not retried either if a newer job with the same coalescing key is pending, since the newer job supersedes it.
+		:type retry_in: float or None
+		:param tx_hash: The hash of the transaction that the attempt sent, or `None` to keep the hash of an earlier attempt.
+		:type tx_hash: str or None
+
+		:return: A boolean indicating whether the worker still held the job.
+		:rtype: bool
+		"""
+
+		status = "'%s'" % self.FAILED
+		if retry_in is not None:
+			status = """
+				CASE WHEN NOT EXISTS (
+					SELECT
+						*
+					FROM
+						blockchain_jobs AS newer
+					WHERE
+						newer.coalesce_key = blockchain_jobs.coalesce_key AND
+						newer.status = '%s'
+				) THEN '%s'::blockchain_job_status ELSE '%s'::blockchain_job_status END
+			""" % (self.PENDING, self.PENDING, self.FAILED)
+
+		cursor = self._connector.execute("""
+			UPDATE
+				blockchain_jobs
+			SET
+				status = %s,
+				run_after = NOW() + INTERVAL '%f seconds',
+				locked_by = NULL,
+				locked_until = NULL,
+				last_error = '%s',
+				tx_hash = COALESCE(%s, tx_hash),
+				updated_at = NOW()
+			WHERE
+				id = %d AND
+				locked_by = '%s'
+		""" % (status, retry_in or 0, escape(error), "NULL" if tx_hash is None else "'%s'" % escape(tx_hash),
+			   int(job_id), escape(worker_id)), with_cursor=True)
+		held = cursor.rowcount > 0
+		cursor.close()
+		return held
+
+	def count(self, status):
+		"""
+		Count the jobs that have the given status.
+
+		:param status: The status of the jobs to count.
+		:type status: str
+
+		:return: The number of jobs that have the given status.
+		:rtype: int
+		"""
+
+		return self._connector.count("""
+			SELECT
+				COUNT(*)
+			FROM
+				blockchain_jobs
+			WHERE
+				status = '%s'
+		""" % status)
+
+	def outstanding(self, operation, argument, values, settle=0):
+		"""
+		Get the jobs of the given operation that have not finished yet, and whose argument has one of the given values.
+		Jobs that finished successfully in the last few seconds are also returned, since readers that lag behind the blockchain may not see their effect yet.
+
+		:param operation: The name of the operation that the jobs perform.
+		:type operation: str
+		:param argument: The name of the argument to filter on.
+		:type argument: str
+		:param values: The values of the argument to look for.
+		:type values: list of str
+		:param settle: The number of seconds for which finished jobs are still returned.
+		:type settle: float
+
+		:return: The jobs, from the oldest to the newest.
+		:rtype: list of dict
+		"""
+
+		if not values:
+			return []
+
+		return self._connector.select("""
+			SELECT
+				*
+			FROM
+				blockchain_jobs
+			WHERE
+				operation = '%s' AND
+				arguments->>'%s' IN ('%s') AND
+				(
+					status IN ('%s', '%s') OR
+					(status = '%s' AND updated_at >= NOW() - INTERVAL '%f seconds')
+				)
+			ORDER BY
+				id
+		""" % (operation, argument, "', '".join(escape(value) for value in values),
+			   self.PENDING, self.RUNNING, self.DONE, settle))
+
+class JobWorker(object):
+	"""
+	The job worker repeatedly claims jobs from the queue and performs them.
+	Failed jobs are retried with an exponential back-off until they have been attempted too many times.
+
+	:ivar _queue: The queue from which jobs are claimed.
+	:vartype _queue: :class:`threads.job_queue.JobQueue`
+	:ivar _operations: The functions that perform each operation, with the operations' names as keys.
+		Each function receives the job's arguments as keyword arguments.
+		If an earlier attempt sent a transaction that was not mined in time, the function also receives its hash as `tx_hash`.
+	:vartype _operations: dict
+	:ivar _worker_id: The unique ID of the worker.
+	:vartype _worker_id: str
+	:ivar _lease: The number of seconds for which a claimed job is reserved for the worker.
+	:vartype _lease: float
+	:ivar _max_attempts: The maximum number of times that a job is attempted.
+	:vartype _max_attempts: int
+	:ivar _backoff: The number of seconds to wait before retrying a job for the first time.
+		The wait doubles after every failed attempt.
+	:vartype _backoff: float
+	:ivar _poll_interval: The number of seconds to wait for a new job when the queue is empty.
+	:vartype _poll_interval: float
+	"""
+
+	def __init__(self, queue, operations, worker_id=None, lease=300, max_attempts=5, backoff=5, poll_interval=1):
+		"""
+		Create the worker.
+
+		:param queue: The queue from which jobs are claimed.
+		:type queue: :class:`threads.job_queue.JobQueue`
+		:param operations: The functions that perform each operation, with the operations' names as keys.
+		:type operations: dict
+		:param worker_id: The unique ID of the worker.
+			If it is not given, an ID is created from the host, the process and the thread.
+		:type worker_id: str or None
+		:param lease: The number of seconds for which a claimed job is reserved for the worker.
+			It should be longer than the longest job.
+		:type lease: float
+		:param max_attempts: The maximum number of times that a job is attempted.
+		:type max_attempts: int
+		:param backoff: The number of seconds to wait before retrying a job for the first time.
+		:type backoff: float
+		:param poll_interval: The number of seconds to wait for a new job when the queue is empty.
+		:type poll_interval: float
+		"""
+
+		self._queue = queue
+		self._operations = operations
+		self._worker_id = worker_id
+		self._lease = lease
+		self._max_attempts = max_attempts
+		self._backoff = backoff
+		self._poll_interval = poll_interval
+
+	def run(self, stop):
+		"""
+		Perform jobs until the worker is asked to stop.
+		The job that is being performed when the worker is asked to stop is finished first.
+
+		:param stop: The event that is set when the worker should stop.
+		:type stop: :class:`threading.Event`
+		"""
+
+		if self._worker_id is None:
+			self._worker_id = "%s:%d:%d" % (socket.gethostname(), os.getpid(), threading.get_ident())
+
+		while not stop.is_set():
+			try:
+				if self.run_once():
+					continue
+			except Exception:
+				"""
+				If the queue itself cannot be reached, wait before trying again.
+				"""
+				traceback.print_exc()
+
+			_new_jobs.wait(self._poll_interval)
+			_new_jobs.clear()
+
+	def run_once(self):
+		"""
+		Claim a job and perform it.
+
+		:return: A boolean indicating whether a job was claimed.
+		:rtype: bool
+		"""
+
+		job = self._queue.claim(self._worker_id, self._lease)
+		if job is None:
+			return False
+
+		"""
+		If an earlier attempt sent a transaction, the operation is given its hash, so that it does not send the same change again while the transaction is still pending.
+		"""
+		arguments = dict(job["arguments"])
+		if job.get("tx_hash") is not None:
+			arguments["tx_hash"] = job["tx_hash"]
+
+		try:
+			operation = self._operations[job["operation"]]
+			operation(**arguments)
+			held = self._queue.complete(job["id"], self._worker_id)
+		except Exception as e:
+			traceback.print_exc()
+			tx_hash = e.tx_hash if isinstance(e, TransactionPendingException) else None
+			if job["attempts"] >= self._max_attempts:
+				held = self._queue.fail(job["id"], self._worker_id, e, tx_hash=tx_hash)
+			else:
+				held = self._queue.fail(job["id"], self._worker_id, e, self._backoff * 2 ** (job["attempts"] - 1), tx_hash)
+
+		if not held:
+			print("Job %d was claimed by another worker before it finished" % job["id"])
+
+		return True
+
+def describe(job):
+	"""
+	Describe a job so that it can be returned by the API.
+
+	:param job: The job, as stored in the queue.
+	:type job: dict
+
+	:return: The job's ID, operation, status, number of attempts, last error and timestamps.
+	:rtype: dict
+	"""
+
+	return {
+		"job_id": job["id"],
+		"operation": job["operation"],
+		"status": job["status"],
+		"attempts": job["attempts"],
+		"error": job["last_error"],
+		"created_at": job["created_at"].isoformat() if isinstance(job["created_at"], datetime) else job["created_at"],
+		"updated_at": job["updated_at"].isoformat() if isinstance(job["updated_at"], datetime) else job["updated_at"],
+	}
@@ -0,0 +1,79 @@
+"""
+A single flight lets identical calls that are made at the same time share one call.
+It is used so that a burst of identical blockchain reads, such as the reads for a popular study, only reaches the node once.
+"""
+
+from concurrent.futures import Future
+
+import threading
+
+class SingleFlight(object):
+	"""
+	The single flight keeps a future for each call that is in flight, with the call's key as key.
+	The first caller with a key makes the call, and the callers that arrive with the same key while it is in flight wait for its result.
+	Once the call returns, the next caller with the same key makes a new call.
+
+	If the call raises an exception, all the callers that shared it get the same exception.
+	The callers also share the same result, so they should not change it.
+
+	:ivar _calls: The futures of the calls in flight, with their keys as keys.
+	:vartype _calls: dict
+	:ivar _lock: The lock that protects the calls in flight.
+	:vartype _lock: :class:`threading.Lock`
+	"""
+
+	def __init__(self):
+		"""
+		Create the single flight without calls in flight.
+		"""
+
+		self._calls = {}
+		self._lock = threading.Lock()
+
+	def do(self, key, function, *args, **kwargs):
+		"""
+		Call the function, or wait for the identical call that is in flight.
+
+		:param key: The key that identifies identical calls.
+		:type key: object
+		:param function: The function to call.
+		:type function: function
+
+		:return: The function's result, and a boolean indicating whether the call was shared with another caller.
+		:rtype: tuple
+
+		:raises: :class:`Exception`
+		"""
+
+		with self._lock:
+			call = self._calls.get(key)
+			shared = call is not None
+			if not shared:
+				call = Future()
+				call.set_running_or_notify_cancel()
+				self._calls[key] = call
+
+		if shared:
+			return call.result(), True
+
+		try:
+			result = function(*args, **kwargs)
+			call.set_result(result)
+			return result, False
+		except BaseException as e:
+			call.set_exception(e)
+			raise
+		finally:
+			with self._lock:
+				del self._calls[key]
+
+	def in_flight(self):
+		"""
+		Count the calls that are in flight.
+
+		:return: The number of calls in flight.
+		:rtype: int
+		"""
+
+		with self._lock:
+			return len(self._calls)
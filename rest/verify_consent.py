@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Verify the proofs that consent changes were anchored on the blockchain.
+The proofs are those that the REST API returns from `/consent_proof`, saved to a file.
+
+Each proof is verified offline by recomputing the root of its batch from the consent change and the inclusion proof.
+If an Ethereum node is given, the tool also checks that the root was anchored by the transaction in the proof.
+
+The tool only uses the standard library, so it can run without the rest of the server.
+"""
+
+import argparse
+import json
+import sys
+import urllib.request
+
+import os
+
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__))))
+
+from biobank.handlers.blockchain import merkle
+
+def setup_args():
+	"""
+	Set up and get the list of command-line arguments.
+
+	Accepted arguments:
+		- -f --file	The file that contains the proofs.
+		- -n --node	The URL of an Ethereum node's JSON-RPC API, to check the anchoring transactions.
+
+	:return: The command-line arguments.
+	:rtype: list
+	"""
+
+	parser = argparse.ArgumentParser(description="Verify the proofs that consent changes were anchored on the blockchain.")
+	parser.add_argument("-f", "--file", type=str, required=True, help="<Required> The file that contains the proofs.")
+	parser.add_argument("-n", "--node", type=str, required=False, help="<Optional> The URL of an Ethereum node's JSON-RPC API.")
+	args = parser.parse_args()
+	return args
+
+def load_proofs(path):
+	"""
+	Load the proofs from a file.
+	The file may contain the REST API's response, a list of proofs or a single proof.
+
+	:param path: The path to the file.
+	:type path: str
+
+	:return: The proofs.
+	:rtype: list of dict
+	"""
+
+	with open(path, "r") as f:
+		proofs = json.load(f)
+
+	if isinstance(proofs, dict):
+		proofs = proofs.get("data", [ proofs ])
+	return proofs
+
+def get_anchored_root(node, tx_hash):
+	"""
+	Get the root that a transaction anchored, and the block that includes it, from an Ethereum node.
+
+	:param node: The URL of the Ethereum node's JSON-RPC API.
+	:type node: str
+	:param tx_hash: The hash of the transaction.
+	:type tx_hash: str
+
+	:return: The root that the transaction anchored and the number of the block that includes it, or `None` if the transaction does not exist.
+	:rtype: tuple or None
+	"""
+
+	request = urllib.request.Request(node, headers={ "Content-Type": "application/json" }, data=json.dumps({
+		"jsonrpc": "2.0",
+		"id": 1,
+		"method": "eth_getTransactionByHash",
+		"params": [ tx_hash ],
+	}).encode("utf-8"))
+	with urllib.request.urlopen(request) as response:
+		transaction = json.load(response).get("result")
+
+	if transaction is None or transaction.get("blockNumber") is None:
+		return None
+
+	return transaction["input"].lower(), int(transaction["blockNumber"], 16)
+
+def verify(proof, node=None):
+	"""
+	Verify one proof.
+
+	:param proof: The proof, as returned by the REST API.
+	:type proof: dict
+	:param node: The URL of an Ethereum node's JSON-RPC API, or `None` to only verify the proof offline.
+	:type node: str or None
+
+	:return: A description of the outcome, and a boolean indicating whether the proof is valid.
+		Changes that are not anchored yet are not considered to be invalid.
+	:rtype: tuple
+	"""
+
+	if not proof.get("anchored"):
+		return "not anchored yet", True
+
+	if not merkle.verify(proof["change"], proof["proof"], proof["root"]):
+		return "the proof does not lead to the root %s" % proof["root"], False
+
+	if node is not None:
+		anchored = get_anchored_root(node, proof["tx_hash"])
+		if anchored is None:
+			return "the transaction %s was not found" % proof["tx_hash"], False
+
+		root, block_number = anchored
+		if root != proof["root"].lower():
+			return "the transaction %s anchored %s instead of %s" % (proof["tx_hash"], root, proof["root"]), False
+
+		if proof.get("block_number") is not None and block_number != proof["block_number"]:
+			return "the transaction %s is in block %d instead of %d" % (proof["tx_hash"], block_number, proof["block_number"]), False
+
+		return "anchored in block %d by %s" % (block_number, proof["tx_hash"]), True
+
+	return "included in the root %s" % proof["root"], True
+
+def main(path, node=None):
+	"""
+	Verify the proofs in a file and print the outcome of each one.
+
+	:param path: The path to the file that contains the proofs.
+	:type path: str
+	:param node: The URL of an Ethereum node's JSON-RPC API, or `None` to only verify the proofs offline.
+	:type node: str or None
+
+	:return: A boolean indicating whether all the proofs are valid.
+	:rtype: bool
+	"""
+
+	valid = True
+	for proof in load_proofs(path):
+		change = proof["change"]
+		outcome, proof_valid = verify(proof, node)
+		print("%s change %d (%s to %s, consent %s): %s" % ("OK" if proof_valid else "FAILED", change["id"],
+			change["address"], change["study_id"], change["consent"], outcome))
+		valid = valid and proof_valid
+
+	return valid
+
+if __name__ == "__main__":
+	args = setup_args()
+	sys.exit(0 if main(args.file, args.node) else 1)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""
+The workers that perform the blockchain writes that the server queues.
+The server runs its own workers, but more can be started in separate processes, or on other hosts, to record consent changes faster.
+All workers share the queue in the database.
+
+The workers' process also runs the consent indexer, the consent anchorer and the participant indexer.
+Servers that do not run these background services themselves, such as servers that run in several processes, rely on it.
+"""
+
+from threading import Event, Thread
+
+import argparse
+import signal
+import sys
+
+import os
+
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__))))
+
+from biobank.handlers.blockchain.participant_index import ParticipantIndex, ParticipantIndexer
+from threads.job_queue import JobQueue, JobWorker
+
+from config import blockchain, db, routes
+from config import server as server_config
+
+def setup_args():
+	"""
+	Set up and get the list of command-line arguments.
+
+	Accepted arguments:
+		- -w --workers	The number of workers to run, defaults to the configuration.
+		- --single-card	Run the workers in single-card mode.
+
+	:return: The command-line arguments.
+	:rtype: list
+	"""
+
+	parser = argparse.ArgumentParser(description="Perform the blockchain writes that the REST API queues.")
+	parser.add_argument("-w", "--workers", type=int, default=max(server_config.job_workers, 1), help="<Optional> The number of workers to run.", required=False)
+	parser.add_argument("--single-card", help="Run the workers in single-card mode.", action="store_true")
+	args = parser.parse_args()
+	return args
+
+def start_job_workers(connection, blockchain_handler, count, stop):
+	"""
+	Start workers that perform the queued blockchain writes in background threads.
+	Each worker has its own database session, so that it does not hold up the other workers or the server.
+
+	:param connection: The database connection, which is copied for each worker.
+	:type connection: :class:`connection.connection.Connection`
+	:param blockchain_handler: The connector to the blockchain.
+	:type blockchain_handler: :class:`biobank.blockchain.api.BlockchainAPI`
+	:param count: The number of workers to start.
+	:type count: int
+	:param stop: The event that is set when the workers should stop.
+	:type stop: :class:`threading.Event`
+
+	:return: The workers' threads.
+	:rtype: list of :class:`threading.Thread`
+	"""
+
+	threads = []
+	for i in range(count):
+		worker_connection = connection.copy()
+		consent_handler = routes.consent_handler_class(worker_connection, blockchain_handler)
+		worker = JobWorker(JobQueue(worker_connection), consent_handler.job_operations(),
+			lease=server_config.job_lease, max_attempts=server_config.job_max_attempts,
+			backoff=server_config.job_backoff, poll_interval=server_config.job_poll_interval)
+		thread = Thread(target=worker.run, args=(stop, ), name="job-worker-%d" % i, daemon=True)
+		thread.start()
+		threads.append(thread)
+
+	return threads
+
+def start_services(connection, blockchain_handler, stop):
+	"""
+	Start the services that keep the data derived from the blockchain up to date in background threads.
+
+	If the backend mirrors the consent on the blockchain, the indexer keeps the mirror up to date.
+	If the backend anchors consent changes in batches, the anchorer sends the batches to the blockchain.
+	Each has its own database session, since it holds a lock that allows only one of its kind to run.
+	The participant indexer adds the participants of studies that existed before the participant index.
+
+	:param connection: The database connection, which is copied for the services that need their own session.
+	:type connection: :class:`connection.connection.Connection`
+	:param blockchain_handler: The connector to the blockchain.
+	:type blockchain_handler: :class:`biobank.blockchain.api.BlockchainAPI`
+	:param stop: The event that is set when the services should stop.
+	:type stop: :class:`threading.Event`
+
+	:return: The services' threads.
+	:rtype: list of :class:`threading.Thread`
+	"""
+
+	threads = []
+	for name, create in [ ("consent-indexer", blockchain_handler.create_indexer),
+						  ("consent-anchorer", blockchain_handler.create_anchorer) ]:
+		service_connection = connection.copy()
+		service = create(service_connection)
+		if service is None:
+			service_connection.close()
+			continue
+
+		thread = Thread(target=service.run, args=(stop, ), name=name, daemon=True)
+		thread.start()
+		threads.append(thread)
+
+	participant_indexer = ParticipantIndexer(ParticipantIndex(connection), blockchain_handler, server_config.participant_index_interval)
+	thread = Thread(target=participant_indexer.run, args=(stop, ), name="participant-indexer", daemon=True)
+	thread.start()
+	threads.append(thread)
+
+	return threads
+
+def main(database, workers, single_card=False):
+	"""
+	Connect to the database and the blockchain, and perform queued blockchain writes until the process is stopped.
+	Workers finish the job that they are performing before stopping.
+
+	:param database: The name of the database that stores the queue.
+	:type database: str
+	:param workers: The number of workers to run.
+	:type workers: int
+	:param single_card: A boolean indicating whether the workers should run in single-card mode.
+	:type single_card: bool
+	"""
+
+	blockchain.multi_card = not single_card
+	connection = routes.handler_connector.connect(database)
+	blockchain_handler = routes.blockchain_handler_class.from_config(connection)
+
+	stop = Event()
+	signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+	signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+	threads = start_job_workers(connection, blockchain_handler, workers, stop)
+	print("Started %d blockchain job workers" % len(threads))
+	threads += start_services(connection, blockchain_handler, stop)
+
+	"""
+	Wait for a signal, and then for the workers to finish their current jobs.
+	"""
+	while not stop.is_set():
+		stop.wait(1)
+
+	for thread in threads:
+		thread.join(server_config.job_lease)
+	connection.close()
+
+if __name__ == "__main__":
+	args = setup_args()
+	main(db.database, args.workers, args.single_card)
@@ -274,6 +274,242 @@ def create_schema(database):
 		connection.execute("""COMMENT ON COLUMN email_recipients.recipient IS 'The email address of a recipient who is meant to receive the email';""")
 		connection.execute("""COMMENT ON COLUMN email_recipients.sent IS 'A boolean indicating whether the email has been sent to the recipient';""")
 
+		"""
+		Blockchain jobs.
+		"""
+
+		"""
+		Create the blockchain job relation.
+		Writes to the blockchain are queued as jobs, so that they survive restarts and can be retried.
+		Workers claim pending jobs, or jobs whose lease has expired because their worker stopped.
+		"""
+
+		connection.execute("""DROP TYPE IF EXISTS blockchain_job_status CASCADE""")
+		connection.execute("""CREATE TYPE blockchain_job_status AS ENUM ('PENDING', 'RUNNING', 'DONE', 'FAILED')""")
+
+		connection.execute("""DROP TABLE IF EXISTS blockchain_jobs CASCADE;""")
+		connection.execute("""CREATE TABLE blockchain_jobs (
+							id				SERIAL							PRIMARY KEY,
+							operation		VARCHAR(64)						NOT NULL,
+							arguments		JSONB							NOT NULL,
+							coalesce_key	VARCHAR(255),
+							status			blockchain_job_status			DEFAULT 'PENDING',
+							attempts		INTEGER							DEFAULT 0,
+							run_after		TIMESTAMP WITHOUT TIME ZONE		DEFAULT NOW(),
+							locked_by		VARCHAR(128),
+							locked_until	TIMESTAMP WITHOUT TIME ZONE,
+							last_error		TEXT,
+							tx_hash			VARCHAR(66),
+							created_at		TIMESTAMP WITHOUT TIME ZONE		DEFAULT NOW(),
+							updated_at		TIMESTAMP WITHOUT TIME ZONE		DEFAULT NOW()
+		);""")
+		connection.execute("""CREATE INDEX blockchain_jobs_claim ON blockchain_jobs (status, run_after);""")
+		connection.execute("""CREATE INDEX blockchain_jobs_address ON blockchain_jobs ((arguments->>'address'));""")
+		connection.execute("""CREATE UNIQUE INDEX blockchain_jobs_coalesce ON blockchain_jobs (coalesce_key) WHERE status = 'PENDING';""")
+		connection.execute("""CREATE INDEX blockchain_jobs_running ON blockchain_jobs (coalesce_key) WHERE status = 'RUNNING';""")
+
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.id IS 'The job''s unique ID and primary key';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.operation IS 'The blockchain operation that the job performs, such as ''set_consent''';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.arguments IS 'The arguments of the operation';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.coalesce_key IS 'The key of jobs that are merged while they are pending, such as a study and a participant''s address';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.status IS 'The job''s status: pending jobs are waiting to run, and running jobs have been claimed by a worker';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.attempts IS 'The number of times that a worker has claimed the job';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.run_after IS 'The time before which the job should not run, used to back off after failures';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.locked_by IS 'The worker that claimed the job';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.locked_until IS 'The time until which the job is reserved for its worker, after which other workers may claim it';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.last_error IS 'The error raised by the job''s last failed attempt';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.tx_hash IS 'The hash of the transaction that an attempt sent but that was not mined in time, which the next attempt waits for';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.created_at IS 'The date and time when the job was created';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_jobs.updated_at IS 'The date and time when the job''s status last changed';""")
+
+		"""
+		Create the idempotency key relation.
+		Clients can give a key with each request, so that a repeated request returns the job of the first one instead of adding another job.
+		"""
+
+		connection.execute("""DROP TABLE IF EXISTS blockchain_job_keys CASCADE;""")
+		connection.execute("""CREATE TABLE blockchain_job_keys (
+							idempotency_key	VARCHAR(255)					PRIMARY KEY,
+							job_id			INTEGER							NOT NULL REFERENCES blockchain_jobs(id) ON DELETE CASCADE,
+							created_at		TIMESTAMP WITHOUT TIME ZONE		DEFAULT NOW()
+		);""")
+
+		connection.execute("""COMMENT ON COLUMN blockchain_job_keys.idempotency_key IS 'The idempotency key that the client gave with the request';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_job_keys.job_id IS 'The job that the request added or was merged into';""")
+		connection.execute("""COMMENT ON COLUMN blockchain_job_keys.created_at IS 'The date and time when the request was made';""")
+
+		"""
+		Create the Ethereum nonce relation.
+		Nonces are allocated from the database, so that every thread and process that signs with the same account gets a different nonce without asking the node.
+		Nonces that were allocated but never sent are released, so that they can be reused and do not leave gaps.
+		"""
+
+		connection.execute("""DROP TABLE IF EXISTS ethereum_nonces CASCADE;""")
+		connection.execute("""CREATE TABLE ethereum_nonces (
+							address			VARCHAR(42)						PRIMARY KEY,
+							next_nonce		BIGINT							NOT NULL,
+							released		BIGINT[]						DEFAULT '{}',
+							stuck_nonce		BIGINT,
+							stuck_since		TIMESTAMP WITHOUT TIME ZONE,
+							synced_at		TIMESTAMP WITHOUT TIME ZONE		DEFAULT NOW()
+		);""")
+
+		connection.execute("""COMMENT ON COLUMN ethereum_nonces.address IS 'The address of the account that signs transactions';""")
+		connection.execute("""COMMENT ON COLUMN ethereum_nonces.next_nonce IS 'The lowest nonce that has never been allocated';""")
+		connection.execute("""COMMENT ON COLUMN ethereum_nonces.released IS 'The nonces below the next nonce that were allocated but not sent, in ascending order';""")
+		connection.execute("""COMMENT ON COLUMN ethereum_nonces.stuck_nonce IS 'The node''s transaction count when it was last seen below the next nonce, which may be a gap that holds up later transactions';""")
+		connection.execute("""COMMENT ON COLUMN ethereum_nonces.stuck_since IS 'The date and time when the gap was first seen';""")
+		connection.execute("""COMMENT ON COLUMN ethereum_nonces.synced_at IS 'The date and time when the nonces were last synchronized with the node';""")
+
+		"""
+		Consent mirror.
+		"""
+
+		"""
+		Create the consent mirror's relations.
+		The consent indexer copies the consent changes that are recorded on the blockchain into these tables, so that consent can be read without asking the node.
+		The checkpoints keep the hashes of the latest indexed blocks, which are used to detect reorganizations of the chain.
+		"""
+
+		connection.execute("""DROP TABLE IF EXISTS consents CASCADE;""")
+		connection.execute("""CREATE TABLE consents (
+							study_id		VARCHAR(128)					NOT NULL,
+							address			VARCHAR(42)						NOT NULL,
+							consent			BOOLEAN							NOT NULL,
+							block_number	BIGINT							NOT NULL,
+							PRIMARY KEY (study_id, address)
+		);""")
+		connection.execute("""CREATE INDEX consents_address ON consents (address);""")
+
+		connection.execute("""COMMENT ON COLUMN consents.study_id IS 'The unique ID of the study on the blockchain';""")
+		connection.execute("""COMMENT ON COLUMN consents.address IS 'The address of the participant on the blockchain';""")
+		connection.execute("""COMMENT ON COLUMN consents.consent IS 'A boolean indicating whether the participant currently consents to the study';""")
+		connection.execute("""COMMENT ON COLUMN consents.block_number IS 'The number of the block that recorded the latest consent change';""")
+
+		connection.execute("""DROP TABLE IF EXISTS consent_changes CASCADE;""")
+		connection.execute("""CREATE TABLE consent_changes (
+							tx_hash			VARCHAR(66)						PRIMARY KEY,
+							study_id		VARCHAR(128)					NOT NULL,
+							address			VARCHAR(42)						NOT NULL,
+							consent			BOOLEAN							NOT NULL,
+							block_number	BIGINT							NOT NULL,
+							tx_index		INTEGER							NOT NULL,
+							block_timestamp	BIGINT							NOT NULL
+		);""")
+		connection.execute("""CREATE INDEX consent_changes_participant ON consent_changes (study_id, address, block_number);""")
+		connection.execute("""CREATE INDEX consent_changes_block ON consent_changes (block_number);""")
+
+		connection.execute("""COMMENT ON COLUMN consent_changes.tx_hash IS 'The hash of the transaction that changed the consent';""")
+		connection.execute("""COMMENT ON COLUMN consent_changes.study_id IS 'The unique ID of the study on the blockchain';""")
+		connection.execute("""COMMENT ON COLUMN consent_changes.address IS 'The address of the participant on the blockchain';""")
+		connection.execute("""COMMENT ON COLUMN consent_changes.consent IS 'A boolean indicating whether consent was given or withdrawn';""")
+		connection.execute("""COMMENT ON COLUMN consent_changes.block_number IS 'The number of the block that recorded the change';""")
+		connection.execute("""COMMENT ON COLUMN consent_changes.tx_index IS 'The position of the transaction in its block';""")
+		connection.execute("""COMMENT ON COLUMN consent_changes.block_timestamp IS 'The timestamp of the block, which the contract stores in the consent trail';""")
+
+		connection.execute("""DROP TABLE IF EXISTS consent_checkpoints CASCADE;""")
+		connection.execute("""CREATE TABLE consent_checkpoints (
+							block_number	BIGINT							PRIMARY KEY,
+							block_hash		VARCHAR(66)						NOT NULL,
+							checked_at		TIMESTAMP WITHOUT TIME ZONE
+		);""")
+
+		connection.execute("""COMMENT ON COLUMN consent_checkpoints.block_number IS 'The number of an indexed block';""")
+		connection.execute("""COMMENT ON COLUMN consent_checkpoints.block_hash IS 'The hash of the block when it was indexed';""")
+		connection.execute("""COMMENT ON COLUMN consent_checkpoints.checked_at IS 'The date and time when the indexer last found that this block was the latest one';""")
+
+		"""
+		Consent anchoring.
+		"""
+
+		"""
+		Create the consent anchoring relations.
+		When consent changes are anchored, they are recorded in the database and grouped into batches.
+		Only the root of each batch's Merkle tree is sent to the blockchain.
+		"""
+
+		connection.execute("""DROP TABLE IF EXISTS consent_anchor_batches CASCADE;""")
+		connection.execute("""CREATE TABLE consent_anchor_batches (
+							id				SERIAL							PRIMARY KEY,
+							size			INTEGER							NOT NULL,
+							root			VARCHAR(66),
+							tx_hash			VARCHAR(66),
+							block_number	BIGINT,
+							created_at		TIMESTAMP WITHOUT TIME ZONE		DEFAULT NOW(),
+							anchored_at		TIMESTAMP WITHOUT TIME ZONE
+		);""")
+
+		connection.execute("""COMMENT ON COLUMN consent_anchor_batches.id IS 'The batch''s unique ID and primary key';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_batches.size IS 'The number of consent changes in the batch';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_batches.root IS 'The root of the Merkle tree of the batch''s consent changes';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_batches.tx_hash IS 'The hash of the transaction that anchored the root on the blockchain';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_batches.block_number IS 'The number of the block that includes the anchoring transaction';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_batches.created_at IS 'The date and time when the batch was created';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_batches.anchored_at IS 'The date and time when the root was anchored';""")
+
+		connection.execute("""DROP TABLE IF EXISTS consent_anchor_changes CASCADE;""")
+		connection.execute("""CREATE TABLE consent_anchor_changes (
+							id				SERIAL							PRIMARY KEY,
+							study_id		VARCHAR(128)					NOT NULL,
+							address			VARCHAR(42)						NOT NULL,
+							consent			BOOLEAN							NOT NULL,
+							changed_at		BIGINT							NOT NULL,
+							batch_id		INTEGER							REFERENCES consent_anchor_batches(id),
+							leaf_index		INTEGER
+		);""")
+		connection.execute("""CREATE INDEX consent_anchor_changes_participant ON consent_anchor_changes (study_id, address, id);""")
+		connection.execute("""CREATE INDEX consent_anchor_changes_batch ON consent_anchor_changes (batch_id, leaf_index);""")
+
+		connection.execute("""COMMENT ON COLUMN consent_anchor_changes.id IS 'The consent change''s unique ID and primary key';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_changes.study_id IS 'The study whose consent changed';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_changes.address IS 'The address of the participant whose consent changed';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_changes.consent IS 'The new consent status';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_changes.changed_at IS 'The UNIX timestamp when the consent changed';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_changes.batch_id IS 'The batch that anchors the consent change, or NULL if it has not been batched yet';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_changes.leaf_index IS 'The index of the consent change''s leaf in the batch''s Merkle tree';""")
+
+		connection.execute("""DROP TABLE IF EXISTS consent_anchor_imports CASCADE;""")
+		connection.execute("""CREATE TABLE consent_anchor_imports (
+							imported_at		TIMESTAMP WITHOUT TIME ZONE		DEFAULT NOW(),
+							changes			INTEGER							NOT NULL
+		);""")
+
+		connection.execute("""COMMENT ON COLUMN consent_anchor_imports.imported_at IS 'The date and time when the consent changes that were recorded on the contract were imported';""")
+		connection.execute("""COMMENT ON COLUMN consent_anchor_imports.changes IS 'The number of consent changes that were read from the contract';""")
+
+		"""
+		Participant index.
+		"""
+
+		"""
+		Create the participant index's relations.
+		The index maps participants to the studies in which they have a consent recorded on the blockchain, so that consent reads only ask the blockchain about their studies.
+		Studies are synced once all of their participants are in the index.
+		"""
+
+		connection.execute("""DROP TABLE IF EXISTS participant_studies CASCADE;""")
+		connection.execute("""CREATE TABLE participant_studies (
+							address			VARCHAR(42)						NOT NULL,
+							study_id		VARCHAR(128)					NOT NULL,
+							consent			BOOLEAN							NOT NULL,
+							updated_at		TIMESTAMP WITHOUT TIME ZONE		DEFAULT NOW(),
+							PRIMARY KEY (address, study_id)
+		);""")
+
+		connection.execute("""COMMENT ON COLUMN participant_studies.address IS 'The address of the participant on the blockchain';""")
+		connection.execute("""COMMENT ON COLUMN participant_studies.study_id IS 'The unique ID of a study in which the participant has a consent recorded';""")
+		connection.execute("""COMMENT ON COLUMN participant_studies.consent IS 'A boolean indicating whether the participant currently consents to the study';""")
+		connection.execute("""COMMENT ON COLUMN participant_studies.updated_at IS 'The date and time when the consent was last indexed';""")
+
+		connection.execute("""DROP TABLE IF EXISTS participant_index_studies CASCADE;""")
+		connection.execute("""CREATE TABLE participant_index_studies (
+							study_id		VARCHAR(128)					PRIMARY KEY,
+							synced_at		TIMESTAMP WITHOUT TIME ZONE		DEFAULT NOW()
+		);""")
+
+		connection.execute("""COMMENT ON COLUMN participant_index_studies.study_id IS 'The unique ID of a study whose participants are all in the index';""")
+		connection.execute("""COMMENT ON COLUMN participant_index_studies.synced_at IS 'The date and time when the study was synced';""")
+
 		"""
 		When a user is removed from the users table, the deletion effect cascades.
 		However, the inverse is not true.